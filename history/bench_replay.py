@@ -0,0 +1,398 @@
+# codex: 2026-10-18 每个规模默认跑 3 次取中位数；基线改为 10k 条、默认 20% 容差；回放模型拆到 replay_llm，行宽 ≤100
+"""
+Offline replay benchmark for `historycards.py`.
+
+不调用任何模型：把录制的回复（或合成的卡片 JSON）按可配置的延迟 / 错误分布，经 `LLMBinding`
+交给 `historycards.main`（回放模型见 `history/replay_llm.py`），其余部分（调度、解析、校验、
+id 索引、manifest、runlog、批量落盘）全部走真实代码。每个规模（默认 1k / 10k / 25k 条）在独立
+子进程里运行，因此峰值 RSS 与 I/O 互不叠加；每个规模跑 `--repeat` 次（默认 3），报告吞吐居中的一次。
+
+报告（JSON）每个规模一项：
+
+    cards / wall_s / cards_per_s     成卡数与吞吐（含重试）；runs_cards_per_s 为每次运行的吞吐
+    peak_rss_mb                      子进程峰值常驻内存（Linux / macOS；Windows 为 null）
+    io                               /proc/self/io 的读写字节与系统调用数（仅 Linux）、输出目录大小
+    phases                           `profile` 中的提交 / 刷盘阶段：manifest_flush、io_commit 等
+
+用法：
+
+    # 对比仓库里的 10k 基线（3 次取中位数；吞吐下降或内存 / 写入量增长超过 20% 时返回 1）
+    python history/bench_replay.py --sizes 10000 --baseline history/bench_baseline.json
+    # 重新录制该基线（机器相关：换机器后先在改动前的代码上重录一次）
+    python history/bench_replay.py --sizes 10000 --save-baseline history/bench_baseline.json
+    # 跑默认规模（1k / 10k / 25k）并保存本地基线
+    python history/bench_replay.py --save-baseline /tmp/bench_baseline_full.json
+    # 200ms 对数正态延迟、2% 错误、3% 坏 JSON、8 个 worker（`--` 之后的参数原样传给 historycards）
+    python history/bench_replay.py --sizes 1000 --latency-ms 200 --latency-dist lognormal \\
+        --error-rate 0.02 --malformed-rate 0.03 -- --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as _dt
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+from typing import Dict, List, Optional
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))  # history/
+_WORKSPACE_ROOT = os.path.dirname(_SCRIPT_DIR)  # fungame/
+if _WORKSPACE_ROOT not in sys.path:
+    sys.path.insert(0, _WORKSPACE_ROOT)
+
+from history.replay_llm import (  # noqa: E402
+    LATENCY_DISTS,
+    ReplayError,
+    ReplayLLM,
+    load_responses,
+    synthetic_responses,
+)
+
+logger = logging.getLogger("historycards.bench")
+
+REPORT_VERSION = 1
+DEFAULT_SIZES = (1000, 10000, 25000)
+DEFAULT_REPEAT = 3
+DEFAULT_DICTIONARY = os.path.join(_SCRIPT_DIR, "resources", "汉语成语词典_词表_23889条.txt")
+# 汇总 profile 中与提交 / 落盘相关的阶段
+IO_PHASES = (
+    "manifest_flush",
+    "io_commit",
+    "card;commit;write_data",
+    "card;commit;index_put",
+    "card;commit;manifest_append",
+    "card;commit;error_files",
+    "skip_scan",
+)
+_MODEL = "replay-model"
+
+
+# -- input -------------------------------------------------------------------
+def build_input(path: str, size: int, dictionary: str = DEFAULT_DICTIONARY) -> None:
+    """取词典前 `size` 条；不够时用“成语 + 序号”补足（仍走拼音 id 与同音冲突处理）。"""
+    from history.card_files import iter_idioms
+
+    words = list(iter_idioms(dictionary)) if os.path.exists(dictionary) else []
+    if not words:
+        words = ["成语"]
+    names = words[:size]
+    n = 2
+    while len(names) < size:
+        names.extend(f"{w}{n}" for w in words[: size - len(names)])
+        n += 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(name + "\n" for name in names)
+
+
+# -- measurement -------------------------------------------------------------
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位 KB，macOS 单位字节
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 2)
+
+
+def proc_io() -> Optional[Dict[str, int]]:
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as f:
+            return {k.strip(): int(v) for k, v in (line.split(":", 1) for line in f if ":" in line)}
+    except OSError:
+        return None
+
+
+def dir_usage(path: str) -> Dict[str, int]:
+    files = total = 0
+    for root, _dirs, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return {"files": files, "bytes": total}
+
+
+def run_child(spec: dict) -> dict:
+    """在当前进程里用回放模型跑一次 historycards（由子进程调用）。"""
+    from history import historycards
+    from history.card_engine import LLMBinding
+
+    replay = ReplayLLM(
+        (
+            load_responses(spec["responses"])
+            if spec.get("responses")
+            else synthetic_responses(seed=spec["seed"])
+        ),
+        latency_ms=spec["latency_ms"],
+        latency_dist=spec["latency_dist"],
+        latency_sigma=spec["latency_sigma"],
+        error_rate=spec["error_rate"],
+        malformed_rate=spec["malformed_rate"],
+        seed=spec["seed"],
+    )
+    llm = LLMBinding(client={}, source="replay", models=[_MODEL], call=replay, stream=replay.stream)
+    # 逐条 INFO 日志写终端的开销不属于流水线本身；先配置好 root logger，historycards 的 basicConfig 不再生效
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    io_before = proc_io()
+    t0 = perf_counter()
+    rc = historycards.main(spec["argv"], llm=llm)
+    wall_s = perf_counter() - t0
+    io_after = proc_io()
+    io = None
+    if io_before is not None and io_after is not None:
+        io = {k: io_after[k] - io_before.get(k, 0) for k in io_after}
+    return {
+        "rc": rc,
+        "wall_s": wall_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "io": io,
+        "llm": {"calls": replay.calls, "errors": replay.errors, "malformed": replay.malformed},
+    }
+
+
+def run_size(size: int, work_dir: str, opts: argparse.Namespace, passthrough: List[str]) -> dict:
+    """准备输入与空的 resources 目录，在子进程中运行一个规模，返回该规模的报告项。"""
+    root = os.path.join(work_dir, f"n{size}")
+    shutil.rmtree(root, ignore_errors=True)
+    resources = os.path.join(root, "resources")
+    os.makedirs(resources)
+    input_file = os.path.join(root, "idioms.txt")
+    build_input(input_file, size, opts.dictionary)
+    spec = {
+        "responses": opts.responses,
+        "latency_ms": opts.latency_ms,
+        "latency_dist": opts.latency_dist,
+        "latency_sigma": opts.latency_sigma,
+        "error_rate": opts.error_rate,
+        "malformed_rate": opts.malformed_rate,
+        "seed": opts.seed,
+        "argv": [
+            "--input",
+            input_file,
+            "--resources-dir",
+            resources,
+            "--progress-file",
+            os.path.join(root, "progress.json"),
+            "--retry-wait-base",
+            "0",
+            "--continue-on-failure",
+            "--max-consecutive-failures",
+            "0",
+            *passthrough,
+        ],
+    }
+    spec_file = os.path.join(root, "spec.json")
+    with open(spec_file, "w", encoding="utf-8") as f:
+        json.dump(spec, f, ensure_ascii=False)
+    out_file = os.path.join(root, "child.json")
+    cmd = [sys.executable, os.path.abspath(__file__), "_child", spec_file, out_file]
+    proc = subprocess.run(cmd, cwd=_WORKSPACE_ROOT)
+    if proc.returncode != 0 or not os.path.exists(out_file):
+        raise RuntimeError(f"Benchmark child for size {size} failed (rc={proc.returncode}).")
+    with open(out_file, "r", encoding="utf-8") as f:
+        child = json.load(f)
+
+    with open(os.path.join(resources, "historycards_summary.json"), "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    phases = summary.get("profile", {}).get("phases", {})
+    cards = int(summary.get("processed", 0))
+    wall_s = child["wall_s"]
+    io = {"output": dir_usage(resources)}
+    if child["io"] is not None:
+        io.update(
+            {
+                k: child["io"][k]
+                for k in ("rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes")
+                if k in child["io"]
+            }
+        )
+    return {
+        "size": size,
+        "rc": child["rc"],
+        "cards": cards,
+        "failed": int(summary.get("failed", 0)),
+        "attempts": int(summary.get("attempts", 0)),
+        "wall_s": round(wall_s, 3),
+        "cards_per_s": round(cards / wall_s, 2) if wall_s > 0 else 0.0,
+        "peak_rss_mb": child["peak_rss_mb"],
+        "io": io,
+        "llm": child["llm"],
+        "llm_call_timing": summary.get("llm_call_timing", {}),
+        "phases": {
+            name: {
+                "count": phases[name]["count"],
+                "total_s": phases[name]["total_s"],
+                "p99_s": phases[name]["p99_s"],
+                "share_of_wall": round(phases[name]["total_s"] / wall_s, 4) if wall_s > 0 else 0.0,
+            }
+            for name in IO_PHASES
+            if name in phases
+        },
+    }
+
+
+def median_run(runs: List[dict]) -> dict:
+    """同一规模重复运行时取吞吐居中的一次（偶数次取偏慢的一次），并记下每次的吞吐。"""
+    ordered = sorted(runs, key=lambda r: r["cards_per_s"])
+    result = dict(ordered[(len(ordered) - 1) // 2])
+    result["runs_cards_per_s"] = [r["cards_per_s"] for r in runs]
+    return result
+
+
+# -- baseline ----------------------------------------------------------------
+def _grew(new, old, tolerance: float) -> bool:
+    return bool(new and old and new > old * (1 + tolerance))
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """与基线逐个规模比较；返回超出容差的回退说明（空列表表示通过）。"""
+    regressions = []
+    base_results = {str(r["size"]): r for r in baseline.get("results", [])}
+    for result in report["results"]:
+        base = base_results.get(str(result["size"]))
+        if base is None:
+            continue
+        n = f"n={result['size']}"
+        new_cps, old_cps = result["cards_per_s"], base["cards_per_s"]
+        if old_cps and new_cps < old_cps * (1 - tolerance):
+            regressions.append(f"{n}: cards/sec {new_cps} < baseline {old_cps}")
+        new_rss, old_rss = result.get("peak_rss_mb"), base.get("peak_rss_mb")
+        if _grew(new_rss, old_rss, tolerance):
+            regressions.append(f"{n}: peak RSS {new_rss} MB > baseline {old_rss} MB")
+        base_io = base.get("io", {})
+        new_out, old_out = result["io"]["output"]["bytes"], base_io.get("output", {}).get("bytes")
+        if _grew(new_out, old_out, tolerance):
+            regressions.append(f"{n}: output {new_out} bytes > baseline {old_out} bytes")
+        new_w, old_w = result["io"].get("wchar"), base_io.get("wchar")
+        if _grew(new_w, old_w, tolerance):
+            regressions.append(f"{n}: bytes written {new_w} > baseline {old_w}")
+    return regressions
+
+
+def _write_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _split_passthrough(argv: List[str]):
+    if "--" in argv:
+        i = argv.index("--")
+        return argv[:i], argv[i + 1 :]
+    return argv, []
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded/synthetic LLM responses through historycards.py and report "
+        "throughput, peak RSS and I/O. Arguments after `--` are passed to historycards.py."
+    )
+    add = parser.add_argument
+    add("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated idiom counts.")
+    add("--responses", default=None, help="Recorded responses: JSONL file or a resources dir.")
+    add("--dictionary", default=DEFAULT_DICTIONARY, help="Idiom list to take names from.")
+    add("--latency-ms", type=float, default=0.0, help="Mean synthetic LLM latency (default: 0).")
+    add("--latency-dist", choices=LATENCY_DISTS, default="const", help="Latency distribution.")
+    add("--latency-sigma", type=float, default=0.5, help="Sigma for --latency-dist lognormal.")
+    add("--error-rate", type=float, default=0.0, help="Fraction of calls raising an error.")
+    add("--malformed-rate", type=float, default=0.0, help="Fraction returning truncated JSON.")
+    add("--seed", type=int, default=0)
+    add("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per size; report the median.")
+    add("--work-dir", default=None, help="Scratch dir (default: a temp dir, removed afterwards).")
+    add("--keep", action="store_true", help="Keep the scratch dir.")
+    add("--out", default=None, help="Write the report JSON here (default: print it).")
+    add("--baseline", default=None, help="Compare against this baseline JSON; rc=1 on regression.")
+    add("--save-baseline", default=None, help="Save this run's report as the baseline JSON.")
+    add("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: 0.2).")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["_child"]:
+        with open(argv[1], "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        _write_json(argv[2], run_child(spec))
+        return 0
+    own, passthrough = _split_passthrough(argv)
+
+    parser = build_parser()
+    args = parser.parse_args(own)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if not sizes or min(sizes) < 1:
+        parser.error("--sizes must list positive integers.")
+    if args.repeat < 1:
+        parser.error("--repeat must be >= 1.")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="historycards_bench_")
+    report = {
+        "version": REPORT_VERSION,
+        "created_at": _dt.datetime.now().isoformat(timespec="seconds"),
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "latency_ms": args.latency_ms,
+            "latency_dist": args.latency_dist,
+            "error_rate": args.error_rate,
+            "malformed_rate": args.malformed_rate,
+            "responses": args.responses or "synthetic",
+            "historycards_args": passthrough,
+        },
+        "results": [],
+    }
+    try:
+        for size in sizes:
+            logger.info(f"Replaying {size} idioms ...")
+            runs = [run_size(size, work_dir, args, passthrough) for _ in range(args.repeat)]
+            result = median_run(runs)
+            logger.info(
+                f"n={size}: {result['cards_per_s']} cards/s (median of {len(runs)}), "
+                f"wall {result['wall_s']}s, peak RSS {result['peak_rss_mb']} MB"
+            )
+            report["results"].append(result)
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    rc = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            logger.warning(
+                "Baseline was recorded with a different replay config; "
+                "comparison may be meaningless."
+            )
+        regressions = compare(report, baseline, args.tolerance)
+        report["regressions"] = regressions
+        for line in regressions:
+            logger.error(f"Regression: {line}")
+        rc = 1 if regressions else 0
+    if args.save_baseline:
+        _write_json(args.save_baseline, {k: v for k, v in report.items() if k != "regressions"})
+        logger.info(f"Saved baseline: {args.save_baseline}")
+    if args.out:
+        _write_json(args.out, report)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
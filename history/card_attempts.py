@@ -0,0 +1,319 @@
+# codex: 2026-10-18 路由路径每个回复只校验一次并直接返回卡片；流式中止在两条路径上语义一致且都计数；对冲落后的流式请求可取消
+"""
+One card = one idiom: LLM call with model fallback (or routing / hedging), retries with backoff,
+response cache, streaming validation and card parsing. Runs on worker threads, so nothing here
+writes manifest/progress/runlog files; stop requests arrive through `GenContext.stop`.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Optional, Tuple
+
+from utils.llm_api import StreamAborted, get_client_temperature
+from utils.llm_cache import CacheMissError, LLMResponseCache
+from utils.llm_routing import ModelRouter
+from history.card_options import EngineOptions
+from history.card_prompts import CardStreamValidator, build_prompt, clean_llm_json, parse_card
+from history.card_stats import CardJob, CardResult, RunStats
+
+logger = logging.getLogger("historycards")
+
+
+@dataclass
+class LLMBinding:
+    """
+    The LLM the engine talks to. `call(client, source, prompt, model, logger) -> text` and
+    `stream(client, source, prompt, model, logger, on_delta=...) -> text` have the signatures of
+    `utils.llm_api.generate_llm_response_single` / `generate_llm_response_stream`; tests and the
+    replay benchmark pass their own.
+    """
+
+    client: object
+    source: str
+    models: list[str]
+    call: Callable[..., str]
+    stream: Optional[Callable[..., str]] = None
+
+
+@dataclass
+class GenContext:
+    """Everything a worker needs to generate one card (shared, read-only apart from stats/cache)."""
+
+    llm: LLMBinding
+    options: EngineOptions
+    stats: RunStats
+    stop: threading.Event = field(default_factory=threading.Event)
+    cache: Optional[LLMResponseCache] = None
+    router: Optional[ModelRouter] = None
+
+    @property
+    def models(self) -> list[str]:
+        return self.llm.models
+
+    def call(self, prompt: str, model_name: str) -> str:
+        return self.llm.call(self.llm.client, self.llm.source, prompt, model_name, logger)
+
+
+def retry_wait_seconds(options: EngineOptions, attempt: int) -> float:
+    if options.retry_backoff == "exponential":
+        wait_s = options.retry_wait_base * (2 ** (attempt - 1))
+    else:
+        wait_s = options.retry_wait_base * attempt
+    wait_s = min(options.retry_wait_max, wait_s)
+    if options.retry_jitter:
+        wait_s += random.uniform(0.0, options.retry_jitter)
+    return wait_s
+
+
+def pace_sleep(ctx: GenContext) -> None:
+    """--sleep-min/--sleep-max：每个 worker 各自随机休息，--workers N 时整体节奏约为单线程的 N 倍。"""
+    if ctx.options.sleep_max <= 0:
+        return
+    delay = random.uniform(ctx.options.sleep_min, ctx.options.sleep_max)
+    if delay > 0:
+        logger.debug(f"Sleep {delay:.2f}s")
+        with ctx.stats.profiler.phase("pace_sleep"):
+            time.sleep(delay)
+
+
+class HedgeLost(StreamAborted):
+    """对冲中另一模型已给出结果：落后的流式请求在下一段输出时放弃（不计为中止或失败）。"""
+
+
+def stream_one(
+    ctx: GenContext,
+    prompt: str,
+    model_name: str,
+    result: CardResult,
+    t0: float,
+    cancel: Optional[threading.Event] = None,
+) -> str:
+    """--stream：流式调用一次模型，增量校验并记录首 token 延迟（TTFT）。"""
+    validator = CardStreamValidator()
+    result.ttft_s = None
+
+    def _on_delta(delta: str) -> None:
+        if cancel is not None and cancel.is_set():
+            raise HedgeLost(f"{model_name}: lost the hedge")
+        if result.ttft_s is None:
+            result.ttft_s = perf_counter() - t0
+            ctx.stats.record_stream(result.ttft_s)
+        validator.feed(delta)
+
+    return ctx.llm.stream(
+        ctx.llm.client, ctx.llm.source, prompt, model_name, logger, on_delta=_on_delta
+    )
+
+
+def _call_model(
+    ctx: GenContext,
+    prompt: str,
+    model_name: str,
+    result: CardResult,
+    cancel: Optional[threading.Event] = None,
+) -> str:
+    """
+    One call to one model, recorded in `RunStats.per_model`. A `StreamAborted` reply (the output
+    can never become a card) is counted and re-raised: it ends the attempt on both the fallback
+    chain and the routed path. A hedge loser that gives up is not recorded at all.
+    """
+    t0 = perf_counter()
+    ok = False
+    try:
+        if ctx.options.stream:
+            text = stream_one(ctx, prompt, model_name, result, t0, cancel)
+        else:
+            text = ctx.call(prompt, model_name)
+        ok = True
+        return text
+    except HedgeLost:
+        raise
+    except StreamAborted as ae:
+        result.used_model = model_name
+        result.response_text = ae.partial_text
+        ctx.stats.record_stream(None, aborted=True)
+        raise
+    finally:
+        if ok or cancel is None or not cancel.is_set():
+            ctx.stats.record_model_attempt(model_name, perf_counter() - t0, ok)
+
+
+def routed_call(
+    job: CardJob, ctx: GenContext, prompt: str, result: CardResult
+) -> Tuple[str, str, str, dict]:
+    """
+    --route/--hedge：由 ModelRouter 决定模型顺序（可并行对冲），只接受能通过校验的回复。
+    每个回复只解析 / 校验一次，返回 (text, model, cleaned_json, card)。
+    """
+    parsed: dict = {}
+    cancel = threading.Event()
+
+    def _call(model_name: str) -> str:
+        text = _call_model(ctx, prompt, model_name, result, cancel)
+        try:
+            cleaned = clean_llm_json(text)
+            card = parse_card(cleaned, job.idiom, job.card_id, job.image_path)
+            parsed[model_name] = (cleaned, card)
+        except Exception:
+            ctx.stats.record_parse_failure(model_name)
+            raise
+        return text
+
+    model_name, text, _ = ctx.router.call(
+        ctx.models, _call, abort_on=(StreamAborted,), cancel=cancel
+    )
+    cleaned, card = parsed[model_name]
+    return text, model_name, cleaned, card
+
+
+def generate_card(job: CardJob, ctx: GenContext) -> CardResult:
+    """
+    LLM call + parse + normalize for one idiom, with retries, model fallback and response cache.
+    Runs on a worker thread when --workers > 1, so it must not write manifest/progress/runlog.
+    """
+    result = CardResult(job=job)
+    prof = ctx.stats.profiler
+    with prof.card(result.phases, waited_s=perf_counter() - job.started), prof.phase("generate"):
+        run_card_attempts(job, ctx, result)
+    result.generated_at = perf_counter()
+    return result
+
+
+def _call_fallback_chain(ctx: GenContext, prompt: str, result: CardResult) -> str:
+    """Try `ctx.models` in order; a `StreamAborted` reply ends the attempt (no model switch)."""
+    model_errors = []
+    raise_last: Optional[Exception] = None
+    for model_name in ctx.models:
+        try:
+            with ctx.stats.profiler.phase("llm_call"):
+                text = _call_model(ctx, prompt, model_name, result)
+            result.used_model = model_name
+            return text
+        except StreamAborted:
+            # 输出本身不可能成卡：算作本次尝试失败（进入重试），而不是换模型
+            raise
+        except Exception as me:
+            model_errors.append(str(me))
+            raise_last = me
+    raise Exception(f"All models failed: {model_errors}") from raise_last
+
+
+def run_card_attempts(job: CardJob, ctx: GenContext, result: CardResult) -> None:
+    options, stats, cache = ctx.options, ctx.stats, ctx.cache
+    prof = stats.profiler
+    if ctx.stop.is_set():
+        result.not_started = True
+        return
+
+    temperature = get_client_temperature(ctx.llm.client)
+    use_cache = cache is not None and cache.enabled
+    for attempt in range(1, options.max_retries + 1):
+        if ctx.stop.is_set() and attempt > 1:
+            logger.warning("Stop requested: skipping further retries for current idiom.")
+            break
+        with prof.phase("prompt"):
+            prompt = build_prompt(job.idiom, job.card_id)
+        result.from_cache = False
+        parsing = False
+        routed = None
+        try:
+            response_text = None
+            result.used_model = None
+            if use_cache:
+                with prof.phase("cache_lookup"):
+                    cached_model, cached_text = cache.lookup(
+                        ctx.llm.source, ctx.models, prompt, temperature
+                    )
+                stats.record_cache(hit=cached_text is not None)
+                if cached_text is not None:
+                    response_text = cached_text
+                    result.used_model = cached_model
+                    result.from_cache = True
+            if response_text is None and ctx.router is not None:
+                with prof.phase("llm_call"):
+                    response_text, result.used_model, *routed = routed_call(
+                        job, ctx, prompt, result
+                    )
+            if response_text is None:
+                response_text = _call_fallback_chain(ctx, prompt, result)
+
+            result.response_text = response_text
+            if routed:
+                # 路由路径已在选模型时解析并校验过这条回复
+                result.cleaned_json, result.card = routed
+            else:
+                parsing = True
+                with prof.phase("parse"):
+                    cleaned = clean_llm_json(response_text)
+                    result.cleaned_json = cleaned
+                with prof.phase("normalize"):
+                    result.card = parse_card(cleaned, job.idiom, job.card_id, job.image_path)
+            result.error = None
+            # 只缓存通过校验的回复，避免坏回复被反复回放
+            if use_cache and not result.from_cache:
+                with prof.phase("cache_write"):
+                    wrote = cache.put(
+                        ctx.llm.source, result.used_model, prompt, response_text, temperature
+                    )
+                if wrote:
+                    stats.record_cache(write=True)
+            break
+        except CacheMissError as e:
+            result.error = e
+            logger.warning(f"Cache miss (replay mode) for {job.idx}:{job.idiom}: {e}")
+            break
+        except Exception as e:
+            result.error = e
+            logger.warning(
+                f"Attempt {attempt}/{options.max_retries} failed for {job.idx}:{job.idiom}: {e}"
+            )
+            if parsing:
+                stats.record_parse_failure(result.used_model)
+            if result.from_cache:
+                # 缓存里的回复无效：删除并在后续重试中直接调用模型
+                cache.invalidate(ctx.llm.source, result.used_model, prompt, temperature)
+                use_cache = False
+            if ctx.stop.is_set():
+                logger.warning("Stop requested: will exit after current attempt.")
+                break
+            if attempt < options.max_retries:
+                stats.record_retry()
+                wait_s = 0.0 if result.from_cache else retry_wait_seconds(options, attempt)
+                if wait_s > 0:
+                    with prof.phase("retry_wait"):
+                        time.sleep(wait_s)
+
+    if result.card is not None and not result.from_cache:
+        pace_sleep(ctx)
+
+
+def call_models(prompt: str, ctx: GenContext) -> Tuple[str, str]:
+    """One LLM call with model fallback (no retries); returns (model, text)."""
+    if ctx.router is not None:
+        model_name, text, _ = ctx.router.call(
+            ctx.models,
+            lambda m: ctx.call(prompt, m),
+            on_attempt=ctx.stats.record_model_attempt,
+        )
+        return model_name, text
+    model_errors = []
+    raise_last: Optional[Exception] = None
+    for model_name in ctx.models:
+        t0 = perf_counter()
+        ok = False
+        try:
+            text = ctx.call(prompt, model_name)
+            ok = True
+            return model_name, text
+        except Exception as me:
+            model_errors.append(str(me))
+            raise_last = me
+        finally:
+            ctx.stats.record_model_attempt(model_name, perf_counter() - t0, ok)
+    raise Exception(f"All models failed: {model_errors}") from raise_last
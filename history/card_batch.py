@@ -0,0 +1,243 @@
+# codex: 2026-10-18 提交前先把完整分块计划写进状态文件；续跑补交缺少 batch id 的分块
+"""
+--batch: submit the selected idioms as Batch API jobs, poll them, then commit results in idx order.
+
+The state file holds the whole plan (every chunk with its idxs and JSONL path) before anything is
+submitted; each chunk gets its batch id as soon as it is accepted. `--batch-resume` submits the
+chunks that still lack an id, then polls all of them.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import logging
+import os
+from time import perf_counter
+from typing import Callable, Optional
+
+from utils.llm_api import get_client_temperature
+from utils.llm_batch import (
+    BATCH_TERMINAL_STATUSES,
+    build_batch_requests,
+    iter_batch_results,
+    poll_batch,
+    submit_batch,
+    supports_batch,
+    write_batch_jsonl,
+)
+from history.card_attempts import GenContext, generate_card
+from history.card_files import atomic_write_json, load_json
+from history.card_prompts import build_prompt, clean_llm_json, parse_card
+from history.card_stats import CardJob, CardResult
+
+logger = logging.getLogger("historycards")
+
+
+def _resume_state_file(ctx: GenContext) -> str:
+    state_file = ctx.options.batch_resume
+    if not os.path.isabs(state_file) and not os.path.exists(state_file):
+        state_file = os.path.join(ctx.options.batch_dir, state_file)
+    return state_file
+
+
+def _plan_state(
+    selected: list[tuple[int, str]],
+    ctx: GenContext,
+    model_name: str,
+    make_job: Callable[..., CardJob],
+    is_done: Callable[[CardJob], bool],
+) -> dict:
+    entries = []
+    reserved: dict = {}
+    reserved_names: set = set()
+    for idx, idiom in selected:
+        job = make_job(idx, idiom, reserved)
+        skipped = (is_done(job) and not ctx.options.force) or idiom in reserved_names
+        if not skipped:
+            reserved[job.card_id] = idiom
+            reserved_names.add(idiom)
+        entries.append({"job": dataclasses.asdict(job), "skipped": skipped})
+    todo = [e["job"]["idx"] for e in entries if not e["skipped"]]
+    size = ctx.options.batch_size
+    batches = [
+        {
+            "id": None,
+            "input_file": os.path.join(
+                ctx.options.batch_dir, f"batch_{ctx.stats.run_id}_{part:03d}.jsonl"
+            ),
+            "idxs": todo[start : start + size],
+            "requests": len(todo[start : start + size]),
+        }
+        for part, start in enumerate(range(0, len(todo), size), start=1)
+    ]
+    return {
+        "run_id": ctx.stats.run_id,
+        "llm_source": ctx.llm.source,
+        "model": model_name,
+        "entries": entries,
+        "batches": batches,
+        "committed": False,
+    }
+
+
+def _write_chunk(ctx: GenContext, state: dict, info: dict) -> None:
+    jobs = {e["job"]["idx"]: e["job"] for e in state["entries"]}
+    requests_ = build_batch_requests(
+        ctx.llm.client,
+        ctx.llm.source,
+        state["model"],
+        [(i, build_prompt(jobs[i]["idiom"], jobs[i]["card_id"])) for i in info["idxs"]],
+    )
+    write_batch_jsonl(info["input_file"], requests_)
+
+
+def _submit_missing(ctx: GenContext, state: dict, state_file: str) -> None:
+    """Submit every planned chunk without a batch id; the state is saved after each one."""
+    pending = [b for b in state["batches"] if not b.get("id")]
+    for info in pending:
+        if not os.path.exists(info["input_file"]):
+            _write_chunk(ctx, state, info)
+        info["id"] = submit_batch(
+            ctx.llm.client,
+            ctx.llm.source,
+            info["input_file"],
+            metadata={"run_id": state["run_id"]},
+            logger=logger,
+        )
+        atomic_write_json(state_file, state)
+    if pending:
+        logger.info(
+            f"Batch state saved: {state_file} ({sum(b['requests'] for b in pending)} requests in "
+            f"{len(pending)} newly submitted batch(es))"
+        )
+
+
+def _poll_all(ctx: GenContext, state: dict, state_file: str) -> Optional[dict]:
+    """Wait for every batch; returns custom_id -> (text, error), or None when interrupted."""
+    options, stats = ctx.options, ctx.stats
+    outputs: dict = {}
+    batch_started = perf_counter()
+    for info in state["batches"]:
+        batch = poll_batch(
+            ctx.llm.client,
+            info["id"],
+            poll_interval=options.batch_poll_interval,
+            timeout=options.batch_timeout or None,
+            logger=logger,
+            should_stop=ctx.stop.is_set,
+        )
+        status = getattr(batch, "status", None)
+        info["status"] = status
+        if status not in BATCH_TERMINAL_STATUSES:
+            atomic_write_json(state_file, state)
+            stats.interrupted = True
+            logger.warning(
+                f"Batch {info['id']} not finished (status={status}). "
+                f"Resume with: --batch --batch-resume {state_file}"
+            )
+            return None
+        for custom_id, text, error in iter_batch_results(ctx.llm.client, batch):
+            outputs[custom_id] = (text, error)
+    stats.batch.update(
+        {
+            "state_file": state_file,
+            "batches": [
+                {"id": b["id"], "status": b.get("status"), "requests": b["requests"]}
+                for b in state["batches"]
+            ],
+            "results": len(outputs),
+            "wait_s": round(perf_counter() - batch_started, 3),
+            "fallbacks": 0,
+        }
+    )
+    return outputs
+
+
+def _batch_result(ctx: GenContext, job: CardJob, model_name: str, output: tuple) -> CardResult:
+    text, error = output
+    result = CardResult(job=job, used_model=model_name)
+    try:
+        if text is None:
+            raise RuntimeError(f"Batch request failed: {error}")
+        result.response_text = text
+        result.cleaned_json = clean_llm_json(text)
+        result.card = parse_card(result.cleaned_json, job.idiom, job.card_id, job.image_path)
+        temperature = get_client_temperature(ctx.llm.client)
+        prompt = build_prompt(job.idiom, job.card_id)
+        if ctx.cache is not None and ctx.cache.put(
+            ctx.llm.source, model_name, prompt, text, temperature
+        ):
+            ctx.stats.record_cache(write=True)
+    except Exception as e:
+        logger.warning(f"Batch item {job.idx}:{job.idiom} invalid ({e}); retrying interactively.")
+        ctx.stats.batch["fallbacks"] += 1
+        if ctx.options.max_retries > 0:
+            result = generate_card(job, ctx)
+        else:
+            result = CardResult(job=job, error=e)
+        if result.error is not None and result.response_text is None:
+            result.response_text = text
+    return result
+
+
+def run_batch(
+    selected: list[tuple[int, str]],
+    ctx: GenContext,
+    make_job: Callable[..., CardJob],
+    is_done: Callable[[CardJob], bool],
+    commit: Callable[[CardResult], bool],
+) -> None:
+    """
+    Submit all selected idioms as Batch API jobs, poll, then commit results in idx order.
+    Items that fail in the batch fall back to the interactive path (`generate_card`, with retries).
+    State is saved to <batch-dir>/<run>.state.json so `--batch-resume` can continue after a
+    crash/Ctrl+C.
+    """
+    if not supports_batch(ctx.llm.client):
+        raise ValueError(
+            f"LLM source '{ctx.llm.source}' client does not support the Batch API (files/batches)."
+        )
+    model_name = ctx.models[0]
+
+    if ctx.options.batch_resume:
+        state_file = _resume_state_file(ctx)
+        state = load_json(state_file)
+        if not state:
+            raise FileNotFoundError(f"Batch state not found: {ctx.options.batch_resume}")
+        model_name = state.get("model", model_name)
+        logger.info(
+            f"Resuming batch state {state_file}: batches={[b['id'] for b in state['batches']]}"
+        )
+    else:
+        state_file = os.path.join(ctx.options.batch_dir, f"batch_{ctx.stats.run_id}.state.json")
+        state = _plan_state(selected, ctx, model_name, make_job, is_done)
+        # 完整计划（分块与 JSONL）先落盘：提交中途崩溃时 --batch-resume 只补交缺少 id 的分块
+        for info in state["batches"]:
+            _write_chunk(ctx, state, info)
+        atomic_write_json(state_file, state)
+
+    if state.get("committed"):
+        logger.info("Batch results already committed; nothing to do.")
+        return
+    _submit_missing(ctx, state, state_file)
+
+    outputs = _poll_all(ctx, state, state_file)
+    if outputs is None:
+        return
+
+    for entry in state["entries"]:
+        job = CardJob(**{**entry["job"], "started": perf_counter()})
+        if entry["skipped"]:
+            result = CardResult(job=job, skipped=True)
+        else:
+            os.makedirs(job.card_dir, exist_ok=True)
+            output = outputs.get(str(job.idx), (None, "Missing from batch output"))
+            result = _batch_result(ctx, job, model_name, output)
+        if commit(result) and ctx.stop.is_set():
+            logger.warning(
+                "Stopped while committing batch results. Resume with: --batch --batch-resume "
+                f"{state_file}"
+            )
+            return
+    state["committed"] = True
+    atomic_write_json(state_file, state)
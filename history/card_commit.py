@@ -0,0 +1,316 @@
+# codex: 2026-10-18 manifest.json 按张数或时间间隔定期写出（日志模式默认也开启）
+"""
+Applies finished cards to disk in idx order (main thread only): data.json, id index, manifest
+(journal or json), progress, runlog and error files.
+
+Everything a card writes goes through the RunWriter group commit: data.json as a buffered file,
+the id index / manifest journal rows as records (staged uncommitted on their SQLite connections so
+later lookups see them, committed once per batch by the writer's sinks). One batch is one WAL
+write, so a crash replays data.json, index, journal and progress together.
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import logging
+import os
+import threading
+from time import perf_counter
+from typing import Callable, Optional
+
+from history.card_files import append_to_manifest, atomic_write_json
+from history.card_index import CardIdIndex
+from history.card_options import EngineOptions
+from history.card_stats import CardResult, RunStats, SkipRun, phase_ms
+from history.manifest_store import ManifestStore
+from history.run_writer import RunWriter
+
+logger = logging.getLogger("historycards")
+
+
+def _now() -> str:
+    return _dt.datetime.now().isoformat(timespec="seconds")
+
+
+class CardCommitter:
+    def __init__(
+        self,
+        options: EngineOptions,
+        stats: RunStats,
+        writer: RunWriter,
+        id_index: CardIdIndex,
+        store: Optional[ManifestStore],
+        manifest: dict,
+        stop: threading.Event,
+        write_summary: Callable[[], None],
+    ):
+        self.options = options
+        self.stats = stats
+        self.writer = writer
+        self.id_index = id_index
+        self.store = store
+        self.manifest = manifest
+        self.stop = stop
+        self.write_summary = write_summary
+        self.manifest_file = os.path.join(options.resources_dir, "manifest.json")
+        cards = [c for c in manifest["cards"] if isinstance(c, dict)]
+        self.existing_names = {c.get("name") for c in cards}
+        self.existing_ids = {c.get("id") for c in cards}
+        self.added_since_flush = 0
+        self.last_flush = perf_counter()
+        # 连续失败计数：用于“连续 N 个失败才停止”。成功会清零。
+        self.consecutive_failures = 0
+
+    # -- buffered writes -----------------------------------------------------
+    def _append_jsonl(self, path: str, obj: dict) -> None:
+        try:
+            self.writer.append_jsonl(path, obj)
+        except Exception:
+            pass
+
+    def _save_progress(self, payload: dict) -> None:
+        self.writer.set_progress(self.options.progress_file, payload)
+
+    def maybe_commit_io(self) -> None:
+        t0 = perf_counter()
+        if self.writer.maybe_commit():
+            self.stats.profiler.record("io_commit", perf_counter() - t0)
+
+    def flush_manifest(self) -> None:
+        # 先提交缓冲的批次：manifest.json 里出现的卡片，其 data.json 与日志行必须已经落盘
+        self.writer.commit()
+        with self.stats.profiler.phase("manifest_flush"):
+            if self.store is not None:
+                self.store.compact(self.manifest_file)
+            else:
+                atomic_write_json(self.manifest_file, self.manifest)
+        self.added_since_flush = 0
+        self.last_flush = perf_counter()
+
+    def finish(self) -> None:
+        """Final manifest flush; closes the journal."""
+        if self.store is not None:
+            # 日志里有未压缩的卡片（包括上次中断遗留的）时才重写 manifest.json
+            if self.store.dirty:
+                self.flush_manifest()
+            self.store.close()
+        elif self.added_since_flush > 0:
+            self.flush_manifest()
+
+    # -- results -------------------------------------------------------------
+    def is_done(self, job) -> bool:
+        return job.idiom in self.existing_names or os.path.exists(job.data_file)
+
+    def commit(self, result: CardResult) -> bool:
+        """Apply one finished idiom to manifest/progress/runlog/errors. Returns True to stop."""
+        if result.not_started or result.skipped:
+            return self._apply(result)
+        # worker 完成到这里之间是重排序缓冲里的等待（前面的条目还没完成）
+        waited = None if result.generated_at is None else perf_counter() - result.generated_at
+        prof = self.stats.profiler
+        with (
+            prof.card(result.phases, waited_s=waited, wait_name="reorder_wait"),
+            prof.phase("commit"),
+        ):
+            return self._apply(result)
+
+    def commit_skip_run(self, run: SkipRun) -> None:
+        count = len(run.idioms)
+        if count == 1:
+            logger.info(f"Skip {run.first_idx}: {run.idioms[0]} (exists)")
+        else:
+            logger.info(f"Skip {run.first_idx}-{run.last_idx}: {count} idioms (exist)")
+        self.stats.skipped += count
+        self._save_progress(
+            {"next_index": run.last_idx + 1, "last_idiom": run.idioms[-1], "last_status": "skipped"}
+        )
+        self._append_jsonl(
+            self.options.runlog_file,
+            {
+                "ts": _now(),
+                "idx": run.first_idx,
+                "idx_end": run.last_idx,
+                "idiom": run.idioms[0],
+                "status": "skipped",
+                "count": count,
+                "wall_s": round(perf_counter() - run.started, 6),
+            },
+        )
+
+    def _apply(self, result: CardResult) -> bool:
+        job = result.job
+        if result.not_started:
+            logger.warning("Stop requested: exiting before starting next idiom.")
+            return True
+        if result.skipped:
+            logger.info(f"Skip {job.idx}: {job.idiom} (exists)")
+            self.stats.skipped += 1
+            self._save_progress(
+                {"next_index": job.idx + 1, "last_idiom": job.idiom, "last_status": "skipped"}
+            )
+            self._append_jsonl(
+                self.options.runlog_file,
+                {
+                    "ts": _now(),
+                    "idx": job.idx,
+                    "idiom": job.idiom,
+                    "id": job.card_id,
+                    "status": "skipped",
+                    "wall_s": round(perf_counter() - job.started, 6),
+                },
+            )
+            return False
+        if result.card is not None:
+            self._apply_card(result)
+        if result.error is None:
+            self.consecutive_failures = 0
+            return False
+        return self._apply_failure(result)
+
+    def _apply_card(self, result: CardResult) -> None:
+        job, card, prof = result.job, result.card, self.stats.profiler
+        with prof.phase("write_data"):
+            self.writer.write_text(job.data_file, json.dumps(card, ensure_ascii=False, indent=2))
+        with prof.phase("index_put"):
+            self.id_index.put(job.card_id, job.idiom, commit=False)
+            self.writer.add_record("id_index", [job.card_id, job.idiom])
+
+        with prof.phase("manifest_append"):
+            if (
+                job.card_id not in self.existing_ids
+                and job.idiom not in self.existing_names
+                and (self.store is None or self._journal_append(card))
+                and append_to_manifest(self.manifest, card, self.existing_ids, self.existing_names)
+            ):
+                self.existing_names.add(job.idiom)
+                self.existing_ids.add(job.card_id)
+                self.added_since_flush += 1
+                every = self.options.manifest_write_every
+                interval = self.options.manifest_write_interval
+                if (every > 0 and self.added_since_flush >= every) or (
+                    interval > 0 and perf_counter() - self.last_flush >= interval
+                ):
+                    self.flush_manifest()
+
+        self._save_progress(
+            {
+                "next_index": job.idx + 1,
+                "last_idiom": job.idiom,
+                "last_status": "ok",
+                "last_id": job.card_id,
+            }
+        )
+        self.stats.processed += 1
+        logger.info(f"OK {job.idx}: {job.idiom} -> {job.data_file}")
+        self._append_jsonl(
+            self.options.runlog_file,
+            {
+                "ts": _now(),
+                "idx": job.idx,
+                "idiom": job.idiom,
+                "id": job.card_id,
+                "status": "ok",
+                "model": result.used_model,
+                "cached": result.from_cache,
+                **({"ttft_s": round(result.ttft_s, 6)} if result.ttft_s is not None else {}),
+                "wall_s": round(perf_counter() - job.started, 6),
+                "phase_ms": phase_ms(result.phases),
+            },
+        )
+
+    def _journal_append(self, card: dict) -> bool:
+        if not self.store.append(card, commit=False):
+            return False
+        self.writer.add_record("journal", card)
+        return True
+
+    def _apply_failure(self, result: CardResult) -> bool:
+        job, options = result.job, self.options
+        idx, idiom, card_id = job.idx, job.idiom, job.card_id
+        last_error = result.error
+        if self.stop.is_set():
+            self._save_progress(
+                {"next_index": idx, "last_idiom": idiom, "last_status": "interrupted"}
+            )
+            self.stats.interrupted = True
+            logger.warning("Stopped by user.")
+            self.write_summary()
+            return True
+        self.stats.failed += 1
+        self.consecutive_failures += 1
+        used_model = result.used_model
+        err_file = os.path.join(job.card_dir, "error.txt")
+        err_response_file = os.path.join(job.card_dir, "error_response.txt")
+        err_cleaned_file = os.path.join(job.card_dir, "error_cleaned.json")
+        err_text = f"{type(last_error).__name__}: {last_error}\n" + "".join(
+            f"{k}={v}\n"
+            for k, v in (
+                ("idx", idx),
+                ("idiom", idiom),
+                ("id", card_id),
+                ("model", used_model),
+                ("max_retries", options.max_retries),
+                ("consecutive_failure_count", self.consecutive_failures),
+            )
+            if k != "model" or used_model
+        )
+        with self.stats.profiler.phase("error_files"):
+            self.writer.write_text(err_file, err_text)
+            if result.response_text:
+                self.writer.write_text(err_response_file, result.response_text)
+            if result.cleaned_json:
+                self.writer.write_text(err_cleaned_file, result.cleaned_json)
+        logger.error(f"FAIL {idx}: {idiom} (wrote {err_file})")
+        next_index = idx + 1 if options.continue_on_failure else idx
+        self._save_progress(
+            {"next_index": next_index, "last_idiom": idiom, "last_status": "failed"}
+        )
+        error_text = f"{type(last_error).__name__}: {last_error}"
+        self._append_jsonl(
+            options.runlog_file,
+            {
+                "ts": _now(),
+                "idx": idx,
+                "idiom": idiom,
+                "id": card_id,
+                "status": "failed",
+                "model": used_model,
+                "error": error_text,
+                **({"ttft_s": round(result.ttft_s, 6)} if result.ttft_s is not None else {}),
+                "wall_s": round(perf_counter() - job.started, 6),
+                "phase_ms": phase_ms(result.phases),
+            },
+        )
+        self._append_jsonl(
+            options.errors_file,
+            {
+                "ts": _now(),
+                "idx": idx,
+                "idiom": idiom,
+                "id": card_id,
+                "model": used_model,
+                "error": error_text,
+                "error_file": err_file,
+                "response_file": err_response_file if result.response_text else None,
+                "cleaned_file": err_cleaned_file if result.cleaned_json else None,
+                "consecutive_failure_count": self.consecutive_failures,
+            },
+        )
+
+        if not options.continue_on_failure:
+            logger.error(
+                "Stopping on failure (use --continue-on-failure, or remove --stop-on-failure)."
+            )
+            return True
+        if (
+            options.max_consecutive_failures
+            and self.consecutive_failures >= options.max_consecutive_failures
+        ):
+            logger.error(
+                "Stopping after %s consecutive failures (use --max-consecutive-failures to change; "
+                "0 disables).",
+                self.consecutive_failures,
+            )
+            return True
+        return False
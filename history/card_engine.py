@@ -0,0 +1,400 @@
+# codex: 2026-10-18 打开 manifest 日志时记录外部改写带来的补入 / 删除条数
+"""
+Card generation engine: prompting, cleaning, normalization, retries, scheduling, commit and stats
+for a list of idioms, with every input passed explicitly.
+
+    from history.card_engine import EngineOptions, generate_cards
+    rc, summary = generate_cards(idioms, EngineOptions(resources_dir="...", workers=4), llm=...)
+
+- `options` (`EngineOptions`) holds what the `historycards.py` flags hold; paths default under
+  `resources_dir`.
+- `llm` is an `LLMBinding` (client + models + call/stream functions) or a zero-argument callable
+  returning one; the callable is only invoked when some idiom actually needs generating. Without
+  it the binding is built from `utils/config.ini` via `connect_llm()`.
+- `stop` is a `threading.Event`; setting it finishes in-flight calls and commits what is done. The
+  engine never installs signal handlers or configures logging; CLI front ends wrap the call in
+  `sigint_stop(stop)` and call `logging.basicConfig` themselves.
+
+Returns `(exit_code, summary)`: 0 = ok or stopped, 2 = some idioms failed; `summary` is the run
+summary (same as `historycards_summary.json`) or `{}` when nothing was selected.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import datetime as _dt
+import logging
+import os
+import signal
+import threading
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+
+from utils.llm_api import key_pool_snapshot, rate_limit_snapshot
+from utils.llm_cache import LLMResponseCache
+from utils.llm_routing import ModelRouter
+from history.card_attempts import GenContext, LLMBinding
+from history.card_batch import run_batch
+from history.card_commit import CardCommitter
+from history.card_files import (
+    atomic_write_json,
+    card_dir_for,
+    choose_card_id,
+    filter_idioms,
+    image_path_for,
+    load_manifest,
+    scan_completed_names,
+    slugify_id,
+)
+from history.card_index import CardIdIndex
+from history.card_options import EngineOptions
+from history.card_scheduler import run_scheduled
+from history.card_stats import CardJob, RunStats
+from history.manifest_store import ManifestStore
+from history.run_profile import PhaseProfiler
+from history.run_writer import RunWriter, peek_progress
+
+__all__ = [
+    "EngineOptions",
+    "LLMBinding",
+    "bind_llm",
+    "connect_llm",
+    "generate_cards",
+    "load_progress",
+    "run_cards",
+    "sigint_stop",
+]
+
+logger = logging.getLogger("historycards")
+
+LLMSource = Union[LLMBinding, Callable[[], LLMBinding]]
+
+
+@contextlib.contextmanager
+def sigint_stop(stop: threading.Event) -> Iterator[threading.Event]:
+    """
+    First Ctrl+C sets `stop` (finish current requests, then exit); the second raises
+    KeyboardInterrupt. Only installed on the main thread; the previous handler is restored on exit.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield stop
+        return
+    count = 0
+
+    def handler(sig, frame):  # noqa: ARG001
+        nonlocal count
+        count += 1
+        if count == 1:
+            stop.set()
+            logger.warning(
+                "Ctrl+C received: will stop after current LLM call finishes. "
+                "Press Ctrl+C again to force."
+            )
+            return
+        signal.default_int_handler(sig, frame)
+
+    previous = signal.signal(signal.SIGINT, handler)
+    try:
+        yield stop
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def connect_llm(
+    config_path: Optional[str] = None,
+    llmsource: Optional[str] = None,
+    models: Optional[list[str]] = None,
+    max_models: Optional[int] = 3,
+) -> LLMBinding:
+    """Build an `LLMBinding` from `utils/config.ini` (provider SDKs are imported here, lazily)."""
+    from utils.llm_api import (
+        generate_llm_response_single,
+        generate_llm_response_stream,
+        load_llm_config,
+        setup_llm_client,
+    )
+
+    return bind_llm(
+        load_llm_config,
+        setup_llm_client,
+        generate_llm_response_single,
+        generate_llm_response_stream,
+        config_path=config_path,
+        llmsource=llmsource,
+        models=models,
+        max_models=max_models,
+    )
+
+
+def bind_llm(
+    load_config,
+    setup_client,
+    call,
+    stream,
+    *,
+    config_path,
+    llmsource=None,
+    models=None,
+    max_models: Optional[int] = 3,
+) -> LLMBinding:
+    """`connect_llm` with the utils.llm_api functions passed in (the CLI passes its own)."""
+    if max_models is not None and max_models < 1:
+        raise ValueError("--max-models must be >= 1.")
+    logger.info(f"Loading LLM config: {config_path}")
+    llm_config = load_config(config_path)
+    if llmsource:
+        if not llm_config.has_section("llmsources"):
+            llm_config.add_section("llmsources")
+        llm_config.set("llmsources", "llmsource", llmsource)
+    client, source, config_models = setup_client(llm_config, logger)
+    chosen = list(models) if models else list(config_models)
+    if max_models is not None:
+        chosen = chosen[:max_models]
+    logger.info(f"LLM ready: source='{source}', models={chosen}")
+    return LLMBinding(client=client, source=source, models=chosen, call=call, stream=stream)
+
+
+def load_progress(options: EngineOptions) -> Optional[dict]:
+    """
+    Progress of the previous run (`--resume`), including a crashed run's not-yet-replayed batch.
+    Read-only (safe for `--dry-run`): the replay itself happens when the engine opens its writer.
+    """
+    options = options.resolved()
+    return peek_progress(options.io_wal, options.progress_file)
+
+
+def generate_cards(
+    idioms: Iterable[str],
+    options: EngineOptions,
+    llm: Optional[LLMSource] = None,
+    *,
+    stop: Optional[threading.Event] = None,
+) -> Tuple[int, dict]:
+    """Run the engine on an in-memory idiom list (blank / `#` lines dropped, 1-based indexes)."""
+    selected = list(enumerate(filter_idioms(idioms), start=1))
+    return run_cards(selected, options, llm, stop=stop)
+
+
+def _open_manifest(options: EngineOptions) -> Tuple[Optional[ManifestStore], dict]:
+    manifest_file = os.path.join(options.resources_dir, "manifest.json")
+    if options.manifest_store != "journal":
+        return None, load_manifest(manifest_file)
+    store = ManifestStore(options.manifest_journal)
+    imported, removed = store.sync_from_manifest(manifest_file)
+    if imported or removed:
+        logger.info(
+            f"Manifest journal: imported {imported}, removed {removed} card(s) from {manifest_file}"
+        )
+    return store, store.to_manifest()
+
+
+def _open_id_index(options: EngineOptions, manifest: dict) -> CardIdIndex:
+    # id 冲突检测走持久化索引：首次使用时扫描一次 manifest + 磁盘上的 data.json，之后只按签名补录外部改写的 manifest
+    id_index = CardIdIndex(options.id_index)
+    if not id_index.built or id_index.card_rel_dir_template != options.card_rel_dir_template:
+        t0 = perf_counter()
+        total = id_index.rebuild(
+            options.resources_dir, options.card_rel_dir_template, manifest["cards"]
+        )
+        logger.info(
+            f"Built id index: {total} ids in {perf_counter() - t0:.2f}s -> {options.id_index}"
+        )
+    id_index.sync_manifest(os.path.join(options.resources_dir, "manifest.json"), manifest["cards"])
+    return id_index
+
+
+def run_cards(
+    selected: list[tuple[int, str]],
+    options: EngineOptions,
+    llm: Optional[LLMSource] = None,
+    *,
+    stop: Optional[threading.Event] = None,
+) -> Tuple[int, dict]:
+    """Generate cards for `(idx, idiom)` pairs; see the module docstring."""
+    options = options.resolved()
+    stop = stop or threading.Event()
+    os.makedirs(os.path.join(options.resources_dir, "cards"), exist_ok=True)
+    if not selected and not options.batch_resume:
+        logger.info("No idioms selected.")
+        return 0, {}
+
+    store, manifest = _open_manifest(options)
+    id_index = _open_id_index(options, manifest)
+    # data.json、索引与日志行都随写入器组提交；先重放上次崩溃遗留的批次，再做跳过扫描
+    sinks = {"id_index": id_index.put_many}
+    if store is not None:
+        sinks["journal"] = store.append_many
+    writer = RunWriter(
+        options.io_wal,
+        durability=options.io_durability,
+        commit_interval_s=options.io_commit_interval,
+        logger=logger,
+        sinks=sinks,
+    )
+    existing_names = {c.get("name") for c in manifest["cards"] if isinstance(c, dict)}
+
+    profiler = PhaseProfiler()
+    completed_names: set = set()
+    if not options.force and not options.batch:
+        t0 = perf_counter()
+        with profiler.phase("skip_scan"):
+            scanned = scan_completed_names(
+                options.resources_dir, options.card_rel_dir_template, id_index
+            )
+            completed_names = (existing_names | scanned) & {i for _, i in selected}
+        if completed_names:
+            logger.info(
+                f"Skip scan: {len(completed_names)} selected idiom(s) already generated "
+                f"({perf_counter() - t0:.2f}s)"
+            )
+
+    # 全部已完成（常见于续跑检查）时不初始化 LLM 客户端：不读 provider 配置、不导入 SDK
+    if options.batch or any(idiom not in completed_names for _, idiom in selected):
+        if llm is None:
+            llm = connect_llm()
+        binding = llm if isinstance(llm, LLMBinding) else llm()
+    else:
+        logger.info("All selected idioms already generated; LLM client not initialized.")
+        binding = LLMBinding(client=None, source=None, models=[], call=None)
+
+    stats = RunStats(
+        run_id=_dt.datetime.now().strftime("%Y%m%d_%H%M%S"),
+        started_at=_dt.datetime.now().isoformat(timespec="seconds"),
+        llm_source=binding.source,
+        models=binding.models,
+        args=options.summary_args(),
+        wall_clock_start=perf_counter(),
+        profiler=profiler,
+    )
+    stats.total_idioms_selected = len(selected)
+
+    cache = None
+    if options.cache_mode != "off":
+        cache = LLMResponseCache(
+            options.cache_file,
+            mode=options.cache_mode,
+            max_bytes=int(options.cache_max_mb * 1024 * 1024),
+            max_age_s=options.cache_max_age_days * 86400,
+        )
+        logger.info(f"LLM response cache: mode={options.cache_mode}, file={options.cache_file}")
+    router = None
+    if options.route != "fixed" or options.hedge:
+        router = ModelRouter(
+            policy=options.route,
+            hedge=options.hedge,
+            hedge_after_s=options.hedge_after,
+            hedge_factor=options.hedge_factor,
+            min_samples=options.route_min_samples,
+            # 路由直接读运行统计（与汇总 / 指标同一份数据）；对冲线程数随并发数有界
+            model_stats=stats.model_stats,
+            max_threads=4 * options.workers,
+        )
+    ctx = GenContext(
+        llm=binding, options=options, stats=stats, stop=stop, cache=cache, router=router
+    )
+
+    summary_out: dict = {}
+
+    def _write_summary() -> None:
+        try:
+            summary_out.clear()
+            summary_out.update(stats.to_dict())
+            summary_out["rate_limits"] = rate_limit_snapshot()
+            api_keys = key_pool_snapshot(binding.client)
+            if api_keys:
+                summary_out["api_keys"] = api_keys
+            if router is not None:
+                summary_out["routing"] = router.snapshot()
+            atomic_write_json(options.summary_file, summary_out)
+        except Exception as e:
+            logger.warning(f"Failed to write summary file: {options.summary_file}: {e}")
+
+    metrics_server = None
+    if options.metrics_port is not None:
+        # 延迟导入：http.server 只在开启指标端点时加载
+        from history.run_metrics import MetricsServer, RunMetrics
+
+        stats.metrics = RunMetrics(
+            stats,
+            snapshots=[
+                ("rate_limits", rate_limit_snapshot),
+                ("api_keys", lambda: key_pool_snapshot(binding.client)),
+            ],
+        )
+        metrics_server = MetricsServer(
+            stats.metrics.registry, options.metrics_port, options.metrics_host
+        )
+        logger.info(f"Metrics: http://{options.metrics_host}:{metrics_server.port}/metrics")
+
+    committer = CardCommitter(
+        options, stats, writer, id_index, store, manifest, stop, _write_summary
+    )
+
+    def _make_job(idx: int, idiom: str, reserved: Optional[dict] = None) -> CardJob:
+        card_id = choose_card_id(idiom, slugify_id(idiom), id_index.name_for_id, reserved)
+        card_dir = card_dir_for(options.resources_dir, options.card_rel_dir_template, card_id)
+        return CardJob(
+            idx=idx,
+            idiom=idiom,
+            card_id=card_id,
+            card_dir=card_dir,
+            data_file=os.path.join(card_dir, "data.json"),
+            image_path=image_path_for(options.image_path_template, card_id),
+            started=perf_counter(),
+        )
+
+    try:
+        if options.batch:
+            if options.max_consecutive_failures:
+                logger.warning(
+                    "Batch mode commits every returned result: --max-consecutive-failures %s is "
+                    "ignored (failures are recorded and processing continues).",
+                    options.max_consecutive_failures,
+                )
+                options.max_consecutive_failures = 0
+
+            def _commit_and_flush(result) -> bool:
+                stop_now = committer.commit(result)
+                committer.maybe_commit_io()
+                return stop_now
+
+            run_batch(selected, ctx, _make_job, committer.is_done, _commit_and_flush)
+        else:
+            run_scheduled(selected, ctx, completed_names, _make_job, committer)
+    finally:
+        if cache is not None:
+            cache.close()
+        if router is not None:
+            router.close()
+        writer.close()
+        if metrics_server is not None:
+            metrics_server.close()
+
+    committer.finish()
+    id_index.close()
+
+    _write_summary()
+    if options.profile_folded:
+        try:
+            with open(options.profile_folded, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in stats.profiler.folded())
+            logger.info(f"Wrote folded profile: {options.profile_folded}")
+        except Exception as e:
+            logger.warning(f"Failed to write folded profile: {options.profile_folded}: {e}")
+    logger.info(
+        "Stats: wall_time_s=%s, selected=%s, processed=%s, skipped=%s, failed=%s, attempts=%s, "
+        "avg_llm_call_s=%s",
+        summary_out.get("wall_time_s"),
+        stats.total_idioms_selected,
+        stats.processed,
+        stats.skipped,
+        stats.failed,
+        stats.total_attempts,
+        summary_out.get("llm_call_timing", {}).get("avg_s"),
+    )
+    logger.info(
+        f"Done. processed={stats.processed}, skipped={stats.skipped}, failed={stats.failed}"
+    )
+    if stop.is_set():
+        return 0, summary_out
+    return (0 if stats.failed == 0 else 2), summary_out
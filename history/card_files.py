@@ -0,0 +1,191 @@
+# codex: 2026-10-18 按 .agent/rules/coding.md 收紧行宽（≤100 字符），逻辑不变
+"""
+Idiom input, card ids, per-card paths and manifest helpers shared by the card generation engine,
+`historycards.py` and `shard_runner.py`.
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import hashlib
+import json
+import os
+import posixpath
+import re
+from typing import Callable, Iterable, Optional, Tuple
+
+from history.card_index import CardIdIndex, iter_card_dirs
+from history.pinyin_slugs import pinyin_of
+
+
+def filter_idioms(lines: Iterable[str]) -> Iterable[str]:
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#") or line.startswith("####"):
+            continue
+        yield line
+
+
+def iter_idioms(path: str) -> Iterable[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        yield from filter_idioms(f)
+
+
+def parse_range(range_text: str) -> Tuple[int, int]:
+    m = re.fullmatch(r"\s*(\d+)\s*-\s*(\d+)\s*", range_text)
+    if not m:
+        raise ValueError(f"Invalid --range '{range_text}', expected like '5-10'.")
+    start = int(m.group(1))
+    end = int(m.group(2))
+    if start < 1 or end < 1:
+        raise ValueError("--range values must be >= 1.")
+    if end < start:
+        raise ValueError("--range end must be >= start.")
+    return start, end
+
+
+def slugify_id(text: str) -> str:
+    base = pinyin_of(text)
+    base = base.lower()
+    base = re.sub(r"[^a-z0-9_]+", "", base)
+    base = base.strip("_")
+    if base:
+        return base
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+    return f"id_{digest}"
+
+
+def load_json(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def atomic_write_json(path: str, data: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def load_manifest(manifest_path: str) -> dict:
+    manifest = load_json(manifest_path) or {"cards": []}
+    if "cards" not in manifest or not isinstance(manifest["cards"], list):
+        raise ValueError(f"Invalid manifest format: {manifest_path}")
+    return manifest
+
+
+def append_to_manifest(
+    manifest: dict,
+    card: dict,
+    existing_ids: Optional[set] = None,
+    existing_names: Optional[set] = None,
+) -> bool:
+    """Append in memory; the caller's id/name sets avoid rescanning every card (O(1) per append)."""
+    if existing_ids is None:
+        existing_ids = {c.get("id") for c in manifest.get("cards", []) if isinstance(c, dict)}
+    if existing_names is None:
+        existing_names = {c.get("name") for c in manifest.get("cards", []) if isinstance(c, dict)}
+    if card["id"] in existing_ids or card["name"] in existing_names:
+        return False
+    manifest["cards"].append(card)
+    manifest["updated_at"] = _dt.date.today().isoformat()
+    if "version" not in manifest:
+        manifest["version"] = "1.0"
+    return True
+
+
+def format_vars(card_id: str) -> dict:
+    shard1 = card_id[:1] if card_id else "x"
+    shard2 = card_id[:2] if len(card_id) >= 2 else (card_id or "x")
+    return {"id": card_id, "shard1": shard1, "shard2": shard2}
+
+
+def safe_relpath_fs(relpath: str) -> str:
+    relpath = relpath.strip().replace("/", os.sep).replace("\\", os.sep)
+    if not relpath:
+        raise ValueError("Empty relative path.")
+    if os.path.isabs(relpath):
+        raise ValueError(f"Absolute path not allowed: {relpath}")
+    norm = os.path.normpath(relpath)
+    if norm == ".." or norm.startswith(".." + os.sep):
+        raise ValueError(f"Path traversal not allowed: {relpath}")
+    return norm
+
+
+def safe_relpath_url(relpath: str) -> str:
+    relpath = relpath.strip().replace("\\", "/")
+    if not relpath:
+        raise ValueError("Empty relative path.")
+    if relpath.startswith("/"):
+        raise ValueError(f"Absolute path not allowed: {relpath}")
+    norm = posixpath.normpath(relpath)
+    if norm == ".." or norm.startswith("../"):
+        raise ValueError(f"Path traversal not allowed: {relpath}")
+    return norm
+
+
+def card_dir_for(resources_dir: str, card_rel_dir_template: str, card_id: str) -> str:
+    """Absolute per-card directory for `card_id` under `--card-rel-dir-template`."""
+    rel_dir = safe_relpath_fs(card_rel_dir_template.format(**format_vars(card_id)))
+    return os.path.join(resources_dir, rel_dir)
+
+
+def image_path_for(image_path_template: str, card_id: str) -> str:
+    """URL-style image path stored in the card JSON (`--image-path-template`)."""
+    return safe_relpath_url(image_path_template.format(**format_vars(card_id)))
+
+
+def scan_completed_names(
+    resources_dir: str, card_rel_dir_template: str, id_index: CardIdIndex
+) -> set:
+    """
+    Names whose `data.json` already exists, from one walk of the cards tree plus the id index
+    (id -> name): no per-idiom pinyin/id resolution, `os.path.exists` or JSON reads. Ids are mapped
+    to directories with the same `--card-rel-dir-template` used for writing, so sharded layouts are
+    matched exactly.
+    """
+    card_dirs = set(iter_card_dirs(resources_dir, card_rel_dir_template))
+    if not card_dirs:
+        return set()
+    completed = set()
+    for card_id, name in id_index.items():
+        try:
+            rel_dir = safe_relpath_fs(card_rel_dir_template.format(**format_vars(card_id)))
+        except ValueError:
+            continue
+        if rel_dir in card_dirs:
+            completed.add(name)
+    return completed
+
+
+def choose_card_id(
+    idiom: str,
+    base_id: str,
+    name_for_id: Callable[[str], Optional[str]],
+    reserved: Optional[dict] = None,
+) -> str:
+    """
+    Prefer pinyin id, but avoid collisions (same id for different idioms).
+    If collision is detected, suffix a deterministic short hash.
+    `name_for_id(card_id)` returns the idiom already owning an id (manifest or an existing
+    `data.json`), or None; normally `CardIdIndex.name_for_id`, so each check is one indexed lookup
+    instead of a manifest/disk scan. `reserved` (id -> name) covers ids already handed to
+    not-yet-written jobs (e.g. a submitted batch).
+    """
+
+    def _id_matches_existing_name(card_id: str) -> bool:
+        existing_name = (reserved or {}).get(card_id)
+        if existing_name is None:
+            existing_name = name_for_id(card_id)
+        return existing_name is None or existing_name == idiom
+
+    if _id_matches_existing_name(base_id):
+        return base_id
+
+    suffix = hashlib.sha1(idiom.encode("utf-8")).hexdigest()[:6]
+    candidate = f"{base_id}_{suffix}"
+    return candidate if _id_matches_existing_name(candidate) else f"id_{suffix}"
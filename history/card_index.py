@@ -0,0 +1,201 @@
+# codex: 2026-10-18 put 支持暂不提交，新增 put_many：引擎按 RunWriter 批次一次事务写入索引
+"""
+Persistent card id index for `historycards.py`.
+
+`_choose_card_id` 需要知道某个拼音 id 是否已被别的成语占用。旧实现每条都从整个 manifest 重建
+id→name 映射，并读取候选 id 的 `data.json`；现在改为查询 `<resources-dir>/.card_index.sqlite`：
+
+- 来源：manifest 中的卡片 + 卡片目录下所有 `data.json`（按 `--card-rel-dir-template` 的静态前缀扫描）
+- 首次使用时自动构建一次；之后每写一张 `data.json` 就更新一行（引擎随 RunWriter 组提交，一批一次事务）
+- `manifest.json` 被外部改写时按文件签名检测，把其中的卡片补进索引
+- `verify` 对比索引与磁盘，报告缺失 / 不一致 / 多余的条目；`rebuild` 从头重建
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ids (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ids_name ON ids(name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _file_signature(path: str) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def card_scan_root(resources_dir: str, card_rel_dir_template: str) -> str:
+    """模板中第一个占位符之前的静态目录，例如 `cards/{shard2}/{id}` -> `<resources>/cards`。"""
+    static = card_rel_dir_template.split("{", 1)[0].replace("\\", "/")
+    static = static.rsplit("/", 1)[0] if "/" in static else ""
+    return os.path.join(resources_dir, *[p for p in static.split("/") if p])
+
+
+def iter_card_dirs(resources_dir: str, card_rel_dir_template: str) -> Iterator[str]:
+    """一次遍历卡片目录，产出含 `data.json` 的目录（相对 `resources_dir`，`os.path.normpath` 形式）；不读取文件内容。"""
+    root = card_scan_root(resources_dir, card_rel_dir_template)
+    for dirpath, _dirnames, filenames in os.walk(root):
+        if "data.json" in filenames:
+            yield os.path.normpath(os.path.relpath(dirpath, resources_dir))
+
+
+def iter_data_files(
+    resources_dir: str, card_rel_dir_template: str
+) -> Iterator[Tuple[str, str, str]]:
+    """扫描卡片目录下的 `data.json`，产出 (id, name, path)；无法解析或缺字段的文件跳过。"""
+    root = card_scan_root(resources_dir, card_rel_dir_template)
+    for dirpath, _dirnames, filenames in os.walk(root):
+        if "data.json" not in filenames:
+            continue
+        path = os.path.join(dirpath, "data.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        if (
+            isinstance(data, dict)
+            and isinstance(data.get("id"), str)
+            and isinstance(data.get("name"), str)
+        ):
+            yield data["id"], data["name"], path
+
+
+def _manifest_pairs(cards: Iterable[dict]) -> Iterator[Tuple[str, str]]:
+    for c in cards:
+        if isinstance(c, dict) and isinstance(c.get("id"), str) and isinstance(c.get("name"), str):
+            yield c["id"], c["name"]
+
+
+class CardIdIndex:
+    """id -> name / name -> id, persisted in SQLite. Single writer (the engine main thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def built(self) -> bool:
+        return self._get_meta("built_at") is not None
+
+    @property
+    def card_rel_dir_template(self) -> Optional[str]:
+        """构建时使用的 `--card-rel-dir-template`（扫描范围）；模板变了需要重建。"""
+        return self._get_meta("card_rel_dir_template")
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def name_for_id(self, card_id: str) -> Optional[str]:
+        row = self._conn.execute("SELECT name FROM ids WHERE id = ?", (card_id,)).fetchone()
+        return row[0] if row else None
+
+    def id_for_name(self, name: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT id FROM ids WHERE name = ? ORDER BY rowid LIMIT 1", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """全部 (id, name)。"""
+        yield from self._conn.execute("SELECT id, name FROM ids")
+
+    def put(self, card_id: str, name: str, commit: bool = True) -> None:
+        """`commit=False` 只在本连接内可见（后续查询能看到），等 `put_many` / 下次提交一起落盘。"""
+        self._conn.execute("INSERT OR REPLACE INTO ids(id, name) VALUES (?, ?)", (card_id, name))
+        if commit:
+            self._conn.commit()
+
+    def put_many(self, pairs: Iterable[Tuple[str, str]]) -> int:
+        """一次事务写入多条 (id, name)（覆盖已有条目，可重复执行）；返回写入条数。"""
+        count = self._put_many(((cid, name) for cid, name in pairs), replace=True)
+        self._conn.commit()
+        return count
+
+    def _put_many(self, pairs: Iterable[Tuple[str, str]], replace: bool) -> int:
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        before = self._conn.total_changes
+        self._conn.executemany(f"{verb} INTO ids(id, name) VALUES (?, ?)", pairs)
+        return self._conn.total_changes - before
+
+    def rebuild(
+        self, resources_dir: str, card_rel_dir_template: str, manifest_cards: Iterable[dict]
+    ) -> int:
+        """清空并重建：先 manifest，再用磁盘上的 `data.json` 覆盖（与旧实现一样以 data.json 为准）。"""
+        self._conn.execute("DELETE FROM ids")
+        self._put_many(_manifest_pairs(manifest_cards), replace=True)
+        self._put_many(
+            (
+                (cid, name)
+                for cid, name, _path in iter_data_files(resources_dir, card_rel_dir_template)
+            ),
+            replace=True,
+        )
+        self._set_meta("built_at", _dt.datetime.now().isoformat(timespec="seconds"))
+        self._set_meta("card_rel_dir_template", card_rel_dir_template)
+        self._conn.commit()
+        return self.count()
+
+    def sync_manifest(self, manifest_file: str, manifest_cards: Iterable[dict]) -> int:
+        """`manifest.json` 自上次同步后有变化时补录其中的卡片（不覆盖已有条目）；返回新增条数。"""
+        signature = _file_signature(manifest_file)
+        if signature is None or signature == self._get_meta("manifest_signature"):
+            return 0
+        added = self._put_many(_manifest_pairs(manifest_cards), replace=False)
+        self._set_meta("manifest_signature", signature)
+        self._conn.commit()
+        return added
+
+    def verify(
+        self, resources_dir: str, card_rel_dir_template: str, manifest_cards: Iterable[dict]
+    ) -> dict:
+        """对比索引与 manifest / 磁盘，返回 {"missing": [...], "mismatched": [...], "stale": [...]}。"""
+        expected = dict(_manifest_pairs(manifest_cards))
+        for cid, name, _path in iter_data_files(resources_dir, card_rel_dir_template):
+            expected[cid] = name
+        indexed = dict(self._conn.execute("SELECT id, name FROM ids"))
+        missing = sorted(cid for cid in expected if cid not in indexed)
+        mismatched = sorted(
+            cid for cid in expected if cid in indexed and indexed[cid] != expected[cid]
+        )
+        stale = sorted(cid for cid in indexed if cid not in expected)
+        return {
+            "indexed": len(indexed),
+            "expected": len(expected),
+            "missing": missing,
+            "mismatched": mismatched,
+            "stale": stale,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
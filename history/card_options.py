@@ -0,0 +1,500 @@
+# codex: 2026-10-18 日志模式默认仍定期写出 manifest.json（每 200 张或 60 秒）；新增 --manifest-write-interval
+"""
+Options of the card generation engine.
+
+`EngineOptions` is what `card_engine.run_cards` takes; library callers (e.g. `tools/gen_meta.py`)
+build it directly. `build_parser` defines the `historycards.py` command line (engine options plus
+the selection / LLM / maintenance flags that only the CLI uses) and `options_from_args` maps the
+parsed namespace onto `EngineOptions`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.llm_cache import CACHE_MODES
+from utils.llm_routing import ROUTING_POLICIES
+from history.run_writer import DURABILITY_LEVELS
+
+PROGRESS_FILE_NAME = ".historycards_progress.json"
+
+
+@dataclass
+class EngineOptions:
+    resources_dir: str
+    progress_file: Optional[str] = None  # 默认 <resources-dir>/.historycards_progress.json
+    force: bool = False
+    continue_on_failure: bool = True
+    max_consecutive_failures: int = 10
+    errors_file: Optional[str] = None
+    workers: int = 1
+    sleep_min: float = 0.0
+    sleep_max: float = 0.0
+    max_retries: int = 3
+    retry_backoff: str = "linear"
+    retry_wait_base: float = 1.5
+    retry_wait_max: float = 10.0
+    retry_jitter: float = 0.0
+    image_path_template: str = "cards/{id}/image.png"
+    card_rel_dir_template: str = "cards/{id}"
+    manifest_write_every: Optional[int] = None
+    manifest_write_interval: Optional[float] = None
+    manifest_store: str = "journal"
+    manifest_journal: Optional[str] = None
+    id_index: Optional[str] = None
+    route: str = "fixed"
+    hedge: bool = False
+    hedge_after: float = 0.0
+    hedge_factor: float = 1.0
+    route_min_samples: int = 5
+    stream: bool = False
+    pack: int = 1
+    batch: bool = False
+    batch_dir: Optional[str] = None
+    batch_size: int = 50000
+    batch_poll_interval: float = 30.0
+    batch_timeout: float = 0.0
+    batch_resume: Optional[str] = None
+    cache_mode: str = "off"
+    cache_file: Optional[str] = None
+    cache_max_mb: float = 0.0
+    cache_max_age_days: float = 0.0
+    runlog_file: Optional[str] = None
+    summary_file: Optional[str] = None
+    io_durability: str = "flush"
+    io_commit_interval: float = 1.0
+    io_wal: Optional[str] = None
+    metrics_port: Optional[int] = None
+    metrics_host: str = "127.0.0.1"
+    profile_folded: Optional[str] = None
+    # 以下只记录到运行汇总的 args 中（条目选择由调用方完成）
+    input: str = "<idioms>"
+    range_text: Optional[str] = None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    limit: Optional[int] = None
+    resume: bool = False
+
+    def resolved(self) -> "EngineOptions":
+        """Copy with default file locations under `resources_dir`; ValueError on bad values."""
+        res = os.path.abspath(self.resources_dir)
+        defaults = {
+            "progress_file": os.path.join(res, PROGRESS_FILE_NAME),
+            "errors_file": os.path.join(res, "cards", "_errors.jsonl"),
+            "runlog_file": os.path.join(res, "historycards_runlog.jsonl"),
+            "summary_file": os.path.join(res, "historycards_summary.json"),
+            "cache_file": os.path.join(res, ".llm_cache.sqlite"),
+            "batch_dir": os.path.join(res, "batches"),
+            "manifest_journal": os.path.join(res, ".manifest_journal.sqlite"),
+            "id_index": os.path.join(res, ".card_index.sqlite"),
+            "io_wal": os.path.join(res, ".historycards_io.wal"),
+            "manifest_write_every": 200 if self.manifest_store == "journal" else 1,
+            "manifest_write_interval": 60.0 if self.manifest_store == "journal" else 0.0,
+        }
+        out = dataclasses.replace(
+            self,
+            resources_dir=res,
+            **{k: v for k, v in defaults.items() if getattr(self, k) is None},
+        )
+        if out.batch_resume:
+            out.batch = True
+        out.validate()
+        return out
+
+    def validate(self) -> None:
+        if self.sleep_min < 0 or self.sleep_max < 0:
+            raise ValueError("--sleep-min/--sleep-max must be >= 0.")
+        if self.sleep_max and self.sleep_max < self.sleep_min:
+            raise ValueError("--sleep-max must be >= --sleep-min.")
+        if self.retry_wait_base < 0 or self.retry_wait_max < 0 or self.retry_jitter < 0:
+            raise ValueError("--retry-wait-base/--retry-wait-max/--retry-jitter must be >= 0.")
+        if self.io_commit_interval < 0:
+            raise ValueError("--io-commit-interval must be >= 0.")
+        if self.manifest_write_every is not None and self.manifest_write_every < 0:
+            raise ValueError("--manifest-write-every must be >= 0.")
+        if self.manifest_write_interval is not None and self.manifest_write_interval < 0:
+            raise ValueError("--manifest-write-interval must be >= 0.")
+        if self.max_consecutive_failures < 0:
+            raise ValueError("--max-consecutive-failures must be >= 0.")
+        if self.workers < 1:
+            raise ValueError("--workers must be >= 1.")
+        if self.pack < 1:
+            raise ValueError("--pack must be >= 1.")
+        if self.batch_size < 1:
+            raise ValueError("--batch-size must be >= 1.")
+        if self.batch and self.pack > 1:
+            raise ValueError("--pack cannot be combined with --batch.")
+        if self.stream and self.pack > 1:
+            # 合并请求返回 JSON 数组，逐卡的流式校验 / 中止无从谈起
+            raise ValueError("--pack cannot be combined with --stream.")
+        if self.batch and not self.continue_on_failure:
+            # 批量模式整批返回后逐条提交，没有“失败即停”的时机
+            raise ValueError("--stop-on-failure cannot be combined with --batch.")
+
+    def summary_args(self) -> dict:
+        """The options recorded under `args` in the run summary."""
+        return {
+            "input": self.input,
+            "resources_dir": self.resources_dir,
+            "range": self.range_text,
+            "start": self.start,
+            "end": self.end,
+            "limit": self.limit,
+            "resume": bool(self.resume),
+            "force": bool(self.force),
+            "continue_on_failure": bool(self.continue_on_failure),
+            "max_consecutive_failures": int(self.max_consecutive_failures),
+            "errors_file": self.errors_file,
+            "sleep_min": self.sleep_min,
+            "sleep_max": self.sleep_max,
+            "max_retries": self.max_retries,
+            "retry_backoff": self.retry_backoff,
+            "retry_wait_base": self.retry_wait_base,
+            "retry_wait_max": self.retry_wait_max,
+            "retry_jitter": self.retry_jitter,
+            "card_rel_dir_template": self.card_rel_dir_template,
+            "image_path_template": self.image_path_template,
+            "manifest_write_every": self.manifest_write_every,
+            "manifest_write_interval": self.manifest_write_interval,
+            "manifest_store": self.manifest_store,
+            "workers": self.workers,
+            "route": self.route,
+            "hedge": bool(self.hedge),
+            "stream": bool(self.stream),
+            "pack": self.pack,
+            "batch": bool(self.batch),
+            "cache_mode": self.cache_mode,
+            "cache_file": self.cache_file if self.cache_mode != "off" else None,
+        }
+
+
+def options_from_args(args: argparse.Namespace) -> EngineOptions:
+    """Pick the engine options out of a parsed `build_parser()` namespace."""
+    names = {f.name for f in dataclasses.fields(EngineOptions)}
+    return EngineOptions(**{k: v for k, v in vars(args).items() if k in names})
+
+
+def build_parser(
+    default_input: str, default_resources_dir: str, default_progress_file: str, default_config: str
+) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate history idiom cards via LLM.")
+    add = parser.add_argument
+    add("--input", default=default_input, help="Idiom list file (UTF-8).")
+    add(
+        "--resources-dir",
+        default=default_resources_dir,
+        help="Output resources dir (contains manifest.json and cards/). "
+        "Example: history/resources/data",
+    )
+    add("--start", type=int, default=None, help="1-based idiom start index (after filtering).")
+    add("--end", type=int, default=None, help="1-based idiom end index (inclusive).")
+    add("--limit", type=int, default=None, help="Max idioms to process from start.")
+    add("--range", dest="range_text", default=None, help="Shorthand range like 5-10 (inclusive).")
+    add(
+        "--progress-file",
+        default=default_progress_file,
+        help="JSON progress file for resumable runs.",
+    )
+    add("--resume", action="store_true", help="Resume from progress file (if present).")
+    add(
+        "--force",
+        action="store_true",
+        help="Regenerate even if existing data.json/manifest entry exists.",
+    )
+    add("--dry-run", action="store_true", help="Print selected idioms and exit.")
+    failure_mode = parser.add_mutually_exclusive_group()
+    failure_mode.add_argument(
+        "--continue-on-failure",
+        dest="continue_on_failure",
+        action="store_true",
+        help="失败后继续处理后续条目（默认）。",
+    )
+    failure_mode.add_argument(
+        "--stop-on-failure",
+        dest="continue_on_failure",
+        action="store_false",
+        help="遇到任意失败立刻停止（便于 --resume 回到失败条目重试）。",
+    )
+    parser.set_defaults(continue_on_failure=True)
+    add(
+        "--max-consecutive-failures",
+        type=int,
+        default=10,
+        help="连续失败达到 N 时停止；设置为 0 表示永不因连续失败停止（默认：10）。",
+    )
+    add(
+        "--errors-file",
+        default=None,
+        help="失败条目汇总 JSONL 文件路径；默认：<resources-dir>/cards/_errors.jsonl",
+    )
+    add(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of idioms generated concurrently (thread pool). Results are committed in "
+        "idiom order by the main thread, so manifest/progress/runlog stay consistent. "
+        "Default: 1 (serial).",
+    )
+    add("--sleep-min", type=float, default=0.0, help="Min seconds to sleep between LLM calls.")
+    add("--sleep-max", type=float, default=0.0, help="Max seconds to sleep between LLM calls.")
+    add("--max-retries", type=int, default=3, help="Max retries per idiom on LLM/parse failure.")
+    add(
+        "--retry-backoff",
+        choices=["linear", "exponential"],
+        default="linear",
+        help="Retry wait strategy when a request fails (default: linear).",
+    )
+    add(
+        "--retry-wait-base",
+        type=float,
+        default=1.5,
+        help="Base seconds for retry waits (linear: base*attempt, "
+        "exponential: base*2^(attempt-1)).",
+    )
+    add(
+        "--retry-wait-max",
+        type=float,
+        default=10.0,
+        help="Max seconds to wait between retries (default: 10).",
+    )
+    add(
+        "--retry-jitter",
+        type=float,
+        default=0.0,
+        help="Add 0..jitter seconds random jitter to retry waits (default: 0).",
+    )
+    add(
+        "--image-path-template",
+        default="cards/{id}/image.png",
+        help="Relative image path template stored in card JSON (default: cards/{id}/image.png).",
+    )
+    add(
+        "--card-rel-dir-template",
+        default="cards/{id}",
+        help="Relative dir (under --resources-dir) for per-card files. "
+        "Example sharding: cards/{shard2}/{id} (default: cards/{id}).",
+    )
+    add(
+        "--manifest-write-every",
+        type=int,
+        default=None,
+        help="Write manifest.json every N newly-added cards; 0 = only once at the end. "
+        "Default: 200 with --manifest-store journal (cards are committed to the journal "
+        "immediately), 1 with json.",
+    )
+    add(
+        "--manifest-write-interval",
+        type=float,
+        default=None,
+        help="Also write manifest.json S seconds after the last write (if cards were added); "
+        "0 = off. Default: 60 with --manifest-store journal, 0 with json.",
+    )
+    add(
+        "--manifest-store",
+        choices=["journal", "json"],
+        default="journal",
+        help="journal (default): append each card to an SQLite journal with id/name indexes and "
+        "compact manifest.json from it; json: legacy mode, rewrite the whole manifest.json.",
+    )
+    add(
+        "--manifest-journal",
+        default=None,
+        help="Manifest journal file. Default: <resources-dir>/.manifest_journal.sqlite",
+    )
+    add(
+        "--compact-manifest",
+        action="store_true",
+        help="Rewrite manifest.json from the manifest journal and exit (no LLM calls).",
+    )
+    add(
+        "--id-index",
+        default=None,
+        help="Persistent card id index (id -> name / name -> id) used to resolve pinyin id "
+        "collisions. Built once on first use, then updated as cards are written. "
+        "Default: <resources-dir>/.card_index.sqlite",
+    )
+    add(
+        "--rebuild-id-index",
+        action="store_true",
+        help="Rebuild the id index from the manifest and all data.json files under the cards dir, "
+        "then exit.",
+    )
+    add(
+        "--verify-id-index",
+        action="store_true",
+        help="Compare the id index with the manifest and data.json files, report differences and "
+        "exit (exit code 1 if they differ).",
+    )
+    add("--config", default=default_config, help="LLM config.ini path (default: utils/config.ini).")
+    add(
+        "--llmsource",
+        default=None,
+        help="Override [llmsources].llmsource "
+        "(e.g. zhipuai, deepseek, openai, openrouter, geminiweb).",
+    )
+    add(
+        "--models",
+        default=None,
+        help="Override model list (comma-separated). If set, ignores models from config.",
+    )
+    add(
+        "--max-models",
+        type=int,
+        default=3,
+        help="Limit number of fallback models to try (default: 3).",
+    )
+    add(
+        "--route",
+        choices=ROUTING_POLICIES,
+        default="fixed",
+        help="Model fallback order: fixed (config order) or latency (reorder by observed "
+        "p50/p95 and error rate).",
+    )
+    add(
+        "--hedge",
+        action="store_true",
+        help="Send a duplicate request to the next model when the current one exceeds its p95 "
+        "latency; the first valid answer wins.",
+    )
+    add(
+        "--hedge-after",
+        type=float,
+        default=0.0,
+        help="Hedge deadline (seconds) used until a model has enough samples for p95 "
+        "(0 = no hedging until then).",
+    )
+    add(
+        "--hedge-factor",
+        type=float,
+        default=1.0,
+        help="Hedge deadline = p95 x factor (default: 1.0).",
+    )
+    add(
+        "--route-min-samples",
+        type=int,
+        default=5,
+        help="Samples per model before its latency stats are used for routing/hedging "
+        "(default: 5).",
+    )
+    add(
+        "--stream",
+        action="store_true",
+        help="Stream LLM output (OpenAI-compatible SSE / Gemini streamGenerateContent), "
+        "validate the JSON incrementally and abort early when it cannot become a valid card. "
+        "Records time-to-first-token.",
+    )
+    add(
+        "--pack",
+        type=int,
+        default=1,
+        help="Idioms per LLM request (default: 1). K>1 sends one prompt asking for a JSON array of "
+        "K cards; missing/malformed items are split off and retried.",
+    )
+    add(
+        "--batch",
+        action="store_true",
+        help="Submit the selected idioms through the provider's Batch API (OpenAI-compatible / "
+        "ZhipuAI), poll until done, then commit results. Failed items fall back to interactive "
+        "calls.",
+    )
+    add("--batch-dir", default=None, help="Batch JSONL/state dir. Default: <resources-dir>/batches")
+    add(
+        "--batch-size", type=int, default=50000, help="Max requests per batch job (default: 50000)."
+    )
+    add(
+        "--batch-poll-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between batch status polls.",
+    )
+    add(
+        "--batch-timeout",
+        type=float,
+        default=0.0,
+        help="Stop polling after N seconds (0 = wait until done).",
+    )
+    add(
+        "--batch-resume",
+        default=None,
+        help="Resume a previously submitted batch from its state file (path or name under "
+        "--batch-dir).",
+    )
+    add(
+        "--cache-mode",
+        choices=list(CACHE_MODES),
+        default="off",
+        help="LLM response cache: off (default), readwrite, readonly, or replay (cache only, never "
+        "call the LLM).",
+    )
+    add(
+        "--cache-file",
+        default=None,
+        help="SQLite response cache path. Default: <resources-dir>/.llm_cache.sqlite",
+    )
+    add(
+        "--cache-max-mb",
+        type=float,
+        default=0.0,
+        help="Evict least-recently-used entries above this size (0 = unlimited).",
+    )
+    add(
+        "--cache-max-age-days",
+        type=float,
+        default=0.0,
+        help="Evict entries older than this (0 = never).",
+    )
+    add("--verbose", action="store_true", help="Verbose logging.")
+    add(
+        "--runlog-file",
+        default=None,
+        help="Append JSONL run log (one line per idiom). "
+        "Default: <resources-dir>/historycards_runlog.jsonl",
+    )
+    add(
+        "--summary-file",
+        default=None,
+        help="Write JSON summary at end. Default: <resources-dir>/historycards_summary.json",
+    )
+    add(
+        "--io-durability",
+        choices=list(DURABILITY_LEVELS),
+        default="flush",
+        help="Progress/runlog/errors writes are buffered and group-committed. none: leave to OS "
+        "buffers; flush (default): write-ahead log + flush, the last batch is replayed after a "
+        "crash; fsync: also fsync.",
+    )
+    add(
+        "--io-commit-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between group commits of progress/runlog/errors writes (0 = commit after "
+        "every idiom). Default: 1.0",
+    )
+    add(
+        "--io-wal",
+        default=None,
+        help="Write-ahead log for buffered writes. Default: <resources-dir>/.historycards_io.wal",
+    )
+    add(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve live Prometheus/OpenMetrics metrics on this port at /metrics (0 = pick a free "
+        "port). Default: off",
+    )
+    add(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="Bind address for --metrics-port. Default: 127.0.0.1 (0.0.0.0 exposes it remotely)",
+    )
+    add(
+        "--profile-folded",
+        default=None,
+        help="Write per-phase self time as folded stacks (`card;generate;llm_call <µs>`) for "
+        "flamegraph.pl / speedscope.",
+    )
+    return parser
@@ -0,0 +1,119 @@
+# codex: 2026-10-18 合并请求只查一次缓存且以合并 prompt 为 key；pace_sleep 计入 profiler
+"""
+--pack K: one LLM request asks for K cards (a JSON array), mapped back to jobs by idiom name.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from time import perf_counter
+
+from utils.llm_api import get_client_temperature
+from utils.llm_cache import CacheMissError
+from history.card_attempts import GenContext, call_models, generate_card, pace_sleep
+from history.card_prompts import build_multi_prompt, clean_llm_json_array, normalize_card
+from history.card_stats import CardJob, CardResult
+
+logger = logging.getLogger("historycards")
+
+
+def generate_pack(jobs: list[CardJob], ctx: GenContext) -> list[CardResult]:
+    """
+    --pack：把多个成语合并为一次请求（JSON 数组），按 name 对回各自的卡片。
+    缺失/不合法的条目拆出来重试：整次失败时对半拆分，部分失败时只重发失败的那几条；
+    拆到单条时走 `generate_card`（单成语 prompt + 原有重试/回退），因此错误文件与 runlog 与逐条模式一致。
+    缓存以实际发出的合并 prompt 为 key：每个合并请求只查一次缓存，命中即整体回放。
+    """
+    if len(jobs) == 1:
+        return [generate_card(jobs[0], ctx)]
+    if ctx.stop.is_set():
+        return [CardResult(job=job, not_started=True) for job in jobs]
+    cache = ctx.cache if ctx.cache is not None and ctx.cache.enabled else None
+    source = ctx.llm.source
+    temperature = get_client_temperature(ctx.llm.client)
+
+    by_name = {job.idiom: job for job in jobs}
+    results: dict = {}
+    model_name = None
+    from_cache = False
+    prof = ctx.stats.profiler
+    prompt = build_multi_prompt([(j.idiom, j.card_id) for j in jobs])
+    try:
+        # 合并请求由多张卡片共享，不挂在单卡的 card 阶段下
+        with prof.phase("generate_pack"):
+            response_text = None
+            if cache is not None:
+                with prof.phase("cache_lookup"):
+                    model_name, response_text = cache.lookup(
+                        source, ctx.models, prompt, temperature
+                    )
+                from_cache = response_text is not None
+                ctx.stats.record_cache(hit=from_cache)
+            if response_text is None:
+                with prof.phase("llm_call"):
+                    model_name, response_text = call_models(prompt, ctx)
+            with prof.phase("parse"):
+                items = json.loads(clean_llm_json_array(response_text))
+        if isinstance(items, dict):
+            items = next((v for v in items.values() if isinstance(v, list)), [items])
+        if not isinstance(items, list):
+            raise ValueError("LLM output JSON is not an array.")
+    except CacheMissError as e:
+        # replay 模式：合并请求未录制过，整组记为失败（不调用模型）
+        logger.warning(f"Cache miss (replay mode) for packed request of {len(jobs)} idioms: {e}")
+        return [CardResult(job=job, error=e) for job in jobs]
+    except Exception as e:
+        logger.warning(f"Packed request for {len(jobs)} idioms failed: {e}")
+        items = []
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        job = by_name.get(str(item.get("name", "")).strip())
+        if job is None or job.idx in results:
+            continue
+        try:
+            card = normalize_card(
+                item, idiom=job.idiom, card_id=job.card_id, image_path=job.image_path
+            )
+        except Exception as e:
+            logger.warning(f"Packed item invalid for {job.idx}:{job.idiom}: {e}")
+            continue
+        item_text = json.dumps(item, ensure_ascii=False)
+        results[job.idx] = CardResult(
+            job=job,
+            card=card,
+            used_model=model_name,
+            response_text=item_text,
+            cleaned_json=item_text,
+            from_cache=from_cache,
+            generated_at=perf_counter(),
+        )
+
+    if cache is not None and not from_cache and results:
+        # 至少有一条可用才缓存；回放时缺失/不合法的条目按同样的拆分重新请求
+        with prof.phase("cache_write"):
+            wrote = cache.put(source, model_name, prompt, response_text, temperature)
+        if wrote:
+            ctx.stats.record_cache(write=True)
+    elif from_cache and not results:
+        cache.invalidate(source, model_name, prompt, temperature)
+
+    leftovers = [job for job in jobs if job.idx not in results]
+    ctx.stats.record_pack(len(results), len(leftovers))
+    out = list(results.values())
+    if leftovers:
+        if len(leftovers) == len(jobs):
+            mid = len(jobs) // 2
+            out += generate_pack(jobs[:mid], ctx)
+            out += generate_pack(jobs[mid:], ctx)
+        else:
+            logger.info(
+                f"Packed request missing/invalid {len(leftovers)}/{len(jobs)} item(s); "
+                "retrying them."
+            )
+            out += generate_pack(leftovers, ctx)
+    elif not from_cache:
+        pace_sleep(ctx)
+    return sorted(out, key=lambda r: r.job.idx)
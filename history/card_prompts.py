@@ -0,0 +1,265 @@
+# codex: 2026-10-18 从 historycards.py 拆出提示词、LLM 输出清洗、卡片校验与 --stream 增量校验，供生成引擎复用
+"""
+Prompts, LLM output cleaning and card validation for the card generation engine.
+
+`parse_card` is the single validation pass over a cleaned reply: it parses the JSON object and
+normalizes it into a card, so callers never re-validate a reply they have already accepted.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Optional
+
+from utils.llm_api import StreamAborted
+
+_PROMPT_PERSONA = (
+    "你是一位深谙中国传统文化的历史学家、语言学家和艺术家。"
+    "你的任务是为一款“历史时间轴成语游戏”编写游戏卡牌描述。"
+)
+
+_PROMPT_FIELDS = "\n".join(
+    [
+        '  "period": "使用中文朝代标签（如：战国、唐朝），需严格参考下文的历史年表",',
+        '  "year_estimate": 整数格式的估算年份（公元前为负数，公元后为正数）,',
+        '  "popular": 1-10 的整数（10代表现代汉语极常用，1代表极其生僻）,',
+        '  "meaning": "该成语的中文准确释义，控制在1-2句话内",',
+        '  "story": "该成语背后的历史典故。要求：取材于最早的典籍，描述生动，字数在80-150字之间",',
+        '  "prompt": "绘画提示词。必须以 \'A trading card design with a heavy historical feel, '
+        "ancient Chinese art style, realistic texture, ' 开头，"
+        "随后接详细的中文描述，涵盖人物、服饰、场景、色调等细节，用以生成极具沉浸感的画面。\"",
+    ]
+)
+
+_PROMPT_HISTORY = "\n".join(
+    [
+        "### 历史参考依据：",
+        "- 史实优先：若起源有争议，请选择最公认的朝代。",
+        "- 朝代对照表：",
+        "[夏朝：约前2029-前1559] | [商朝：约前1559-前1046] | [西周：前1046-前771] "
+        "| [东周(春秋/战国)：前770-前256] ",
+        "[秦朝：前221-前207] | [西汉：前202-公元8] | [新朝：8-23] | [东汉：25-220] ",
+        "[三国(魏/蜀/吴)：220-280] | [西晋：266-316] | [东晋：317-420] | [南北朝：386-589]",
+        "[隋朝：581-618] | [唐朝：618-907] | [五代十国：907-979] | [宋朝(北宋/南宋)：960-1279]",
+        "[辽/金/西夏：907-1234] | [元朝：1271-1368] | [明朝：1368-144] | [清朝：1636-1912]",
+    ]
+)
+
+_PROMPT_RULES = """### 强制执行规则：
+1. **纯中文输出**：除 JSON Key 名和 image prompt 中的基础前缀外，所有内容（包括释义、故事、描述）必须使用规范中文。
+2. **严禁混杂**：禁止在中文句子中夹杂英文单词。"""
+
+
+def build_prompt(idiom: str, card_id: str) -> str:
+    return f"""
+{_PROMPT_PERSONA}
+
+{_PROMPT_RULES}
+3. **格式规范**：仅输出合法的 JSON 字符串，不包含 Markdown 代码块标记（如 ```json）。
+
+针对成语 “{idiom}”，请输出如下 JSON 对象：
+{{
+  "id": "{card_id}",
+  "name": "{idiom}",
+{_PROMPT_FIELDS}
+}}
+
+{_PROMPT_HISTORY}
+""".strip()
+
+
+def build_multi_prompt(items: list[tuple[str, str]]) -> str:
+    """--pack：一次请求生成多张卡；items 为 (idiom, card_id)，共用规则与年表，只发送一次。"""
+    listing = "\n".join(
+        f"{i}. “{idiom}”（id: {card_id}）" for i, (idiom, card_id) in enumerate(items, start=1)
+    )
+    return f"""
+{_PROMPT_PERSONA}
+
+{_PROMPT_RULES}
+3. **格式规范**：仅输出合法的 JSON 数组，不包含 Markdown 代码块标记（如 ```json）。
+4. **逐条对应**：下列 {len(items)} 个成语各输出一个 JSON 对象，"name" 必须与成语原文完全一致，"id" 照抄括号中的 id。
+
+成语列表：
+{listing}
+
+请输出 JSON 数组，每个元素格式如下：
+[
+{{
+  "id": "对应的 id",
+  "name": "成语原文",
+{_PROMPT_FIELDS}
+}}
+]
+
+{_PROMPT_HISTORY}
+""".strip()
+
+
+def _strip_fences(text: str) -> str:
+    s = text.strip()
+    if "```" in s:
+        parts = re.split(r"```(?:json)?\s*", s, flags=re.IGNORECASE)
+        if len(parts) >= 2:
+            s = parts[1]
+            s = s.split("```", 1)[0].strip()
+    return s
+
+
+def clean_llm_json(text: str) -> str:
+    s = _strip_fences(text)
+    if s.startswith("{") and s.endswith("}"):
+        return s
+    left = s.find("{")
+    right = s.rfind("}")
+    if left != -1 and right != -1 and right > left:
+        return s[left : right + 1]
+    return s
+
+
+def clean_llm_json_array(text: str) -> str:
+    s = _strip_fences(text)
+    if s.startswith("[") and s.endswith("]"):
+        return s
+    left = s.find("[")
+    right = s.rfind("]")
+    if left != -1 and right != -1 and right > left:
+        return s[left : right + 1]
+    return s
+
+
+def normalize_card(data: dict, idiom: str, card_id: str, image_path: str) -> dict:
+    required = ["period", "year_estimate", "meaning", "story", "prompt", "popular"]
+    missing = [k for k in required if k not in data]
+    if missing:
+        raise ValueError(f"Missing fields: {missing}")
+
+    normalized = dict(data)
+    normalized["id"] = card_id
+    normalized["name"] = idiom
+    normalized["image_path"] = image_path.replace("\\", "/")
+
+    try:
+        normalized["year_estimate"] = int(normalized["year_estimate"])
+    except Exception as e:
+        raise ValueError(f"Invalid year_estimate: {normalized.get('year_estimate')}") from e
+
+    try:
+        normalized["popular"] = int(normalized["popular"])
+    except Exception as e:
+        raise ValueError(f"Invalid popular: {normalized.get('popular')}") from e
+
+    if normalized["popular"] < 1:
+        normalized["popular"] = 1
+    if normalized["popular"] > 10:
+        normalized["popular"] = 10
+
+    for key in ["period", "meaning", "story", "prompt"]:
+        if not isinstance(normalized.get(key), str) or not normalized[key].strip():
+            raise ValueError(f"Invalid {key}: {normalized.get(key)!r}")
+        normalized[key] = normalized[key].strip()
+
+    return normalized
+
+
+def parse_card(cleaned: str, idiom: str, card_id: str, image_path: str) -> dict:
+    """Parse + normalize one cleaned reply (`clean_llm_json` output); raises on invalid output."""
+    data = json.loads(cleaned)
+    if not isinstance(data, dict):
+        raise ValueError("LLM output JSON is not an object.")
+    return normalize_card(data, idiom=idiom, card_id=card_id, image_path=image_path)
+
+
+_CJK_RE = re.compile(r"[\u3400-\u9fff]")
+
+
+class CardStreamValidator:
+    """
+    --stream：边接收边检查输出能否成为一张合法卡片，明显不可能时抛 `StreamAborted` 中止生成。
+    只做保守判断（宁可放过，不可误杀），完整输出仍由 `parse_card` 校验。
+    """
+
+    CHINESE_KEYS = ("period", "meaning", "story")
+    MAX_PREAMBLE = 200  # 顶层 "{" 之前允许的说明文字 / 代码块标记长度
+    MIN_CJK_RATIO = 0.3  # 中文字段累计 16 字以上时，汉字占比低于该值视为非中文
+
+    def __init__(self) -> None:
+        self.received = 0
+        self._preamble = 0
+        self._depth = 0
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._is_key = False
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._buf: list[str] = []
+
+    def feed(self, delta: str) -> None:
+        self.received += len(delta)
+        for ch in delta:
+            if self._done:
+                return
+            if self._depth == 0:
+                self._scan_preamble(ch)
+            else:
+                self._scan(ch)
+
+    def _scan_preamble(self, ch: str) -> None:
+        if ch == "{":
+            self._depth = 1
+            self._expect_key = True
+            return
+        if ch == "[":
+            raise StreamAborted("Top-level JSON is an array, expected an object.")
+        self._preamble += 1
+        if self._preamble > self.MAX_PREAMBLE:
+            raise StreamAborted(f"No JSON object within the first {self.MAX_PREAMBLE} characters.")
+
+    def _scan(self, ch: str) -> None:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+                self._buf.append("\\" + ch)  # 保留转义原文：含 \uXXXX 的值不做汉字占比判断
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._end_string()
+            else:
+                self._buf.append(ch)
+                if not self._is_key and len(self._buf) % 8 == 0:
+                    self._check_value("".join(self._buf), final=False)
+            return
+        if ch == '"':
+            self._in_string = True
+            self._is_key = self._depth == 1 and self._expect_key
+            self._buf = []
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._done = True
+        elif self._depth == 1 and ch == ":":
+            self._expect_key = False
+        elif self._depth == 1 and ch == ",":
+            self._expect_key = True
+
+    def _end_string(self) -> None:
+        text = "".join(self._buf)
+        if self._is_key:
+            self._key = text
+        else:
+            self._check_value(text, final=True)
+
+    def _check_value(self, text: str, final: bool) -> None:
+        if self._depth != 1 or self._key not in self.CHINESE_KEYS or "\\u" in text:
+            return
+        text = text.strip()
+        cjk = len(_CJK_RE.findall(text))
+        if final and text and cjk == 0:
+            raise StreamAborted(f"Field {self._key!r} is not Chinese: {text[:40]!r}")
+        if len(text) >= 16 and cjk / len(text) < self.MIN_CJK_RATIO:
+            raise StreamAborted(f"Field {self._key!r} is mostly non-Chinese: {text[:40]!r}")
@@ -0,0 +1,179 @@
+# codex: 2026-10-18 按 .agent/rules/coding.md 收紧行宽（≤100 字符），逻辑不变
+"""
+Worker scheduling with a reorder buffer.
+
+Workers only call the LLM and parse; the main thread commits results in idx order, so
+next_index / runlog / consecutive-failure counting match a serial run even when items finish out
+of order. Dispatch pauses while the same idiom or card id is still in flight, so the next job's
+skip/id decision sees the previous commit (same semantics as `choose_card_id` in a serial run).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from time import perf_counter
+from typing import Callable
+
+from history.card_attempts import GenContext, generate_card
+from history.card_commit import CardCommitter
+from history.card_pack import generate_pack
+from history.card_stats import CardJob, CardResult, SkipRun
+
+logger = logging.getLogger("historycards")
+
+
+def _resolved(value) -> Future:
+    fut: Future = Future()
+    fut.set_result(value)
+    return fut
+
+
+class _Dispatcher:
+    """Pending futures in idx order; `--pack K` groups share one request and fan out per job."""
+
+    def __init__(self, ctx: GenContext, executor):
+        self.ctx = ctx
+        self.executor = executor
+        self.pending: deque = deque()  # (job, Future)，按 idx 有序
+        self.group: list = []  # --pack：凑满 K 条（或无法继续派发）时作为一次请求提交
+
+    def _submit(self, fn, *args) -> Future:
+        if self.executor is None:
+            return _resolved(fn(*args))
+        return self.executor.submit(fn, *args)
+
+    def add_resolved(self, key, value) -> None:
+        self.flush()  # 保持 pending 按 idx 有序
+        self.pending.append((key, _resolved(value)))
+
+    def flush(self) -> None:
+        # 一组共享一个 Future；完成后把各条结果分发到每个条目自己的 Future（提交顺序仍按 idx）
+        if not self.group:
+            return
+        jobs = list(self.group)
+        self.group.clear()
+        if self.ctx.options.pack == 1:
+            self.pending.append((jobs[0], self._submit(generate_card, jobs[0], self.ctx)))
+            return
+        children = {job.idx: Future() for job in jobs}
+
+        def _fan_out(parent: Future) -> None:
+            try:
+                results = parent.result()
+            except BaseException as e:  # pragma: no cover - generate_pack 自身不抛异常
+                results = [CardResult(job=job, error=e) for job in jobs]
+            for r in results:
+                children[r.job.idx].set_result(r)
+
+        self._submit(generate_pack, jobs, self.ctx).add_done_callback(_fan_out)
+        for job in jobs:
+            self.pending.append((job, children[job.idx]))
+
+    def running(self) -> int:
+        return sum(1 for _, f in self.pending if not f.done())
+
+
+def run_scheduled(
+    selected: list[tuple[int, str]],
+    ctx: GenContext,
+    completed_names: set,
+    make_job: Callable[[int, str], CardJob],
+    committer: CardCommitter,
+) -> None:
+    options, stop_event = ctx.options, ctx.stop
+    executor = None
+    if options.workers > 1:
+        executor = ThreadPoolExecutor(
+            max_workers=options.workers, thread_name_prefix="historycards"
+        )
+    # 已派发但未提交的条目上限（限制乱序缓冲的内存）；--pack K 时每个 worker 一次处理 K 条
+    max_window = (options.workers * 4 if options.workers > 1 else 1) * options.pack
+    dispatcher = _Dispatcher(ctx, executor)
+    pending = dispatcher.pending
+    pending_names: set = set()
+    pending_ids: set = set()
+    in_window = 0
+    next_pos = 0
+    stop = False
+
+    try:
+        while True:
+            while not stop_event.is_set() and next_pos < len(selected) and in_window < max_window:
+                if dispatcher.running() >= options.workers * options.pack:
+                    break
+                idx, idiom = selected[next_pos]
+                if idiom in completed_names:
+                    # 预扫描已确认完成：把连续的已完成条目整段快进，不逐条解析 id / 检查文件
+                    end = next_pos
+                    while end < len(selected) and selected[end][1] in completed_names:
+                        end += 1
+                    run = SkipRun(
+                        first_idx=idx,
+                        last_idx=selected[end - 1][0],
+                        idioms=[i for _, i in selected[next_pos:end]],
+                        started=perf_counter(),
+                    )
+                    dispatcher.add_resolved(run, run)
+                    next_pos = end
+                    continue
+                if idiom in pending_names:
+                    break
+                job = make_job(idx, idiom)
+                if job.card_id in pending_ids:
+                    break
+                next_pos += 1
+                if committer.is_done(job) and not options.force:
+                    dispatcher.add_resolved(job, CardResult(job=job, skipped=True))
+                    continue
+                os.makedirs(job.card_dir, exist_ok=True)
+                dispatcher.group.append(job)
+                pending_names.add(idiom)
+                pending_ids.add(job.card_id)
+                in_window += 1
+                if len(dispatcher.group) >= options.pack:
+                    dispatcher.flush()
+            dispatcher.flush()
+
+            while pending and pending[0][1].done():
+                job, fut = pending.popleft()
+                result = fut.result()
+                if isinstance(result, SkipRun):
+                    committer.commit_skip_run(result)
+                    continue
+                if not result.skipped:
+                    pending_names.discard(job.idiom)
+                    pending_ids.discard(job.card_id)
+                    in_window -= 1
+                if committer.commit(result):
+                    stop = True
+                    break
+            committer.maybe_commit_io()
+            if ctx.stats.metrics is not None:
+                ctx.stats.metrics.set_queue(
+                    dispatched=len(pending),
+                    in_flight=dispatcher.running(),
+                    remaining=len(selected) - next_pos,
+                )
+            if stop:
+                # 停止点之后的在途结果直接丢弃，保证 next_index 不越过停止点
+                if pending:
+                    logger.warning(f"Discarding {len(pending)} in-flight idiom(s) after stop.")
+                break
+
+            if not pending:
+                if stop_event.is_set():
+                    logger.warning("Stop requested: exiting after finishing in-flight idioms.")
+                    break
+                if next_pos >= len(selected):
+                    break
+                continue
+            waiting = [f for _, f in pending if not f.done()]
+            if waiting:
+                # 带超时等待，保证停止请求（如 Ctrl+C）能及时生效
+                wait(waiting, timeout=0.5, return_when=FIRST_COMPLETED)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
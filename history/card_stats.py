@@ -0,0 +1,240 @@
+# codex: 2026-10-18 RunStats.metrics 的类型在 TYPE_CHECKING 下导入 RunMetrics（运行时不加载 run_metrics）
+"""
+Run statistics and the job/result records passed between the scheduler, workers and the committer.
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import threading
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import TYPE_CHECKING, Optional
+
+from history.run_profile import PhaseProfiler, QuantileSketch
+
+if TYPE_CHECKING:
+    from history.run_metrics import RunMetrics
+
+
+@dataclass
+class RunStats:
+    run_id: str
+    started_at: str
+    llm_source: str
+    models: list[str]
+    args: dict
+    wall_clock_start: float
+    processed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    total_idioms_selected: int = 0
+    total_attempts: int = 0
+    total_retries: int = 0
+    interrupted: bool = False
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cache_writes: int = 0
+    batch: dict = field(default_factory=dict)
+    pack_calls: int = 0
+    pack_items_ok: int = 0
+    pack_items_retried: int = 0
+    stream_aborts: int = 0
+    parse_failures: int = 0
+    llm_calls: QuantileSketch = field(default_factory=QuantileSketch)
+    ttft: QuantileSketch = field(default_factory=QuantileSketch)
+    per_model: dict = field(default_factory=dict)
+    # --workers 下多线程共享统计
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # --metrics-port：同步写入实时指标
+    metrics: Optional["RunMetrics"] = field(default=None, repr=False)
+    # 按阶段耗时（生成 / 提交 / 刷盘）
+    profiler: PhaseProfiler = field(default_factory=PhaseProfiler, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.per_model is None:  # pragma: no cover
+            self.per_model = {}
+
+    def _model_slot(self, model: str) -> dict:
+        return self.per_model.setdefault(
+            model,
+            {
+                "attempts": 0,
+                "successes": 0,
+                "failures": 0,
+                "parse_failures": 0,
+                "timing": QuantileSketch(),
+                "ok_timing": QuantileSketch(),  # 只含成功调用：路由按它估计延迟
+            },
+        )
+
+    def record_model_attempt(self, model: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.total_attempts += 1
+            self.llm_calls.add(seconds)
+            slot = self._model_slot(model)
+            slot["attempts"] += 1
+            if ok:
+                slot["successes"] += 1
+                slot["ok_timing"].add(seconds)
+            else:
+                slot["failures"] += 1
+            slot["timing"].add(seconds)
+        if self.metrics is not None:
+            self.metrics.observe_llm_call(model, seconds, ok)
+
+    def record_parse_failure(self, model: Optional[str]) -> None:
+        """The model answered but the reply failed JSON parsing / card validation."""
+        with self._lock:
+            self.parse_failures += 1
+            if model:
+                self._model_slot(model)["parse_failures"] += 1
+        if self.metrics is not None:
+            self.metrics.parse_failure(model)
+
+    def model_stats(self, model: str) -> dict:
+        """`ModelRouter(model_stats=...)` 的统计来源：调用次数、成功调用的 p50/p95、错误率（含解析失败）。"""
+        with self._lock:
+            slot = self.per_model.get(model)
+            if not slot or not slot["attempts"]:
+                return {"samples": 0, "p50_s": 0.0, "p95_s": 0.0, "error_rate": 0.0}
+            errors = slot["failures"] + slot["parse_failures"]
+            return {
+                "samples": slot["attempts"],
+                "p50_s": slot["ok_timing"].quantile(0.5),
+                "p95_s": slot["ok_timing"].quantile(0.95),
+                "error_rate": min(1.0, errors / slot["attempts"]),
+            }
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.total_retries += 1
+
+    def record_cache(self, hit: Optional[bool] = None, write: bool = False) -> None:
+        with self._lock:
+            if hit is True:
+                self.cache_hits += 1
+            elif hit is False:
+                self.cache_misses += 1
+            if write:
+                self.cache_writes += 1
+
+    def record_stream(self, ttft_s: Optional[float], aborted: bool = False) -> None:
+        with self._lock:
+            if ttft_s is not None:
+                self.ttft.add(ttft_s)
+            if aborted:
+                self.stream_aborts += 1
+        if self.metrics is not None and ttft_s is not None:
+            self.metrics.observe_ttft(ttft_s)
+
+    def record_pack(self, ok_items: int, retried_items: int) -> None:
+        with self._lock:
+            self.pack_calls += 1
+            self.pack_items_ok += ok_items
+            self.pack_items_retried += retried_items
+
+    def to_dict(self) -> dict:
+        ended_at = _dt.datetime.now().isoformat(timespec="seconds")
+        wall_s = perf_counter() - self.wall_clock_start
+        per_model_out = {}
+        with self._lock:
+            for k, v in self.per_model.items():
+                per_model_out[k] = {
+                    "attempts": v["attempts"],
+                    "successes": v["successes"],
+                    "failures": v["failures"],
+                    "parse_failures": v["parse_failures"],
+                    "timing": v["timing"].to_dict(),
+                }
+        out = {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "ended_at": ended_at,
+            "wall_time_s": round(wall_s, 6),
+            "llm_source": self.llm_source,
+            "models": self.models,
+            "args": self.args,
+            "selected": self.total_idioms_selected,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "interrupted": self.interrupted,
+            "attempts": self.total_attempts,
+            "retries": self.total_retries,
+            "parse_failures": self.parse_failures,
+            "cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "writes": self.cache_writes,
+            },
+            "llm_call_timing": self.llm_calls.to_dict(),
+            "per_model": per_model_out,
+            "profile": self.profiler.snapshot(cards=self.processed + self.failed),
+        }
+        if self.ttft.count or self.stream_aborts:
+            out["stream"] = {"ttft": self.ttft.to_dict(), "aborts": self.stream_aborts}
+        if self.batch:
+            out["batch"] = dict(self.batch)
+        if self.pack_calls:
+            out["pack"] = {
+                "calls": self.pack_calls,
+                "items_ok": self.pack_items_ok,
+                "items_retried": self.pack_items_retried,
+            }
+        return out
+
+
+@dataclass
+class CardJob:
+    """One idiom scheduled for generation; paths/id are resolved by the main thread."""
+
+    idx: int
+    idiom: str
+    card_id: str
+    card_dir: str
+    data_file: str
+    image_path: str
+    started: float
+
+
+@dataclass
+class CardResult:
+    """Worker output. Workers never touch shared files; the main thread commits in idx order."""
+
+    job: CardJob
+    card: Optional[dict] = None
+    error: Optional[Exception] = None
+    used_model: Optional[str] = None
+    # 最近一次模型原始输出：失败时写入文件便于统一修复。
+    response_text: Optional[str] = None
+    # 最近一次清洗后的 JSON 文本：失败时写入文件便于定位解析问题。
+    cleaned_json: Optional[str] = None
+    skipped: bool = False
+    not_started: bool = False  # 排队期间收到停止请求：未调用 LLM，直接放弃
+    from_cache: bool = False
+    ttft_s: Optional[float] = None  # --stream：最近一次调用的首 token 延迟
+    phases: dict = field(default_factory=dict)  # 本卡各阶段自身耗时（路径 -> 秒），写入 runlog
+    generated_at: Optional[float] = None  # worker 完成时刻：到主线程提交之间是重排序等待
+
+
+@dataclass
+class SkipRun:
+    """
+    A contiguous run of already-generated idioms found by the pre-pass scan; committed as one
+    progress/runlog write.
+    """
+
+    first_idx: int
+    last_idx: int
+    idioms: list[str]
+    started: float
+
+
+def phase_ms(phases: dict) -> dict:
+    """runlog 用：本卡各阶段自身耗时（毫秒），去掉根阶段前缀 `card;`。"""
+    return {
+        path.split(";", 1)[-1]: round(seconds * 1000, 3)
+        for path, seconds in phases.items()
+        if seconds > 0
+    }
@@ -180,16 +180,37 @@ const FALLBACK_MANIFEST = {
     ]
 };
 
+// 分片牌库（tools/pack.py 生成）：deck.json 指向带版本的精简索引，卡片正文按需从内容寻址分片中取
+const RESOURCE_BASE = '../resources/';
+const SHARD_CACHE_LIMIT = 8;
+
 class ResourceManager {
     constructor() {
         this.manifest = null;
+        this.deck = null; // { base, fields, shards, cards: [[id, name, year_estimate, popular, period, shard], ...] }
+        this.shardCache = new Map(); // 分片序号 -> Promise<Map<id, card>>，按最近使用淘汰
+    }
+
+    async fetchJson(url, options) {
+        const response = await fetch(url, options);
+        if (!response.ok) throw new Error(`Network response was not ok: ${url}`);
+        return response.json();
     }
 
     async load() {
         try {
-            const response = await fetch('../resources/manifest.json');
-            if (!response.ok) throw new Error('Network response was not ok');
-            this.manifest = await response.json();
+            // 指针很小且会变，绕过缓存；索引与分片文件名带内容哈希，可以长期缓存
+            const pointer = await this.fetchJson(`${RESOURCE_BASE}deck.json`, { cache: 'no-cache' });
+            const index = await this.fetchJson(`${RESOURCE_BASE}${pointer.index}`);
+            if (!index.cards.length) throw new Error('Deck is empty');
+            const base = RESOURCE_BASE + pointer.index.slice(0, pointer.index.lastIndexOf('/') + 1);
+            this.deck = { base, fields: index.fields, shards: index.shards, cards: index.cards };
+            return true;
+        } catch (e) {
+            console.warn('Failed to load deck.json, falling back to manifest.json.', e);
+        }
+        try {
+            this.manifest = await this.fetchJson(`${RESOURCE_BASE}manifest.json`);
             return true;
         } catch (e) {
             console.warn('Failed to load manifest via fetch (likely CORS or missing file). Using fallback data.', e);
@@ -198,7 +219,43 @@ class ResourceManager {
         }
     }
 
-    getCards(count) {
+    loadShard(shardIndex) {
+        let pending = this.shardCache.get(shardIndex);
+        if (pending) {
+            this.shardCache.delete(shardIndex); // 重新插入以标记为最近使用
+        } else {
+            const shard = this.deck.shards[shardIndex];
+            pending = this.fetchJson(this.deck.base + shard.file).then(data => new Map(data.cards.map(card => [card.id, card])));
+            pending.catch(() => this.shardCache.delete(shardIndex));
+        }
+        this.shardCache.set(shardIndex, pending);
+        while (this.shardCache.size > SHARD_CACHE_LIMIT) {
+            this.shardCache.delete(this.shardCache.keys().next().value);
+        }
+        return pending;
+    }
+
+    sampleIndices(total, count) {
+        // 只抽 count 个下标，不复制、不打乱整副牌
+        const picked = new Set();
+        while (picked.size < Math.min(count, total)) {
+            picked.add(Math.floor(Math.random() * total));
+        }
+        return [...picked];
+    }
+
+    async getCards(count) {
+        if (this.deck && this.deck.cards.length > 0) {
+            const shardPos = this.deck.fields.indexOf('shard');
+            const rows = this.sampleIndices(this.deck.cards.length, count).map(i => this.deck.cards[i]);
+            const shards = await Promise.all([...new Set(rows.map(row => row[shardPos]))].map(async s => [s, await this.loadShard(s)]));
+            const byShard = new Map(shards);
+            return rows.map(row => {
+                const slim = Object.fromEntries(this.deck.fields.map((field, i) => [field, row[i]]));
+                const full = byShard.get(row[shardPos]).get(slim.id) || {};
+                return { image_path: `cards/${slim.id}/image.png`, ...full, ...slim };
+            });
+        }
         if (!this.manifest || !this.manifest.cards) return [];
         const cardData = this.manifest.cards.length > 0 ? this.manifest.cards : FALLBACK_MANIFEST.cards;
         const shuffled = [...cardData].sort(() => 0.5 - Math.random());
@@ -372,7 +429,7 @@ class GameApp {
         return Math.floor(points / 2);
     }
 
-    startGame(level) {
+    async startGame(level) {
         this.currentLevel = level; // Track level for scoring
         let count = 5;
         if (level === 'medium') count = 7;
@@ -382,7 +439,7 @@ class GameApp {
         this.selectedCard = null;
         document.getElementById('submit-btn').style.display = 'inline-block';
 
-        this.currentCards = this.resourceManager.getCards(count);
+        this.currentCards = await this.resourceManager.getCards(count);
         this.dom.levelIndicator.textContent = `${count}张`;
         this.renderCards();
         this.showScreen('game');
@@ -420,12 +477,10 @@ class GameApp {
             // el.draggable = true; // Disable DnD
             el.dataset.id = card.id;
 
-            const imgPath = `../resources/${card.image_path}`;
-
             el.innerHTML = `
                 <div class="card-inner">
                     <div class="card-front">
-                        <img src="${imgPath}" class="card-image" draggable="false">
+                        ${this.cardImageHtml(card, 'draggable="false"')}
                         <div class="card-name">${card.name}</div>
                     </div>
                     <div class="card-back">
@@ -458,6 +513,18 @@ class GameApp {
         });
     }
 
+    cardImageHtml(card, attrs = '') {
+        // gen_image.py 生成的变体（AVIF 优先，其次 WebP），浏览器都不支持时回退原图
+        const variants = (card.images && card.images.variants) || {};
+        const sources = ['avif', 'webp']
+            .map(fmt => variants[`full.${fmt}`] && `<source srcset="${RESOURCE_BASE}${variants[`full.${fmt}`].path}" type="image/${fmt}">`)
+            .filter(Boolean)
+            .join('');
+        const full = variants['full.webp'] || variants['full.avif'];
+        const size = full ? ` width="${full.width}" height="${full.height}"` : '';
+        return `<picture>${sources}<img src="${RESOURCE_BASE}${card.image_path}" class="card-image"${size} ${attrs}></picture>`;
+    }
+
     handleCardClick(el) {
         if (this.gameEnded) {
             // If game ended, click flips the card (Result Mode)
@@ -577,11 +644,10 @@ class GameApp {
             el.className = 'card flipped'; // Start Flipped
             el.dataset.id = card.id;
 
-            const imgPath = `../resources/${card.image_path}`;
             el.innerHTML = `
                 <div class="card-inner">
                     <div class="card-front">
-                        <img src="${imgPath}" class="card-image">
+                        ${this.cardImageHtml(card)}
                         <div class="card-name">${card.name}</div>
                     </div>
                     <div class="card-back">
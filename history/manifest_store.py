@@ -0,0 +1,199 @@
+# codex: 2026-10-18 manifest 存储折行到 ≤100，逻辑不变
+"""
+Append-only manifest journal for `historycards.py`.
+
+每张新卡只执行一次 INSERT（id / name 各有唯一索引），提交成本不随卡片数量增长（引擎随 RunWriter
+组提交，一批一次事务）；
+前端使用的 `manifest.json` 只在压缩（`compact`）时整体写出一次。
+
+- 首次打开时把已有的 `manifest.json` 导入日志；之后若 `manifest.json` 被其他工具改写（如 `tools/pack.py`），
+  下次打开会把其中日志里没有的卡片补进来（按 id / name 去重），并删除其中已被移除的卡片；
+  上次压缩之后才追加的卡片（`pending`）本来就不在 `manifest.json` 里，不会被当作删除
+- 日志是 manifest 卡片的唯一事实来源：压缩时按写入顺序输出全部卡片，并保留原文件中 `cards` 以外的顶层字段
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import os
+import sqlite3
+from typing import Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    pending INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _file_signature(path: str) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def _atomic_write_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+class ManifestStore:
+    """SQLite manifest journal. Single writer (the historycards main thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cards)")}
+        if "pending" not in columns:
+            # 旧日志没有 pending 列：有未压缩的卡片时保守地全部视为待压缩，下次压缩后恢复正常
+            self._conn.execute("ALTER TABLE cards ADD COLUMN pending INTEGER NOT NULL DEFAULT 0")
+            if self.dirty:
+                self._conn.execute("UPDATE cards SET pending = 1")
+        self._conn.commit()
+
+    # -- meta ---------------------------------------------------------------
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def dirty(self) -> bool:
+        """日志里有尚未压缩进 manifest.json 的卡片。"""
+        return self._get_meta("dirty") == "1"
+
+    # -- import / sync ------------------------------------------------------
+    def sync_from_manifest(self, manifest_file: str) -> Tuple[int, int]:
+        """
+        `manifest.json` 自上次导入/压缩后有变化时，以它为准同步日志：补入缺少的卡片，
+        删除已从中移除的卡片（`pending` 的新卡除外）；返回 (补入条数, 删除条数)。
+        """
+        signature = _file_signature(manifest_file)
+        if signature is None or signature == self._get_meta("manifest_signature"):
+            return 0, 0
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("cards"), list):
+            raise ValueError(f"Invalid manifest format: {manifest_file}")
+        added = 0
+        listed = set()
+        for card in manifest["cards"]:
+            if not isinstance(card, dict):
+                continue
+            if not (isinstance(card.get("id"), str) and isinstance(card.get("name"), str)):
+                continue
+            listed.add(card["id"])
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO cards(id, name, data) VALUES (?, ?, ?)",
+                (card["id"], card["name"], json.dumps(card, ensure_ascii=False)),
+            )
+            added += cur.rowcount
+        gone = [
+            (card_id,)
+            for (card_id,) in self._conn.execute("SELECT id FROM cards WHERE pending = 0")
+            if card_id not in listed
+        ]
+        self._conn.executemany("DELETE FROM cards WHERE id = ?", gone)
+        header = {k: v for k, v in manifest.items() if k != "cards"}
+        self._set_meta("header", json.dumps(header, ensure_ascii=False))
+        self._set_meta("manifest_signature", signature)
+        self._conn.commit()
+        return added, len(gone)
+
+    # -- writes -------------------------------------------------------------
+    def append(self, card: dict, commit: bool = True) -> bool:
+        """追加一张卡；id 或 name 已存在时不写入并返回 False。
+
+        `commit=False` 只在本连接内可见，等 `append_many` / 下次提交一起落盘。
+        """
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO cards(id, name, data, pending) VALUES (?, ?, ?, 1)",
+            (card["id"], card["name"], json.dumps(card, ensure_ascii=False)),
+        )
+        if cur.rowcount:
+            self._set_meta("dirty", "1")
+        if commit:
+            self._conn.commit()
+        return bool(cur.rowcount)
+
+    def append_many(self, cards: list) -> int:
+        """一次事务追加多张卡（已存在的 id / name 跳过，可重复执行）；返回新增条数。"""
+        added = sum(self.append(card, commit=False) for card in cards)
+        self._conn.commit()
+        return added
+
+    # -- reads --------------------------------------------------------------
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def has_id(self, card_id: str) -> bool:
+        return (
+            self._conn.execute("SELECT 1 FROM cards WHERE id = ?", (card_id,)).fetchone()
+            is not None
+        )
+
+    def has_name(self, name: str) -> bool:
+        return (
+            self._conn.execute("SELECT 1 FROM cards WHERE name = ?", (name,)).fetchone() is not None
+        )
+
+    def name_for_id(self, card_id: str) -> Optional[str]:
+        row = self._conn.execute("SELECT name FROM cards WHERE id = ?", (card_id,)).fetchone()
+        return row[0] if row else None
+
+    def id_for_name(self, name: str) -> Optional[str]:
+        row = self._conn.execute("SELECT id FROM cards WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def iter_cards(self) -> Iterator[dict]:
+        for (data,) in self._conn.execute("SELECT data FROM cards ORDER BY seq"):
+            yield json.loads(data)
+
+    def to_manifest(self) -> dict:
+        """按 manifest.json 的结构返回全部卡片（保留原文件的其他顶层字段与顺序）。"""
+        header = json.loads(self._get_meta("header") or "{}")
+        manifest = {"cards": list(self.iter_cards())}
+        for key, value in header.items():
+            manifest[key] = value
+        return manifest
+
+    # -- compaction ---------------------------------------------------------
+    def compact(self, manifest_file: str) -> int:
+        """把日志整体写成 `manifest.json`（原子替换）；返回卡片数。"""
+        manifest = self.to_manifest()
+        if self.dirty or "updated_at" not in manifest:
+            manifest["updated_at"] = _dt.date.today().isoformat()
+        manifest.setdefault("version", "1.0")
+        _atomic_write_json(manifest_file, manifest)
+        header = {k: v for k, v in manifest.items() if k != "cards"}
+        self._set_meta("header", json.dumps(header, ensure_ascii=False))
+        self._set_meta("manifest_signature", _file_signature(manifest_file) or "")
+        self._set_meta("dirty", "0")
+        self._conn.execute("UPDATE cards SET pending = 0 WHERE pending = 1")
+        self._conn.commit()
+        return len(manifest["cards"])
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,185 @@
+# codex: 2026-10-18 拼音表模块折行到 ≤100（文档与 main 参数），逻辑不变
+"""
+Precomputed idiom -> pinyin table shared by `historycards.py` and `tools/gen_meta.py`.
+
+旧实现每次运行都要导入 pypinyin 并对每条成语调用 `lazy_pinyin`（2 万多条时占启动 / dry-run 时间的大头）。
+现在从成语词典预先生成 `history/resources/pinyin_slugs.tsv`：
+
+- 表中保存 `"".join(lazy_pinyin(idiom))` 的原始结果，各工具再按自己的规则规整（historycards 会转小写、去掉非字母数字）
+- 首行是版本头：`#pinyin_slugs<TAB>version=N<TAB>pypinyin=x.y.z<TAB>source_sha1=...`；
+  版本与 `SLUG_TABLE_VERSION` 不一致时整表忽略
+- `source_sha1` 与当前成语词典不一致（词典已更新、表没重新生成）时告警一次，并整表回退到现场转换
+- 查表未命中才导入 pypinyin 现场转换（结果在进程内缓存）；未安装 pypinyin 时退回逐字拼接（与旧的测试兜底一致）
+
+重新生成（词典更新或 pypinyin 升级后）：
+
+    python history/pinyin_slugs.py --build
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+SLUG_TABLE_VERSION = 1
+
+_HISTORY_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TABLE_PATH = os.path.join(_HISTORY_DIR, "resources", "pinyin_slugs.tsv")
+DEFAULT_DICT_PATH = os.path.join(_HISTORY_DIR, "resources", "汉语成语词典_词表_23889条.txt")
+
+_HEADER_TAG = "#pinyin_slugs"
+
+logger = logging.getLogger("historycards")
+
+
+def _iter_dict_idioms(path: str) -> Iterable[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def _sha1_file(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _live_converter():
+    try:
+        from pypinyin import lazy_pinyin
+    except ModuleNotFoundError:  # pragma: no cover
+        return list
+    return lazy_pinyin
+
+
+@lru_cache(maxsize=65536)
+def live_pinyin(text: str) -> str:
+    """现场转换（未命中预计算表时的兜底）。"""
+    return "".join(_live_converter()(text))
+
+
+def _read(path: str) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    with f:
+        header = f.readline().rstrip("\n").split("\t")
+        if not header or header[0] != _HEADER_TAG:
+            return None
+        meta = dict(item.split("=", 1) for item in header[1:] if "=" in item)
+        if meta.get("version") != str(SLUG_TABLE_VERSION):
+            return None
+        table: Dict[str, str] = {}
+        for line in f:
+            idiom, sep, pinyin = line.rstrip("\n").partition("\t")
+            if sep:
+                table[idiom] = pinyin
+        return meta, table
+
+
+def read_table(path: str) -> Optional[Dict[str, str]]:
+    """读取拼音表；文件不存在或版本不匹配时返回 None。"""
+    loaded = _read(path)
+    return loaded[1] if loaded else None
+
+
+def stale_reason(path: str, dict_path: str = DEFAULT_DICT_PATH) -> Optional[str]:
+    """表与词典不匹配的原因（缺失 / 版本不符 / 词典 sha1 不同）；匹配或词典不存在时返回 None。"""
+    loaded = _read(path)
+    if loaded is None:
+        return f"missing or outdated table (expected version {SLUG_TABLE_VERSION})"
+    if not os.path.exists(dict_path):
+        return None
+    expected, actual = loaded[0].get("source_sha1"), _sha1_file(dict_path)
+    if expected != actual:
+        name = os.path.basename(dict_path)
+        return f"built from dictionary sha1 {expected}, current {name} is {actual}"
+    return None
+
+
+@lru_cache(maxsize=None)
+def _load_table(path: str, dict_path: str = DEFAULT_DICT_PATH) -> Dict[str, str]:
+    loaded = _read(path)
+    if loaded is None:
+        return {}
+    if os.path.exists(dict_path) and loaded[0].get("source_sha1") != _sha1_file(dict_path):
+        logger.warning(
+            f"Pinyin table {path} was built from a different idiom dictionary; "
+            "using pypinyin instead (rebuild with `python history/pinyin_slugs.py --build`)."
+        )
+        return {}
+    return loaded[1]
+
+
+def pinyin_of(
+    text: str, table_path: str = DEFAULT_TABLE_PATH, dict_path: str = DEFAULT_DICT_PATH
+) -> str:
+    """`"".join(lazy_pinyin(text))`：优先查预计算表（须与 `dict_path` 词典匹配），未命中再现场转换。"""
+    hit = _load_table(table_path, dict_path).get(text)
+    return hit if hit is not None else live_pinyin(text)
+
+
+def build_table(dict_path: str = DEFAULT_DICT_PATH, table_path: str = DEFAULT_TABLE_PATH) -> int:
+    """从成语词典生成拼音表（按词典顺序、去重）；返回条数。"""
+    try:
+        import pypinyin
+    except ModuleNotFoundError as e:
+        raise RuntimeError("生成拼音表需要安装 pypinyin。") from e
+    seen: Dict[str, str] = {}
+    for idiom in _iter_dict_idioms(dict_path):
+        if idiom not in seen:
+            seen[idiom] = "".join(pypinyin.lazy_pinyin(idiom))
+    header = [
+        _HEADER_TAG,
+        f"version={SLUG_TABLE_VERSION}",
+        f"pypinyin={getattr(pypinyin, '__version__', 'unknown')}",
+        f"source_sha1={_sha1_file(dict_path)}",
+    ]
+    tmp = f"{table_path}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\t".join(header) + "\n")
+        for idiom, pinyin in seen.items():
+            f.write(f"{idiom}\t{pinyin}\n")
+    os.replace(tmp, table_path)
+    _load_table.cache_clear()
+    return len(seen)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or check the idiom pinyin table.")
+    add = parser.add_argument
+    add("--build", action="store_true", help="Regenerate the table from the idiom dictionary.")
+    add("--dict", default=DEFAULT_DICT_PATH, help="Idiom dictionary (one idiom per line).")
+    add(
+        "--table",
+        default=DEFAULT_TABLE_PATH,
+        help="Table path (default: history/resources/pinyin_slugs.tsv).",
+    )
+    args = parser.parse_args(argv)
+
+    if args.build:
+        count = build_table(args.dict, args.table)
+        print(f"Wrote {count} idioms -> {args.table}")
+        return 0
+    reason = stale_reason(args.table, args.dict)
+    if reason is not None:
+        print(f"Stale pinyin table {args.table}: {reason}", file=sys.stderr)
+        return 1
+    table = read_table(args.table)
+    print(f"{args.table}: {len(table)} idioms, version {SLUG_TABLE_VERSION}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
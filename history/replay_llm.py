@@ -0,0 +1,155 @@
+# codex: 2026-10-18 从 bench_replay 拆出回放模型（ReplayLLM 与录制 / 合成回复），bench_replay 保持 ≤500 行
+"""
+Replay LLM for `history/bench_replay.py` (and tests): no network, no provider SDK.
+
+`ReplayLLM` has the signatures of `LLMBinding.call` / `LLMBinding.stream`; it hands out recorded
+or synthetic replies in turn, with configurable latency, error and truncation rates.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import List
+
+LATENCY_DISTS = ("const", "exp", "lognormal")
+
+
+class ReplayError(Exception):
+    """回放时按 --error-rate 注入的模型错误。"""
+
+
+# -- responses ---------------------------------------------------------------
+def _response_from_card(card: dict) -> str:
+    return json.dumps(
+        {k: v for k, v in card.items() if k not in ("id", "name", "image_path")}, ensure_ascii=False
+    )
+
+
+def synthetic_responses(count: int = 64, seed: int = 0) -> List[str]:
+    """合成的合法卡片回复（字段长度接近真实输出）。"""
+    rng = random.Random(seed)
+    periods = ["先秦", "春秋", "战国", "秦", "汉", "三国", "晋", "唐", "宋", "明", "清"]
+    out = []
+    for i in range(count):
+        card = {
+            "period": rng.choice(periods),
+            "year_estimate": rng.randint(-800, 1900),
+            "meaning": "比喻" + "意思" * rng.randint(10, 30),
+            "story": "相传" + "故事内容" * rng.randint(60, 150),
+            "prompt": "Chinese ink painting, " + "scene detail, " * rng.randint(10, 25),
+            "popular": rng.randint(1, 10),
+        }
+        out.append(
+            _response_from_card(card) if i % 4 else f"```json\n{_response_from_card(card)}\n```"
+        )
+    return out
+
+
+def load_responses(path: str, limit: int = 2000) -> List[str]:
+    """录制的回复：JSONL（每行 `{"response": "..."}` 或一张卡片），或一个 resources 目录（读取其中的 data.json）。"""
+    out: List[str] = []
+    if os.path.isdir(path):
+        for root, _dirs, files in os.walk(path):
+            if "data.json" in files:
+                with open(os.path.join(root, "data.json"), "r", encoding="utf-8") as f:
+                    out.append(_response_from_card(json.load(f)))
+                if len(out) >= limit:
+                    break
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                out.append(item["response"] if "response" in item else _response_from_card(item))
+                if len(out) >= limit:
+                    break
+    if not out:
+        raise ValueError(f"No recorded responses found in {path}")
+    return out
+
+
+class ReplayLLM:
+    """`LLMBinding` 的 call（实例本身）/ stream：轮流回放，按分布注入延迟与错误。"""
+
+    def __init__(
+        self,
+        responses: List[str],
+        latency_ms: float = 0.0,
+        latency_dist: str = "const",
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(
+                f"Unknown latency distribution: {latency_dist!r} (choose from {LATENCY_DISTS})"
+            )
+        self.responses = list(responses)
+        self.latency_s = latency_ms / 1000.0
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next = 0
+        self.calls = 0
+        self.errors = 0
+        self.malformed = 0
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            text = self.responses[self._next % len(self.responses)]
+            self._next += 1
+            if self.latency_s <= 0:
+                delay = 0.0
+            elif self.latency_dist == "exp":
+                delay = self._rng.expovariate(1.0 / self.latency_s)
+            elif self.latency_dist == "lognormal":
+                # 均值保持为 latency_ms
+                delay = (
+                    self._rng.lognormvariate(0.0, self.latency_sigma)
+                    * self.latency_s
+                    / math.exp(self.latency_sigma**2 / 2)
+                )
+            else:
+                delay = self.latency_s
+            roll = self._rng.random()
+            if roll < self.error_rate:
+                self.errors += 1
+                return delay, None
+            if roll < self.error_rate + self.malformed_rate:
+                self.malformed += 1
+                text = text[: len(text) // 2]  # 截断：JSON 解析失败
+        return delay, text
+
+    def __call__(self, _client, _llm_source, _prompt, _model_name, _logger=None) -> str:
+        delay, text = self._draw()
+        if delay > 0:
+            time.sleep(delay)
+        if text is None:
+            raise ReplayError("synthetic 503 Service Unavailable")
+        return text
+
+    def stream(
+        self, _client, _llm_source, _prompt, _model_name, _logger=None, on_delta=None
+    ) -> str:
+        delay, text = self._draw()
+        if delay > 0:
+            time.sleep(delay)
+        if text is None:
+            raise ReplayError("synthetic 503 Service Unavailable")
+        if on_delta is not None:
+            step = max(1, len(text) // 8)
+            for i in range(0, len(text), step):
+                on_delta(text[i : i + step])
+        return text
@@ -0,0 +1,367 @@
+# codex: 2026-10-18 按行宽 ≤100 折行；限流器的三个指标族改由 _LIMITER_FIELDS 表生成，输出不变
+"""
+Live metrics endpoint for long `historycards.py` runs (`--metrics-port`).
+
+运行汇总（`historycards_summary.json`）只在结束时写一次；多天的运行中途看不到吞吐和延迟。
+开启 `--metrics-port` 后在 `http://<host>:<port>/metrics` 暴露：
+
+- `historycards_llm_call_seconds{model,outcome}`：每次模型调用耗时的直方图（分位数用 `histogram_quantile()` 计算）
+- `historycards_llm_ttft_seconds`：`--stream` 的首 token 延迟直方图
+- `historycards_parse_failures_total{model}`：模型有回复但解析/校验失败的次数
+- `historycards_cards_total{status}`、`historycards_retries_total`、
+  `historycards_cache_events_total{event}`
+- `historycards_queue_depth{state}`：已派发未提交 / 正在调用模型 / 尚未派发的条目数
+- `historycards_cards_per_minute`：最近 `rate_window_s` 秒内的成卡速度
+- 限流器与多 key 池的计数（429、在途、隔离中的 key）
+
+请求头 `Accept` 含 `application/openmetrics-text` 时返回 OpenMetrics 格式，否则返回 Prometheus 文本格式 0.0.4。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 模型调用通常在 1 秒到几分钟之间
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+# collector 返回的一个指标族：(name, type, help, [(labels, value), ...])；counter 的 name 不含 `_total`
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+# 共享限流器快照里按 limiter 导出的字段：(字段, 类型, 说明)
+_LIMITER_FIELDS = (
+    ("throttled", "counter", "429 responses seen by the shared rate limiter."),
+    ("in_flight", "gauge", "Requests in flight per rate limiter."),
+    ("concurrency_limit", "gauge", "Current AIMD concurrency window."),
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _MetricFamily:
+    """一个带标签的指标族；线程安全（所有子序列共用注册表的锁）。"""
+
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        kind: str,
+        help_text: str,
+        labelnames: Sequence[str],
+        buckets=(),
+    ):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        with self.registry.lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.registry.lock:
+            self._values[self._key(labels)] = float(value)
+
+    def observe(self, value: float, **labels: str) -> None:
+        with self.registry.lock:
+            key = self._key(labels)
+            slot = self._values.get(key)
+            if slot is None:
+                slot = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    slot[0][i] += 1
+            slot[1] += value
+            slot[2] += 1
+
+    def value(self, **labels: str):
+        with self.registry.lock:
+            return self._values.get(self._key(labels))
+
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for key, val in sorted(self._values.items()):
+            labels = dict(zip(self.labelnames, key))
+            if self.kind == "histogram":
+                counts, total, count = val
+                for bound, c in zip(self.buckets, counts):
+                    yield "_bucket", {**labels, "le": _format_value(bound)}, c
+                yield "_bucket", {**labels, "le": "+Inf"}, count
+                yield "_sum", labels, total
+                yield "_count", labels, count
+            elif self.kind == "counter":
+                yield "_total", labels, val
+            else:
+                yield "", labels, val
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self._families: List[_MetricFamily] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _add(
+        self, name: str, kind: str, help_text: str, labelnames: Sequence[str], buckets=()
+    ) -> _MetricFamily:
+        family = _MetricFamily(self, name, kind, help_text, labelnames, buckets)
+        self._families.append(family)
+        return family
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> _MetricFamily:
+        """`name` 不含 `_total` 后缀（输出时自动加上）。"""
+        return self._add(name, "counter", help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> _MetricFamily:
+        return self._add(name, "gauge", help_text, labelnames)
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS
+    ) -> _MetricFamily:
+        return self._add(name, "histogram", help_text, labelnames, buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """抓取时调用 `collector()`，把已有统计（计数器字段、快照字典）直接转成指标族。"""
+        self._collectors.append(collector)
+
+    def render(self, openmetrics: bool = False) -> str:
+        lines: List[str] = []
+
+        def _emit_header(name: str, kind: str, help_text: str) -> None:
+            type_name = name + "_total" if kind == "counter" and not openmetrics else name
+            lines.append(f"# HELP {type_name} {_escape(help_text)}")
+            lines.append(f"# TYPE {type_name} {kind}")
+
+        with self.lock:
+            for family in self._families:
+                _emit_header(family.name, family.kind, family.help)
+                for suffix, labels, value in family._samples():
+                    lines.append(
+                        f"{family.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+                    )
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                _emit_header(name, kind, help_text)
+                suffix = "_total" if kind == "counter" else ""
+                for labels, value in samples:
+                    lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """后台线程里的 `/metrics` HTTP 服务；`port=0` 时由系统分配端口（见 `.port`）。"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        self.registry = registry
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(handler) -> None:  # noqa: N805 - 闭包引用外层 registry
+                if handler.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    handler.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in (
+                    handler.headers.get("Accept") or ""
+                )
+                body = registry.render(openmetrics=openmetrics).encode("utf-8")
+                handler.send_response(200)
+                handler.send_header(
+                    "Content-Type",
+                    OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE,
+                )
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *_args) -> None:  # 抓取请求不写日志
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self.host = host
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="historycards-metrics", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class RunMetrics:
+    """把 historycards 的 `_RunStats` 与调度状态映射成指标。
+
+    计数类字段（processed / failed / retries / cache ...）在抓取时直接从 `stats` 读取；
+    需要分布的值（调用耗时、TTFT）由 `_RunStats.record_*` 在记录时同步写入直方图。
+    """
+
+    def __init__(
+        self,
+        stats,
+        snapshots: Sequence[Tuple[str, Callable[[], dict]]] = (),
+        rate_window_s: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.stats = stats
+        self.registry = MetricsRegistry()
+        self.rate_window_s = rate_window_s
+        self._clock = clock
+        self._started = clock()
+        self._samples: deque = deque()  # (t, processed)，用于 cards/min
+        self._samples_lock = threading.Lock()
+        self.llm_seconds = self.registry.histogram(
+            "historycards_llm_call_seconds",
+            "LLM call latency per model attempt.",
+            ("model", "outcome"),
+        )
+        self.ttft_seconds = self.registry.histogram(
+            "historycards_llm_ttft_seconds",
+            "Time to first token for --stream calls.",
+            (),
+            TTFT_BUCKETS,
+        )
+        self.parse_failures = self.registry.counter(
+            "historycards_parse_failures",
+            "Model replies that failed JSON parsing or card validation.",
+            ("model",),
+        )
+        self.queue_depth = self.registry.gauge(
+            "historycards_queue_depth",
+            "Idioms by scheduling state (dispatched / in_flight / remaining).",
+            ("state",),
+        )
+        self._snapshots = list(snapshots)
+        self.registry.add_collector(self._collect_stats)
+        self.registry.add_collector(self._collect_snapshots)
+
+    # --- 记录（worker 线程调用） ---
+    def observe_llm_call(self, model: str, seconds: float, ok: bool) -> None:
+        self.llm_seconds.observe(seconds, model=model, outcome="ok" if ok else "error")
+
+    def observe_ttft(self, seconds: float) -> None:
+        self.ttft_seconds.observe(seconds)
+
+    def parse_failure(self, model: Optional[str]) -> None:
+        self.parse_failures.inc(model=model or "unknown")
+
+    def set_queue(self, dispatched: int, in_flight: int, remaining: int) -> None:
+        self.queue_depth.set(dispatched, state="dispatched")
+        self.queue_depth.set(in_flight, state="in_flight")
+        self.queue_depth.set(remaining, state="remaining")
+
+    # --- 抓取时的 collector ---
+    def cards_per_minute(self) -> float:
+        """最近 `rate_window_s` 秒内（不足时按整个运行）的成卡速度。"""
+        now = self._clock()
+        processed = self.stats.processed
+        with self._samples_lock:  # 并发抓取
+            self._samples.append((now, processed))
+            while len(self._samples) > 1 and now - self._samples[0][0] > self.rate_window_s:
+                self._samples.popleft()
+            t0, p0 = self._samples[0]
+        if now - t0 < 1.0:
+            t0, p0 = self._started, 0
+        elapsed = now - t0
+        return (processed - p0) * 60.0 / elapsed if elapsed > 0 else 0.0
+
+    def _collect_stats(self) -> Iterable[Family]:
+        s = self.stats
+        yield "historycards_cards", "counter", "Idioms committed by status.", [
+            ({"status": "ok"}, s.processed),
+            ({"status": "failed"}, s.failed),
+            ({"status": "skipped"}, s.skipped),
+        ]
+        yield "historycards_cards_selected", "gauge", "Idioms selected for this run.", [
+            ({}, s.total_idioms_selected)
+        ]
+        yield (
+            "historycards_cards_per_minute",
+            "gauge",
+            "Cards generated per minute (recent window).",
+            [({}, round(self.cards_per_minute(), 6))],
+        )
+        yield "historycards_retries", "counter", "Per-idiom retries after a failed attempt.", [
+            ({}, s.total_retries)
+        ]
+        yield "historycards_cache_events", "counter", "Response cache hits / misses / writes.", [
+            ({"event": "hit"}, s.cache_hits),
+            ({"event": "miss"}, s.cache_misses),
+            ({"event": "write"}, s.cache_writes),
+        ]
+        yield (
+            "historycards_stream_aborts",
+            "counter",
+            "Streams aborted early by incremental validation.",
+            [({}, s.stream_aborts)],
+        )
+        yield "historycards_uptime_seconds", "gauge", "Seconds since the run started.", [
+            ({}, round(self._clock() - self._started, 3))
+        ]
+
+    def _collect_snapshots(self) -> Iterable[Family]:
+        for kind, snapshot in self._snapshots:
+            try:
+                data = snapshot() or {}
+            except Exception:  # pragma: no cover - 快照失败不影响抓取
+                continue
+            if kind == "rate_limits":
+                limiters = sorted(data.items())
+                for field, field_kind, help_text in _LIMITER_FIELDS:
+                    yield f"historycards_ratelimit_{field}", field_kind, help_text, [
+                        ({"limiter": name}, snap.get(field, 0)) for name, snap in limiters
+                    ]
+            elif kind == "api_keys":
+                keys = sorted((data.get("keys") or {}).items())
+                yield "historycards_api_key_calls", "counter", "Calls per API key and outcome.", [
+                    ({"key": name, "outcome": outcome}, snap.get(outcome, 0))
+                    for name, snap in keys
+                    for outcome in ("ok", "failed")
+                ]
+                yield "historycards_api_key_throttled", "counter", "429 responses per API key.", [
+                    ({"key": name}, snap.get("throttled", 0)) for name, snap in keys
+                ]
+                yield (
+                    "historycards_api_key_quarantined",
+                    "gauge",
+                    "1 while an API key is quarantined.",
+                    [
+                        ({"key": name}, 1 if snap.get("quarantined_s", 0) > 0 else 0)
+                        for name, snap in keys
+                    ],
+                )
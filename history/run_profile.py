@@ -0,0 +1,229 @@
+# codex: 2026-10-18 分位数草图与阶段剖析模块折行到 ≤100，逻辑不变
+"""
+Streaming percentile sketches and a per-phase profiler for `historycards.py`.
+
+`QuantileSketch`：对数分桶（与 DDSketch / HDR histogram 同一思路），值 v 落在
+`ceil(log(v) / log(gamma))` 号桶，`gamma = (1 + alpha) / (1 - alpha)`，任意分位数的相对误差不超过 `alpha`（默认 1%）。
+内存只与数值跨度有关（1 ms ~ 1000 s 约 700 个桶），两个草图合并就是桶计数相加，所以各线程 / 各分片可以分别统计再汇总。
+
+`PhaseProfiler`：`with profiler.phase("llm_call"):` 记录一段耗时；阶段可以嵌套，
+路径用 `;` 连接（`card;generate;llm_call`）。
+每条路径一个草图（总耗时，含子阶段），另外累计“自身耗时”（扣除子阶段），输出为折叠栈
+（`card;generate;llm_call 123456`，单位微秒），可直接交给 flamegraph.pl / speedscope。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+DEFAULT_ALPHA = 0.01
+_MIN_VALUE = 1e-9  # 小于该值（含 0）计入零桶
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class QuantileSketch:
+    """Not thread-safe; callers hold their own lock (or keep one sketch per thread and `merge`)."""
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA):
+        if not 0 < alpha < 1:
+            raise ValueError("alpha must be in (0, 1).")
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        if value > _MIN_VALUE:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different alpha.")
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(0.0, self.min)
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # 桶 (gamma^(k-1), gamma^k] 的代表值，相对误差 <= alpha
+                estimate = 2 * self.gamma**key / (self.gamma + 1)
+                return min(self.max, max(self.min, estimate))
+        return self.max
+
+    def to_dict(self) -> dict:
+        """count / total / avg / min / max 加上 p50 / p90 / p99（秒）。"""
+        out = {
+            "count": self.count,
+            "total_s": round(self.total, 6),
+            "avg_s": round(self.total / self.count, 6) if self.count else 0.0,
+            "min_s": round(self.min, 6) if self.count else 0.0,
+            "max_s": round(self.max, 6) if self.count else 0.0,
+        }
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}_s"] = round(self.quantile(q), 6)
+        return out
+
+    def to_state(self) -> dict:
+        """可序列化的完整状态（JSON），`from_state` 还原后可与其他草图合并。"""
+        return {
+            "alpha": self.alpha,
+            "zero": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max,
+            "buckets": {str(k): n for k, n in sorted(self.buckets.items())},
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "QuantileSketch":
+        sketch = cls(alpha=float(state["alpha"]))
+        sketch.buckets = {int(k): int(n) for k, n in (state.get("buckets") or {}).items()}
+        sketch.zero_count = int(state.get("zero", 0))
+        sketch.count = int(state.get("count", 0))
+        sketch.total = float(state.get("total", 0.0))
+        sketch.min = math.inf if state.get("min") is None else float(state["min"])
+        sketch.max = float(state.get("max", 0.0))
+        return sketch
+
+
+class PhaseProfiler:
+    """线程安全；每个线程各自维护阶段栈，结果汇总到同一组草图。"""
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, clock: Callable[[], float] = perf_counter):
+        self.alpha = alpha
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sketches: Dict[str, QuantileSketch] = {}
+        self._self_s: Dict[str, float] = {}
+        self._local = threading.local()
+
+    def _stack(self) -> List[list]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, path: str, total_s: float, self_s: float) -> None:
+        with self._lock:
+            sketch = self._sketches.get(path)
+            if sketch is None:
+                sketch = self._sketches[path] = QuantileSketch(self.alpha)
+            sketch.add(total_s)
+            self._self_s[path] = self._self_s.get(path, 0.0) + self_s
+        acc = getattr(self._local, "card", None)
+        if acc is not None:
+            acc[path] = acc.get(path, 0.0) + self_s
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stack = self._stack()
+        frame = [name, 0.0]  # [名称, 子阶段累计耗时]
+        stack.append(frame)
+        path = ";".join(f[0] for f in stack)
+        t0 = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - t0
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            self._add(path, elapsed, max(0.0, elapsed - frame[1]))
+
+    def record(self, name: str, seconds: float) -> None:
+        """记录一段在别处测得的耗时（例如排队等待），挂在当前阶段之下。"""
+        stack = self._stack()
+        path = ";".join([f[0] for f in stack] + [name])
+        if stack:
+            stack[-1][1] += seconds
+        self._add(path, seconds, seconds)
+
+    @contextmanager
+    def card(
+        self,
+        acc: Optional[dict] = None,
+        waited_s: Optional[float] = None,
+        wait_name: str = "queue_wait",
+    ) -> Iterator[None]:
+        """一张卡片的处理范围：最外层时压入根阶段 `card`；`acc` 按路径累计本卡各阶段的自身耗时。
+
+        `waited_s`：进入该范围之前的等待（排队、重排序缓冲），记为 `card;<wait_name>`；嵌套调用时忽略。
+        """
+        previous = getattr(self._local, "card", None)
+        if acc is not None:
+            self._local.card = acc
+        try:
+            if self._stack():
+                yield
+            else:
+                with self.phase("card"):
+                    if waited_s is not None:
+                        self.record(wait_name, max(0.0, waited_s))
+                    yield
+        finally:
+            self._local.card = previous
+
+    def merge(self, other: "PhaseProfiler") -> "PhaseProfiler":
+        with other._lock:
+            sketches = {k: QuantileSketch(other.alpha).merge(v) for k, v in other._sketches.items()}
+            self_s = dict(other._self_s)
+        with self._lock:
+            for path, sketch in sketches.items():
+                if path in self._sketches:
+                    self._sketches[path].merge(sketch)
+                else:
+                    self._sketches[path] = sketch
+            for path, seconds in self_s.items():
+                self._self_s[path] = self._self_s.get(path, 0.0) + seconds
+        return self
+
+    def folded(self) -> List[str]:
+        """折叠栈（自身耗时，微秒），按耗时降序。"""
+        with self._lock:
+            items = sorted(self._self_s.items(), key=lambda kv: -kv[1])
+        return [f"{path} {int(round(seconds * 1e6))}" for path, seconds in items if seconds > 0]
+
+    def snapshot(self, cards: int = 0) -> dict:
+        """各阶段的分位数与自身耗时占比；`cards` > 0 时附上每张卡片的平均自身耗时。"""
+        with self._lock:
+            total_self = sum(self._self_s.values())
+            phases = {}
+            for path in sorted(self._sketches):
+                entry = self._sketches[path].to_dict()
+                self_s = self._self_s.get(path, 0.0)
+                entry["self_s"] = round(self_s, 6)
+                entry["self_share"] = round(self_s / total_self, 4) if total_self else 0.0
+                if cards:
+                    entry["self_per_card_s"] = round(self_s / cards, 6)
+                phases[path] = entry
+        return {"phases": phases, "flame": self.folded()}
@@ -0,0 +1,237 @@
+# codex: 2026-10-18 组提交写入器折行到 ≤100，逻辑不变
+"""
+Buffered writer for the small per-idiom files of `historycards.py`.
+
+旧实现每条成语都要原子重写一次进度文件、分别 `open(..., "a")` 追加 runlog 与 `_errors.jsonl`，
+失败时再写三个错误文件。在网络盘 / 同步盘（BaiduSyncdisk 等）上这些小文件操作占了大头。现在：
+
+- 主线程只把操作放进内存缓冲；每隔 `commit_interval_s` 秒（或攒满 `max_batch` 条）做一次组提交：
+  每个 JSONL 文件只打开一次写入整批行，进度文件只写最后一次的内容
+- durability：`none` 只交给操作系统缓冲；`flush` 先把整批写进 WAL 再落盘目标文件；
+  `fsync` 在 `flush` 基础上对 WAL 与目标文件 fsync
+- 崩溃恢复：WAL 记录本批次写入前各 JSONL 文件的长度，下次启动时截断到该长度后重放整批，
+  因此最后一批要么完整生效、要么完全没写，不会出现重复或半行
+- 记录（`add_record`）：id 索引、manifest 日志等 SQLite 写入也随批次进 WAL，提交时按名字交给
+  `sinks` 中的回调，每个回调一批只做一次事务；回调必须幂等（重放时会再执行一次）
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+DURABILITY_LEVELS = ("none", "flush", "fsync")
+
+
+def _fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def peek_progress(wal_path: str, path: str) -> Optional[dict]:
+    """进度文件的最新内容（含崩溃遗留、尚未重放的 WAL 批次）；只读，不改动任何文件。"""
+    try:
+        with open(wal_path, "r", encoding="utf-8") as f:
+            payload = json.loads(f.read()).get("progress", {}).get(path)
+    except (FileNotFoundError, ValueError, AttributeError):
+        payload = None
+    if isinstance(payload, dict):
+        return payload
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+class RunWriter:
+    """Single writer (the historycards main thread); not thread-safe."""
+
+    def __init__(
+        self,
+        wal_path: str,
+        durability: str = "flush",
+        commit_interval_s: float = 1.0,
+        max_batch: int = 64,
+        logger: Optional[logging.Logger] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sinks: Optional[Dict[str, Callable[[List[Any]], None]]] = None,
+    ):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"Invalid durability: {durability!r}, expected one of {DURABILITY_LEVELS}"
+            )
+        self.wal_path = wal_path
+        self.durability = durability
+        self.commit_interval_s = max(0.0, float(commit_interval_s))
+        self.max_batch = max(1, int(max_batch))
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self.sinks = dict(sinks or {})
+        self._jsonl: Dict[str, List[str]] = {}
+        self._files: Dict[str, str] = {}
+        self._progress: Dict[str, dict] = {}
+        self._records: Dict[str, List[Any]] = {}
+        self._ops = 0
+        self._last_commit = clock()
+        self.commits = 0
+        self.recovered = self.recover()
+
+    # -- buffering ----------------------------------------------------------
+    def append_jsonl(self, path: str, obj: dict) -> None:
+        self._jsonl.setdefault(path, []).append(json.dumps(obj, ensure_ascii=False) + "\n")
+        self._ops += 1
+
+    def write_text(self, path: str, text: str) -> None:
+        """整文件写入（失败条目的 error.txt 等）；同一路径在一批内后写覆盖先写。"""
+        self._files[path] = text
+        self._ops += 1
+
+    def add_record(self, sink: str, record: Any) -> None:
+        """交给 `sinks[sink]` 的一条记录（须可 JSON 序列化）；同一 sink 一批只调用一次回调。"""
+        if sink not in self.sinks:
+            raise KeyError(f"Unknown sink: {sink!r}")
+        self._records.setdefault(sink, []).append(record)
+        self._ops += 1
+
+    def set_progress(self, path: str, payload: dict) -> None:
+        """进度文件只保留最后一次内容，组提交时原子替换。"""
+        self._progress[path] = payload
+        self._ops += 1
+
+    @property
+    def pending(self) -> int:
+        return self._ops
+
+    def maybe_commit(self) -> bool:
+        """距上次提交超过间隔或缓冲已满时提交；返回是否提交。"""
+        if not self._ops:
+            return False
+        if (
+            self._ops < self.max_batch
+            and self._clock() - self._last_commit < self.commit_interval_s
+        ):
+            return False
+        self.commit()
+        return True
+
+    # -- commit -------------------------------------------------------------
+    def commit(self) -> None:
+        self._last_commit = self._clock()
+        if not self._ops:
+            return
+        batch = {
+            "offsets": {
+                path: (os.path.getsize(path) if os.path.exists(path) else 0) for path in self._jsonl
+            },
+            "jsonl": self._jsonl,
+            "files": self._files,
+            "records": self._records,
+            "progress": self._progress,
+        }
+        self._jsonl, self._files, self._records, self._progress = {}, {}, {}, {}
+        self._ops = 0
+        if self.durability != "none":
+            self._write_wal(batch)
+        self._apply(batch)
+        if self.durability != "none":
+            self._clear_wal()
+        self.commits += 1
+
+    def close(self) -> None:
+        self.commit()
+
+    def _write_wal(self, batch: dict) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.wal_path)), exist_ok=True)
+        with open(self.wal_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(batch, ensure_ascii=False))
+            f.flush()
+            if self.durability == "fsync":
+                os.fsync(f.fileno())
+
+    def _clear_wal(self) -> None:
+        try:
+            os.remove(self.wal_path)
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, batch: dict) -> None:
+        fsync = self.durability == "fsync"
+        for path, lines in batch["jsonl"].items():
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            except Exception as e:
+                self.logger.warning(f"Failed to append {len(lines)} line(s) to {path}: {e}")
+        for path, text in batch["files"].items():
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                tmp = f"{path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp, path)
+            except Exception as e:
+                self.logger.warning(f"Failed to write {path}: {e}")
+        # SQLite 记录在进度之前落地：进度文件推进时，本批次的卡片一定已进索引与日志
+        for sink, records in batch.get("records", {}).items():
+            self.sinks[sink](records)
+        for path, payload in batch["progress"].items():
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+            if fsync:
+                _fsync_path(os.path.dirname(os.path.abspath(path)))
+
+    # -- recovery -----------------------------------------------------------
+    def recover(self) -> int:
+        """重放上次崩溃遗留的 WAL 批次；返回重放的操作数（没有遗留批次时为 0）。"""
+        try:
+            with open(self.wal_path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return 0
+        try:
+            batch = json.loads(raw)
+        except ValueError:
+            # WAL 本身没写完：目标文件尚未改动，丢弃即可
+            self.logger.warning(f"Discarding incomplete write-ahead batch: {self.wal_path}")
+            self._clear_wal()
+            return 0
+        missing = sorted(set(batch.get("records", {})) - set(self.sinks))
+        if missing:
+            # 没有对应回调时不能丢掉这些记录：保留 WAL，等带 sinks 的写入器重放
+            self.logger.warning(f"Write-ahead batch needs sink(s) {missing}; kept {self.wal_path}")
+            return 0
+        for path, offset in batch.get("offsets", {}).items():
+            if os.path.exists(path) and os.path.getsize(path) > offset:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+        self._apply(batch)
+        self._clear_wal()
+        ops = (
+            sum(len(v) for v in batch.get("jsonl", {}).values())
+            + sum(len(v) for v in batch.get("records", {}).values())
+            + len(batch.get("files", {}))
+            + len(batch.get("progress", {}))
+        )
+        self.logger.warning(f"Recovered {ops} buffered write(s) from {self.wal_path}")
+        return ops
@@ -0,0 +1,76 @@
+# codex: 2026-10-18 从 shard_runner 拆出命令行定义（与 card_options 的 build_parser 对应），行宽 ≤100
+"""
+Command line of `history/shard_runner.py`.
+
+`build_parser` defines the `plan` / `work` / `run` / `merge` / `status` subcommands; arguments after
+`--` are not parsed here (`split_passthrough`) and are handed to `historycards.py` unchanged.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from typing import List, Tuple
+
+DEFAULT_LEASE_S = 600.0
+COMMANDS = ("plan", "work", "run", "merge", "status")
+
+
+def split_passthrough(argv: List[str]) -> Tuple[List[str], List[str]]:
+    if "--" in argv:
+        i = argv.index("--")
+        return argv[:i], argv[i + 1 :]
+    return argv, []
+
+
+def _add_plan_args(p: argparse.ArgumentParser, required: bool) -> None:
+    add = p.add_argument
+    if required:
+        add("--shards", type=int, required=True, help="Number of contiguous shards.")
+    else:
+        add("--shards", type=int, default=None, help="Plan this many shards if no plan exists yet.")
+    add("--input", default=None, help="Idiom list (default: historycards default dictionary).")
+    add("--resources-dir", default=None, help="Main resources dir to seed from / merge into.")
+    add(
+        "--range",
+        dest="range_text",
+        default=None,
+        help="Only shard idioms in this range, e.g. 1-5000.",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Split historycards work into shards run by local processes or other hosts "
+        "via a shared dir. Arguments after `--` are passed to historycards.py."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in COMMANDS:
+        p = sub.add_parser(name)
+        add = p.add_argument
+        add("--shard-dir", required=True, help="Shared coordination dir.")
+        if name in ("plan", "run"):
+            _add_plan_args(p, required=name == "plan")
+        if name in ("work", "run"):
+            add(
+                "--lease",
+                type=float,
+                default=DEFAULT_LEASE_S,
+                help="Seconds before an idle claim can be taken over.",
+            )
+        if name == "work":
+            add("--max-shards", type=int, default=0, help="Stop after N shards (0 = all).")
+        if name == "run":
+            add("--procs", type=int, default=os.cpu_count() or 1, help="Local worker processes.")
+        if name == "merge":
+            add(
+                "--resources-dir",
+                default=None,
+                help="Merge target (default: the planned resources dir).",
+            )
+            add(
+                "--allow-partial",
+                action="store_true",
+                help="Merge finished shards even if others are pending.",
+            )
+    return parser
@@ -0,0 +1,494 @@
+# codex: 2026-10-18 命令行定义移到 shard_options，行宽 ≤100；merge 复制整个卡片目录（不只 data.json）
+"""
+Shard coordinator for `historycards.py`.
+
+多开 historycards 时要手工分 `--range`、各配 `--progress-file`，而且都在抢同一个 `manifest.json`。
+这里把选中的条目切成 N 个连续分片，每个分片在共享目录里有自己独立的 resources 目录
+（自己的 manifest / 日志 / id 索引 / 进度），最后由 `merge` 按条目顺序确定性地合并回主 resources 目录。
+
+共享目录布局（`--shard-dir`，可以是 NFS / SMB / 同步盘上的目录）：
+
+    plan.json            分片计划（条目范围 + 传给 historycards 的参数）
+    input.txt            词典副本（保证各机器上的条目序号一致）
+    seed_manifest.json   主 manifest 的快照：分片据此跳过已完成的成语、避开已占用的 id
+    shard_000/           分片 0 的 resources 目录
+        claim.json       认领标记（O_EXCL 创建；认领者定期刷新 mtime，超过 --lease 秒未刷新可被接管）
+        done.json        完成标记（historycards 的返回码）
+
+合并规则：按分片顺序、分片内按写入顺序逐张处理，用与 historycards 相同的 `choose_card_id` 在主目录的
+id 索引上重新决定 id（同音成语在不同分片里可能拿到同一个拼音 id，合并时后到者加哈希后缀）；
+主 manifest 已有同名成语，或主目录已有该成语的 data.json 时跳过。结果与按同样顺序串行运行一致。
+合并时复制整个卡片目录（`--card-rel-dir-template` 必须每张卡片一个目录，默认 `cards/{id}`）：
+data.json 按新 id 改写 `id` / `image_path`，目录里的其他文件（卡图等）原样复制。
+
+用法：
+
+    # 本机 4 个进程跑完整词典，分 16 片，结束后自动合并
+    python history/shard_runner.py run --shard-dir /mnt/share/hc --shards 16 --procs 4 \\
+        -- --workers 4
+    # 其他机器加入（各自用自己的 API key 配置）
+    python history/shard_runner.py work --shard-dir /mnt/share/hc -- --config /path/to/config.ini
+    python history/shard_runner.py status --shard-dir /mnt/share/hc
+    python history/shard_runner.py merge --shard-dir /mnt/share/hc
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))  # history/
+_WORKSPACE_ROOT = os.path.dirname(_SCRIPT_DIR)  # fungame/
+if _WORKSPACE_ROOT not in sys.path:
+    sys.path.insert(0, _WORKSPACE_ROOT)
+
+from history.card_files import (  # noqa: E402
+    atomic_write_json,
+    choose_card_id,
+    format_vars,
+    iter_idioms,
+    load_manifest,
+    parse_range,
+    safe_relpath_fs,
+    safe_relpath_url,
+    slugify_id,
+)
+from history.card_index import CardIdIndex  # noqa: E402
+from history.manifest_store import ManifestStore  # noqa: E402
+from history.shard_options import DEFAULT_LEASE_S, build_parser, split_passthrough  # noqa: E402
+
+logger = logging.getLogger("historycards.shards")
+
+PLAN_VERSION = 1
+_MERGE_IGNORE = shutil.ignore_patterns("data.json", "*.tmp")
+
+
+def _now() -> str:
+    return _dt.datetime.now().isoformat(timespec="seconds")
+
+
+def _write_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _arg_value(argv: List[str], flag: str, default: str) -> str:
+    """取 historycards 参数列表中某个选项的值（支持 `--flag value` 与 `--flag=value`，后出现的覆盖前面的）。"""
+    value = default
+    for i, item in enumerate(argv):
+        if item == flag and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif item.startswith(flag + "="):
+            value = item.split("=", 1)[1]
+    return value
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# -- plan --------------------------------------------------------------------
+def load_plan(shard_dir: str) -> dict:
+    plan = _read_json(os.path.join(shard_dir, "plan.json"))
+    if not plan:
+        raise FileNotFoundError(f"No shard plan in {shard_dir} (run `plan` first).")
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported shard plan version: {plan.get('version')!r}")
+    return plan
+
+
+def make_plan(
+    shard_dir: str,
+    shards: int,
+    input_path: str,
+    resources_dir: str,
+    historycards_args: List[str],
+    start: int = 1,
+    end: Optional[int] = None,
+) -> dict:
+    """把 [start, end] 内的条目均分成 `shards` 个连续分片，写 plan.json / input.txt / seed_manifest.json。"""
+    if shards < 1:
+        raise ValueError("--shards must be >= 1.")
+    if os.path.exists(os.path.join(shard_dir, "plan.json")):
+        raise FileExistsError(f"Shard plan already exists: {shard_dir}")
+    total = sum(1 for _ in iter_idioms(input_path))
+    end = total if end is None else min(end, total)
+    if end < start:
+        raise ValueError("Empty shard range.")
+    count = end - start + 1
+    shards = min(shards, count)
+    os.makedirs(shard_dir, exist_ok=True)
+    shutil.copyfile(input_path, os.path.join(shard_dir, "input.txt"))
+    manifest_file = os.path.join(resources_dir, "manifest.json")
+    manifest = load_manifest(manifest_file)
+    journal = _arg_value(
+        historycards_args,
+        "--manifest-journal",
+        os.path.join(resources_dir, ".manifest_journal.sqlite"),
+    )
+    if os.path.exists(journal):
+        # 主目录的日志里可能有尚未压缩进 manifest.json 的卡片
+        store = ManifestStore(journal)
+        try:
+            store.sync_from_manifest(manifest_file)
+            manifest = store.to_manifest()
+        finally:
+            store.close()
+    _write_json(os.path.join(shard_dir, "seed_manifest.json"), manifest)
+
+    plan_shards = []
+    base, extra = divmod(count, shards)
+    lo = start
+    for k in range(shards):
+        hi = lo + base + (1 if k < extra else 0) - 1
+        plan_shards.append({"name": f"shard_{k:03d}", "start": lo, "end": hi})
+        lo = hi + 1
+    plan = {
+        "version": PLAN_VERSION,
+        "created_at": _now(),
+        "resources_dir": os.path.abspath(resources_dir),
+        "historycards_args": list(historycards_args),
+        "shards": plan_shards,
+    }
+    _write_json(os.path.join(shard_dir, "plan.json"), plan)
+    logger.info(f"Planned {shards} shard(s) over idioms {start}-{end} -> {shard_dir}")
+    return plan
+
+
+# -- claims ------------------------------------------------------------------
+def _claim_path(shard_dir: str, shard: dict) -> str:
+    return os.path.join(shard_dir, shard["name"], "claim.json")
+
+
+def _done_path(shard_dir: str, shard: dict) -> str:
+    return os.path.join(shard_dir, shard["name"], "done.json")
+
+
+def try_claim(shard_dir: str, shard: dict, owner: str, lease_s: float = DEFAULT_LEASE_S) -> bool:
+    """原子认领一个分片；已完成或被他人持有（且未过期）时返回 False。"""
+    if os.path.exists(_done_path(shard_dir, shard)):
+        return False
+    path = _claim_path(shard_dir, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        age = None
+    if age is not None:
+        if age < lease_s:
+            return False
+        # 过期认领：先原子改名到自己名下；若改走的其实是别人刚创建的新认领，放回去并放弃
+        stale = f"{path}.stale.{owner.replace(':', '_')}"
+        try:
+            os.replace(path, stale)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.path.getmtime(stale) < lease_s:
+            os.replace(stale, path)
+            return False
+        os.remove(stale)
+        logger.warning(f"Taking over stale claim on {shard['name']} (idle {age:.0f}s)")
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"owner": owner, "claimed_at": _now()}, f, ensure_ascii=False)
+    return True
+
+
+class _Heartbeat:
+    """认领期间定期刷新 claim.json 的 mtime，让其他 worker 知道分片仍在运行。"""
+
+    def __init__(self, path: str, interval_s: float):
+        self.path = path
+        self.interval_s = max(0.5, interval_s)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="shard-heartbeat", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# -- work --------------------------------------------------------------------
+def shard_argv(shard_dir: str, plan: dict, shard: dict, extra_args: List[str]) -> List[str]:
+    resources = os.path.join(shard_dir, shard["name"])
+    return [
+        "--input",
+        os.path.join(shard_dir, "input.txt"),
+        "--resources-dir",
+        resources,
+        "--progress-file",
+        os.path.join(resources, ".historycards_progress.json"),
+        "--range",
+        f"{shard['start']}-{shard['end']}",
+        *plan.get("historycards_args", []),
+        *extra_args,
+    ]
+
+
+def run_historycards(argv: List[str]) -> int:
+    """
+    在子进程里运行一次 `historycards.py`：每个分片都从干净的解释器开始，上一个分片的日志 handler、
+    LLM 客户端、限流器与停止信号不会带进下一个分片。Ctrl+C 同时送达子进程，这里等它保存进度后退出。
+    """
+    child = subprocess.Popen([sys.executable, os.path.join(_SCRIPT_DIR, "historycards.py"), *argv])
+    while True:
+        try:
+            return child.wait()
+        except KeyboardInterrupt:
+            logger.warning("Stop requested: waiting for the running shard to save its progress.")
+
+
+def run_shard(
+    shard_dir: str, plan: dict, shard: dict, extra_args: List[str], owner: str, lease_s: float
+) -> int:
+    """在子进程中运行一个已认领的分片；返回 historycards 的返回码。"""
+    resources = os.path.join(shard_dir, shard["name"])
+    manifest_file = os.path.join(resources, "manifest.json")
+    seed = os.path.join(shard_dir, "seed_manifest.json")
+    if not os.path.exists(manifest_file) and os.path.exists(seed):
+        shutil.copyfile(seed, manifest_file)
+    logger.info(f"[{owner}] running {shard['name']}: idioms {shard['start']}-{shard['end']}")
+    with _Heartbeat(_claim_path(shard_dir, shard), lease_s / 3):
+        try:
+            rc = run_historycards(shard_argv(shard_dir, plan, shard, extra_args))
+        except OSError as e:
+            logger.error(f"[{owner}] {shard['name']} crashed: {type(e).__name__}: {e}")
+            rc = 1
+    progress = _read_json(os.path.join(resources, ".historycards_progress.json")) or {}
+    finished = int(progress.get("next_index", 0)) > shard["end"]
+    # rc 2 = 有失败条目（已记录在分片的 _errors.jsonl）；中途停止（Ctrl+C、连续失败上限）时进度没到分片末尾，留给下次认领续跑
+    if rc in (0, 2) and finished:
+        _write_json(_done_path(shard_dir, shard), {"rc": rc, "owner": owner, "finished_at": _now()})
+    elif rc in (0, 2):
+        rc = 1
+    try:
+        os.remove(_claim_path(shard_dir, shard))
+    except FileNotFoundError:
+        pass
+    return rc
+
+
+def work(
+    shard_dir: str, extra_args: List[str], lease_s: float = DEFAULT_LEASE_S, max_shards: int = 0
+) -> int:
+    """循环认领并运行分片，直到没有可认领的分片（或已运行 `max_shards` 个）。"""
+    plan = load_plan(shard_dir)
+    owner = _owner()
+    ran = 0
+    failed = 0
+    for shard in plan["shards"]:
+        if max_shards and ran >= max_shards:
+            break
+        if not try_claim(shard_dir, shard, owner, lease_s):
+            continue
+        ran += 1
+        if run_shard(shard_dir, plan, shard, extra_args, owner, lease_s) not in (0, 2):
+            failed += 1
+        progress = (
+            _read_json(os.path.join(shard_dir, shard["name"], ".historycards_progress.json")) or {}
+        )
+        if progress.get("last_status") == "interrupted":
+            logger.warning(f"[{owner}] stop requested; not claiming more shards.")
+            break
+    logger.info(f"[{owner}] ran {ran} shard(s), {failed} crashed/stopped")
+    return 1 if failed else 0
+
+
+def status(shard_dir: str) -> dict:
+    plan = load_plan(shard_dir)
+    out = {"shards": [], "done": 0, "running": 0, "pending": 0}
+    for shard in plan["shards"]:
+        done = _read_json(_done_path(shard_dir, shard))
+        claim = _read_json(_claim_path(shard_dir, shard))
+        state = "done" if done else ("running" if claim else "pending")
+        out[state] += 1
+        summary = (
+            _read_json(os.path.join(shard_dir, shard["name"], "historycards_summary.json")) or {}
+        )
+        out["shards"].append(
+            {
+                **shard,
+                "state": state,
+                "owner": (done or claim or {}).get("owner"),
+                "processed": summary.get("processed"),
+                "failed": summary.get("failed"),
+            }
+        )
+    return out
+
+
+# -- merge -------------------------------------------------------------------
+def _shard_cards(resources: str):
+    journal = os.path.join(resources, ".manifest_journal.sqlite")
+    manifest_file = os.path.join(resources, "manifest.json")
+    if os.path.exists(journal):
+        store = ManifestStore(journal)
+        try:
+            store.sync_from_manifest(manifest_file)
+            return list(store.iter_cards())
+        finally:
+            store.close()
+    return load_manifest(manifest_file)["cards"]
+
+
+def merge(shard_dir: str, resources_dir: Optional[str] = None, allow_partial: bool = False) -> dict:
+    """把各分片生成的卡片按条目顺序合并进主 resources 目录（manifest 日志 + data.json + id 索引）。"""
+    plan = load_plan(shard_dir)
+    resources_dir = os.path.abspath(resources_dir or plan["resources_dir"])
+    hc_args = plan.get("historycards_args", [])
+    rel_template = _arg_value(hc_args, "--card-rel-dir-template", "cards/{id}")
+    image_template = _arg_value(hc_args, "--image-path-template", "cards/{id}/image.png")
+
+    incomplete = [s["name"] for s in plan["shards"] if not os.path.exists(_done_path(shard_dir, s))]
+    if incomplete and not allow_partial:
+        raise RuntimeError(
+            f"{len(incomplete)} shard(s) not finished: {incomplete[:5]} (use --allow-partial)"
+        )
+
+    manifest_file = os.path.join(resources_dir, "manifest.json")
+    store = ManifestStore(os.path.join(resources_dir, ".manifest_journal.sqlite"))
+    index = CardIdIndex(os.path.join(resources_dir, ".card_index.sqlite"))
+    report = {"merged": 0, "skipped": 0, "renamed": [], "incomplete": incomplete}
+    try:
+        store.sync_from_manifest(manifest_file)
+        if not index.built or index.card_rel_dir_template != rel_template:
+            index.rebuild(resources_dir, rel_template, store.iter_cards())
+        for shard in plan["shards"]:
+            if shard["name"] in incomplete:
+                continue
+            resources = os.path.join(shard_dir, shard["name"])
+            for card in _shard_cards(resources):
+                if not (
+                    isinstance(card, dict)
+                    and isinstance(card.get("id"), str)
+                    and isinstance(card.get("name"), str)
+                ):
+                    continue
+                shard_rel = rel_template.format(**format_vars(card["id"]))
+                src_dir = os.path.join(resources, safe_relpath_fs(shard_rel))
+                if not os.path.exists(os.path.join(src_dir, "data.json")):
+                    continue  # 种子 manifest 里的卡片，不是本分片生成的
+                name = card["name"]
+                card_id = choose_card_id(name, slugify_id(name), index.name_for_id)
+                rel_vars = format_vars(card_id)
+                dst_dir = os.path.join(
+                    resources_dir, safe_relpath_fs(rel_template.format(**rel_vars))
+                )
+                dst = os.path.join(dst_dir, "data.json")
+                if store.has_name(name) or os.path.exists(dst):
+                    report["skipped"] += 1
+                    continue
+                with open(os.path.join(src_dir, "data.json"), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if card_id != card["id"]:
+                    report["renamed"].append({"name": name, "shard_id": card["id"], "id": card_id})
+                data["id"] = card_id
+                data["image_path"] = safe_relpath_url(image_template.format(**rel_vars))
+                # 卡片目录里的其他文件（卡图等）原样复制；data.json 改写 id / image_path 后最后写入
+                shutil.copytree(src_dir, dst_dir, dirs_exist_ok=True, ignore=_MERGE_IGNORE)
+                atomic_write_json(dst, data)
+                index.put(card_id, name)
+                if store.append(data):
+                    report["merged"] += 1
+        if store.dirty:
+            store.compact(manifest_file)
+    finally:
+        store.close()
+        index.close()
+    report["merged_at"] = _now()
+    _write_json(os.path.join(shard_dir, "merge_report.json"), report)
+    logger.info(
+        f"Merged {report['merged']} card(s) into {resources_dir} "
+        f"(skipped {report['skipped']}, re-assigned {len(report['renamed'])} id(s))"
+    )
+    return report
+
+
+# -- run (local processes) ---------------------------------------------------
+def run_local(shard_dir: str, procs: int, extra_args: List[str], lease_s: float) -> int:
+    """启动 `procs` 个本机 worker 进程认领分片，全部结束后合并。"""
+    cmd = [sys.executable, os.path.abspath(__file__), "work", "--shard-dir", shard_dir]
+    cmd += ["--lease", str(lease_s), "--"]
+    children = [subprocess.Popen(cmd + list(extra_args)) for _ in range(max(1, procs))]
+    rcs = [p.wait() for p in children]
+    if any(rcs):
+        logger.error(
+            f"{sum(1 for rc in rcs if rc)} worker process(es) reported failures; merge skipped."
+        )
+        return 1
+    merge(shard_dir)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    own, passthrough = split_passthrough(argv)
+    parser = build_parser()
+    args = parser.parse_args(own)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    planned = os.path.exists(os.path.join(args.shard_dir, "plan.json"))
+    if args.command in ("plan", "run") and not planned:
+        if args.shards is None:
+            parser.error("--shards is required when no plan exists yet.")
+        default_resources = os.path.join(_SCRIPT_DIR, "resources")
+        input_path = args.input or os.path.join(default_resources, "汉语成语词典_词表_23889条.txt")
+        resources_dir = args.resources_dir or default_resources
+        start, end = parse_range(args.range_text) if args.range_text else (1, None)
+        make_plan(args.shard_dir, args.shards, input_path, resources_dir, passthrough, start, end)
+        passthrough = []  # 已记入 plan，run 时不再重复追加
+    elif args.command == "plan":
+        parser.error(f"Shard plan already exists: {args.shard_dir}")
+
+    if args.command == "plan":
+        return 0
+    if args.command == "work":
+        return work(args.shard_dir, passthrough, lease_s=args.lease, max_shards=args.max_shards)
+    if args.command == "run":
+        return run_local(args.shard_dir, args.procs, passthrough, args.lease)
+    if args.command == "merge":
+        report = merge(args.shard_dir, args.resources_dir, allow_partial=args.allow_partial)
+        counts = {**report, "renamed": len(report["renamed"])}
+        print(json.dumps(counts, ensure_ascii=False))
+        return 0
+    print(json.dumps(status(args.shard_dir), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
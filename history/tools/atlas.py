@@ -0,0 +1,287 @@
+# codex: 2026-10-18 缩略图图集构建折行到 ≤100，参数改用 add 简写，逻辑不变
+import os
+import json
+import zlib
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import common
+import gen_image
+from PIL import Image
+
+# Setup Logger
+logger = common.setup_logging('Atlas')
+
+ATLAS_DIR = 'atlas'
+ATLAS_LIST = 'atlas.json'
+GROUP_BY_CHOICES = ('period', 'popular')
+DEFAULT_PER_ATLAS = 48  # 240x320 的缩略图在 2048x2048 内约能放 8x6 张
+DEFAULT_MAX_SIZE = 2048
+PADDING = 2  # 图块间留白，避免缩放采样时串色
+
+
+def shelf_pack(sizes, max_size=DEFAULT_MAX_SIZE, padding=PADDING):
+    """
+    货架式装箱：按高度降序逐行摆放，一行放不下换行，一页放不下换页。
+    sizes 为 [(w, h), ...]；返回页列表，每页 {'width', 'height', 'placements': [(下标, x, y), ...]}。
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], i))
+    pages = []
+    page = shelf_y = shelf_h = x = None
+    for i in order:
+        w, h = sizes[i]
+        if w > max_size or h > max_size:
+            raise ValueError(f"thumbnail {w}x{h} larger than atlas {max_size}")
+        if page is not None and x + w > max_size:
+            shelf_y, shelf_h, x = shelf_y + shelf_h + padding, 0, 0
+        if page is None or shelf_y + h > max_size:
+            page = {'width': 0, 'height': 0, 'placements': []}
+            pages.append(page)
+            shelf_y, shelf_h, x = 0, 0, 0
+        page['placements'].append((i, x, shelf_y))
+        page['width'] = max(page['width'], x + w)
+        page['height'] = max(page['height'], shelf_y + h)
+        shelf_h = max(shelf_h, h)
+        x += w + padding
+    return pages
+
+
+def _thumb_source(card_dir, data):
+    """缩略图来源与尺寸：优先 gen_image 生成的 thumb.webp，否则按同样的上限缩放 image.png。"""
+    variant = (data.get('images') or {}).get('variants', {}).get('thumb.webp')
+    if variant and os.path.exists(os.path.join(card_dir, os.path.basename(variant['path']))):
+        source_key = f"{data['images']['source']['sha1']}:{data['images']['key']}"
+        return (
+            os.path.join(card_dir, os.path.basename(variant['path'])),
+            (variant['width'], variant['height']),
+            source_key,
+        )
+    path = os.path.join(card_dir, 'image.png')
+    with open(path, 'rb') as f:
+        source_key = hashlib.sha1(f.read()).hexdigest()
+    with Image.open(path) as image:
+        size = image.size
+    bounds = gen_image.SIZES['thumb']
+    scale = min(1.0, bounds[0] / size[0], bounds[1] / size[1])
+    return path, (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))), source_key
+
+
+def build_page(out_path, width, height, tiles, preset):
+    """合成并编码一页图集（进程池 worker 调用）。tiles = [(源图路径, x, y, w, h), ...]。"""
+    atlas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    for path, x, y, w, h in tiles:
+        with Image.open(path) as tile:
+            tile = tile.convert('RGBA')
+            if tile.size != (w, h):
+                tile = tile.resize((w, h), Image.Resampling.LANCZOS)
+            atlas.paste(tile, (x, y))
+    tmp = f"{out_path}.tmp"
+    atlas.save(tmp, format='WEBP', **gen_image.PRESETS[preset]['webp'])
+    os.replace(tmp, out_path)
+    return os.path.getsize(out_path)
+
+
+def _buckets(count, per_atlas):
+    # 与牌库分片相同：组内按 crc32(id) 分到 2 的幂个桶，增删少量卡片只影响所在图集
+    buckets = 1
+    while buckets * per_atlas < count:
+        buckets *= 2
+    return buckets
+
+
+def build_atlases(
+    cards_root=None,
+    resources_dir=None,
+    group_by='period',
+    per_atlas=DEFAULT_PER_ATLAS,
+    max_size=DEFAULT_MAX_SIZE,
+    preset='medium',
+    workers=None,
+):
+    """
+    为全部有效卡片构建缩略图图集，写出 resources/atlas/<hash>.webp 与 resources/atlas/atlas.json，
+    并把每张卡片的 `atlas`（图集文件、像素偏移与 UV）写回 data.json（仅在变化时）。返回统计。
+    """
+    cards_root = cards_root or common.CARDS_DIR
+    resources_dir = resources_dir or common.RESOURCES_DIR
+    atlas_dir = os.path.join(resources_dir, ATLAS_DIR)
+    os.makedirs(atlas_dir, exist_ok=True)
+
+    cards = []
+    for entry in sorted(os.scandir(cards_root), key=lambda e: e.name):
+        data_file = os.path.join(entry.path, 'data.json')
+        if not entry.is_dir() or not os.path.exists(os.path.join(entry.path, 'image.png')):
+            continue
+        try:
+            with open(data_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            path, size, source_key = _thumb_source(entry.path, data)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Skipping {entry.name}: {e}")
+            continue
+        key = data.get('period') if group_by == 'period' else data.get('popular')
+        cards.append(
+            {
+                'id': entry.name,
+                'data_file': data_file,
+                'data': data,
+                'path': path,
+                'size': size,
+                'source_key': source_key,
+                'group': '未知' if key is None else str(key),
+            }
+        )
+
+    groups = {}
+    for card in cards:
+        groups.setdefault(card['group'], []).append(card)
+
+    pages = []
+    for group in sorted(groups):
+        members = groups[group]
+        count = _buckets(len(members), per_atlas)
+        split = [[] for _ in range(count)]
+        for card in members:
+            split[zlib.crc32(card['id'].encode('utf-8')) & (count - 1)].append(card)
+        for bucket in split:
+            for packed in shelf_pack([card['size'] for card in bucket], max_size=max_size):
+                tiles = [(bucket[i], x, y) for i, x, y in packed['placements']]
+                tiles.sort(key=lambda tile: tile[0]['id'])
+                layout = [
+                    [card['id'], card['source_key'], x, y, *card['size']] for card, x, y in tiles
+                ]
+                webp = gen_image.PRESETS[preset]['webp']
+                spec = json.dumps([layout, packed['width'], packed['height'], webp])
+                name = hashlib.sha1(spec.encode('utf-8')).hexdigest()[:16]
+                pages.append(
+                    {
+                        'file': f"{ATLAS_DIR}/{name}.webp",
+                        'group': group,
+                        'width': packed['width'],
+                        'height': packed['height'],
+                        'tiles': tiles,
+                    }
+                )
+
+    # 内容寻址：同名文件即同内容，只编码新出现的图集
+    todo = [page for page in pages if not os.path.exists(os.path.join(resources_dir, page['file']))]
+    args = (
+        [os.path.join(resources_dir, page['file']) for page in todo],
+        [page['width'] for page in todo],
+        [page['height'] for page in todo],
+        [[(card['path'], x, y, *card['size']) for card, x, y in page['tiles']] for page in todo],
+        [preset] * len(todo),
+    )
+    if len(todo) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(build_page, *args))
+    else:
+        for item in zip(*args):
+            build_page(*item)
+
+    updated = 0
+    for page in pages:
+        page_w, page_h = page['width'], page['height']
+        for card, x, y in page['tiles']:
+            w, h = card['size']
+            atlas = {
+                'file': page['file'],
+                'width': page_w,
+                'height': page_h,
+                'x': x,
+                'y': y,
+                'w': w,
+                'h': h,
+                'uv': [
+                    round(x / page_w, 6),
+                    round(y / page_h, 6),
+                    round((x + w) / page_w, 6),
+                    round((y + h) / page_h, 6),
+                ],
+            }
+            if card['data'].get('atlas') == atlas:
+                continue
+            card['data']['atlas'] = atlas
+            tmp = f"{card['data_file']}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(card['data'], f, ensure_ascii=False, indent=2)
+            os.replace(tmp, card['data_file'])
+            updated += 1
+
+    # 图集清单：保留当前与上一版引用的文件（已发布的牌库可能仍指向上一版），其余清理
+    list_path = os.path.join(atlas_dir, ATLAS_LIST)
+    previous = {}
+    if os.path.exists(list_path):
+        with open(list_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    files = [page['file'] for page in pages]
+    listing = {
+        'group_by': group_by,
+        'per_atlas': per_atlas,
+        'max_size': max_size,
+        'preset': preset,
+        'atlases': [
+            {
+                'file': page['file'],
+                'group': page['group'],
+                'width': page['width'],
+                'height': page['height'],
+                'count': len(page['tiles']),
+                'bytes': os.path.getsize(os.path.join(resources_dir, page['file'])),
+            }
+            for page in pages
+        ],
+    }
+    if previous.get('atlases') and [a['file'] for a in previous['atlases']] != files:
+        listing['previous'] = [a['file'] for a in previous['atlases']]
+    elif previous.get('previous'):
+        listing['previous'] = previous['previous']
+    tmp = f"{list_path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(listing, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, list_path)
+    keep = {os.path.basename(file) for file in files + listing.get('previous', [])} | {ATLAS_LIST}
+    pruned = 0
+    for entry in os.scandir(atlas_dir):
+        if entry.is_file() and entry.name not in keep:
+            os.remove(entry.path)
+            pruned += 1
+
+    stats = {
+        'cards': len(cards),
+        'atlases': len(pages),
+        'encoded': len(todo),
+        'updated': updated,
+        'pruned': pruned,
+    }
+    logger.info(
+        f"Atlas: {stats['cards']} cards in {stats['atlases']} atlases by {group_by} "
+        f"(encoded {stats['encoded']}, data.json updated {updated}, pruned {pruned})"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack card thumbnails into WebP texture atlases and record UVs in data.json."
+    )
+    add = parser.add_argument
+    add('--group-by', choices=GROUP_BY_CHOICES, default='period', help="Group by period/popular.")
+    add('--per-atlas', type=int, default=DEFAULT_PER_ATLAS, help="Thumbnails per atlas.")
+    add('--max-size', type=int, default=DEFAULT_MAX_SIZE, help="Max atlas side in pixels.")
+    add('--preset', choices=sorted(gen_image.PRESETS), default='medium', help="WebP quality.")
+    add('--workers', type=int, default=None, help="Worker processes for encoding (1 = serial).")
+    args = parser.parse_args()
+    if args.per_atlas < 1:
+        parser.error("--per-atlas must be >= 1")
+    build_atlases(
+        group_by=args.group_by,
+        per_atlas=args.per_atlas,
+        max_size=args.max_size,
+        preset=args.preset,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
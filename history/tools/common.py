@@ -1,3 +1,4 @@
+# codex: 2026-10-18 把仓库根目录加入 sys.path，tools 脚本可导入共享的 history.pinyin_slugs
 import os
 import sys
 import logging
@@ -9,6 +10,9 @@ WORKSPACE_ROOT = os.path.dirname(PROJECT_ROOT) # fungame/
 
 # Add utils to sys.path
 sys.path.append(os.path.join(WORKSPACE_ROOT, 'utils'))
+# Add workspace root so shared `history.*` helpers (e.g. history.pinyin_slugs) are importable
+if WORKSPACE_ROOT not in sys.path:
+    sys.path.append(WORKSPACE_ROOT)
 
 # Define resource paths
 RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'raw_data')
@@ -1,15 +1,36 @@
+# codex: 2026-10-18 图片变体生成折行到 ≤100，逻辑不变
 import os
+import sys
 import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import common
 from PIL import Image, ImageDraw, ImageFont
 
 # Setup Logger
 logger = common.setup_logging('GenImage')
 
+# 变体尺寸上限（宽, 高）；只缩小不放大
+SIZES = {
+    'thumb': (240, 320),
+    'full': (768, 1024),
+}
+FORMATS = ('webp', 'avif')
+# 各预设下的编码参数；AVIF 的 speed 越大越快（体积略大）
+PRESETS = {
+    'low': {'webp': {'quality': 60, 'method': 4}, 'avif': {'quality': 40, 'speed': 8}},
+    'medium': {'webp': {'quality': 75, 'method': 4}, 'avif': {'quality': 50, 'speed': 8}},
+    'high': {'webp': {'quality': 88, 'method': 6}, 'avif': {'quality': 65, 'speed': 6}},
+}
+# 低于该数量的卡片在主进程内处理
+PARALLEL_MIN_CARDS = 8
+
+
 def create_mock_image(card_dir, data):
     image_path = os.path.join(card_dir, 'image.png')
     if os.path.exists(image_path):
-        logger.info(f"Image exists for {data['name']}, skipping.")
+        logger.debug(f"Image exists for {data['name']}, skipping.")
         return
 
     # Create a simple image
@@ -20,41 +41,195 @@ def create_mock_image(card_dir, data):
 
     # Draw Text (Need to handle fonts, defaulting to basic for now)
     # Ideally we'd use a Chinese font, but for mock we can just confirm it works
-    # Or just save the file. 
+    # Or just save the file.
     # To avoid font issues in this mock env, we'll just save the colored block.
     # In a real scenario we would try to load a font or use default.
-    
+
     # Draw Border
     draw.rectangle([10, 10, width-10, height-10], outline=(100, 50, 50), width=5)
-    
+
     # Try to draw text if safe, otherwise just color is fine for mock
     try:
         # Use default font
-        # draw.text((50, 150), data['name'], fill=(0,0,0)) 
-        pass 
+        # draw.text((50, 150), data['name'], fill=(0,0,0))
+        pass
     except Exception:
         pass
 
     image.save(image_path)
     logger.info(f"Generated mock image for {data['name']}")
 
-def main():
-    cards_root = common.CARDS_DIR
-    if not os.path.exists(cards_root):
-        logger.error("No cards directory found.")
-        return
 
-    for card_id in os.listdir(cards_root):
-        card_dir = os.path.join(cards_root, card_id)
-        data_file = os.path.join(card_dir, 'data.json')
-        
-        if not os.path.exists(data_file):
-            continue
+def avif_supported():
+    """当前 Pillow 能否编码 AVIF（Pillow 11.3+ 的官方 wheel 自带；旧版本或自行编译时可能没有）。"""
+    try:
+        from PIL import features
+        return bool(features.check('avif'))
+    except (ImportError, ValueError):
+        return False
+
+
+def usable_formats(formats):
+    """去掉当前环境编码不了的格式（目前只有 AVIF 可能缺失），并告警一次。"""
+    formats = tuple(formats)
+    if 'avif' in formats and not avif_supported():
+        logger.warning(
+            "This Pillow build cannot encode AVIF; writing WebP variants only "
+            "(upgrade with `pip install -U 'pillow>=11.3'`)."
+        )
+        formats = tuple(fmt for fmt in formats if fmt != 'avif')
+    return formats
+
+
+def settings_key(preset, formats):
+    """变体参数的指纹：预设、格式或尺寸变化时所有卡片都需要重新编码。"""
+    spec = {
+        'sizes': SIZES,
+        'formats': list(formats),
+        'encode': {fmt: PRESETS[preset][fmt] for fmt in formats},
+    }
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def _variants_present(card_dir, images):
+    return all(
+        os.path.exists(os.path.join(card_dir, os.path.basename(variant['path'])))
+        for variant in images.get('variants', {}).values()
+    )
+
 
+def _encode_variants(card_id, card_dir, source_path, preset, formats):
+    variants = {}
+    with Image.open(source_path) as source:
+        source.load()
+        width, height = source.size
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        for size_name, bounds in SIZES.items():
+            resized = source.copy()
+            resized.thumbnail(bounds, Image.Resampling.LANCZOS)
+            for fmt in formats:
+                filename = f"image.{size_name}.{fmt}"
+                out_path = os.path.join(card_dir, filename)
+                tmp = f"{out_path}.tmp"
+                resized.save(tmp, format=fmt.upper(), **PRESETS[preset][fmt])
+                os.replace(tmp, out_path)
+                variants[f"{size_name}.{fmt}"] = {
+                    'path': f"cards/{card_id}/{filename}",
+                    'width': resized.width,
+                    'height': resized.height,
+                    'bytes': os.path.getsize(out_path),
+                }
+    return (width, height), variants
+
+
+def process_card(card_dir, preset='medium', formats=FORMATS, force=False):
+    """
+    处理一张卡片（进程池 worker 调用）：没有 image.png 时先渲染占位图，然后按需编码变体并把结果写回 data.json 的 `images`。
+    源图 (mtime, size) 与记录一致时不读源图；不一致时比较 sha1，内容未变只更新 stat。
+    返回 (card_id, 状态, 失败原因)；状态为 encoded / skipped / touched / failed。
+    """
+    card_id = os.path.basename(card_dir)
+    data_file = os.path.join(card_dir, 'data.json')
+    source_path = os.path.join(card_dir, 'image.png')
+    try:
         with open(data_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            
         create_mock_image(card_dir, data)
 
+        key = settings_key(preset, formats)
+        images = data.get('images') or {}
+        source = images.get('source') or {}
+        st = os.stat(source_path)
+        current = not force and images.get('key') == key and _variants_present(card_dir, images)
+        stamp = {'bytes': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if current and all(source.get(field) == value for field, value in stamp.items()):
+            return card_id, 'skipped', None
+
+        with open(source_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if current and source.get('sha1') == digest:
+            images['source'] = {**source, **stamp}
+            status = 'touched'
+        else:
+            (width, height), variants = _encode_variants(
+                card_id, card_dir, source_path, preset, formats
+            )
+            images = {
+                'key': key,
+                'preset': preset,
+                'source': {'sha1': digest, 'width': width, 'height': height, **stamp},
+                'variants': variants,
+            }
+            status = 'encoded'
+
+        data['images'] = images
+        tmp = f"{data_file}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, data_file)
+        return card_id, status, None
+    except Exception as e:
+        return card_id, 'failed', f"{type(e).__name__}: {e}"
+
+
+def run(cards_root=None, workers=None, preset='medium', formats=FORMATS, force=False):
+    """处理 cards_root 下全部卡片；返回各状态计数与失败列表。"""
+    cards_root = cards_root or common.CARDS_DIR
+    if not os.path.exists(cards_root):
+        logger.error("No cards directory found.")
+        return None
+
+    formats = usable_formats(formats)
+    if not formats:
+        logger.error("None of the requested image formats can be encoded here.")
+        return None
+
+    card_dirs = sorted(
+        entry.path
+        for entry in os.scandir(cards_root)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'data.json'))
+    )
+    n = len(card_dirs)
+    args = (card_dirs, [preset] * n, [tuple(formats)] * n, [force] * n)
+    if len(card_dirs) >= PARALLEL_MIN_CARDS and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_card, *args, chunksize=4))
+    else:
+        results = [process_card(*item) for item in zip(*args)]
+
+    summary = {'encoded': 0, 'skipped': 0, 'touched': 0, 'failed': 0, 'errors': []}
+    for card_id, status, error in results:
+        summary[status] += 1
+        if error:
+            summary['errors'].append({'id': card_id, 'error': error})
+            logger.error(f"Failed to process image for {card_id}: {error}")
+    logger.info(
+        f"Images: {summary['encoded']} encoded, {summary['skipped']} skipped, "
+        f"{summary['touched']} touched, {summary['failed']} failed "
+        f"(preset {preset}, {','.join(formats)})"
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render/ingest card art and encode WebP/AVIF thumb/full variants."
+    )
+    add = parser.add_argument
+    add('--workers', type=int, default=None, help="Worker processes (1 = serial).")
+    add('--preset', choices=sorted(PRESETS), default='medium', help="Encoder quality preset.")
+    add('--formats', default=','.join(FORMATS), help="Comma-separated formats (webp, avif).")
+    add('--force', action='store_true', help="Re-encode every card, even unchanged ones.")
+    args = parser.parse_args(argv)
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown or not formats:
+        parser.error(f"--formats must be a subset of {','.join(FORMATS)}")
+    summary = run(workers=args.workers, preset=args.preset, formats=formats, force=args.force)
+    # 没有卡片目录 / 没有可编码的格式（run 返回 None）或有卡片失败：退出码 1
+    return 1 if summary is None or summary['failed'] else 0
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,76 +1,111 @@
-import json
+# codex: 2026-10-18 去掉 basicConfig（root 再挂 handler 会让每行日志输出两次）；--verbose 只调 logger 级别
 import os
-import sys
+import argparse
+import logging
+import threading
 import common
-from pypinyin import lazy_pinyin
-from llm_api import load_llm_config, setup_llm_client, generate_llm_response
+from history.card_engine import EngineOptions, connect_llm, load_progress, run_cards, sigint_stop
+from history.card_files import filter_idioms
+from utils.config import get_utils_config_path
+from utils.llm_cache import CACHE_MODES
 
 # Setup Logger
 logger = common.setup_logging('GenMeta')
 
-def get_pinyin_id(text):
-    return "".join(lazy_pinyin(text))
+# 独立的进度文件：idioms.txt 的序号与 historycards 默认词典不同，不能共用
+PROGRESS_FILE = os.path.join(common.RESOURCES_DIR, '.gen_meta_progress.json')
 
-def generate_metadata(idiom, client, llm_source, models):
-    pinyin_id = get_pinyin_id(idiom)
-    card_dir = os.path.join(common.CARDS_DIR, pinyin_id)
-    data_file = os.path.join(card_dir, 'data.json')
 
-    if os.path.exists(data_file):
-        logger.info(f"Skipping {idiom} ({pinyin_id}), already exists.")
-        return
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate card metadata for raw_data/idioms.txt via the historycards engine "
+        "(history/card_engine.py).",
+    )
+    add = parser.add_argument
+    add(
+        '--input',
+        default=os.path.join(common.RAW_DATA_DIR, 'idioms.txt'),
+        help="Idiom list (one per line).",
+    )
+    add('--workers', type=int, default=4, help="Idioms generated concurrently (default: 4).")
+    add('--resume', action='store_true', help="Start from the progress file's next_index.")
+    add('--force', action='store_true', help="Regenerate idioms that already have data.json.")
+    add('--max-retries', type=int, default=3, help="Max retries per idiom on LLM/parse failure.")
+    add('--retry-wait-base', type=float, default=1.5, help="Base seconds to wait before retrying.")
+    add(
+        '--stream',
+        action='store_true',
+        help="Stream responses and abort hopeless generations early.",
+    )
+    add('--pack', type=int, default=1, help="Cards per LLM request (default: 1).")
+    add(
+        '--cache-mode',
+        choices=list(CACHE_MODES),
+        default='off',
+        help="Reuse validated LLM responses for identical prompts.",
+    )
+    add('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this port.")
+    add(
+        '--config',
+        default=get_utils_config_path('config.ini'),
+        help="LLM config (utils/config.ini).",
+    )
+    add('--llmsource', default=None, help="Override [llmsources] llmsource.")
+    add('--models', default=None, help="Comma-separated model names (overrides config).")
+    add('--max-models', type=int, default=3, help="Use at most N models from the fallback chain.")
+    add('--verbose', action='store_true', help="Debug logging.")
+    return parser
 
-    logger.info(f"Processing {idiom}...")
-    
-    prompt = f"""
-You are a historian and art director. For the idiom '{idiom}', provide a JSON response with the following fields:
-1. "id": "{pinyin_id}"
-2. "name": "{idiom}"
-3. "period": Estimated historical period (e.g., "Eastern Han Dynasty").
-4. "year_estimate": Estimated year (integer, e.g., 208).
-5. "meaning": The meaning of the idiom (Chinese).
-6. "story": A brief story background (Chinese, ~100 words).
-7. "prompt": An image generation prompt describing a scene from the story. Strictly follow this style: 'A trading card design with a heavy historical feel, ancient Chinese art style, realistic texture, [scene description]'.
 
-Output ONLY valid JSON.
-"""
-    try:
-        response_text = generate_llm_response(client, llm_source, prompt, models, logger)
-        # Clean up code blocks if Present
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-        data = json.loads(response_text)
-        
-        # Ensure ID consistency
-        data['id'] = pinyin_id
-        
-        os.makedirs(card_dir, exist_ok=True)
-        with open(data_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        logger.info(f"Saved metadata for {idiom}")
-        
-    except Exception as e:
-        logger.error(f"Failed to generate metadata for {idiom}: {e}")
+def main(argv=None, llm=None):
+    """`llm`: optional `LLMBinding` (or factory); defaults to the provider in --config."""
+    args = build_parser().parse_args(argv)
+    # 引擎日志用 historycards logger：与 GenMeta 一样挂自己的 handler，root 不加 handler（避免重复输出）
+    for log in (logger, common.setup_logging('historycards')):
+        log.setLevel(logging.DEBUG if args.verbose else logging.INFO)
 
-def main():
-    # Load Config
-    config = load_llm_config(common.os.path.join(common.WORKSPACE_ROOT, 'utils', 'config.ini'))
-    client, llm_source, models = setup_llm_client(config, logger)
+    if not os.path.exists(args.input):
+        logger.error(f"Idioms file not found at {args.input}")
+        return 1
 
-    idioms_path = os.path.join(common.RAW_DATA_DIR, 'idioms.txt')
-    if not os.path.exists(idioms_path):
-        logger.error(f"Idioms file not found at {idioms_path}")
-        return
+    with open(args.input, 'r', encoding='utf-8') as f:
+        selected = list(enumerate(filter_idioms(f), start=1))
 
-    with open(idioms_path, 'r', encoding='utf-8') as f:
-        idioms = [line.strip() for line in f if line.strip()]
+    options = EngineOptions(
+        resources_dir=common.RESOURCES_DIR,
+        progress_file=PROGRESS_FILE,
+        workers=args.workers,
+        force=args.force,
+        max_retries=args.max_retries,
+        retry_wait_base=args.retry_wait_base,
+        stream=args.stream,
+        pack=args.pack,
+        cache_mode=args.cache_mode,
+        metrics_port=args.metrics_port,
+        input=args.input,
+        resume=args.resume,
+    )
+    if args.resume:
+        progress = load_progress(options) or {}
+        options.start = int(progress.get('next_index', 1))
+        selected = [(i, idiom) for i, idiom in selected if i >= options.start]
+
+    if llm is None:
+        models = [m.strip() for m in args.models.split(',') if m.strip()] if args.models else None
+
+        def llm():
+            return connect_llm(args.config, args.llmsource, models, args.max_models)
+
+    with sigint_stop(threading.Event()) as stop:
+        rc, summary = run_cards(selected, options, llm, stop=stop)
+    if summary:
+        logger.info(
+            f"Processed {summary['processed']}, skipped {summary['skipped']}, "
+            f"failed {summary['failed']} of {summary['selected']} idioms "
+            f"in {summary['wall_time_s']}s (exit code {rc})"
+        )
+    return rc
 
-    for idiom in idioms:
-        generate_metadata(idiom, client, llm_source, models)
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -1,77 +1,471 @@
+# codex: 2026-10-18 牌库分片写出与 --shard-* 参数折行到 ≤100，逻辑不变
 import os
 import json
+import time
+import sqlite3
+import hashlib
+import zlib
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
 import common
 
 # Setup Logger
 logger = common.setup_logging('Pack')
 
-def pack_resources():
-    cards_root = common.CARDS_DIR
+INDEX_VERSION = '3'
+# 打包索引与变更记录放在 manifest.json 所在的 resources 目录（每棵卡片树各自一份）
+INDEX_FILE_NAME = '.pack_index.sqlite'
+CHANGELOG_FILE_NAME = 'pack_changelog.jsonl'
+DECK_POINTER = 'deck.json'
+DECK_DIR = 'deck'
+# 精简索引每行的字段（其后是 sprite 与分片序号两列）；卡片正文（meaning / story / prompt ...）只在分片里
+DECK_FIELDS = ['id', 'name', 'year_estimate', 'popular', 'period']
+SHARD_BY_CHOICES = ('period', 'popular')
+DEFAULT_SHARD_SIZE = 200
+REQUIRED_FIELDS = ['id', 'name', 'year_estimate']
+# 需要重读的卡片少于该数量时在主进程内解析（进程池启动开销大于收益）
+PARALLEL_MIN_CARDS = 64
+
+# fragment：按 manifest.json 中的缩进序列化好的卡片文本，manifest 直接拼接，不再逐张 json.dump；
+# body：紧凑 JSON，拼接成牌库分片；name / year_estimate / popular / period 供精简索引与分组；
+# atlas：卡片在缩略图图集中的位置（atlas.py 写入 data.json 的 `atlas`，JSON 文本）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY,
+    data_mtime INTEGER,
+    data_size INTEGER,
+    image_mtime INTEGER,
+    image_size INTEGER,
+    sha1 TEXT,
+    fragment TEXT,
+    error TEXT,
+    body TEXT,
+    name TEXT,
+    year_estimate,
+    popular,
+    period TEXT,
+    atlas TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _stat_key(path):
+    """文件的 (mtime_ns, size)；不存在时为 (None, None)。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None, None
+    return st.st_mtime_ns, st.st_size
+
+
+def card_fragment(card):
+    """与 `json.dump({"cards": [...]}, indent=2)` 中单张卡片完全相同的文本（含 4 格缩进）。"""
+    lines = json.dumps(card, ensure_ascii=False, indent=2).split("\n")
+    return "\n".join("    " + line for line in lines)
+
+
+def load_card(card_id, data_file):
+    """
+    读取并校验一张卡片（进程池 worker 调用）。
+    返回 (card_id, sha1, parsed 或 None, 失败原因)；
+    parsed = (fragment, body, name, year_estimate, popular, period, atlas)。
+    """
+    try:
+        with open(data_file, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        return card_id, None, None, f"read error: {e}"
+    digest = hashlib.sha1(raw).hexdigest()
+    try:
+        data = json.loads(raw.decode('utf-8'))
+    except ValueError as e:
+        return card_id, digest, None, f"invalid JSON: {e}"
+    if not isinstance(data, dict):
+        return card_id, digest, None, "data.json is not an object"
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return card_id, digest, None, f"missing field {field}"
+    # Add relative path for image to be used by frontend
+    # Frontend will load 'resources/cards/{id}/image.png'
+    data['image_path'] = f"cards/{card_id}/image.png"
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    atlas = data.get('atlas')
+    atlas = json.dumps(atlas, ensure_ascii=False) if isinstance(atlas, dict) else None
+    parsed = (
+        card_fragment(data),
+        body,
+        data['name'],
+        data['year_estimate'],
+        data.get('popular'),
+        data.get('period'),
+        atlas,
+    )
+    return card_id, digest, parsed, None
+
+
+def _open_index(index_file):
+    conn = sqlite3.connect(index_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != INDEX_VERSION:
+        conn.execute("DELETE FROM cards")
+        conn.execute(
+            "INSERT OR REPLACE INTO meta(key, value) VALUES ('version', ?)", (INDEX_VERSION,)
+        )
+        conn.commit()
+    return conn
+
+
+def _is_valid(row):
+    """row = (data_mtime, data_size, image_mtime, image_size, sha1, has_fragment, error)"""
+    return row is not None and row[5] and row[6] is None and row[2] is not None
+
+
+def _reason(row):
+    if row[0] is None:
+        return "missing data.json"
+    if row[6] is not None:
+        return row[6]
+    return "missing image.png"
+
+
+def _write_immutable(path, text):
+    """内容寻址文件：同名即同内容，已存在时不重写。"""
+    if os.path.exists(path):
+        return False
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+def _content_name(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _shard_buckets(count, shard_size):
+    """组内分桶数取 2 的幂：增删少量卡片时桶数不变，只有所在分片的内容（文件名）变化。"""
+    buckets = 1
+    while buckets * shard_size < count:
+        buckets *= 2
+    return buckets
+
+
+def write_deck(conn, resources_dir, shard_by='period', shard_size=DEFAULT_SHARD_SIZE):
+    """
+    从打包索引写出前端用的分片牌库：
+      deck/shards/<sha1>.json   一组卡片的完整数据 {"cards": [...]}，文件名即内容哈希，可永久缓存
+      deck/index.<sha1>.json    精简索引：每张卡片 DECK_FIELDS + sprite + 分片序号（列式数组）；
+                                sprite = [图集序号, x, y, w, h]（无图集时为 null），图集见 `atlases`
+      deck.json                 顶层指针：当前索引文件与版本号（前端每次以 no-cache 读取）
+    只保留当前与上一版指针引用的文件，更早的索引/分片被清理。返回指针内容。
+    """
+    deck_dir = os.path.join(resources_dir, DECK_DIR)
+    shards_dir = os.path.join(deck_dir, 'shards')
+    os.makedirs(shards_dir, exist_ok=True)
+
+    groups = {}
+    atlases = []
+    atlas_pos = {}
+    for card_id, name, year, popular, period, body, atlas in conn.execute(
+        "SELECT id, name, year_estimate, popular, period, body, atlas FROM cards "
+        "WHERE body IS NOT NULL AND error IS NULL AND image_mtime IS NOT NULL ORDER BY id"
+    ):
+        sprite = None
+        if atlas:
+            atlas = json.loads(atlas)
+            if atlas['file'] not in atlas_pos:
+                atlas_pos[atlas['file']] = len(atlases)
+                atlases.append(
+                    {'file': atlas['file'], 'width': atlas['width'], 'height': atlas['height']}
+                )
+            sprite = [atlas_pos[atlas['file']], atlas['x'], atlas['y'], atlas['w'], atlas['h']]
+        key = period if shard_by == 'period' else popular
+        member = (card_id, name, year, popular, period, body, sprite)
+        groups.setdefault('未知' if key is None else str(key), []).append(member)
+
+    shards = []
+    rows = []
+    written = 0
+    for group in sorted(groups):
+        members = groups[group]
+        buckets = _shard_buckets(len(members), shard_size)
+        split = [[] for _ in range(buckets)]
+        for member in members:
+            split[zlib.crc32(member[0].encode('utf-8')) & (buckets - 1)].append(member)
+        for bucket in split:
+            if not bucket:
+                continue
+            text = '{"cards":[' + ','.join(member[5] for member in bucket) + ']}'
+            file = f"shards/{_content_name(text)}.json"
+            written += _write_immutable(os.path.join(deck_dir, file), text)
+            for member in bucket:
+                rows.append([*member[:5], member[6], len(shards)])
+            shards.append({'file': file, 'group': group, 'count': len(bucket)})
+    rows.sort(key=lambda row: row[0])
+
+    index_text = json.dumps(
+        {
+            'fields': DECK_FIELDS + ['sprite', 'shard'],
+            'shards': shards,
+            'atlases': atlases,
+            'cards': rows,
+        },
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    version = _content_name(index_text)
+    index_file = f"{DECK_DIR}/index.{version}.json"
+    _write_immutable(os.path.join(resources_dir, index_file), index_text)
+
+    pointer_path = os.path.join(resources_dir, DECK_POINTER)
+    previous = _read_json(pointer_path)
+    if previous and previous.get('version') == version:
+        return previous
+    pointer = {
+        'version': version,
+        'index': index_file,
+        'cards': len(rows),
+        'shards': len(shards),
+        'shard_by': shard_by,
+        'shard_size': shard_size,
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    if previous and previous.get('index'):
+        pointer['previous'] = previous['index']
+    tmp = f"{pointer_path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(pointer, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, pointer_path)
+
+    # 已加载旧指针的页面仍可能按上一版索引取分片，保留上一版引用的文件
+    keep = {index_file, *(f"{DECK_DIR}/{shard['file']}" for shard in shards)}
+    if previous and previous.get('index'):
+        keep.add(previous['index'])
+        old_index = _read_json(os.path.join(resources_dir, previous['index'])) or {}
+        keep.update(f"{DECK_DIR}/{shard['file']}" for shard in old_index.get('shards', []))
+    pruned = 0
+    for sub in ('', 'shards'):
+        folder = os.path.join(deck_dir, sub)
+        for entry in os.scandir(folder):
+            rel = f"{DECK_DIR}/{sub + '/' if sub else ''}{entry.name}"
+            if entry.is_file() and entry.name.endswith('.json') and rel not in keep:
+                os.remove(entry.path)
+                pruned += 1
+    logger.info(
+        f"Deck {version}: {len(rows)} cards in {len(shards)} shards by {shard_by} "
+        f"(new {written}, pruned {pruned})"
+    )
+    return pointer
+
+
+def pack_resources(
+    cards_root=None,
+    manifest_file=None,
+    index_file=None,
+    changelog_file=None,
+    workers=None,
+    full=False,
+    deck=True,
+    shard_by='period',
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    """
+    增量打包：对每个卡片目录只 stat data.json / image.png；与索引中 (mtime, size) 一致的
+    卡片不读文件，变化的卡片重新读取（内容 sha1 未变时只更新 stat），有效卡片按 id 排序写入 manifest。
+    manifest 默认在 `cards_root` 的上一级；索引与变更记录默认在 manifest 所在的 resources 目录，
+    因此不同的卡片树互不干扰。`deck=True` 时在同一目录另写分片牌库（见 `write_deck`）。
+    返回本次的变更记录（added / removed / updated / invalidated，以及牌库版本 deck）。
+    """
+    cards_root = cards_root or common.CARDS_DIR
+    default_manifest = os.path.join(os.path.dirname(os.path.abspath(cards_root)), 'manifest.json')
+    manifest_file = manifest_file or default_manifest
+    resources_dir = os.path.dirname(os.path.abspath(manifest_file))
+    index_file = index_file or os.path.join(resources_dir, INDEX_FILE_NAME)
+    changelog_file = changelog_file or os.path.join(resources_dir, CHANGELOG_FILE_NAME)
     if not os.path.exists(cards_root):
         logger.error("No cards directory found.")
-        return
+        return None
+
+    t0 = time.perf_counter()
+    conn = _open_index(index_file)
+    try:
+        old = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT id, data_mtime, data_size, image_mtime, image_size, sha1, "
+                "fragment IS NOT NULL, error FROM cards"
+            )
+        }
+        new = {}
+        # id -> (data_mtime, data_size, image_mtime, image_size, sha1, parsed, error)；
+        # parsed 为 ... 表示沿用索引里的解析结果
+        upserts = {}
+        to_read = []
+        for entry in os.scandir(cards_root):
+            if not entry.is_dir():
+                continue
+            card_id = entry.name
+            data_stat = _stat_key(os.path.join(entry.path, 'data.json'))
+            image_stat = _stat_key(os.path.join(entry.path, 'image.png'))
+            prev = old.get(card_id)
+            if not full and prev is not None and prev[:2] == data_stat:
+                new[card_id] = (*data_stat, *image_stat, *prev[4:])
+                if prev[2:4] != image_stat:
+                    # 只有图片变化：沿用上次解析结果
+                    upserts[card_id] = (*data_stat, *image_stat, prev[4], ..., prev[6])
+                continue
+            if data_stat[0] is None:
+                new[card_id] = (None, None, *image_stat, None, False, None)
+                upserts[card_id] = (None, None, *image_stat, None, None, None)
+                continue
+            new[card_id] = (*data_stat, *image_stat)  # 解析后补全
+            to_read.append((card_id, os.path.join(entry.path, 'data.json')))
+
+        if to_read:
+            if len(to_read) >= PARALLEL_MIN_CARDS and workers != 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    chunksize = max(1, len(to_read) // ((workers or os.cpu_count() or 1) * 4))
+                    results = list(pool.map(load_card, *zip(*to_read), chunksize=chunksize))
+            else:
+                results = [load_card(card_id, path) for card_id, path in to_read]
+            for card_id, digest, parsed, error in results:
+                stats = new[card_id]
+                prev = old.get(card_id)
+                if not full and prev is not None and digest is not None and prev[4] == digest:
+                    # 只是被 touch 过，内容没变
+                    new[card_id] = (*stats, digest, prev[5], prev[6])
+                    upserts[card_id] = (*stats, digest, ..., prev[6])
+                else:
+                    new[card_id] = (*stats, digest, parsed is not None, error)
+                    upserts[card_id] = (*stats, digest, parsed, error)
+
+        changes = {'added': [], 'removed': [], 'updated': [], 'invalidated': []}
+        for card_id in sorted(new):
+            row, prev = new[card_id], old.get(card_id)
+            valid, was_valid = _is_valid(row), _is_valid(prev)
+            if valid and not was_valid:
+                changes['added'].append(card_id)
+            elif valid and row[4] != prev[4]:
+                changes['updated'].append(card_id)
+            elif not valid and (prev is None or was_valid or _reason(prev) != _reason(row)):
+                changes['invalidated'].append({'id': card_id, 'reason': _reason(row)})
+                logger.warning(f"Card {card_id} invalid: {_reason(row)}")
+        removed = [card_id for card_id in old if card_id not in new]
+        changes['removed'] = sorted(card_id for card_id in removed if _is_valid(old[card_id]))
+
+        for card_id, values in upserts.items():
+            if values[5] is ...:
+                conn.execute(
+                    "UPDATE cards SET data_mtime = ?, data_size = ?, image_mtime = ?, "
+                    "image_size = ?, sha1 = ?, error = ? WHERE id = ?",
+                    (*values[:5], values[6], card_id),
+                )
+            else:
+                parsed = values[5] or (None,) * 7
+                conn.execute(
+                    "INSERT OR REPLACE INTO cards (id, data_mtime, data_size, image_mtime, "
+                    "image_size, sha1, error, fragment, body, name, year_estimate, popular, "
+                    "period, atlas) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (card_id, *values[:5], values[6], *parsed),
+                )
+        conn.executemany("DELETE FROM cards WHERE id = ?", [(card_id,) for card_id in removed])
+        conn.commit()
+
+        valid_count = sum(1 for row in new.values() if _is_valid(row))
+        if valid_count == 0:
+            logger.warning("No valid cards found to pack.")
+        elif any(changes.values()) or not os.path.exists(manifest_file):
+            # Save Manifest（与 json.dump(manifest, indent=2) 的输出逐字节一致）
+            fragments = [
+                fragment
+                for (fragment,) in conn.execute(
+                    "SELECT fragment FROM cards WHERE fragment IS NOT NULL AND error IS NULL "
+                    "AND image_mtime IS NOT NULL ORDER BY id"
+                )
+            ]
+            tmp = f"{manifest_file}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write('{\n  "cards": [\n' + ",\n".join(fragments) + '\n  ]\n}')
+            os.replace(tmp, manifest_file)
+        deck_version = None
+        if deck and valid_count:
+            pointer = _read_json(os.path.join(resources_dir, DECK_POINTER)) or {}
+            stale = (pointer.get('shard_by'), pointer.get('shard_size')) != (shard_by, shard_size)
+            missing = not os.path.exists(os.path.join(resources_dir, pointer.get('index', '')))
+            if any(changes.values()) or stale or missing:
+                pointer = write_deck(conn, resources_dir, shard_by=shard_by, shard_size=shard_size)
+            deck_version = pointer['version']
+    finally:
+        conn.close()
 
-    manifest = {
-        "cards": []
+    elapsed = time.perf_counter() - t0
+    record = {
+        'ts': datetime.datetime.now().isoformat(timespec='seconds'),
+        **changes,
+        'cards': valid_count,
+        'scanned': len(new),
+        'reread': len(to_read),
+        'deck': deck_version,
+        'elapsed_s': round(elapsed, 4),
     }
+    if any(changes.values()):
+        with open(changelog_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    logger.info(
+        f"Packed {valid_count}/{len(new)} cards into manifest.json in {elapsed:.3f}s "
+        f"(re-read {len(to_read)}; +{len(changes['added'])} ~{len(changes['updated'])} "
+        f"-{len(changes['removed'])} !{len(changes['invalidated'])})"
+    )
+    return record
 
-    cards_found = 0
-    cards_valid = 0
-
-    for card_id in os.listdir(cards_root):
-        card_dir = os.path.join(cards_root, card_id)
-        if not os.path.isdir(card_dir):
-            continue
-            
-        cards_found += 1
-        data_file = os.path.join(card_dir, 'data.json')
-        image_file = os.path.join(card_dir, 'image.png')
-
-        is_valid = True
-        
-        # Validate files exist
-        if not os.path.exists(data_file):
-            logger.warning(f"Missing data.json for {card_id}")
-            is_valid = False
-            
-        if not os.path.exists(image_file):
-            logger.warning(f"Missing image.png for {card_id}")
-            is_valid = False
-            
-        if is_valid:
-            try:
-                with open(data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                # Basic schema validation could go here
-                required_fields = ['id', 'name', 'year_estimate']
-                for field in required_fields:
-                    if field not in data:
-                        logger.warning(f"Card {card_id} missing field {field}")
-                        is_valid = False
-                        break
-                
-                if is_valid:
-                    # Add relative path for image to be used by frontend
-                    # Frontend will load 'resources/cards/{id}/image.png'
-                    data['image_path'] = f"cards/{card_id}/image.png"
-                    manifest['cards'].append(data)
-                    cards_valid += 1
-                    
-            except Exception as e:
-                logger.error(f"Error reading {card_id}: {e}")
-
-    # Check for empty manifest
-    if cards_valid == 0:
-        logger.warning("No valid cards found to pack.")
-    else:
-        # Save Manifest
-        with open(common.MANIFEST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(manifest, f, ensure_ascii=False, indent=2)
-        logger.info(f"Packed {cards_valid}/{cards_found} cards into manifest.json")
 
 def main():
-    pack_resources()
+    parser = argparse.ArgumentParser(
+        description="Pack card directories into manifest.json (incremental)."
+    )
+    add = parser.add_argument
+    add('--full', action='store_true', help="Re-read every card, ignoring unchanged mtime/size.")
+    add('--workers', type=int, default=None, help="Processes parsing changed cards (1 = serial).")
+    add('--no-deck', action='store_true', help="Only write manifest.json (no deck.json / shards).")
+    add(
+        '--shard-by',
+        choices=SHARD_BY_CHOICES,
+        default='period',
+        help="Group deck shards by period or popular.",
+    )
+    add(
+        '--shard-size',
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="Target cards per shard within a group.",
+    )
+    args = parser.parse_args()
+    if args.shard_size < 1:
+        parser.error("--shard-size must be >= 1")
+    pack_resources(
+        workers=args.workers,
+        full=args.full,
+        deck=not args.no_deck,
+        shard_by=args.shard_by,
+        shard_size=args.shard_size,
+    )
 
 if __name__ == "__main__":
     main()
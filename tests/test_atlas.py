@@ -0,0 +1,120 @@
+# codex: 2026-10-18 图集单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import sys
+
+from PIL import Image
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_TOOLS_DIR = _REPO_ROOT / "history" / "tools"
+for _path in (_REPO_ROOT, _TOOLS_DIR):
+    if str(_path) not in sys.path:
+        sys.path.insert(0, str(_path))
+
+import atlas  # noqa: E402
+import pack  # noqa: E402
+
+
+def test_shelf_pack_fills_pages_without_overlap():
+    sizes = [(240, 320)] * 20 + [(100, 150), (300, 200), (50, 50)]
+    pages = atlas.shelf_pack(sizes, max_size=1000, padding=2)
+    placed = sorted(i for page in pages for i, _, _ in page["placements"])
+    assert placed == list(range(len(sizes))) and len(pages) > 1
+    for page in pages:
+        assert page["width"] <= 1000 and page["height"] <= 1000
+        rects = [(x, y, x + sizes[i][0], y + sizes[i][1]) for i, x, y in page["placements"]]
+        for a in range(len(rects)):
+            for b in range(a + 1, len(rects)):
+                ra, rb = rects[a], rects[b]
+                assert ra[2] <= rb[0] or rb[2] <= ra[0] or ra[3] <= rb[1] or rb[3] <= ra[1]
+
+
+def _card(resources: Path, card_id: str, period: str, color: tuple) -> Path:
+    card_dir = resources / "cards" / card_id
+    card_dir.mkdir(parents=True, exist_ok=True)
+    data = {
+        "id": card_id,
+        "name": f"成语{card_id}",
+        "period": period,
+        "year_estimate": 1,
+        "popular": 5,
+    }
+    (card_dir / "data.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    Image.new("RGB", (480, 640), color).save(card_dir / "image.png")
+    return card_dir
+
+
+def _atlas_entry(card_dir: Path) -> dict:
+    return json.loads((card_dir / "data.json").read_text(encoding="utf-8"))["atlas"]
+
+
+def test_build_atlases_records_uvs_and_skips_unchanged(tmp_path):
+    resources = tmp_path / "resources"
+    colors = {f"c{i}": (i * 20, 100, 200 - i * 20) for i in range(8)}
+    dirs = {
+        card_id: _card(resources, card_id, "秦" if i < 5 else "汉", color)
+        for i, (card_id, color) in enumerate(colors.items())
+    }
+    kwargs = dict(
+        cards_root=str(resources / "cards"), resources_dir=str(resources), per_atlas=4, workers=1
+    )
+    stats = atlas.build_atlases(**kwargs)
+    assert (
+        stats["cards"] == 8 and stats["updated"] == 8 and stats["encoded"] == stats["atlases"] >= 2
+    )
+
+    for card_id, card_dir in dirs.items():
+        entry = _atlas_entry(card_dir)
+        assert (entry["w"], entry["h"]) == (240, 320)  # 按 thumb 上限缩放
+        assert entry["uv"] == [
+            round(entry["x"] / entry["width"], 6),
+            round(entry["y"] / entry["height"], 6),
+            round((entry["x"] + entry["w"]) / entry["width"], 6),
+            round((entry["y"] + entry["h"]) / entry["height"], 6),
+        ]
+        with Image.open(resources / entry["file"]) as sheet:
+            assert sheet.size == (entry["width"], entry["height"])
+            pixel = sheet.convert("RGB").getpixel((entry["x"] + 120, entry["y"] + 160))
+        assert all(abs(a - b) < 12 for a, b in zip(pixel, colors[card_id]))
+    listing = json.loads((resources / "atlas" / "atlas.json").read_text(encoding="utf-8"))
+    assert {item["group"] for item in listing["atlases"]} == {"秦", "汉"}
+
+    mtimes = {
+        card_id: (card_dir / "data.json").stat().st_mtime_ns for card_id, card_dir in dirs.items()
+    }
+    again = atlas.build_atlases(**kwargs)
+    assert again["encoded"] == 0 and again["updated"] == 0
+    assert all(
+        (dirs[card_id] / "data.json").stat().st_mtime_ns == mtime
+        for card_id, mtime in mtimes.items()
+    )
+
+    # 换一张卡的图：只重编它所在的图集；旧图集保留一代
+    old_file = _atlas_entry(dirs["c6"])["file"]
+    Image.new("RGB", (480, 640), (0, 0, 0)).save(dirs["c6"] / "image.png")
+    third = atlas.build_atlases(**kwargs)
+    assert third["encoded"] == 1 and third["pruned"] == 0
+    assert _atlas_entry(dirs["c6"])["file"] != old_file and (resources / old_file).exists()
+    _card(resources, "c9", "汉", (1, 2, 3))
+    assert atlas.build_atlases(**kwargs)["pruned"] >= 1
+    assert not (resources / old_file).exists()
+
+    # pack 把图集位置带进牌库精简索引
+    pack.pack_resources(
+        cards_root=str(resources / "cards"),
+        manifest_file=str(resources / "manifest.json"),
+        index_file=str(tmp_path / "index.sqlite"),
+        changelog_file=str(tmp_path / "changelog.jsonl"),
+    )
+    pointer = json.loads((resources / "deck.json").read_text(encoding="utf-8"))
+    index = json.loads((resources / pointer["index"]).read_text(encoding="utf-8"))
+    sprite_col = index["fields"].index("sprite")
+    row = next(row for row in index["cards"] if row[0] == "c3")
+    entry = _atlas_entry(dirs["c3"])
+    assert index["atlases"][row[sprite_col][0]]["file"] == entry["file"]
+    assert row[sprite_col][1:] == [entry["x"], entry["y"], entry["w"], entry["h"]]
+    assert os.path.exists(resources / index["atlases"][0]["file"])
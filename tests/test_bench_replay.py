@@ -0,0 +1,122 @@
+# codex: 2026-10-18 回放基准单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import bench_replay, historycards  # noqa: E402
+from history.card_engine import LLMBinding  # noqa: E402
+
+
+def test_replay_llm_injects_errors_and_truncation():
+    replay = bench_replay.ReplayLLM(
+        bench_replay.synthetic_responses(count=4), error_rate=0.25, malformed_rate=0.25, seed=3
+    )
+    outcomes = {"ok": 0, "error": 0, "bad": 0}
+    for _ in range(400):
+        try:
+            text = replay(None, "replay", "prompt", "m")
+        except bench_replay.ReplayError:
+            outcomes["error"] += 1
+            continue
+        try:
+            json.loads(text.strip().removeprefix("```json").removesuffix("```"))
+            outcomes["ok"] += 1
+        except ValueError:
+            outcomes["bad"] += 1
+    assert outcomes["error"] == replay.errors and outcomes["bad"] == replay.malformed
+    assert 60 < replay.errors < 140 and 60 < replay.malformed < 140
+
+    chunks = []
+    assert (
+        bench_replay.ReplayLLM(["{}"]).stream(None, "replay", "p", "m", on_delta=chunks.append)
+        == "{}"
+    )
+    assert "".join(chunks) == "{}"
+    with pytest.raises(ValueError):
+        bench_replay.ReplayLLM(["{}"], latency_dist="pareto")
+
+
+def test_bench_reports_throughput_io_and_detects_regression(tmp_path):
+    dictionary = tmp_path / "dict.txt"
+    dictionary.write_text("#### header\n甲乙\n丙丁\n戊己\n", encoding="utf-8")
+    baseline = tmp_path / "baseline.json"
+    out = tmp_path / "report.json"
+    argv = [
+        "--sizes",
+        "5,12",
+        "--dictionary",
+        str(dictionary),
+        "--malformed-rate",
+        "0.3",
+        "--out",
+        str(out),
+    ]
+
+    assert bench_replay.main(argv + ["--save-baseline", str(baseline)]) == 0
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert [r["size"] for r in report["results"]] == [5, 12]
+    big = report["results"][1]
+    assert big["cards"] == 12 and big["failed"] == 0
+    assert report["repeat"] == 3 and len(big["runs_cards_per_s"]) == 3
+    assert big["cards_per_s"] == sorted(big["runs_cards_per_s"])[1]  # 中位数
+    assert big["attempts"] == big["llm"]["calls"] > 12  # 坏 JSON 触发重试
+    assert big["cards_per_s"] > 0 and big["io"]["output"]["files"] >= 12
+    assert big["phases"]["card;commit;write_data"]["count"] == 12
+    assert "manifest_flush" in big["phases"]
+    assert json.loads(baseline.read_text(encoding="utf-8"))["results"][0]["size"] == 5
+
+    # 基线吞吐虚高 10 倍：判定为回退
+    inflated = json.loads(baseline.read_text(encoding="utf-8"))
+    for result in inflated["results"]:
+        result["cards_per_s"] *= 10
+    baseline.write_text(json.dumps(inflated), encoding="utf-8")
+    assert (
+        bench_replay.main(
+            [
+                "--sizes",
+                "5",
+                "--dictionary",
+                str(dictionary),
+                "--out",
+                str(out),
+                "--baseline",
+                str(baseline),
+            ]
+        )
+        == 1
+    )
+    regressions = json.loads(out.read_text(encoding="utf-8"))["regressions"]
+    assert regressions and regressions[0].startswith("n=5: cards/sec")
+
+
+def test_historycards_main_uses_injected_llm(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        historycards, "load_llm_config", lambda _path: pytest.fail("config.ini read")
+    )
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲乙\n丙丁\n", encoding="utf-8")
+    replay = bench_replay.ReplayLLM(bench_replay.synthetic_responses(count=2))
+    llm = LLMBinding(client={}, source="replay", models=["m"], call=replay, stream=replay.stream)
+    argv = ["--input", str(input_file), "--resources-dir", str(tmp_path / "res")]
+    assert historycards.main(argv, llm=llm) == 0
+    assert replay.calls == 2
+    assert (tmp_path / "res" / "manifest.json").exists()
+
+
+def test_committed_baseline_matches_report_format():
+    baseline_file = _REPO_ROOT / "history" / "bench_baseline.json"
+    baseline = json.loads(baseline_file.read_text(encoding="utf-8"))
+    assert baseline["version"] == bench_replay.REPORT_VERSION
+    assert baseline["repeat"] == bench_replay.DEFAULT_REPEAT
+    assert [r["size"] for r in baseline["results"]] == [10000]
+    assert baseline["results"][0]["cards"] == 10000
+    assert bench_replay.compare(baseline, baseline, 0.0) == []
@@ -0,0 +1,119 @@
+# codex: 2026-10-18 卡片索引单测折行到 ≤100
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history.card_files import choose_card_id  # noqa: E402
+from history.card_index import CardIdIndex, card_scan_root  # noqa: E402
+
+
+def _write_card(resources_dir: Path, rel_dir: str, card_id: str, name: str) -> None:
+    card_dir = resources_dir / rel_dir
+    card_dir.mkdir(parents=True, exist_ok=True)
+    (card_dir / "data.json").write_text(
+        json.dumps({"id": card_id, "name": name}, ensure_ascii=False), encoding="utf-8"
+    )
+
+
+def test_rebuild_scans_manifest_and_data_files_then_verifies(tmp_path):
+    resources_dir = tmp_path / "resources"
+    template = "cards/{shard2}/{id}"
+    assert card_scan_root(str(resources_dir), template) == str(resources_dir / "cards")
+    _write_card(resources_dir, "cards/ab/abc", "abc", "甲")
+    _write_card(resources_dir, "cards/xy/xyz", "xyz", "乙")
+    (resources_dir / "cards" / "broken").mkdir(parents=True)
+    (resources_dir / "cards" / "broken" / "data.json").write_text("{", encoding="utf-8")
+
+    index = CardIdIndex(str(tmp_path / ".card_index.sqlite"))
+    assert not index.built
+    manifest_cards = [{"id": "abc", "name": "甲"}, {"id": "m", "name": "丙"}]
+    assert index.rebuild(str(resources_dir), template, manifest_cards) == 3
+    assert index.built and index.card_rel_dir_template == template
+    assert index.name_for_id("xyz") == "乙" and index.id_for_name("丙") == "m"
+    assert index.name_for_id("nope") is None
+
+    report = index.verify(str(resources_dir), template, manifest_cards)
+    assert (report["missing"], report["mismatched"], report["stale"]) == ([], [], [])
+
+    index.put("zzz", "丁")
+    _write_card(resources_dir, "cards/qq/qqq", "qqq", "戊")
+    _write_card(resources_dir, "cards/xy/xyz", "xyz", "己")
+    report = index.verify(str(resources_dir), template, manifest_cards)
+    assert (
+        report["missing"] == ["qqq"]
+        and report["mismatched"] == ["xyz"]
+        and report["stale"] == ["zzz"]
+    )
+    index.close()
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_card_index_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_choose_card_id_uses_index_lookup_for_collisions():
+    owners = {"yi": "一", "yi_" + hashlib.sha1("乙".encode("utf-8")).hexdigest()[:6]: "已"}
+    suffix = hashlib.sha1("乙".encode("utf-8")).hexdigest()[:6]
+
+    assert choose_card_id("一", "yi", owners.get) == "yi"
+    assert choose_card_id("乙", "yi", owners.get) == f"id_{suffix}"
+    assert choose_card_id("亿", "er", owners.get, reserved={"er": "二"}).startswith("er_")
+
+
+def test_historycards_builds_index_once_and_resolves_disk_collisions(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    # 磁盘上已有一张不在 manifest 里的卡片占用了 "乙" 的拼音 id
+    _write_card(resources_dir, "cards/yi", "yi", "已")
+    good = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+    rebuilds = []
+    original_rebuild = module.CardIdIndex.rebuild
+
+    def counting_rebuild(self, *a, **kw):
+        rebuilds.append(1)
+        return original_rebuild(self, *a, **kw)
+
+    monkeypatch.setattr(module.CardIdIndex, "rebuild", counting_rebuild)
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", lambda *_a: good)
+
+    args = ["--input", str(input_file), "--resources-dir", str(resources_dir), "--max-retries", "1"]
+    assert module.main(args) == 0
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    ids = {c["name"]: c["id"] for c in manifest["cards"]}
+    assert ids["甲"] == "jia"
+    assert ids["乙"].startswith("yi_")
+    assert len(rebuilds) == 1
+
+    # 续跑：索引已存在，不再扫描磁盘；校验命令确认索引与磁盘一致
+    assert module.main(args) == 0
+    assert len(rebuilds) == 1
+    assert module.main(["--resources-dir", str(resources_dir), "--verify-id-index"]) == 0
+
+    _write_card(resources_dir, "cards/bing", "bing", "丙")
+    assert module.main(["--resources-dir", str(resources_dir), "--verify-id-index"]) == 1
+    assert module.main(["--resources-dir", str(resources_dir), "--rebuild-id-index"]) == 0
+    assert module.main(["--resources-dir", str(resources_dir), "--verify-id-index"]) == 0
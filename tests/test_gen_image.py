@@ -0,0 +1,107 @@
+# codex: 2026-10-18 单测补充 gen_image 命令行退出码：没有可用格式或有卡片失败时返回 1
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import sys
+
+from PIL import Image
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_TOOLS_DIR = _REPO_ROOT / "history" / "tools"
+for _path in (_REPO_ROOT, _TOOLS_DIR):
+    if str(_path) not in sys.path:
+        sys.path.insert(0, str(_path))
+
+import gen_image  # noqa: E402
+
+
+def _card(root: Path, card_id: str, art: tuple | None = None) -> Path:
+    card_dir = root / card_id
+    card_dir.mkdir(parents=True)
+    data = {"id": card_id, "name": f"成语{card_id}", "year_estimate": 1}
+    (card_dir / "data.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    if art:
+        Image.new("RGBA", art, (120, 80, 40, 255)).save(card_dir / "image.png")
+    return card_dir
+
+
+def _images(card_dir: Path) -> dict:
+    return json.loads((card_dir / "data.json").read_text(encoding="utf-8"))["images"]
+
+
+def test_variants_recorded_and_unchanged_sources_skipped(tmp_path):
+    rendered = _card(tmp_path, "a")
+    ingested = _card(tmp_path, "b", art=(960, 1400))
+    summary = gen_image.run(cards_root=str(tmp_path), workers=1)
+    assert summary["encoded"] == 2 and summary["failed"] == 0
+    assert (rendered / "image.png").exists()
+
+    images = _images(ingested)
+    assert images["source"]["width"] == 960 and images["source"]["height"] == 1400
+    assert set(images["variants"]) == {"thumb.webp", "thumb.avif", "full.webp", "full.avif"}
+    full, thumb = images["variants"]["full.webp"], images["variants"]["thumb.avif"]
+    assert (full["width"], full["height"]) == (702, 1024) and thumb["height"] == 320
+    assert full["path"] == "cards/b/image.full.webp"
+    assert full["bytes"] == os.path.getsize(ingested / "image.full.webp")
+    with Image.open(ingested / "image.thumb.avif") as im:
+        assert im.size == (thumb["width"], thumb["height"])
+    # 小图只缩不放
+    assert _images(rendered)["variants"]["full.webp"]["width"] == 300
+
+    data_mtime = (ingested / "data.json").stat().st_mtime_ns
+    assert gen_image.run(cards_root=str(tmp_path), workers=1)["skipped"] == 2
+    assert (ingested / "data.json").stat().st_mtime_ns == data_mtime
+
+    # touch 源图：按哈希判定未变，只更新 stat
+    source = ingested / "image.png"
+    os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10**9))
+    summary = gen_image.run(cards_root=str(tmp_path), workers=1)
+    assert summary["touched"] == 1 and summary["encoded"] == 0
+
+    # 换图、换预设或删掉变体都会重新编码
+    Image.new("RGB", (400, 400), (0, 0, 0)).save(source)
+    assert gen_image.run(cards_root=str(tmp_path), workers=1)["encoded"] == 1
+    assert _images(ingested)["variants"]["full.webp"]["width"] == 400
+    (rendered / "image.thumb.webp").unlink()
+    assert gen_image.run(cards_root=str(tmp_path), workers=1)["encoded"] == 1
+    summary = gen_image.run(cards_root=str(tmp_path), workers=1, preset="low", formats=("webp",))
+    assert summary["encoded"] == 2
+    assert set(_images(ingested)["variants"]) == {"thumb.webp", "full.webp"}
+
+
+def test_parallel_run_and_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(gen_image, "PARALLEL_MIN_CARDS", 2)
+    for i in range(4):
+        _card(tmp_path, f"c{i}", art=(300, 500))
+    (tmp_path / "c3" / "image.png").write_bytes(b"not a png")
+    summary = gen_image.run(cards_root=str(tmp_path), workers=2)
+    assert summary["encoded"] == 3 and summary["failed"] == 1
+    assert summary["errors"][0]["id"] == "c3"
+
+
+def test_avif_is_skipped_when_pillow_cannot_encode_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(gen_image, "avif_supported", lambda: False)
+    card_dir = _card(tmp_path, "a", art=(300, 500))
+    summary = gen_image.run(cards_root=str(tmp_path), workers=1)
+    assert summary["encoded"] == 1 and summary["failed"] == 0
+    assert set(_images(card_dir)["variants"]) == {"thumb.webp", "full.webp"}
+    assert not (card_dir / "image.thumb.avif").exists()
+    assert gen_image.run(cards_root=str(tmp_path), workers=1, formats=("avif",)) is None
+
+    # 之后装上支持 AVIF 的 Pillow：格式集合变了，卡片重新编码补齐 AVIF
+    monkeypatch.setattr(gen_image, "avif_supported", lambda: True)
+    assert gen_image.run(cards_root=str(tmp_path), workers=1)["encoded"] == 1
+    assert "full.avif" in _images(card_dir)["variants"]
+
+
+def test_main_exit_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(gen_image.common, "CARDS_DIR", str(tmp_path))
+    monkeypatch.setattr(gen_image, "avif_supported", lambda: False)
+    _card(tmp_path, "a", art=(300, 500))
+    assert gen_image.main(["--workers", "1", "--formats", "avif"]) == 1  # 没有可编码的格式
+    assert gen_image.main(["--workers", "1"]) == 0
+    (tmp_path / "a" / "image.png").write_bytes(b"not a png")
+    assert gen_image.main(["--workers", "1", "--force"]) == 1
@@ -0,0 +1,149 @@
+# codex: 2026-10-18 gen_meta 单测折行到 ≤100
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+import signal
+import sys
+import threading
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_TOOLS_DIR = _REPO_ROOT / "history" / "tools"
+for _path in (_REPO_ROOT, _TOOLS_DIR):
+    if str(_path) not in sys.path:
+        sys.path.insert(0, str(_path))
+
+from history.card_engine import (  # noqa: E402
+    EngineOptions,
+    LLMBinding,
+    generate_cards,
+    run_cards,
+    sigint_stop,
+)
+import common  # noqa: E402
+import gen_meta  # noqa: E402
+
+_GOOD = (
+    '```json\n{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+    '\n```'
+)
+
+
+def _binding(call) -> LLMBinding:
+    return LLMBinding(client=object(), source="dummy", models=["model-x"], call=call)
+
+
+def test_generate_cards_runs_engine_on_idiom_list(tmp_path):
+    calls = {"n": 0}
+
+    def fake_generate(_client, _llm_source, _prompt, _model_name, _logger):
+        calls["n"] += 1
+        return "not json" if calls["n"] == 1 else _GOOD  # 第一次坏 JSON 走重试
+
+    resources = tmp_path / "resources"
+    options = EngineOptions(
+        resources_dir=str(resources),
+        workers=2,
+        retry_wait_base=0,
+        progress_file=str(tmp_path / "progress.json"),
+    )
+    rc, summary = generate_cards(
+        ["# header", "卧薪尝胆", "", "完璧归赵", "负荆请罪"], options, _binding(fake_generate)
+    )
+    assert rc == 0
+    assert summary["selected"] == 3 and summary["processed"] == 3 and summary["retries"] == 1
+    assert summary["args"]["workers"] == 2 and summary["args"]["input"] == "<idioms>"
+    assert summary == json.loads(
+        (resources / "historycards_summary.json").read_text(encoding="utf-8")
+    )
+    manifest = json.loads((resources / "manifest.json").read_text(encoding="utf-8"))
+    assert sorted(card["name"] for card in manifest["cards"]) == [
+        "卧薪尝胆",
+        "完璧归赵",
+        "负荆请罪",
+    ]
+
+    # 再跑一次：已生成的全部跳过，LLM 工厂不会被调用
+    def _no_llm():
+        raise AssertionError("LLM binding should not be created")
+
+    rc, summary = generate_cards(["卧薪尝胆"], EngineOptions(resources_dir=str(resources)), _no_llm)
+    assert rc == 0 and summary["skipped"] == 1 and calls["n"] == 4
+
+    # 空选择：不运行引擎，汇总为空
+    assert run_cards([], EngineOptions(resources_dir=str(resources)), _no_llm) == (0, {})
+
+
+def test_engine_stop_event_and_sigint_scope(tmp_path):
+    stop = threading.Event()
+    stop.set()
+    rc, summary = generate_cards(
+        ["甲", "乙"],
+        EngineOptions(resources_dir=str(tmp_path)),
+        _binding(lambda *_a: _GOOD),
+        stop=stop,
+    )
+    assert rc == 0 and summary["processed"] == 0
+
+    # 处理器只在 with 块内生效，退出后恢复原处理器；不修改任何模块级状态
+    previous = signal.getsignal(signal.SIGINT)
+    with sigint_stop(threading.Event()) as event:
+        assert signal.getsignal(signal.SIGINT) is not previous
+        signal.getsignal(signal.SIGINT)(signal.SIGINT, None)
+        assert event.is_set()
+    assert signal.getsignal(signal.SIGINT) is previous
+
+    # 非主线程：不安装处理器（signal.signal 在子线程会抛 ValueError）
+    errors = []
+
+    def _in_thread():
+        try:
+            with sigint_stop(threading.Event()):
+                pass
+        except ValueError as e:  # pragma: no cover
+            errors.append(e)
+
+    t = threading.Thread(target=_in_thread)
+    t.start()
+    t.join()
+    assert errors == []
+
+
+def test_gen_meta_is_thin_front_end(tmp_path, monkeypatch):
+    resources = tmp_path / "resources"
+    monkeypatch.setattr(common, "RESOURCES_DIR", str(resources))
+    monkeypatch.setattr(gen_meta, "PROGRESS_FILE", str(tmp_path / "gen_meta_progress.json"))
+    idioms = tmp_path / "idioms.txt"
+    idioms.write_text("桃园结义\n草船借箭\n", encoding="utf-8")
+
+    llm = _binding(lambda *_args: _GOOD)
+    assert (
+        gen_meta.main(["--input", str(idioms), "--workers", "2", "--max-retries", "1"], llm=llm)
+        == 0
+    )
+    data = json.loads(
+        (resources / "cards" / "taoyuanjieyi" / "data.json").read_text(encoding="utf-8")
+    )
+    assert data["name"] == "桃园结义" and data["popular"] == 5
+    assert (
+        json.loads((tmp_path / "gen_meta_progress.json").read_text(encoding="utf-8"))["next_index"]
+        == 3
+    )
+    summary = json.loads((resources / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["args"]["max_retries"] == 1 and summary["args"]["workers"] == 2
+
+    # --resume：从进度文件的 next_index 开始，全部已完成时不选任何条目
+    assert gen_meta.main(["--input", str(idioms), "--resume"], llm=llm) == 0
+
+    assert gen_meta.main(["--input", str(tmp_path / "missing.txt")]) == 1
+
+
+def test_gen_meta_logs_once_and_verbose_sets_levels(tmp_path):
+    root_handlers = list(logging.getLogger().handlers)
+    assert gen_meta.main(["--input", str(tmp_path / "missing.txt"), "--verbose"]) == 1
+    assert logging.getLogger().handlers == root_handlers  # 只有 GenMeta 自己的 handler
+    assert len(gen_meta.logger.handlers) == 1
+    assert gen_meta.logger.level == logging.getLogger("historycards").level == logging.DEBUG
+    assert gen_meta.main(["--input", str(tmp_path / "missing.txt")]) == 1
+    assert gen_meta.logger.level == logging.getLogger("historycards").level == logging.INFO
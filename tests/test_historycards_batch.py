@@ -0,0 +1,178 @@
+# codex: 2026-10-18 批量模式单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import card_batch  # noqa: E402
+from utils.llm_loadtest import mock_config  # noqa: E402
+from utils.llm_mockserver import MockLLMServer, MockScenario  # noqa: E402
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_batch_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [
+        json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()
+    ]
+
+
+@pytest.fixture
+def server():
+    server = MockLLMServer()
+    yield server
+    server.close()
+
+
+def _use_mock(monkeypatch, module, server) -> None:
+    monkeypatch.setattr(
+        module, "load_llm_config", lambda _path: mock_config(server.url, model="model-b")
+    )
+
+
+def _args(input_file: Path, resources_dir: Path) -> list[str]:
+    return [
+        "--input",
+        str(input_file),
+        "--resources-dir",
+        str(resources_dir),
+        "--max-retries",
+        "1",
+        "--retry-wait-base",
+        "0",
+        "--retry-wait-max",
+        "0",
+        "--batch",
+        "--batch-poll-interval",
+        "0",
+    ]
+
+
+def test_batch_commits_results_in_order_and_falls_back_for_failures(tmp_path, monkeypatch, server):
+    module = _load_historycards_module()
+    _use_mock(monkeypatch, module, server)
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n甲\n丙\n丁\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    # 批内按提交顺序：甲 ok、乙卡片 JSON 被截断、丙 503、丁 ok；两条失败改走交互调用（之后全部 ok）
+    server.set_scenario(MockScenario(script=["ok", "bad_content", "500", "ok"], batch_polls=2))
+    rc = module.main(_args(input_file, resources_dir) + ["--batch-size", "2"])
+    assert rc == 0
+
+    # 重复的“甲”不进入批次；4 个请求按 --batch-size 2 拆成两个批次
+    assert len(server.batch_store.batches) == 2
+    submitted = [
+        json.loads(line)
+        for batch in server.batch_store.batches.values()
+        for line in server.batch_store.content(batch["input_file_id"]).decode("utf-8").splitlines()
+    ]
+    assert [r["custom_id"] for r in submitted] == ["1", "2", "4", "5"]
+    assert {r["body"]["model"] for r in submitted} == {"model-b"}
+    assert server.stats()["by_format"] == {"batch": 4, "openai": 2}
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["idx"] for r in runlog] == [1, 2, 3, 4, 5]
+    assert [r["status"] for r in runlog] == ["ok", "ok", "skipped", "ok", "ok"]
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["甲", "乙", "丙", "丁"]
+
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["batch"]["fallbacks"] == 2
+    assert summary["batch"]["results"] == 4
+
+    states = list((resources_dir / "batches").glob("*.state.json"))
+    assert len(states) == 1
+    assert json.loads(states[0].read_text(encoding="utf-8"))["committed"] is True
+
+
+def test_batch_resume_continues_polling_from_state_file(tmp_path, monkeypatch, server):
+    module = _load_historycards_module()
+    _use_mock(monkeypatch, module, server)
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("春\n夏\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    # 第一次：轮询超时即退出，只保存状态，不写卡片
+    server.set_scenario(MockScenario(batch_polls=10**9))
+    rc = module.main(_args(input_file, resources_dir) + ["--batch-timeout", "0.01"])
+    assert rc == 0
+    assert not (resources_dir / "cards" / "chun" / "data.json").exists()
+    assert _read_jsonl(resources_dir / "historycards_runlog.jsonl") == []
+    state_file = next((resources_dir / "batches").glob("*.state.json"))
+
+    server.set_scenario(MockScenario(batch_polls=1))
+    rc = module.main(_args(input_file, resources_dir) + ["--batch-resume", state_file.name])
+    assert rc == 0
+    assert len(server.batch_store.batches) == 1
+    assert server.stats()["by_format"] == {"batch": 2}
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["春", "夏"]
+    assert json.loads(state_file.read_text(encoding="utf-8"))["committed"] is True
+
+
+def test_batch_plan_is_saved_before_submit_and_resume_submits_missing_chunks(
+    tmp_path, monkeypatch, server
+):
+    module = _load_historycards_module()
+    _use_mock(monkeypatch, module, server)
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("东\n南\n西\n北\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    # 第二个分块提交时进程“崩溃”
+    real_submit = card_batch.submit_batch
+    calls = []
+
+    def flaky_submit(*args, **kwargs):
+        calls.append(args[2])
+        if len(calls) == 2:
+            raise ConnectionError("network down")
+        return real_submit(*args, **kwargs)
+
+    monkeypatch.setattr(card_batch, "submit_batch", flaky_submit)
+    with pytest.raises(ConnectionError):
+        module.main(_args(input_file, resources_dir) + ["--batch-size", "3"])
+    state_file = next((resources_dir / "batches").glob("*.state.json"))
+    state = json.loads(state_file.read_text(encoding="utf-8"))
+    assert [b["idxs"] for b in state["batches"]] == [[1, 2, 3], [4]]
+    assert state["batches"][0]["id"] and state["batches"][1]["id"] is None
+    assert all(Path(b["input_file"]).exists() for b in state["batches"])
+
+    rc = module.main(_args(input_file, resources_dir) + ["--batch-resume", state_file.name])
+    assert rc == 0
+    assert calls[-1] == state["batches"][1]["input_file"] and len(calls) == 3
+    assert len(server.batch_store.batches) == 2
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["东", "南", "西", "北"]
+
+
+def test_batch_rejects_stop_on_failure(tmp_path, monkeypatch, server):
+    module = _load_historycards_module()
+    _use_mock(monkeypatch, module, server)
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("春\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="--stop-on-failure"):
+        module.main(_args(input_file, tmp_path / "resources") + ["--stop-on-failure"])
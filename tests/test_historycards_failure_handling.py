@@ -31,7 +31,6 @@ def _read_jsonl(path: Path) -> list[dict]:
 
 
 def _install_llm_fakes(monkeypatch, module, *, generate_impl):
-    monkeypatch.setattr(module, "_install_sigint_handler", lambda: None)
     monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
     monkeypatch.setattr(module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"]))
     monkeypatch.setattr(module, "generate_llm_response_single", generate_impl)
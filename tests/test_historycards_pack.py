@@ -0,0 +1,197 @@
+# codex: 2026-10-18 historycards 打包单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import re
+import sys
+
+import pytest
+
+
+def _load_historycards_module():
+    repo_root = Path(__file__).resolve().parents[1]
+    module_path = repo_root / "history" / "historycards.py"
+    module_name = "historycards_for_pack_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [
+        json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()
+    ]
+
+
+def _card(name: str) -> dict:
+    return {
+        "name": name,
+        "period": "汉",
+        "year_estimate": 1,
+        "meaning": "x",
+        "story": "y",
+        "prompt": "p",
+        "popular": 5,
+    }
+
+
+def _names_in_prompt(prompt: str) -> list[str]:
+    if "针对成语 “" in prompt:
+        return [prompt.split("针对成语 “", 1)[1].split("”", 1)[0]]
+    return re.findall(r"^\d+\. “(.+?)”（id: ", prompt, flags=re.MULTILINE)
+
+
+def _install_llm_fakes(monkeypatch, module, generate_impl):
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", generate_impl)
+
+
+def _args(input_file: Path, resources_dir: Path) -> list[str]:
+    return [
+        "--input",
+        str(input_file),
+        "--resources-dir",
+        str(resources_dir),
+        "--max-retries",
+        "1",
+        "--retry-wait-base",
+        "0",
+        "--retry-wait-max",
+        "0",
+        "--continue-on-failure",
+    ]
+
+
+def test_pack_maps_by_name_and_retries_missing_or_invalid_items(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n丁\n戊\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls: list[list[str]] = []
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        names = _names_in_prompt(prompt)
+        calls.append(names)
+        if len(names) == 1:
+            if names[0] == "丁":
+                return "still broken"
+            return json.dumps(_card(names[0]), ensure_ascii=False)
+        items = []
+        for name in reversed(names):  # 打乱顺序：必须按 name 对回
+            if name == "乙":
+                continue  # 缺失
+            card = _card(name)
+            if name == "丁":
+                card.pop("story")  # 不合法
+            items.append(card)
+        return "```json\n" + json.dumps(items, ensure_ascii=False) + "\n```"
+
+    _install_llm_fakes(monkeypatch, module, fake_generate)
+
+    rc = module.main(_args(input_file, resources_dir) + ["--pack", "3"])
+    assert rc == 2
+
+    # 第一组 [甲,乙,丙]：乙缺失 → 单条重试；第二组 [丁,戊]：丁不合法 → 单条重试（仍失败）
+    assert calls == [["甲", "乙", "丙"], ["乙"], ["丁", "戊"], ["丁"]]
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["idx"] for r in runlog] == [1, 2, 3, 4, 5]
+    assert [r["status"] for r in runlog] == ["ok", "ok", "ok", "failed", "ok"]
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["甲", "乙", "丙", "戊"]
+    assert all(c["id"] and c["image_path"].endswith("image.png") for c in manifest["cards"])
+
+    errors = _read_jsonl(resources_dir / "cards" / "_errors.jsonl")
+    assert [e["idiom"] for e in errors] == ["丁"]
+
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["pack"] == {"calls": 2, "items_ok": 3, "items_retried": 2}
+
+
+def test_pack_whole_request_failure_splits_in_halves(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    idioms = ["一", "二", "三", "四"]
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("\n".join(idioms) + "\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls: list[list[str]] = []
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        names = _names_in_prompt(prompt)
+        calls.append(names)
+        if len(names) > 2:
+            return "not an array"
+        return (
+            json.dumps([_card(n) for n in names], ensure_ascii=False)
+            if len(names) > 1
+            else json.dumps(_card(names[0]))
+        )
+
+    _install_llm_fakes(monkeypatch, module, fake_generate)
+
+    rc = module.main(_args(input_file, resources_dir) + ["--pack", "4", "--workers", "2"])
+    assert rc == 0
+    assert calls[0] == idioms
+    assert sorted(map(tuple, calls[1:])) == [("一", "二"), ("三", "四")]
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == idioms
+
+
+def test_pack_caches_the_packed_prompt_and_counts_each_lookup_once(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls: list[list[str]] = []
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        names = _names_in_prompt(prompt)
+        calls.append(names)
+        if len(names) == 1:
+            return json.dumps(_card(names[0]), ensure_ascii=False)
+        return json.dumps([_card(n) for n in names if n != "乙"], ensure_ascii=False)
+
+    _install_llm_fakes(monkeypatch, module, fake_generate)
+    base = _args(input_file, resources_dir) + ["--pack", "3"]
+
+    # 合并 prompt 与单条重试的 prompt 各查一次、各写一次
+    assert module.main(base + ["--cache-mode", "readwrite"]) == 0
+    assert calls == [["甲", "乙", "丙"], ["乙"]]
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["cache"] == {"hits": 0, "misses": 2, "writes": 2}
+
+    # 回放按同样的拆分命中，不调用模型
+    assert module.main(base + ["--cache-mode", "replay", "--force"]) == 0
+    assert len(calls) == 2
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["cache"] == {"hits": 2, "misses": 0, "writes": 0}
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["cached"] for r in runlog[3:]] == [True, True, True]
+
+
+def test_pack_rejects_stream(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+    _install_llm_fakes(monkeypatch, module, lambda *_a: "")
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="--stream"):
+        module.main(_args(input_file, tmp_path / "resources") + ["--pack", "2", "--stream"])
@@ -0,0 +1,107 @@
+# codex: 2026-10-18 跳过扫描单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import card_engine  # noqa: E402
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_skip_scan_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_resume_fast_forwards_completed_runs_in_bulk(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n丁\n戊\n己\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    good = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+    generated = []
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        generated.append(prompt)
+        return good
+
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", fake_generate)
+
+    common = [
+        "--input",
+        str(input_file),
+        "--resources-dir",
+        str(resources_dir),
+        "--max-retries",
+        "1",
+        "--card-rel-dir-template",
+        "cards/{shard2}/{id}",
+        "--manifest-store",
+        "json",
+    ]
+    assert module.main(common + ["--range", "1-3"]) == 0
+    assert module.main(common + ["--range", "5-5"]) == 0
+    assert len(generated) == 4
+    (resources_dir / "historycards_runlog.jsonl").unlink()
+
+    # manifest 里没有“戊”：只有磁盘上的 data.json，预扫描也能认出
+    manifest_file = resources_dir / "manifest.json"
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    manifest["cards"] = [c for c in manifest["cards"] if c["name"] != "戊"]
+    manifest_file.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+
+    slugified = []
+    original_slugify = card_engine.slugify_id
+    monkeypatch.setattr(
+        card_engine, "slugify_id", lambda idiom: slugified.append(idiom) or original_slugify(idiom)
+    )
+
+    assert module.main(common + ["--range", "1-6"]) == 0
+    assert len(generated) == 6
+    assert slugified == ["丁", "己"]  # 已完成的条目不再解析拼音 id
+
+    runlog = [
+        json.loads(line)
+        for line in (resources_dir / "historycards_runlog.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    assert [(r["status"], r["idx"], r.get("count")) for r in runlog] == [
+        ("skipped", 1, 3),
+        ("ok", 4, None),
+        ("skipped", 5, 1),
+        ("ok", 6, None),
+    ]
+    assert runlog[0]["idx_end"] == 3
+
+    progress = json.loads(
+        (resources_dir / ".historycards_progress.json").read_text(encoding="utf-8")
+    )
+    assert progress["next_index"] == 7
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["skipped"] == 4 and summary["processed"] == 2
+
+    # 全部已完成的续跑检查：不初始化 LLM 客户端
+    def _no_llm(*_a):
+        raise AssertionError("LLM client should not be initialized")
+
+    monkeypatch.setattr(module, "load_llm_config", _no_llm)
+    monkeypatch.setattr(module, "setup_llm_client", _no_llm)
+    assert module.main(common + ["--range", "1-6"]) == 0
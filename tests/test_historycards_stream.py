@@ -0,0 +1,136 @@
+# codex: 2026-10-18 流式校验单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history.card_prompts import CardStreamValidator  # noqa: E402
+from utils.llm_api import StreamAborted  # noqa: E402
+
+
+def _load_historycards_module():
+    repo_root = Path(__file__).resolve().parents[1]
+    module_path = repo_root / "history" / "historycards.py"
+    module_name = "historycards_for_stream_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [
+        json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()
+    ]
+
+
+_GOOD = (
+    '```json\n{"id":"x","name":"甲","period":"汉朝","year_estimate":1,'
+    '"meaning":"比喻做事多此一举","story":"楚国有人比赛画蛇，先画完的人又给蛇添上脚，结果输了酒。",'
+    '"prompt":"A trading card design, 画蛇","popular":5}\n```'
+)
+
+
+def _feed_all(text: str, step: int = 3) -> None:
+    validator = CardStreamValidator()
+    for i in range(0, len(text), step):
+        validator.feed(text[i : i + step])
+
+
+def test_validator_accepts_valid_card_in_small_chunks():
+    _feed_all(_GOOD)
+    _feed_all('{"period":"\\u6c49","meaning":"比喻\\"多余\\"","story":"中文"}')
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '[{"period":"汉"}]',
+        "Sorry, I cannot help with that request. " * 10,
+        '{"period":"Han Dynasty","meaning":"多此一举"}',
+        '{"id":"x","story":"Once upon a time in ancient China there was a man '
+        'who painted a snake 画蛇"}',
+    ],
+)
+def test_validator_aborts_when_output_cannot_be_a_card(text):
+    with pytest.raises(StreamAborted):
+        _feed_all(text)
+
+
+def test_stream_mode_aborts_bad_generation_retries_and_records_ttft(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls = {"n": 0, "emitted_after_abort": 0}
+
+    def fake_stream(_client, _llm_source, _prompt, _model_name, _logger, on_delta=None):
+        calls["n"] += 1
+        text = (
+            '{"period":"The Han dynasty period of ancient China", "story":"..."}'
+            if calls["n"] == 1
+            else _GOOD
+        )
+        sent = []
+        try:
+            for i in range(0, len(text), 4):
+                sent.append(text[i : i + 4])
+                on_delta(text[i : i + 4])
+        except StreamAborted as e:
+            calls["emitted_after_abort"] = len(text) - len("".join(sent))
+            e.partial_text = "".join(sent)
+            raise
+        return text
+
+    def fail_single(*_a, **_k):
+        raise AssertionError("non-stream path should not be used")
+
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", fail_single)
+    monkeypatch.setattr(module, "generate_llm_response_stream", fake_stream)
+
+    rc = module.main(
+        [
+            "--input",
+            str(input_file),
+            "--resources-dir",
+            str(resources_dir),
+            "--max-retries",
+            "2",
+            "--retry-wait-base",
+            "0",
+            "--retry-wait-max",
+            "0",
+            "--stream",
+        ]
+    )
+    assert rc == 0
+    assert calls["n"] == 2
+    assert calls["emitted_after_abort"] > 0  # 第一次生成在结束前就被中止
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert runlog[0]["status"] == "ok"
+    assert runlog[0]["ttft_s"] >= 0
+
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["stream"]["aborts"] == 1
+    assert summary["stream"]["ttft"]["count"] == 2
+    assert summary["args"]["stream"] is True
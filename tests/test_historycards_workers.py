@@ -0,0 +1,166 @@
+# codex: 2026-10-18 并发 worker 单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+import threading
+import time
+
+
+def _load_historycards_module():
+    repo_root = Path(__file__).resolve().parents[1]
+    module_path = repo_root / "history" / "historycards.py"
+    module_name = "historycards_for_worker_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [
+        json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()
+    ]
+
+
+def _install_llm_fakes(monkeypatch, module, *, generate_impl):
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", generate_impl)
+
+
+_GOOD = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+
+def _idiom_from_prompt(prompt: str) -> str:
+    return prompt.split("针对成语 “", 1)[1].split("”", 1)[0]
+
+
+def _base_args(input_file: Path, resources_dir: Path) -> list[str]:
+    return [
+        "--input",
+        str(input_file),
+        "--resources-dir",
+        str(resources_dir),
+        "--max-retries",
+        "1",
+        "--retry-wait-base",
+        "0",
+        "--retry-wait-max",
+        "0",
+    ]
+
+
+def test_workers_commit_in_index_order_when_finishing_out_of_order(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    idioms = ["甲", "乙", "丙", "丁", "戊", "己"]
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("\n".join(idioms) + "\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    # 越靠前的条目越慢，迫使后面的条目先完成
+    delays = {name: 0.05 * (len(idioms) - i) for i, name in enumerate(idioms)}
+    lock = threading.Lock()
+    active = {"now": 0, "peak": 0}
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        idiom = _idiom_from_prompt(prompt)
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        time.sleep(delays[idiom])
+        with lock:
+            active["now"] -= 1
+        if idiom == "丙":
+            return "not json"
+        return _GOOD
+
+    _install_llm_fakes(monkeypatch, module, generate_impl=fake_generate)
+
+    rc = module.main(_base_args(input_file, resources_dir) + ["--workers", "3"])
+    assert rc == 2
+    assert active["peak"] > 1
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["idx"] for r in runlog] == [1, 2, 3, 4, 5, 6]
+    assert [r["status"] for r in runlog] == ["ok", "ok", "failed", "ok", "ok", "ok"]
+
+    errors = _read_jsonl(resources_dir / "cards" / "_errors.jsonl")
+    assert [e["idiom"] for e in errors] == ["丙"]
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["甲", "乙", "丁", "戊", "己"]
+
+    progress = json.loads(
+        (resources_dir / ".historycards_progress.json").read_text(encoding="utf-8")
+    )
+    assert progress["next_index"] == 7
+
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["processed"] == 5
+    assert summary["attempts"] == 6
+    assert summary["args"]["workers"] == 3
+
+
+def test_workers_stop_on_failure_keeps_next_index_at_failed_item(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("一\n二\n三\n四\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        idiom = _idiom_from_prompt(prompt)
+        if idiom == "二":
+            time.sleep(0.1)
+            return "broken"
+        return _GOOD
+
+    _install_llm_fakes(monkeypatch, module, generate_impl=fake_generate)
+
+    rc = module.main(
+        _base_args(input_file, resources_dir) + ["--workers", "4", "--stop-on-failure"]
+    )
+    assert rc == 2
+
+    progress = json.loads(
+        (resources_dir / ".historycards_progress.json").read_text(encoding="utf-8")
+    )
+    assert progress["next_index"] == 2
+    assert progress["last_status"] == "failed"
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["status"] for r in runlog] == ["ok", "failed"]
+
+
+def test_workers_duplicate_idiom_is_skipped_not_regenerated(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("同\n同\n异\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls: list[str] = []
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        calls.append(_idiom_from_prompt(prompt))
+        return _GOOD
+
+    _install_llm_fakes(monkeypatch, module, generate_impl=fake_generate)
+
+    rc = module.main(_base_args(input_file, resources_dir) + ["--workers", "4"])
+    assert rc == 0
+    assert sorted(calls) == ["同", "异"]
+
+    runlog = _read_jsonl(resources_dir / "historycards_runlog.jsonl")
+    assert [r["status"] for r in runlog] == ["ok", "skipped", "ok"]
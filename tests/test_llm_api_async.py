@@ -0,0 +1,76 @@
+# codex: 2026-10-18 异步客户端单测折行到 ≤100
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_api, llm_async  # noqa: E402
+
+
+def test_thread_pool_path_respects_max_concurrency(monkeypatch):
+    lock = threading.Lock()
+    active = {"now": 0, "peak": 0}
+
+    def fake_single(_client, _llm_source, prompt, _model_name, _logger=None):
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        time.sleep(0.02)
+        with lock:
+            active["now"] -= 1
+        return f"echo:{prompt}"
+
+    monkeypatch.setattr(llm_async, "generate_llm_response_single", fake_single)
+    client = llm_api.AsyncLLMClient("zhipuai", sync_client={}, max_concurrency=3)
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(
+                    llm_api.agenerate_llm_response_single(client, "zhipuai", str(i), "m")
+                    for i in range(12)
+                )
+            )
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(run())
+    assert results == [f"echo:{i}" for i in range(12)]
+    assert active["peak"] == 3
+
+
+def test_native_async_client_and_fallback():
+    calls: list[str] = []
+
+    async def create(model, messages):
+        calls.append(model)
+        if model == "bad":
+            raise RuntimeError("429 Too Many Requests")
+        await asyncio.sleep(0)
+        text = f" {model}:{messages[0]['content']} "
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    fake_async = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    client = llm_api.AsyncLLMClient(
+        "openai", sync_client=None, async_client=fake_async, max_concurrency=2
+    )
+
+    text = asyncio.run(llm_api.agenerate_llm_response(client, "openai", "hi", ["bad", "good"]))
+    assert text == "good:hi"
+    assert calls == ["bad", "good"]
+
+    with pytest.raises(Exception, match="All fallback models failed"):
+        asyncio.run(llm_api.agenerate_llm_response(client, "openai", "hi", ["bad"]))
@@ -0,0 +1,118 @@
+# codex: 2026-10-18 流式调用单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_api  # noqa: E402
+
+
+class _FakeStream:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.closed = False
+
+    def __iter__(self):
+        for d in self.deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=d))])
+
+    def close(self):
+        self.closed = True
+
+
+def _openai_like(stream, seen_kwargs):
+    def create(**kwargs):
+        seen_kwargs.update(kwargs)
+        return stream
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_openai_compatible_stream_emits_deltas_and_returns_text():
+    stream = _FakeStream(["  {\"a\"", ": 1", None, "} "])
+    kwargs: dict = {}
+    deltas: list[str] = []
+    text = llm_api.generate_llm_response_stream(
+        _openai_like(stream, kwargs), "openai", "hi", "m", on_delta=deltas.append
+    )
+    assert text == '{"a": 1}'
+    assert deltas == ['  {"a"', ": 1", "} "]
+    assert kwargs["stream"] is True and kwargs["model"] == "m"
+    assert stream.closed
+
+
+def test_stream_abort_closes_connection_and_carries_partial_text():
+    stream = _FakeStream(["[", "1,", "2]"])
+
+    def on_delta(delta):
+        if delta == "1,":
+            raise llm_api.StreamAborted("bad")
+
+    with pytest.raises(llm_api.StreamAborted) as info:
+        llm_api.generate_llm_response_stream(
+            _openai_like(stream, {}), "deepseek", "hi", "m", on_delta=on_delta
+        )
+    assert info.value.partial_text == "[1,"
+    assert stream.closed
+
+
+class _FakeSSEResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.closed = False
+
+    def raise_for_status(self):
+        return None
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+
+def test_gemini_web_stream_uses_sse_endpoint():
+    events = [
+        {"candidates": [{"content": {"parts": [{"text": "你好"}]}}]},
+        {
+            "candidates": [{"content": {"parts": [{"text": "世界"}]}}],
+            "usageMetadata": {"totalTokenCount": 3},
+        },
+    ]
+    response = _FakeSSEResponse(
+        ["data: " + json.dumps(e, ensure_ascii=False) for e in events] + ["", ": keep-alive"]
+    )
+    calls: list[dict] = []
+
+    def post(url, **kwargs):
+        calls.append({"url": url, **kwargs})
+        return response
+
+    client = {
+        "session": SimpleNamespace(post=post),
+        "base_url": "https://example.com",
+        "api_key": "k",
+        "auth_mode": "header",
+    }
+    deltas: list[str] = []
+    text = llm_api.generate_llm_response_stream(
+        client, "geminiweb", "hi", "gemini-x", on_delta=deltas.append
+    )
+
+    assert text == "你好世界"
+    assert deltas == ["你好", "世界"]
+    assert calls[0]["url"] == "https://example.com/v1beta/models/gemini-x:streamGenerateContent"
+    assert calls[0]["params"] == {"alt": "sse"}
+    assert calls[0]["stream"] is True
+    assert response.closed
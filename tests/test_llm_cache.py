@@ -0,0 +1,126 @@
+# codex: 2026-10-18 响应缓存单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_cache  # noqa: E402
+
+
+def test_lookup_follows_model_order_and_counts_once(tmp_path):
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "c.sqlite"))
+    cache.put("zhipuai", "m2", "prompt", "from-m2", temperature=0.6)
+    assert cache.lookup("zhipuai", ["m1", "m2"], "prompt", 0.6) == ("m2", "from-m2")
+    assert cache.lookup("zhipuai", ["m1", "m2"], "prompt", 0.9) == (
+        None,
+        None,
+    )  # temperature 是 key 的一部分
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"]) == (1, 1, 1)
+    cache.close()
+
+
+def test_readonly_does_not_write_and_replay_raises_on_miss(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    llm_cache.LLMResponseCache(path).put("s", "m", "p", "text")
+
+    readonly = llm_cache.LLMResponseCache(path, mode="readonly")
+    assert readonly.put("s", "m", "other", "x") is False
+    assert readonly.get("s", "m", "p") == "text"
+
+    replay = llm_cache.LLMResponseCache(path, mode="replay")
+    assert replay.get("s", "m", "p") == "text"
+    with pytest.raises(llm_cache.CacheMissError):
+        replay.lookup("s", ["m"], "other")
+
+
+def test_eviction_by_size_keeps_recently_used(tmp_path, monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock["now"])
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "c.sqlite"), max_bytes=25, evict_every=1000)
+    for i in range(3):
+        clock["now"] += 1
+        cache.put("s", "m", f"p{i}", "x" * 10)
+    clock["now"] += 1
+    assert cache.get("s", "m", "p0") is not None  # p0 最近被访问，p1 变成最久未用
+    assert cache.evict() == 1
+    assert cache.get("s", "m", "p1") is None
+    assert cache.get("s", "m", "p0") is not None
+
+
+def test_eviction_by_age(tmp_path, monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock["now"])
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "c.sqlite"), max_age_s=60)
+    cache.put("s", "m", "old", "x")
+    clock["now"] += 120
+    assert cache.get("s", "m", "old") is None
+    assert cache.evict() == 1
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_cache_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_historycards_force_rerun_is_served_from_cache(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+
+    calls = {"n": 0}
+
+    def fake_generate(_client, _llm_source, _prompt, _model_name, _logger):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            return "not json"  # 无效回复不会进入缓存
+        return (
+            '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+        )
+
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", fake_generate)
+
+    base = [
+        "--input",
+        str(input_file),
+        "--resources-dir",
+        str(resources_dir),
+        "--retry-wait-base",
+        "0",
+    ]
+    assert module.main(base + ["--cache-mode", "readwrite"]) == 0
+    assert calls["n"] == 3
+
+    assert module.main(base + ["--cache-mode", "replay", "--force"]) == 0
+    assert calls["n"] == 3
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["cache"] == {"hits": 2, "misses": 0, "writes": 0}
+    assert summary["attempts"] == 0
+
+    runlog = [
+        json.loads(x)
+        for x in (resources_dir / "historycards_runlog.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    assert [r["cached"] for r in runlog if r["status"] == "ok"] == [False, False, True, True]
@@ -0,0 +1,191 @@
+# codex: 2026-10-18 单测覆盖多 key 池；并发上限直接从 llm_client 取，不经 llm_api 再导出
+
+from __future__ import annotations
+
+import configparser
+from pathlib import Path
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_api, llm_client, llm_keypool, llm_ratelimit  # noqa: E402
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class _HTTP429(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: str | None = None) -> None:
+        super().__init__("Too Many Requests")
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        self.response = type("Resp", (), {"headers": headers, "status_code": 429})()
+
+
+def _pool(names, clock, **kwargs):
+    return llm_keypool.KeyPool(
+        "openai", [(n, n) for n in names], clock=clock, sleep=clock.sleep, **kwargs
+    )
+
+
+def test_round_robin_and_429_failover_quarantines_key():
+    clock = _FakeClock()
+    pool = _pool(["a", "b", "c"], clock)
+    assert [pool.call(lambda c: c) for _ in range(6)] == ["a", "b", "c", "a", "b", "c"]
+
+    def flaky(client):
+        if client == "a":
+            raise _HTTP429(retry_after="30")
+        return client
+
+    # a 返回 429：隔离 30 秒，请求立即换到 b
+    assert pool.call(flaky) == "b"
+    assert [pool.call(lambda c: c) for _ in range(4)] == ["c", "b", "c", "b"]
+    clock.now += 31
+    assert [pool.call(lambda c: c) for _ in range(2)] == ["c", "a"]
+
+    snap = pool.snapshot()["keys"]
+    assert snap["a"]["throttled"] == 1 and snap["a"]["quarantines"] == 1
+    assert sum(s["calls"] for s in snap.values()) == 14
+
+
+def test_all_keys_throttled_raises_then_waits_for_release():
+    clock = _FakeClock()
+    pool = _pool(["a", "b"], clock, quarantine_s=10)
+
+    def always_429(_client):
+        raise _HTTP429()
+
+    with pytest.raises(_HTTP429):
+        pool.call(always_429)
+    assert pool.available() == 0
+    # 全部隔离：acquire 等到最早解除隔离的 key
+    assert pool.call(lambda c: c) == "a"
+    assert clock.now == pytest.approx(10)
+
+
+def test_least_loaded_and_consecutive_failure_quarantine():
+    clock = _FakeClock()
+    pool = _pool(
+        ["a", "b", "c"], clock, strategy="least_loaded", failure_threshold=2, quarantine_s=5
+    )
+    first, second = pool.acquire(), pool.acquire()
+    assert (first.label, second.label) == ("a", "b")
+    pool.release(first, ok=True)
+    assert pool.acquire().label == "c"  # c 与 a 都空闲，按轮询顺序取 c
+    assert pool.acquire().label == "a"
+
+    def broken(client):
+        if client == "b":
+            raise RuntimeError("boom")
+        return client
+
+    pool = _pool(["a", "b"], clock, failure_threshold=2, quarantine_s=5)
+    pool.call(lambda c: c)
+    with pytest.raises(RuntimeError):
+        pool.call(broken)  # 普通错误不换 key 重发
+    pool.call(lambda c: c)
+    with pytest.raises(RuntimeError):
+        pool.call(broken)
+    assert pool.snapshot()["keys"]["b"]["quarantines"] == 1
+    assert [pool.call(lambda c: c) for _ in range(3)] == ["a", "a", "a"]
+
+
+def test_setup_llm_client_builds_pool_and_scales_rate_limits(monkeypatch):
+    created = []
+
+    class FakeOpenAI:
+        def __init__(self, api_key, base_url):
+            created.append((api_key, base_url))
+            self.api_key = api_key
+
+            def create(model, messages):
+                text = f"{self.api_key}:{messages[0]['content']}"
+                return SimpleNamespace(
+                    choices=[SimpleNamespace(message=SimpleNamespace(content=text))]
+                )
+
+            self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+    monkeypatch.setattr(llm_client, "_openai_sdk", lambda: SimpleNamespace(OpenAI=FakeOpenAI))
+    config = configparser.ConfigParser()
+    config.read_string(
+        """
+[llmsources]
+llmsource = deepseek
+[DeepSeek]
+api_keys = sk-one, sk-two
+  sk-three
+base_url = https://example.test/v1
+model = m1
+requests_per_minute = 60
+max_concurrency = 4
+"""
+    )
+    try:
+        client, source, models = llm_api.setup_llm_client(config)
+        assert isinstance(client, llm_keypool.KeyPool) and (source, models) == ("deepseek", ["m1"])
+        assert created == [(k, "https://example.test/v1") for k in ("sk-one", "sk-two", "sk-three")]
+        limiter = llm_ratelimit.get_rate_limiter("deepseek", "m1")
+        assert limiter.requests.rate == pytest.approx(3.0)  # 60 rpm x 3 keys
+        assert limiter.aimd.max_limit == 12
+        assert llm_client._get_max_concurrency(config, "deepseek") == 12
+
+        texts = [llm_api.generate_llm_response_single(client, source, "hi", "m1") for _ in range(3)]
+        assert texts == ["sk-one:hi", "sk-two:hi", "sk-three:hi"]
+        assert set(llm_api.key_pool_snapshot(client)["keys"]) == {
+            "0:...-one",
+            "1:...-two",
+            "2:...hree",
+        }
+
+        config.set("DeepSeek", "base_urls", "https://a.test, https://b.test")
+        with pytest.raises(ValueError, match="base_urls"):
+            llm_api.setup_llm_client(config)
+    finally:
+        config.remove_section("DeepSeek")
+        config.add_section("DeepSeek")
+        llm_ratelimit.configure_rate_limits(config, "deepseek", "DeepSeek")
+
+
+def test_429_retried_on_another_key_still_slows_the_shared_limiter():
+    def fake_client(name):
+        def create(model, messages):
+            if name == "a":
+                raise _HTTP429()
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=name))])
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    config = configparser.ConfigParser()
+    config.read_string(
+        "[DeepSeek]\nadaptive_concurrency = true\nmax_concurrency = 4\ninitial_concurrency = 4\n"
+    )
+    llm_ratelimit.configure_rate_limits(config, "deepseek", "DeepSeek", key_count=2)
+    try:
+        limiter = llm_ratelimit.get_rate_limiter("deepseek", "m1")
+        limit_before = limiter.aimd.limit
+        pool = llm_keypool.KeyPool("deepseek", [("a", fake_client("a")), ("b", fake_client("b"))])
+        # a 被限流、换到 b 成功：调用方拿到结果，但限流器仍记下这次 429 并降并发
+        assert llm_api.generate_llm_response_single(pool, "deepseek", "hi", "m1") == "b"
+        snap = limiter.snapshot()
+        assert snap["throttled"] == 1 and snap["ok"] == 1 and snap["failed"] == 0
+        assert limiter.aimd.decreases == 1 and limiter.aimd.limit < limit_before
+    finally:
+        config.remove_section("DeepSeek")
+        config.add_section("DeepSeek")
+        llm_ratelimit.configure_rate_limits(config, "deepseek", "DeepSeek")
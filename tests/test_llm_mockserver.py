@@ -0,0 +1,118 @@
+# codex: 2026-10-18 本地 mock 服务单测折行到 ≤100
+
+from __future__ import annotations
+
+import http.client
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_api, llm_loadtest, llm_mockserver  # noqa: E402
+
+
+def _post(server, path: str, body: dict):
+    conn = http.client.HTTPConnection(server.host, server.port, timeout=5)
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    try:
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_scripted_outcomes_follow_wire_formats():
+    scenario = llm_mockserver.MockScenario(
+        script=["429", "malformed", "truncated", "bad_content", "500"], retry_after_s=2.5
+    )
+    server = llm_mockserver.MockLLMServer(scenario)
+    try:
+        chat = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+        status, headers, _ = _post(server, "/v1/chat/completions", chat)
+        assert status == 429 and headers["Retry-After"] == "2.5"
+        status, _, body = _post(server, "/v1/chat/completions", chat)
+        assert status == 200
+        with pytest.raises(ValueError):
+            json.loads(body)
+        with pytest.raises(http.client.IncompleteRead):
+            _post(server, "/api/paas/v4/chat/completions", chat)
+        status, _, body = _post(server, "/v1beta/models/m:generateContent", {"contents": []})
+        text = json.loads(body)["candidates"][0]["content"]["parts"][0]["text"]
+        with pytest.raises(ValueError):
+            json.loads(text)  # 信封合法，卡片 JSON 被截断
+        assert _post(server, "/v1/chat/completions", chat)[0] == 503
+        status, _, body = _post(server, "/v1/chat/completions", chat)
+        assert (
+            status == 200
+            and json.loads(json.loads(body)["choices"][0]["message"]["content"])["popular"] == 6
+        )
+        assert _post(server, "/scenario", {"script": ["nope"]})[0] == 400
+        stats = server.stats()
+        assert stats["requests"] == 6 and stats["outcomes"]["ok"] == 1
+        assert stats["by_format"] == {"openai": 5, "gemini": 1}
+    finally:
+        server.close()
+
+
+def test_gemini_paths_and_loadtest_against_mock():
+    scenario = llm_mockserver.MockScenario(responses=["卧薪尝胆：越王勾践的故事"], latency_ms=5)
+    server = llm_mockserver.MockLLMServer(scenario)
+    try:
+        client, source, models = llm_api.setup_llm_client(
+            llm_loadtest.mock_config(server.url, "geminiweb")
+        )
+        assert (
+            llm_api.generate_llm_response_single(client, source, "hi", models[0])
+            == "卧薪尝胆：越王勾践的故事"
+        )
+        deltas = []
+        text = llm_api.generate_llm_response_stream(
+            client, source, "hi", models[0], on_delta=deltas.append
+        )
+        assert (
+            text == "卧薪尝胆：越王勾践的故事" and len(deltas) > 1
+        )  # SSE 不带 charset 时仍按 UTF-8 解码
+
+        report = llm_loadtest.run_loadtest(
+            server.url, "geminiweb", qps=40, duration_s=0.5, concurrency=8, keys=2
+        )
+        assert report["requests"] == 20 and report["ok"] == 20 and not report["errors"]
+        assert report["latency_s"]["p99"] >= report["latency_s"]["p50"] > 0
+        assert sum(k["calls"] for k in report["api_keys"]["keys"].values()) == 20
+        assert server.stats()["requests"] == 22
+    finally:
+        server.close()
+
+
+def test_historycards_end_to_end_through_mock(tmp_path):
+    server = llm_mockserver.MockLLMServer(
+        llm_mockserver.MockScenario(script=["429"], retry_after_s=0.01)
+    )
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("卧薪尝胆\n完璧归赵\n", encoding="utf-8")
+    resources = tmp_path / "resources"
+    try:
+        rc = llm_loadtest.run_historycards(
+            server.url,
+            "geminiweb",
+            qps=50,
+            passthrough=[
+                "--input",
+                str(input_file),
+                "--resources-dir",
+                str(resources),
+                "--retry-wait-base",
+                "0",
+            ],
+        )
+    finally:
+        server.close()
+    assert rc == 0
+    summary = json.loads((resources / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["processed"] == 2 and summary["retries"] == 1
+    assert summary["rate_limits"]["geminiweb/*"]["throttled"] == 1  # 429 经共享限流器记账
@@ -0,0 +1,136 @@
+# codex: 2026-10-18 限流单测折行到 ≤100
+
+from __future__ import annotations
+
+import configparser
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils import llm_ratelimit  # noqa: E402
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class _HTTP429(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: str | None = None) -> None:
+        super().__init__("Too Many Requests")
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        self.response = type("Resp", (), {"headers": headers, "status_code": 429})()
+
+
+def test_token_bucket_reserve_returns_wait_when_overdrawn():
+    clock = _FakeClock()
+    bucket = llm_ratelimit.TokenBucket(per_minute=60, clock=clock)
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == 1.0  # 1 token/s
+    clock.now += 2.0
+    assert bucket.reserve(1) == 0.0
+
+
+def test_aimd_additive_increase_and_single_decrease_per_cooldown():
+    clock = _FakeClock()
+    aimd = llm_ratelimit.AIMDController(
+        max_limit=8, min_limit=1, initial=4, cooldown_s=1.0, clock=clock
+    )
+    for _ in range(5):  # 每个窗口（约 limit 次成功）+1
+        aimd.on_result(ok=True, throttled=False, latency_s=0.1)
+    assert aimd.window == 5
+
+    aimd.on_result(ok=False, throttled=True, latency_s=0.1)
+    aimd.on_result(ok=False, throttled=True, latency_s=0.1)  # 同一拥塞事件只减一次
+    assert aimd.window == 2
+    assert aimd.decreases == 1
+
+    clock.now += 2.0
+    aimd.on_result(ok=False, throttled=True, latency_s=0.1)
+    assert aimd.window == 1
+
+
+def test_limiter_throttle_shrinks_window_and_honours_retry_after():
+    clock = _FakeClock()
+    limiter = llm_ratelimit.ProviderRateLimiter(
+        "x",
+        requests_per_minute=600,
+        max_concurrency=4,
+        adaptive=True,
+        initial_concurrency=4,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    lease = limiter.acquire()
+    lease.release(ok=False, exc=_HTTP429(retry_after="7"))
+    snap = limiter.snapshot()
+    assert snap["throttled"] == 1
+    assert snap["concurrency_limit"] == 2.0
+
+    start = clock.now
+    limiter.acquire().release(ok=True)
+    assert clock.now - start >= 7.0
+
+
+def test_limiter_window_blocks_extra_entries():
+    limiter = llm_ratelimit.ProviderRateLimiter(
+        "x", max_concurrency=2, adaptive=True, initial_concurrency=2
+    )
+    first = limiter.acquire()
+    second = limiter.acquire()
+    assert not limiter._try_enter()
+    first.release(ok=True)
+    assert limiter._try_enter()
+    second.release(ok=True)
+
+
+def test_configure_rate_limits_registry_is_shared_and_scoped(monkeypatch):
+    monkeypatch.setattr(llm_ratelimit, "_LIMITER_SETTINGS", {})
+    monkeypatch.setattr(llm_ratelimit, "_LIMITERS", {})
+    config = configparser.ConfigParser()
+    config.read_string(
+        "[OpenAI]\nrequests_per_minute = 120\ntokens_per_minute = 1000\nrate_limit_scope = model\n"
+        "[ZhipuAI]\nmodel = glm\n"
+    )
+    assert llm_ratelimit.configure_rate_limits(config, "zhipuai", "ZhipuAI") is None
+    assert llm_ratelimit.get_rate_limiter("zhipuai", "glm") is None
+
+    settings = llm_ratelimit.configure_rate_limits(config, "openai", "OpenAI")
+    assert settings["requests_per_minute"] == 120
+    a1 = llm_ratelimit.get_rate_limiter("openai", "a")
+    assert a1 is llm_ratelimit.get_rate_limiter("openai", "a")
+    assert a1 is not llm_ratelimit.get_rate_limiter("openai", "b")
+    assert "openai/a" in llm_ratelimit.rate_limit_snapshot()
+
+
+def test_is_rate_limit_error_and_estimate_tokens():
+    assert llm_ratelimit.is_rate_limit_error(_HTTP429())
+    assert llm_ratelimit.is_rate_limit_error(
+        RuntimeError("Gemini Web API 请求失败: 429 Client Error")
+    )
+    assert not llm_ratelimit.is_rate_limit_error(ValueError("bad json"))
+    assert llm_ratelimit.is_rate_limit_error(
+        RuntimeError("Error code: 429 - {'error': 'slow down'}")
+    )
+    assert llm_ratelimit.is_rate_limit_error(RuntimeError("Rate limit reached for requests"))
+
+    class RateLimitError(Exception):  # 各 SDK 的限流异常按类名识别
+        pass
+
+    assert llm_ratelimit.is_rate_limit_error(RateLimitError("quota"))
+    # 消息里恰好出现 429（token 数、行号、端口等）不算限流
+    for text in ("prompt_tokens=429", "invalid JSON at line 429", "connect to :8429 refused"):
+        assert not llm_ratelimit.is_rate_limit_error(RuntimeError(text)), text
+    assert not llm_ratelimit.is_rate_limit_error(ValueError("accurate limits exceeded"))
+    assert llm_ratelimit.estimate_tokens("成语abcd") == 3
@@ -0,0 +1,234 @@
+# codex: 2026-10-18 模型路由单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+import threading
+import time
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from utils.llm_routing import ModelRouter  # noqa: E402
+
+
+def test_latency_policy_reorders_by_p50_and_error_rate():
+    router = ModelRouter(policy="latency", min_samples=3)
+    assert router.order(["a", "b", "c"]) == ["a", "b", "c"]  # 无样本：保持配置顺序
+
+    for _ in range(3):
+        router.record("a", 2.0, True)
+        router.record("b", 0.5, True)
+    assert router.order(["a", "b", "c"]) == ["b", "a", "c"]
+
+    for _ in range(3):
+        router.record("b", 0.1, False)  # b 变得不可靠：0.5 × (1 + 4 × 0.5) = 1.5，仍快于 a
+    assert router.order(["a", "b"]) == ["b", "a"]
+    for _ in range(6):
+        router.record("b", 0.1, False)
+    assert router.order(["a", "b"]) == ["a", "b"]
+    assert router.model_stats("b")["error_rate"] == pytest.approx(0.75)
+
+    fixed = ModelRouter(policy="fixed")
+    fixed.record("b", 0.1, True)
+    assert fixed.order(["a", "b"]) == ["a", "b"]
+
+
+def test_sequential_fallback_skips_invalid_answers():
+    router = ModelRouter(policy="fixed")
+    seen = []
+
+    def call(model):
+        seen.append(model)
+        return {"a": "bad", "b": "good"}[model]
+
+    def validate(text):
+        if text != "good":
+            raise ValueError("invalid")
+        return text.upper()
+
+    assert router.call(["a", "b"], call, validate=validate) == ("b", "good", "GOOD")
+    assert seen == ["a", "b"]
+    assert router.model_stats("a")["error_rate"] == 1.0
+
+    with pytest.raises(Exception, match="All models failed"):
+        router.call(["a"], call, validate=validate)
+
+
+def test_hedge_fires_after_deadline_and_first_valid_answer_wins():
+    router = ModelRouter(policy="fixed", hedge=True, hedge_after_s=0.05)
+    release = threading.Event()
+    attempts = []
+
+    def call(model):
+        attempts.append(model)
+        if model == "slow":
+            release.wait(2)
+            return "late"
+        return "fast"
+
+    t0 = time.monotonic()
+    model, text, _ = router.call(["slow", "quick"], call)
+    elapsed = time.monotonic() - t0
+    release.set()
+
+    assert (model, text) == ("quick", "fast")
+    assert elapsed < 1.0
+    assert attempts == ["slow", "quick"]
+    snap = router.snapshot()
+    assert snap["hedges"] == 1 and snap["hedge_wins"] == 1
+
+    # 有足够样本后，按 p95 × factor 决定对冲时间
+    learned = ModelRouter(hedge=True, hedge_after_s=10, hedge_factor=2.0, min_samples=2)
+    learned.record("m", 0.1, True)
+    assert learned.hedge_delay("m") == 10
+    learned.record("m", 0.3, True)
+    assert learned.hedge_delay("m") == pytest.approx(0.6)
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_routing_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_historycards_hedge_uses_next_model_when_primary_is_slow(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    good = (
+        '{"period":"汉朝","year_estimate":1,"meaning":"比喻做事多此一举",'
+        '"story":"楚国有人比赛画蛇，先画完的人又给蛇添上脚。","prompt":"A card, 画蛇","popular":5}'
+    )
+
+    def fake_generate(_client, _llm_source, _prompt, model_name, _logger):
+        if model_name == "model-slow":
+            time.sleep(0.5)
+        return good
+
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module,
+        "setup_llm_client",
+        lambda _cfg, _logger: (object(), "dummy", ["model-slow", "model-fast"]),
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", fake_generate)
+
+    rc = module.main(
+        [
+            "--input",
+            str(input_file),
+            "--resources-dir",
+            str(resources_dir),
+            "--max-retries",
+            "1",
+            "--hedge",
+            "--hedge-after",
+            "0.05",
+        ]
+    )
+    assert rc == 0
+
+    runlog = [
+        json.loads(line)
+        for line in (resources_dir / "historycards_runlog.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    assert [r["model"] for r in runlog] == ["model-fast", "model-fast"]
+
+    summary = json.loads((resources_dir / "historycards_summary.json").read_text(encoding="utf-8"))
+    assert summary["routing"]["hedges"] == 2
+    assert summary["routing"]["hedge_wins"] == 2
+    assert summary["args"]["hedge"] is True
+
+
+def test_external_stats_abort_on_and_bounded_hedges():
+    stats = {"a": {"samples": 9, "p50_s": 2.0, "p95_s": 3.0, "error_rate": 0.0}}
+    empty = {"samples": 0, "p50_s": 0.0, "p95_s": 0.0, "error_rate": 0.0}
+    stats["b"] = {"samples": 9, "p50_s": 0.5, "p95_s": 0.6, "error_rate": 0.0}
+    router = ModelRouter(min_samples=3, model_stats=lambda m: stats.get(m, empty))
+    router.record("a", 0.01, True)  # 统计由调用方维护：record 不生效
+    assert router.order(["a", "b"]) == ["b", "a"]
+    assert router.snapshot()["per_model"] == {}
+
+    # abort_on：不换模型，直接抛出
+    seen = []
+
+    def aborting(model):
+        seen.append(model)
+        raise KeyboardInterrupt if model == "b" else AssertionError("fallback must not run")
+
+    with pytest.raises(KeyboardInterrupt):
+        router.call(["a", "b"], aborting, abort_on=(KeyboardInterrupt,))
+    assert seen == ["b"]
+
+    # 对冲：胜出后设置 cancel；线程池被落后请求占满时不再对冲
+    hedging = ModelRouter(policy="fixed", hedge=True, hedge_after_s=0.02, max_threads=2)
+    release = threading.Event()
+    cancel = threading.Event()
+
+    def call(model):
+        if model == "slow":
+            release.wait(2)
+            return "late"
+        return "fast"
+
+    assert hedging.call(["slow", "quick"], call, cancel=cancel)[0] == "quick"
+    assert cancel.is_set()
+    # 上一次落后的 slow 仍占着一个线程：这次首选 + 对冲会超过 2 个线程，只能等首选
+    threading.Timer(0.1, release.set).start()
+    assert hedging.call(["slow", "quick"], call)[:2] == ("slow", "late")
+    snap = hedging.snapshot()
+    assert snap["hedges"] == 1 and snap["hedges_skipped"] == 1
+    hedging.close()
+
+
+def test_routed_path_validates_once_and_aborts_like_fallback_chain(tmp_path, monkeypatch):
+    from history import card_attempts
+    from history.card_engine import EngineOptions, LLMBinding, generate_cards
+
+    good = (
+        '{"period":"汉朝","year_estimate":1,"meaning":"比喻做事多此一举",'
+        '"story":"楚国有人比赛画蛇，先画完的人又给蛇添上脚。","prompt":"A card, 画蛇","popular":5}'
+    )
+    streams = []
+
+    def fake_stream(_client, _source, _prompt, model_name, _logger, on_delta=None):
+        streams.append(model_name)
+        text = "[1, 2]" if len(streams) == 1 else good  # 第一次输出不可能成卡 -> 中止
+        for ch in text:
+            on_delta(ch)
+        return text
+
+    parses = []
+    real_parse = card_attempts.parse_card
+    monkeypatch.setattr(
+        card_attempts, "parse_card", lambda *a: parses.append(a[1]) or real_parse(*a)
+    )
+
+    binding = LLMBinding(
+        client=None, source="dummy", models=["m1", "m2"], call=None, stream=fake_stream
+    )
+    options = EngineOptions(
+        resources_dir=str(tmp_path), stream=True, route="latency", max_retries=2, retry_wait_base=0
+    )
+    rc, summary = generate_cards(["甲"], options, binding)
+    assert rc == 0 and summary["processed"] == 1 and summary["retries"] == 1
+    # 中止结束本次尝试（不换到 m2），重试时 m1 成功；回复只解析一次
+    assert streams == ["m1", "m1"] and parses == ["甲"]
+    assert summary["stream"]["aborts"] == 1
+    assert summary["per_model"]["m1"]["attempts"] == 2 and "m2" not in summary["per_model"]
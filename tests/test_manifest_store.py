@@ -0,0 +1,148 @@
+# codex: 2026-10-18 manifest 存储单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history.manifest_store import ManifestStore  # noqa: E402
+
+
+def _card(card_id: str, name: str) -> dict:
+    return {"id": card_id, "name": name, "period": "汉"}
+
+
+def test_journal_imports_dedupes_and_compacts(tmp_path):
+    manifest_file = tmp_path / "manifest.json"
+    manifest_file.write_text(
+        json.dumps(
+            {"cards": [_card("a", "甲")], "version": "2.0", "note": "keep"}, ensure_ascii=False
+        ),
+        encoding="utf-8",
+    )
+    store = ManifestStore(str(tmp_path / ".manifest_journal.sqlite"))
+    assert store.sync_from_manifest(str(manifest_file)) == (1, 0)
+    assert store.sync_from_manifest(str(manifest_file)) == (0, 0)  # 未变化：不再重复读取
+    assert not store.dirty
+
+    assert store.append(_card("b", "乙"))
+    assert not store.append(_card("b", "丙"))  # id 冲突
+    assert not store.append(_card("c", "甲"))  # name 冲突
+    assert store.dirty
+    assert store.id_for_name("乙") == "b" and store.name_for_id("a") == "甲"
+    assert store.has_id("b") and not store.has_name("丙")
+
+    assert store.compact(str(manifest_file)) == 2
+    out = json.loads(manifest_file.read_text(encoding="utf-8"))
+    assert [c["id"] for c in out["cards"]] == ["a", "b"]
+    assert out["version"] == "2.0" and out["note"] == "keep" and out["updated_at"]
+    assert not store.dirty
+
+    # 外部工具改写 manifest.json：下次打开时把缺少的卡片补进日志
+    out["cards"].append(_card("d", "丁"))
+    manifest_file.write_text(json.dumps(out, ensure_ascii=False), encoding="utf-8")
+    os.utime(manifest_file, ns=(1, 1))
+    store.close()
+    store = ManifestStore(str(tmp_path / ".manifest_journal.sqlite"))
+    assert store.sync_from_manifest(str(manifest_file)) == (1, 0)
+    assert [c["id"] for c in store.iter_cards()] == ["a", "b", "d"]
+
+    # 外部删掉卡片 a：同步为删除；压缩后才追加的 e 尚未写进 manifest.json，不受影响
+    assert store.append(_card("e", "戊"))
+    out["cards"] = [c for c in out["cards"] if c["id"] != "a"]
+    manifest_file.write_text(json.dumps(out, ensure_ascii=False), encoding="utf-8")
+    os.utime(manifest_file, ns=(2, 2))
+    assert store.sync_from_manifest(str(manifest_file)) == (0, 1)
+    assert [c["id"] for c in store.iter_cards()] == ["b", "d", "e"]
+    assert not store.has_name("甲") and store.dirty
+    store.compact(str(manifest_file))
+    out = json.loads(manifest_file.read_text(encoding="utf-8"))
+    assert [c["id"] for c in out["cards"]] == ["b", "d", "e"]
+    store.close()
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_manifest_store_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_historycards_commits_to_journal_and_compacts_once(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    good = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+    compactions = []
+    original_compact = module.ManifestStore.compact
+
+    def counting_compact(self, manifest_file):
+        compactions.append(manifest_file)
+        return original_compact(self, manifest_file)
+
+    monkeypatch.setattr(module.ManifestStore, "compact", counting_compact)
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", lambda *_a: good)
+
+    args = ["--input", str(input_file), "--resources-dir", str(resources_dir), "--max-retries", "1"]
+    assert module.main(args) == 0
+    assert len(compactions) == 1  # 默认每 200 张 / 60 秒：3 张卡只在结束时压缩
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in manifest["cards"]] == ["甲", "乙", "丙"]
+    assert (resources_dir / ".manifest_journal.sqlite").exists()
+
+    # 全部跳过的重跑：日志无新卡，不重写 manifest.json
+    assert module.main(args) == 0
+    assert len(compactions) == 1
+
+    # 删除 manifest.json 后可从日志按需重建
+    (resources_dir / "manifest.json").unlink()
+    assert module.main(["--resources-dir", str(resources_dir), "--compact-manifest"]) == 0
+    rebuilt = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [c["name"] for c in rebuilt["cards"]] == ["甲", "乙", "丙"]
+
+
+def test_historycards_flushes_manifest_periodically(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n丁\n戊\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    good = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+    seen = []
+    original_compact = module.ManifestStore.compact
+
+    def recording_compact(self, manifest_file):
+        total = original_compact(self, manifest_file)
+        seen.append(total)
+        return total
+
+    monkeypatch.setattr(module.ManifestStore, "compact", recording_compact)
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(module, "generate_llm_response_single", lambda *_a: good)
+
+    args = ["--input", str(input_file), "--resources-dir", str(resources_dir), "--max-retries", "1"]
+    assert module.main(args + ["--manifest-write-every", "2"]) == 0
+    # 每 2 张新卡压缩一次，结束时补上第 5 张
+    assert seen == [2, 4, 5]
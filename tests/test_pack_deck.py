@@ -0,0 +1,109 @@
+# codex: 2026-10-18 分片牌库单测的长行折到 ≤100，断言不变
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_TOOLS_DIR = _REPO_ROOT / "history" / "tools"
+for _path in (_REPO_ROOT, _TOOLS_DIR):
+    if str(_path) not in sys.path:
+        sys.path.insert(0, str(_path))
+
+import pack  # noqa: E402
+
+
+def _write_card(root: Path, card_id: str, period: str, popular: int, story: str = "故事") -> None:
+    card_dir = root / "cards" / card_id
+    card_dir.mkdir(parents=True, exist_ok=True)
+    data = {
+        "id": card_id,
+        "name": f"成语{card_id}",
+        "period": period,
+        "year_estimate": -400,
+        "popular": popular,
+        "story": story,
+    }
+    (card_dir / "data.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    (card_dir / "image.png").write_bytes(b"png")
+
+
+def _pack(root: Path, **kwargs):
+    return pack.pack_resources(
+        cards_root=str(root / "cards"),
+        manifest_file=str(root / "manifest.json"),
+        index_file=str(root / "index.sqlite"),
+        changelog_file=str(root / "changelog.jsonl"),
+        **kwargs,
+    )
+
+
+def _load_deck(root: Path):
+    pointer = json.loads((root / "deck.json").read_text(encoding="utf-8"))
+    index = json.loads((root / pointer["index"]).read_text(encoding="utf-8"))
+    return pointer, index
+
+
+def _shard_files(root: Path) -> set:
+    return {path.name for path in (root / "deck" / "shards").iterdir()}
+
+
+def test_deck_index_is_slim_and_shards_are_content_addressed(tmp_path):
+    for i in range(10):
+        _write_card(tmp_path, f"c{i}", "春秋" if i < 7 else "战国", popular=i % 3 + 1)
+    record = _pack(tmp_path, shard_size=2)
+    pointer, index = _load_deck(tmp_path)
+    assert record["deck"] == pointer["version"] and pointer["cards"] == 10
+    fields = ["id", "name", "year_estimate", "popular", "period", "sprite", "shard"]
+    assert index["fields"] == fields
+    assert index["atlases"] == [] and all(row[5] is None for row in index["cards"])
+    assert [row[0] for row in index["cards"]] == sorted(f"c{i}" for i in range(10))
+    assert "故事" not in (tmp_path / pointer["index"]).read_text(encoding="utf-8")
+
+    # 每张卡片恰好在它所在分片里，分片按时期分组
+    for row in index["cards"]:
+        shard = index["shards"][row[-1]]
+        assert shard["group"] == row[4]
+        cards = json.loads((tmp_path / "deck" / shard["file"]).read_text(encoding="utf-8"))["cards"]
+        image_path = f"cards/{row[0]}/image.png"
+        assert any(card["id"] == row[0] and card["image_path"] == image_path for card in cards)
+    assert {shard["group"] for shard in index["shards"]} == {"春秋", "战国"}
+    assert len(index["shards"]) == len(_shard_files(tmp_path)) > 2
+
+    # 无变化：版本不变
+    assert _pack(tmp_path, shard_size=2)["deck"] == pointer["version"]
+
+    # 改一张卡：只新增一个分片，新指针记录上一版索引，旧文件保留一代
+    before = _shard_files(tmp_path)
+    _write_card(tmp_path, "c3", "春秋", popular=1, story="新的故事")
+    second = _pack(tmp_path, shard_size=2)
+    pointer2, index2 = _load_deck(tmp_path)
+    assert second["deck"] != pointer["version"] and pointer2["previous"] == pointer["index"]
+    assert len(_shard_files(tmp_path) - before) == 1
+    assert (tmp_path / pointer["index"]).exists()
+
+    # 再改一次：第一版的索引与独有分片被清理
+    _write_card(tmp_path, "c8", "战国", popular=1, story="又一个故事")
+    _pack(tmp_path, shard_size=2)
+    pointer3, index3 = _load_deck(tmp_path)
+    assert not (tmp_path / pointer["index"]).exists()
+    referenced = {shard["file"].split("/")[-1] for shard in index2["shards"] + index3["shards"]}
+    assert _shard_files(tmp_path) == referenced
+
+
+def test_deck_regroups_when_shard_by_changes(tmp_path):
+    for i in range(6):
+        _write_card(tmp_path, f"p{i}", "汉", popular=i % 2 + 5)
+    _pack(tmp_path)
+    _, index = _load_deck(tmp_path)
+    assert [shard["group"] for shard in index["shards"]] == ["汉"]
+
+    record = _pack(tmp_path, shard_by="popular")
+    assert not record["added"]  # 卡片未变，只是牌库重新分组
+    pointer, index = _load_deck(tmp_path)
+    assert pointer["shard_by"] == "popular"
+    assert sorted(shard["group"] for shard in index["shards"]) == ["5", "6"]
+
+    assert _pack(tmp_path, deck=False)["deck"] is None
@@ -0,0 +1,140 @@
+# codex: 2026-10-18 增量打包单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_TOOLS_DIR = _REPO_ROOT / "history" / "tools"
+for _path in (_REPO_ROOT, _TOOLS_DIR):
+    if str(_path) not in sys.path:
+        sys.path.insert(0, str(_path))
+
+import pack  # noqa: E402
+
+
+def _write_card(root: Path, card_id: str, **extra) -> Path:
+    card_dir = root / card_id
+    card_dir.mkdir(parents=True, exist_ok=True)
+    data = {"id": card_id, "name": f"卡片{card_id}", "year_estimate": -500, **extra}
+    (card_dir / "data.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    (card_dir / "image.png").write_bytes(b"png")
+    return card_dir
+
+
+def _pack(tmp_path: Path, **kwargs):
+    return pack.pack_resources(
+        cards_root=str(tmp_path / "cards"),
+        manifest_file=str(tmp_path / "manifest.json"),
+        index_file=str(tmp_path / "index.sqlite"),
+        changelog_file=str(tmp_path / "changelog.jsonl"),
+        **kwargs,
+    )
+
+
+def _full_rebuild(cards_root: Path) -> str:
+    cards = []
+    for card_id in sorted(os.listdir(cards_root)):
+        card_id_dir = cards_root / card_id
+        if not (card_id_dir / "image.png").exists():
+            continue
+        try:
+            data = json.loads((card_id_dir / "data.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if all(field in data for field in pack.REQUIRED_FIELDS):
+            data["image_path"] = f"cards/{card_id}/image.png"
+            cards.append(data)
+    return json.dumps({"cards": cards}, indent=2, ensure_ascii=False)
+
+
+def test_incremental_changes_and_manifest_matches_full_rebuild(tmp_path):
+    cards = tmp_path / "cards"
+    for card_id in ["c", "a", "b", "d"]:
+        _write_card(cards, card_id)
+    first = _pack(tmp_path)
+    assert first["added"] == ["a", "b", "c", "d"] and first["reread"] == 4
+    manifest = tmp_path / "manifest.json"
+    assert manifest.read_text(encoding="utf-8") == _full_rebuild(cards)
+
+    _write_card(cards, "a", dynasty="春秋")  # 修改
+    for name in ("data.json", "image.png"):
+        (cards / "d" / name).unlink()
+    (cards / "d").rmdir()  # 删除
+    _write_card(cards, "e")  # 新增
+    (cards / "b" / "data.json").write_text("{broken", encoding="utf-8")  # 失效
+    second = _pack(tmp_path)
+    assert second["added"] == ["e"] and second["updated"] == ["a"] and second["removed"] == ["d"]
+    assert [item["id"] for item in second["invalidated"]] == ["b"]
+    assert second["invalidated"][0]["reason"].startswith("invalid JSON")
+    assert second["reread"] == 3
+    assert manifest.read_text(encoding="utf-8") == _full_rebuild(cards)
+    log = [
+        json.loads(line)
+        for line in (tmp_path / "changelog.jsonl").read_text(encoding="utf-8").splitlines()
+    ]
+    assert len(log) == 2 and log[1]["updated"] == ["a"]
+
+    # 空跑：不读文件、不重写 manifest、不追加变更记录
+    mtime = manifest.stat().st_mtime_ns
+    third = _pack(tmp_path)
+    assert third["reread"] == 0 and not any(
+        third[key] for key in ("added", "removed", "updated", "invalidated")
+    )
+    assert manifest.stat().st_mtime_ns == mtime
+    assert len((tmp_path / "changelog.jsonl").read_text(encoding="utf-8").splitlines()) == 2
+
+    # touch 但内容不变：重读后按 sha1 判定未变
+    data_file = cards / "c" / "data.json"
+    os.utime(data_file, ns=(data_file.stat().st_atime_ns, data_file.stat().st_mtime_ns + 10**9))
+    fourth = _pack(tmp_path)
+    assert fourth["reread"] == 1 and fourth["updated"] == []
+
+    # 修复失效卡片后重新出现在 added
+    _write_card(cards, "b")
+    assert _pack(tmp_path)["added"] == ["b"]
+    assert manifest.read_text(encoding="utf-8") == _full_rebuild(cards)
+
+
+def test_parallel_reread_and_full_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(pack, "PARALLEL_MIN_CARDS", 4)
+    cards = tmp_path / "cards"
+    for i in range(12):
+        _write_card(cards, f"card{i:02d}", note="长" * i)
+    (cards / "card05" / "image.png").unlink()
+    record = _pack(tmp_path, workers=2)
+    assert record["reread"] == 12 and len(record["added"]) == 11
+    assert record["invalidated"] == [{"id": "card05", "reason": "missing image.png"}]
+    assert (tmp_path / "manifest.json").read_text(encoding="utf-8") == _full_rebuild(cards)
+
+    # --full 重读全部，但内容未变时不产生变更
+    again = _pack(tmp_path, workers=2, full=True)
+    assert (
+        again["reread"] == 12
+        and not again["added"]
+        and not again["updated"]
+        and not again["invalidated"]
+    )
+
+
+def test_default_index_follows_the_cards_tree(tmp_path):
+    default_index = Path(pack.common.RESOURCES_DIR) / pack.INDEX_FILE_NAME
+    default_state = default_index.stat().st_mtime_ns if default_index.exists() else None
+    for tree, ids in (("a", ["x1", "x2"]), ("b", ["y1"])):
+        for card_id in ids:
+            _write_card(tmp_path / tree / "cards", card_id)
+        record = pack.pack_resources(cards_root=str(tmp_path / tree / "cards"), deck=False)
+        assert record["added"] == ids
+        assert (tmp_path / tree / pack.INDEX_FILE_NAME).exists()
+        assert (tmp_path / tree / pack.CHANGELOG_FILE_NAME).exists()
+        manifest = json.loads((tmp_path / tree / "manifest.json").read_text(encoding="utf-8"))
+        assert [c["id"] for c in manifest["cards"]] == ids
+
+    # 各自的索引都还在：再打包 a 不会把 b 的卡片算作删除，也不会重读
+    again = pack.pack_resources(cards_root=str(tmp_path / "a" / "cards"), deck=False)
+    assert again["reread"] == 0 and not any(again[k] for k in ("added", "removed", "updated"))
+    current = default_index.stat().st_mtime_ns if default_index.exists() else None
+    assert current == default_state
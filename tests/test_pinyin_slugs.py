@@ -0,0 +1,73 @@
+# codex: 2026-10-18 单测覆盖预计算拼音表：生成/读取、版本不符整表忽略、查表优先、词典 sha1 变化时告警并回退现场转换
+
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import pinyin_slugs  # noqa: E402
+
+
+def test_build_and_lookup_prefers_table(tmp_path):
+    pytest.importorskip("pypinyin")
+    dict_path = tmp_path / "idioms.txt"
+    dict_path.write_text("#### header\n\n一丝不苟\n画蛇添足\n一丝不苟\n", encoding="utf-8")
+    table_path = tmp_path / "slugs.tsv"
+
+    assert pinyin_slugs.build_table(str(dict_path), str(table_path)) == 2
+    table = pinyin_slugs.read_table(str(table_path))
+    assert table == {"一丝不苟": "yisibugou", "画蛇添足": "huashetianzu"}
+
+    # 表中的值优先于现场转换；未命中的词才调用 pypinyin
+    table_path.write_text(
+        table_path.read_text(encoding="utf-8").replace("huashetianzu", "hua_she"), encoding="utf-8"
+    )
+    pinyin_slugs._load_table.cache_clear()
+    assert pinyin_slugs.pinyin_of("画蛇添足", str(table_path), str(dict_path)) == "hua_she"
+    assert pinyin_slugs.pinyin_of("守株待兔", str(table_path), str(dict_path)) == "shouzhudaitu"
+
+
+def test_table_from_another_dictionary_warns_and_falls_back(tmp_path, caplog):
+    pytest.importorskip("pypinyin")
+    dict_path = tmp_path / "idioms.txt"
+    dict_path.write_text("画蛇添足\n", encoding="utf-8")
+    table_path = tmp_path / "slugs.tsv"
+    pinyin_slugs.build_table(str(dict_path), str(table_path))
+    table_path.write_text(
+        table_path.read_text(encoding="utf-8").replace("huashetianzu", "hua_she"), encoding="utf-8"
+    )
+    assert pinyin_slugs.stale_reason(str(table_path), str(dict_path)) is None
+
+    # 词典更新后没有重新生成表：告警，并整表改用 pypinyin
+    dict_path.write_text("画蛇添足\n守株待兔\n", encoding="utf-8")
+    pinyin_slugs._load_table.cache_clear()
+    with caplog.at_level("WARNING", logger="historycards"):
+        assert pinyin_slugs.pinyin_of("画蛇添足", str(table_path), str(dict_path)) == "huashetianzu"
+    assert "different idiom dictionary" in caplog.text
+    assert "sha1" in pinyin_slugs.stale_reason(str(table_path), str(dict_path))
+    assert pinyin_slugs.main(["--table", str(table_path), "--dict", str(dict_path)]) == 1
+
+
+def test_outdated_table_is_ignored(tmp_path):
+    table_path = tmp_path / "slugs.tsv"
+    table_path.write_text("#pinyin_slugs\tversion=0\n画蛇添足\tstale\n", encoding="utf-8")
+    assert pinyin_slugs.read_table(str(table_path)) is None
+    assert pinyin_slugs.read_table(str(tmp_path / "missing.tsv")) is None
+    assert pinyin_slugs.main(["--table", str(table_path)]) == 1
+
+
+def test_shipped_table_matches_dictionary():
+    table = pinyin_slugs.read_table(pinyin_slugs.DEFAULT_TABLE_PATH)
+    assert table is not None
+    idioms = list(dict.fromkeys(pinyin_slugs._iter_dict_idioms(pinyin_slugs.DEFAULT_DICT_PATH)))
+    assert list(table) == idioms
+    assert pinyin_slugs.stale_reason(pinyin_slugs.DEFAULT_TABLE_PATH) is None
+    lazy_pinyin = pytest.importorskip("pypinyin").lazy_pinyin
+    for idiom in idioms[:: max(1, len(idioms) // 200)]:
+        assert table[idiom] == "".join(lazy_pinyin(idiom))
@@ -0,0 +1,123 @@
+# codex: 2026-10-18 运行指标单测折行到 ≤100
+
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+import urllib.request
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import historycards, run_metrics  # noqa: E402
+
+_GOOD = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+
+def _scrape(port: int, openmetrics: bool = False) -> str:
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/metrics")
+    if openmetrics:
+        request.add_header("Accept", "application/openmetrics-text; version=1.0.0")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        assert response.headers["Content-Type"].startswith(
+            "application/openmetrics-text" if openmetrics else "text/plain; version=0.0.4"
+        )
+        return response.read().decode("utf-8")
+
+
+def test_registry_renders_prometheus_and_openmetrics():
+    registry = run_metrics.MetricsRegistry()
+    calls = registry.counter("demo_calls", "Calls.", ("model",))
+    latency = registry.histogram("demo_seconds", "Latency.", ("model",), buckets=(1.0, 5.0))
+    calls.inc(model='a"b')
+    latency.observe(0.5, model="m")
+    latency.observe(3.0, model="m")
+    registry.add_collector(lambda: [("demo_depth", "gauge", "Depth.", [({}, 2.5)])])
+
+    text = registry.render()
+    assert "# TYPE demo_calls_total counter" in text
+    assert 'demo_calls_total{model="a\\"b"} 1' in text
+    assert 'demo_seconds_bucket{model="m",le="1"} 1' in text
+    assert 'demo_seconds_bucket{model="m",le="5"} 2' in text
+    assert 'demo_seconds_bucket{model="m",le="+Inf"} 2' in text
+    assert 'demo_seconds_sum{model="m"} 3.5' in text
+    assert "demo_depth 2.5" in text
+    assert not text.rstrip().endswith("# EOF")
+
+    om = registry.render(openmetrics=True)
+    assert "# TYPE demo_calls counter" in om and om.endswith("# EOF\n")
+
+
+def test_historycards_serves_live_metrics(tmp_path, monkeypatch):
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n", encoding="utf-8")
+    servers = []
+    scraped = []
+
+    class _RecordingServer(run_metrics.MetricsServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            servers.append(self)
+
+    replies = iter(["not json", _GOOD, _GOOD, _GOOD])
+
+    def fake_generate(_client, _llm_source, prompt, _model_name, _logger):
+        if "丙" in prompt:
+            # 运行中抓取：前两条已提交
+            scraped.append(_scrape(servers[0].port))
+        return next(replies)
+
+    monkeypatch.setattr(run_metrics, "MetricsServer", _RecordingServer)
+    monkeypatch.setattr(historycards, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        historycards, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(historycards, "generate_llm_response_single", fake_generate)
+
+    rc = historycards.main(
+        [
+            "--input",
+            str(input_file),
+            "--resources-dir",
+            str(tmp_path / "resources"),
+            "--max-retries",
+            "2",
+            "--retry-wait-base",
+            "0",
+            "--metrics-port",
+            "0",
+            "--metrics-host",
+            "127.0.0.1",
+        ]
+    )
+    assert rc == 0
+    text = scraped[0]
+    assert 'historycards_cards_total{status="ok"} 2' in text
+    assert 'historycards_parse_failures_total{model="model-x"} 1' in text
+    assert 'historycards_llm_call_seconds_count{model="model-x",outcome="ok"} 3' in text
+    assert "historycards_retries_total 1" in text
+    assert 'historycards_queue_depth{state="remaining"} 1' in text
+    assert "historycards_cards_per_minute " in text
+    # 运行结束后端点关闭
+    try:
+        _scrape(servers[0].port)
+    except OSError:
+        pass
+    else:  # pragma: no cover
+        raise AssertionError("metrics server still running after main() returned")
+
+
+def test_metrics_endpoint_binds_loopback_by_default():
+    from history.card_options import EngineOptions, build_parser
+
+    assert EngineOptions(resources_dir="res").metrics_host == "127.0.0.1"
+    assert build_parser("in.txt", "res", "progress.json", "cfg").parse_args([]).metrics_host == (
+        "127.0.0.1"
+    )
+    server = run_metrics.MetricsServer(run_metrics.MetricsRegistry(), 0)
+    try:
+        assert server._server.server_address[0] == "127.0.0.1"
+        assert _scrape(server.port).endswith("\n")
+    finally:
+        server.close()
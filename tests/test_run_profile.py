@@ -0,0 +1,138 @@
+# codex: 2026-10-18 阶段剖析单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import random
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import historycards, run_profile  # noqa: E402
+
+_GOOD = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def test_sketch_quantiles_within_alpha_and_mergeable():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(0, 1.5) for _ in range(20000)]
+    sketch = run_profile.QuantileSketch(alpha=0.01)
+    left, right = run_profile.QuantileSketch(), run_profile.QuantileSketch()
+    for i, v in enumerate(values):
+        sketch.add(v)
+        (left if i % 2 else right).add(v)
+
+    for q in (0.5, 0.9, 0.99):
+        assert sketch.quantile(q) == pytest.approx(_exact(values, q), rel=0.01)
+    assert len(sketch.buckets) < 2000
+
+    merged = left.merge(right)
+    assert merged.to_dict() == sketch.to_dict()
+    restored = run_profile.QuantileSketch.from_state(json.loads(json.dumps(sketch.to_state())))
+    assert restored.to_dict() == sketch.to_dict()
+
+    empty = run_profile.QuantileSketch()
+    assert empty.to_dict()["p99_s"] == 0.0
+    empty.add(0.0)
+    assert empty.quantile(0.5) == 0.0
+    with pytest.raises(ValueError):
+        empty.merge(run_profile.QuantileSketch(alpha=0.05))
+
+
+def test_profiler_nesting_self_time_and_folded_output():
+    now = [0.0]
+    prof = run_profile.PhaseProfiler(clock=lambda: now[0])
+    acc: dict = {}
+    with prof.card(acc, waited_s=0.5):
+        with prof.phase("generate"):
+            now[0] += 1.0
+            with prof.phase("llm_call"):
+                now[0] += 3.0
+    with prof.phase("manifest_flush"):
+        now[0] += 0.25
+
+    snap = prof.snapshot(cards=1)["phases"]
+    assert snap["card"]["count"] == 1 and snap["card"]["self_s"] == 0.0
+    assert snap["card;generate"]["total_s"] == pytest.approx(4.0)
+    assert snap["card;generate"]["self_s"] == pytest.approx(1.0)
+    assert snap["card;generate;llm_call"]["p99_s"] == pytest.approx(3.0, rel=0.01)
+    assert snap["card;queue_wait"]["self_s"] == pytest.approx(0.5)
+    assert acc == pytest.approx(
+        {"card;queue_wait": 0.5, "card;generate;llm_call": 3.0, "card;generate": 1.0, "card": 0.0}
+    )
+    assert prof.folded() == [
+        "card;generate;llm_call 3000000",
+        "card;generate 1000000",
+        "card;queue_wait 500000",
+        "manifest_flush 250000",
+    ]
+
+    other = run_profile.PhaseProfiler(clock=lambda: now[0])
+    other.record("manifest_flush", 0.75)
+    prof.merge(other)
+    assert prof.snapshot()["phases"]["manifest_flush"]["count"] == 2
+    assert prof.folded()[2] == "manifest_flush 1000000"
+
+
+def test_historycards_summary_and_runlog_include_phases(tmp_path, monkeypatch):
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n", encoding="utf-8")
+    replies = iter(["not json", _GOOD, _GOOD])
+
+    monkeypatch.setattr(historycards, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        historycards, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(historycards, "generate_llm_response_single", lambda *_args: next(replies))
+
+    resources = tmp_path / "resources"
+    folded = tmp_path / "profile.folded"
+    rc = historycards.main(
+        [
+            "--input",
+            str(input_file),
+            "--resources-dir",
+            str(resources),
+            "--max-retries",
+            "2",
+            "--retry-wait-base",
+            "0",
+            "--profile-folded",
+            str(folded),
+        ]
+    )
+    assert rc == 0
+    summary = json.loads((resources / "historycards_summary.json").read_text(encoding="utf-8"))
+    timing = summary["llm_call_timing"]
+    assert timing["count"] == 3 and {"p50_s", "p90_s", "p99_s"} <= set(timing)
+    phases = summary["profile"]["phases"]
+    assert phases["card;generate;llm_call"]["count"] == 3
+    assert phases["card;generate;parse"]["count"] == 3
+    assert phases["card;commit;write_data"]["count"] == 2
+    assert "skip_scan" in phases and "self_per_card_s" in phases["card;generate"]
+
+    lines = [
+        json.loads(line)
+        for line in (resources / "historycards_runlog.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    ok_lines = [line for line in lines if line["status"] == "ok"]
+    assert len(ok_lines) == 2
+    assert {"generate;llm_call", "generate;parse", "commit;write_data"} <= set(
+        ok_lines[0]["phase_ms"]
+    )
+
+    stacks = folded.read_text(encoding="utf-8").splitlines()
+    assert any(line.startswith("card;generate;llm_call ") for line in stacks)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in stacks)
@@ -0,0 +1,223 @@
+# codex: 2026-10-18 组提交写入器单测折行到 ≤100
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history.card_index import CardIdIndex  # noqa: E402
+from history.manifest_store import ManifestStore  # noqa: E402
+from history.run_writer import RunWriter, peek_progress  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_group_commit_by_interval_and_batch_size(tmp_path):
+    clock = _Clock()
+    runlog = tmp_path / "runlog.jsonl"
+    progress = tmp_path / "progress.json"
+    writer = RunWriter(str(tmp_path / "io.wal"), commit_interval_s=1.0, max_batch=5, clock=clock)
+
+    writer.append_jsonl(str(runlog), {"idx": 1})
+    writer.set_progress(str(progress), {"next_index": 2})
+    assert not writer.maybe_commit()
+    assert not runlog.exists() and not progress.exists()
+
+    writer.append_jsonl(str(runlog), {"idx": 2})
+    writer.set_progress(str(progress), {"next_index": 3})
+    clock.now = 1.5
+    assert writer.maybe_commit()
+    assert [
+        json.loads(line)["idx"] for line in runlog.read_text(encoding="utf-8").splitlines()
+    ] == [1, 2]
+    assert json.loads(progress.read_text(encoding="utf-8")) == {"next_index": 3}
+    assert not (tmp_path / "io.wal").exists()
+
+    for i in range(5):  # 攒满 max_batch 时不等间隔
+        writer.append_jsonl(str(runlog), {"idx": 3 + i})
+    assert writer.maybe_commit()
+    writer.write_text(str(tmp_path / "cards" / "x" / "error.txt"), "boom\n")
+    writer.close()
+    assert len(runlog.read_text(encoding="utf-8").splitlines()) == 7
+    assert (tmp_path / "cards" / "x" / "error.txt").read_text(encoding="utf-8") == "boom\n"
+    assert writer.commits == 3
+
+    with pytest.raises(ValueError):
+        RunWriter(str(tmp_path / "io.wal"), durability="sometimes")
+
+
+def test_recovery_replays_last_batch_exactly_once(tmp_path):
+    runlog = tmp_path / "runlog.jsonl"
+    progress = tmp_path / "progress.json"
+    wal = tmp_path / "io.wal"
+    runlog.write_text('{"idx": 1}\n', encoding="utf-8")
+
+    writer = RunWriter(str(wal), durability="fsync")
+    writer.append_jsonl(str(runlog), {"idx": 2})
+    writer.append_jsonl(str(runlog), {"idx": 3})
+    writer.set_progress(str(progress), {"next_index": 4})
+
+    # 模拟崩溃：WAL 已落盘，目标文件只写了半行
+    def crash(_batch):
+        with open(runlog, "a", encoding="utf-8") as f:
+            f.write('{"idx": 2}\n{"id')
+        raise KeyboardInterrupt
+
+    writer._apply = crash
+    with pytest.raises(KeyboardInterrupt):
+        writer.commit()
+    assert wal.exists()
+
+    recovered = RunWriter(str(wal))
+    assert recovered.recovered == 3
+    assert [
+        json.loads(line)["idx"] for line in runlog.read_text(encoding="utf-8").splitlines()
+    ] == [1, 2, 3]
+    assert json.loads(progress.read_text(encoding="utf-8")) == {"next_index": 4}
+    assert not wal.exists()
+
+    # WAL 本身没写完：直接丢弃，目标文件不动
+    wal.write_text('{"offsets": {', encoding="utf-8")
+    assert RunWriter(str(wal)).recovered == 0
+    assert not wal.exists()
+    assert len(runlog.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def test_records_reach_sinks_once_per_batch_and_replay_after_crash(tmp_path):
+    wal = tmp_path / "io.wal"
+    progress = tmp_path / "progress.json"
+    calls = []
+    sinks = {"ids": calls.append}
+
+    writer = RunWriter(str(wal), sinks=sinks)
+    with pytest.raises(KeyError):
+        writer.add_record("journal", {"id": "a"})
+    writer.add_record("ids", ["a", "甲"])
+    writer.add_record("ids", ["b", "乙"])
+    writer.write_text(str(tmp_path / "a" / "data.json"), '{"id": "a"}')
+    writer.set_progress(str(progress), {"next_index": 3})
+    writer.commit()
+    assert calls == [[["a", "甲"], ["b", "乙"]]]
+    assert json.loads((tmp_path / "a" / "data.json").read_text(encoding="utf-8")) == {"id": "a"}
+    assert not (tmp_path / "a" / "data.json.tmp").exists()
+
+    # 崩溃：WAL 已写、记录与进度都没落地；只读的 peek_progress 能看到 WAL 里的进度
+    writer.add_record("ids", ["c", "丙"])
+    writer.set_progress(str(progress), {"next_index": 4})
+    writer._apply = lambda _batch: (_ for _ in ()).throw(KeyboardInterrupt)
+    with pytest.raises(KeyboardInterrupt):
+        writer.commit()
+    assert peek_progress(str(wal), str(progress)) == {"next_index": 4}
+    assert json.loads(progress.read_text(encoding="utf-8")) == {"next_index": 3}
+
+    # 没有对应回调的写入器不重放也不丢弃这批记录
+    assert RunWriter(str(wal)).recovered == 0 and wal.exists()
+    assert RunWriter(str(wal), sinks=sinks).recovered == 2
+    assert calls[-1] == [["c", "丙"]] and not wal.exists()
+    assert peek_progress(str(wal), str(progress)) == {"next_index": 4}
+    assert peek_progress(str(wal), str(tmp_path / "missing.json")) is None
+
+
+def _load_historycards_module():
+    module_path = _REPO_ROOT / "history" / "historycards.py"
+    module_name = "historycards_for_run_writer_tests"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_historycards_group_commits_progress_and_logs(tmp_path, monkeypatch):
+    module = _load_historycards_module()
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("甲\n乙\n丙\n丁\n", encoding="utf-8")
+    resources_dir = tmp_path / "resources"
+    good = '{"period":"汉","year_estimate":1,"meaning":"x","story":"y","prompt":"p","popular":5}'
+
+    commits = []
+    original_commit = RunWriter.commit
+
+    def counting_commit(self):
+        commits.append(self.pending)
+        return original_commit(self)
+
+    monkeypatch.setattr(RunWriter, "commit", counting_commit)
+    sink_calls = []
+    for cls, name in ((CardIdIndex, "put_many"), (ManifestStore, "append_many")):
+        original = getattr(cls, name)
+
+        def counting_sink(self, items, _original=original, _name=name):
+            sink_calls.append((_name, len(items)))
+            return _original(self, items)
+
+        monkeypatch.setattr(cls, name, counting_sink)
+    monkeypatch.setattr(module, "load_llm_config", lambda _path: object())
+    monkeypatch.setattr(
+        module, "setup_llm_client", lambda _cfg, _logger: (object(), "dummy", ["model-x"])
+    )
+    monkeypatch.setattr(
+        module,
+        "generate_llm_response_single",
+        lambda _c, _s, prompt, _m, _l: "not json" if "丙" in prompt else good,
+    )
+
+    rc = module.main(
+        [
+            "--input",
+            str(input_file),
+            "--resources-dir",
+            str(resources_dir),
+            "--max-retries",
+            "1",
+            "--retry-wait-base",
+            "0",
+            "--retry-wait-max",
+            "0",
+            "--io-commit-interval",
+            "60",
+        ]
+    )
+    assert rc == 2
+    # 4 条成语（含 1 条失败：runlog、errors、progress 与 error 文件）只在结束时提交一次
+    assert len([n for n in commits if n]) == 1 and max(commits) >= 10
+    # 3 张成功的卡：data.json、索引行与日志行同批提交，索引与日志各一次事务
+    assert sorted(sink_calls) == [("append_many", 3), ("put_many", 3)]
+    index = CardIdIndex(str(resources_dir / ".card_index.sqlite"))
+    assert sorted(name for _id, name in index.items()) == ["丁", "乙", "甲"]
+    index.close()
+
+    runlog = [
+        json.loads(line)
+        for line in (resources_dir / "historycards_runlog.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    assert [r["status"] for r in runlog] == ["ok", "ok", "failed", "ok"]
+    progress = json.loads(
+        (resources_dir / ".historycards_progress.json").read_text(encoding="utf-8")
+    )
+    assert progress["next_index"] == 5
+    errors = (resources_dir / "cards" / "_errors.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(errors[0])["idiom"] == "丙"
+    assert (
+        (Path(json.loads(errors[0])["error_file"]))
+        .read_text(encoding="utf-8")
+        .startswith("JSONDecodeError")
+    )
@@ -0,0 +1,125 @@
+# codex: 2026-10-18 分片运行单测折行到 ≤100
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from history import historycards, shard_runner  # noqa: E402
+from utils.llm_loadtest import mock_config  # noqa: E402
+from utils.llm_mockserver import MockLLMServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    server = MockLLMServer()
+    yield server
+    server.close()
+
+
+def test_plan_splits_contiguous_ranges(tmp_path):
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text("\n".join("甲乙丙丁戊己庚") + "\n", encoding="utf-8")
+    shard_dir = tmp_path / "shards"
+
+    plan = shard_runner.make_plan(
+        str(shard_dir), 3, str(input_file), str(tmp_path / "res"), ["--workers", "2"], start=2
+    )
+    assert [(s["start"], s["end"]) for s in plan["shards"]] == [(2, 3), (4, 5), (6, 7)]
+    assert shard_runner.load_plan(str(shard_dir))["historycards_args"] == ["--workers", "2"]
+    assert (shard_dir / "input.txt").read_text(encoding="utf-8") == input_file.read_text(
+        encoding="utf-8"
+    )
+    assert json.loads((shard_dir / "seed_manifest.json").read_text(encoding="utf-8"))["cards"] == []
+
+
+def test_claims_are_exclusive_and_stale_claims_can_be_taken_over(tmp_path):
+    shard = {"name": "shard_000", "start": 1, "end": 1}
+    assert shard_runner.try_claim(str(tmp_path), shard, "a:1", lease_s=60)
+    assert not shard_runner.try_claim(str(tmp_path), shard, "b:2", lease_s=60)
+
+    claim = tmp_path / "shard_000" / "claim.json"
+    old = time.time() - 120
+    os.utime(claim, (old, old))
+    assert shard_runner.try_claim(str(tmp_path), shard, "b:2", lease_s=60)
+    assert json.loads(claim.read_text(encoding="utf-8"))["owner"] == "b:2"
+    assert sorted(p.name for p in claim.parent.iterdir()) == ["claim.json"]
+
+    (tmp_path / "shard_000" / "done.json").write_text("{}", encoding="utf-8")
+    claim.unlink()
+    assert not shard_runner.try_claim(str(tmp_path), shard, "c:3", lease_s=60)
+
+
+def test_work_then_merge_reassigns_cross_shard_homophones(tmp_path, monkeypatch, server):
+    # 分片在子进程里运行，LLM 由本地模拟服务提供（通过 --config 传给子进程）
+    config_file = tmp_path / "config.ini"
+    with open(config_file, "w", encoding="utf-8") as f:
+        mock_config(server.url).write(f)
+    children = []
+    real_run = shard_runner.run_historycards
+    monkeypatch.setattr(
+        shard_runner, "run_historycards", lambda argv: children.append(argv) or real_run(argv)
+    )
+
+    input_file = tmp_path / "idioms.txt"
+    input_file.write_text(
+        "甲\n乙\n假\n丙\n", encoding="utf-8"
+    )  # 甲 / 假 拼音 id 都是 jia，分在不同分片
+    resources_dir = tmp_path / "resources"
+    shard_dir = tmp_path / "shards"
+    hc_args = ["--max-retries", "1", "--card-rel-dir-template", "cards/{shard2}/{id}"]
+    hc_args += ["--config", str(config_file)]
+    shard_runner.make_plan(str(shard_dir), 2, str(input_file), str(resources_dir), hc_args)
+
+    assert shard_runner.work(str(shard_dir), [], lease_s=60) == 0
+    assert len(children) == 2 and server.stats()["requests"] == 4
+    status = shard_runner.status(str(shard_dir))
+    assert status["done"] == 2 and status["pending"] == 0
+    # 两个分片各自独立分配 id，都拿到了 jia
+    shard_ids = {
+        name: [c["id"] for c in shard_runner._shard_cards(str(shard_dir / name))]
+        for name in ("shard_000", "shard_001")
+    }
+    assert shard_ids == {"shard_000": ["jia", "yi"], "shard_001": ["jia", "bing"]}
+
+    # 分片在卡片目录里写的其他文件随卡片一起合并（改 id 时搬到新目录）
+    (shard_dir / "shard_001" / "cards" / "ji" / "jia" / "image.png").write_bytes(b"png")
+    report = shard_runner.merge(str(shard_dir))
+    assert report["merged"] == 4 and report["skipped"] == 0
+    assert [(r["name"], r["id"]) for r in report["renamed"]] == [("假", "jia_3eab97")]
+
+    manifest = json.loads((resources_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert [(c["name"], c["id"]) for c in manifest["cards"]] == [
+        ("甲", "jia"),
+        ("乙", "yi"),
+        ("假", "jia_3eab97"),
+        ("丙", "bing"),
+    ]
+    data = json.loads(
+        (resources_dir / "cards" / "ji" / "jia_3eab97" / "data.json").read_text(encoding="utf-8")
+    )
+    assert data["id"] == "jia_3eab97" and data["name"] == "假"
+    assert data["image_path"] == "cards/jia_3eab97/image.png"
+    moved = resources_dir / "cards" / "ji" / "jia_3eab97" / "image.png"
+    assert moved.read_bytes() == b"png"
+    assert not (resources_dir / "cards" / "ji" / "jia" / "image.png").exists()
+
+    # 重复合并是幂等的；合并后的主目录按序续跑不需要再调用模型
+    again = shard_runner.merge(str(shard_dir))
+    assert again["merged"] == 0 and again["skipped"] == 4
+    assert (
+        historycards.main(
+            ["--input", str(input_file), "--resources-dir", str(resources_dir), *hc_args]
+        )
+        == 0
+    )
+    assert server.stats()["requests"] == 4
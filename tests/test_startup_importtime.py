@@ -0,0 +1,57 @@
+# codex: 2026-10-18 启动导入耗时基准折行到 ≤100，预算不变
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+_SCRIPT = _REPO_ROOT / "history" / "historycards.py"
+
+# 不调用模型的路径不应加载这些模块
+_HEAVY_MODULES = ("openai", "requests", "zai", "zhipuai", "pypinyin", "httpx")
+# 导入耗时预算（毫秒，不含解释器自身的 site 初始化）；负载较高的机器上可通过环境变量放宽
+_BUDGET_MS = float(os.environ.get("HISTORYCARDS_IMPORT_BUDGET_MS", "1000"))
+
+
+def _importtime(args: list[str]) -> dict:
+    """运行 historycards 并解析 `-X importtime` 输出，返回 {顶层模块名: 累计耗时 µs}（只含直接由脚本触发的导入）。"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(_SCRIPT), *args],
+        cwd=str(_REPO_ROOT),
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    modules: dict = {}
+    top_level: dict = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        if not cumulative_us.strip().isdigit():
+            continue  # 表头
+        stripped = name.strip()
+        modules[stripped.split(".")[0]] = True
+        if name.startswith(" ") and not name.startswith("  "):
+            top_level[stripped] = int(cumulative_us)
+    return {"modules": set(modules), "top_level": top_level}
+
+
+@pytest.mark.parametrize("args", [["--help"], ["--range", "1-3", "--dry-run"]])
+def test_cli_startup_skips_provider_sdks(args):
+    result = _importtime(args)
+    loaded = sorted(m for m in _HEAVY_MODULES if m in result["modules"])
+    assert not loaded, f"provider SDKs imported at startup: {loaded}"
+
+    top_level = result["top_level"]
+    total_ms = sum(us for name, us in top_level.items() if name not in ("site", "encodings")) / 1000
+    slowest = sorted(top_level.items(), key=lambda kv: -kv[1])[:5]
+    budget = f"budget {_BUDGET_MS:.0f} ms"
+    assert total_ms < _BUDGET_MS, f"startup imports took {total_ms:.0f} ms ({budget}): {slowest}"
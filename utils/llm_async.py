@@ -0,0 +1,178 @@
+# codex: 2026-10-18 多 key 池换 key 重发的 429 通过 on_throttle 通知共享限流器
+"""asyncio 版本的 LLM 调用：`setup_async_llm_client` / `agenerate_llm_response(_single)`。"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    from utils.llm_client import (
+        DEFAULT_MAX_CONCURRENCY,
+        OPENAI_COMPATIBLE_SOURCES,
+        PROVIDER_SECTIONS,
+        _build_keyed_client,
+        _get_max_concurrency,
+        _key_entries,
+        _openai_sdk,
+        generate_llm_response_single,
+        setup_llm_client,
+    )
+    from utils.llm_keypool import KeyPool
+    from utils.llm_ratelimit import estimate_tokens, get_rate_limiter
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_client import (
+        DEFAULT_MAX_CONCURRENCY,
+        OPENAI_COMPATIBLE_SOURCES,
+        PROVIDER_SECTIONS,
+        _build_keyed_client,
+        _get_max_concurrency,
+        _key_entries,
+        _openai_sdk,
+        generate_llm_response_single,
+        setup_llm_client,
+    )
+    from llm_keypool import KeyPool
+    from llm_ratelimit import estimate_tokens, get_rate_limiter
+
+
+class AsyncLLMClient:
+    """asyncio 客户端：按 provider 共享连接池，并用信号量限制同时在途的请求数。
+
+    - OpenAI 兼容服务：使用 `AsyncOpenAI`（内部 httpx 连接池，keep-alive 复用）
+    - 其他服务（ZhipuAI / Doubao / Mistral / Gemini Web 等）：SDK 没有原生异步接口，
+      在专用线程池中调用同步客户端；线程池大小与并发上限一致，不占用默认 executor
+    """
+
+    def __init__(
+        self,
+        llm_source: str,
+        sync_client,
+        async_client=None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        self.llm_source = llm_source
+        self.sync_client = sync_client
+        self.async_client = async_client
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix=f"llm-{self.llm_source}"
+            )
+        return self._executor
+
+    async def aclose(self) -> None:
+        """关闭连接池与线程池；批处理结束时调用一次。"""
+        if isinstance(self.async_client, KeyPool):
+            for slot in self.async_client.slots:
+                await slot.client.close()
+        elif self.async_client is not None and hasattr(self.async_client, 'close'):
+            await self.async_client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        sync_clients = (
+            [slot.client for slot in self.sync_client.slots]
+            if isinstance(self.sync_client, KeyPool)
+            else [self.sync_client]
+        )
+        for sync_client in sync_clients:
+            if isinstance(sync_client, dict) and sync_client.get('session') is not None:
+                sync_client['session'].close()
+
+
+def setup_async_llm_client(config, logger=None):
+    """根据配置创建异步客户端，返回 `(AsyncLLMClient, llm_source, models)`。
+
+    并发上限读取 provider Section 下的 `max_concurrency`（默认 16）。
+    """
+    sync_client, llm_source, models = setup_llm_client(config, logger)
+    max_concurrency = _get_max_concurrency(config, llm_source)
+    async_client = None
+    if llm_source in OPENAI_COMPATIBLE_SOURCES:
+        section = PROVIDER_SECTIONS[llm_source]
+        AsyncOpenAI = _openai_sdk().AsyncOpenAI
+        async_client = _build_keyed_client(
+            config,
+            llm_source,
+            _key_entries(config, section),
+            lambda key, url: AsyncOpenAI(api_key=key, base_url=url),
+        )
+    if logger:
+        mode = "native async" if async_client is not None else "thread pool"
+        logger.info(
+            f"Async LLM client ready: source={llm_source}, "
+            f"max_concurrency={max_concurrency}, mode={mode}"
+        )
+    return (
+        AsyncLLMClient(llm_source, sync_client, async_client, max_concurrency),
+        llm_source,
+        models,
+    )
+
+
+async def agenerate_llm_response_single(
+    client: AsyncLLMClient, llm_source, prompt: str, model_name: str, logger=None
+) -> str:
+    """`generate_llm_response_single` 的 asyncio 版本（不做回退），受 provider 并发上限约束。"""
+    async with client.semaphore:
+        if client.async_client is not None and llm_source in OPENAI_COMPATIBLE_SOURCES:
+            limiter = get_rate_limiter(llm_source, model_name)
+            lease = await limiter.aacquire(estimate_tokens(prompt)) if limiter is not None else None
+            try:
+
+                def _create(async_client):
+                    return async_client.chat.completions.create(
+                        model=model_name, messages=[{"role": "user", "content": prompt}]
+                    )
+
+                if isinstance(client.async_client, KeyPool):
+                    response = await client.async_client.acall(
+                        _create, on_throttle=limiter.on_throttle if limiter is not None else None
+                    )
+                else:
+                    response = await _create(client.async_client)
+                text = response.choices[0].message.content.strip()
+            except Exception as exc:
+                if lease is not None:
+                    lease.release(ok=False, exc=exc)
+                raise
+            if lease is not None:
+                lease.release(ok=True, tokens_used=estimate_tokens(prompt) + estimate_tokens(text))
+            return text
+        # 同步实现内部已经过限流器
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            client.executor,
+            generate_llm_response_single,
+            client.sync_client,
+            llm_source,
+            prompt,
+            model_name,
+            logger,
+        )
+
+
+async def agenerate_llm_response(
+    client: AsyncLLMClient, llm_source, prompt: str, models: list, logger=None
+) -> str:
+    """`generate_llm_response` 的 asyncio 版本：按 models 顺序回退。"""
+    errors = []
+    for model_name in models:
+        try:
+            return await agenerate_llm_response_single(
+                client, llm_source, prompt, model_name, logger
+            )
+        except Exception as e:
+            error_msg = f"Model '{model_name}' failed: {e}"
+            if logger:
+                logger.warning(error_msg)
+            errors.append(error_msg)
+    final_error_message = f"All fallback models failed for source '{llm_source}'. Errors: {errors}"
+    if logger:
+        logger.error(final_error_message)
+    raise Exception(final_error_message)
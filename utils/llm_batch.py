@@ -0,0 +1,177 @@
+# codex: 2026-10-18 批量任务模块折行到 ≤100，逻辑不变
+"""
+OpenAI 兼容的 Batch API 流程（OpenAI / DeepSeek 等兼容服务，以及 ZhipuAI 的 `/v4/chat/completions` 批处理）。
+
+客户端需要提供 `files.create / files.content / batches.create / batches.retrieve`，
+即 `setup_llm_client` 返回的 `OpenAI` 对象或 ZhipuAI 字典里的 SDK 客户端。
+配置了多个 API key（`KeyPool`）时固定使用第一个 key：批量任务与上传的文件属于同一个账号。
+Doubao（方舟）的批量推理需在控制台创建任务，不走这套接口。
+"""
+
+import json
+import os
+import time
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    from utils.llm_keypool import KeyPool
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_keypool import KeyPool
+
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+_BATCH_ENDPOINTS = {
+    "zhipuai": "/v4/chat/completions",
+}
+
+
+def batch_endpoint(llm_source: str) -> str:
+    return _BATCH_ENDPOINTS.get(llm_source, "/v1/chat/completions")
+
+
+def _unwrap_pool(client):
+    return client.primary if isinstance(client, KeyPool) else client
+
+
+def _sdk_client(client):
+    client = _unwrap_pool(client)
+    return client.get("client") if isinstance(client, dict) else client
+
+
+def supports_batch(client) -> bool:
+    sdk = _sdk_client(client)
+    return hasattr(sdk, "batches") and hasattr(sdk, "files")
+
+
+def build_batch_requests(
+    client, llm_source: str, model_name: str, items: Iterable[Tuple[str, str]]
+) -> list:
+    """items: (custom_id, prompt)。ZhipuAI 会带上客户端配置的 system_prompt / temperature。"""
+    client = _unwrap_pool(client)
+    system_prompt = client.get("system_prompt") if isinstance(client, dict) else None
+    temperature = client.get("temperature") if isinstance(client, dict) else None
+    url = batch_endpoint(llm_source)
+    out = []
+    for custom_id, prompt in items:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        body = {"model": model_name, "messages": messages}
+        if temperature is not None:
+            body["temperature"] = temperature
+        out.append({"custom_id": str(custom_id), "method": "POST", "url": url, "body": body})
+    return out
+
+
+def write_batch_jsonl(path: str, requests_: list) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for req in requests_:
+            f.write(json.dumps(req, ensure_ascii=False) + "\n")
+    return path
+
+
+def submit_batch(
+    client, llm_source: str, jsonl_path: str, metadata: Optional[dict] = None, logger=None
+) -> str:
+    """上传 JSONL 并创建批处理任务，返回 batch id。"""
+    sdk = _sdk_client(client)
+    with open(jsonl_path, "rb") as f:
+        uploaded = sdk.files.create(file=f, purpose="batch")
+    kwargs = {
+        "input_file_id": uploaded.id,
+        "endpoint": batch_endpoint(llm_source),
+        "completion_window": "24h",
+    }
+    if metadata:
+        kwargs["metadata"] = metadata
+    batch = sdk.batches.create(**kwargs)
+    if logger:
+        logger.info(
+            f"Batch submitted: id={batch.id}, input_file={uploaded.id}, "
+            f"endpoint={kwargs['endpoint']}"
+        )
+    return batch.id
+
+
+def poll_batch(
+    client,
+    batch_id: str,
+    poll_interval: float = 30.0,
+    timeout: Optional[float] = None,
+    logger=None,
+    sleep: Callable[[float], None] = time.sleep,
+    should_stop: Optional[Callable[[], bool]] = None,
+):
+    """轮询直到任务进入终态；返回最终的 batch 对象。超时或 should_stop() 为真时返回当前状态。"""
+    sdk = _sdk_client(client)
+    started = time.monotonic()
+    last_status = None
+    while True:
+        batch = sdk.batches.retrieve(batch_id)
+        status = getattr(batch, "status", None)
+        if logger and status != last_status:
+            counts = getattr(batch, "request_counts", None)
+            logger.info(f"Batch {batch_id}: status={status}, request_counts={counts}")
+            last_status = status
+        if status in BATCH_TERMINAL_STATUSES:
+            return batch
+        if timeout is not None and time.monotonic() - started >= timeout:
+            return batch
+        if should_stop is not None and should_stop():
+            return batch
+        sleep(poll_interval)
+
+
+def _read_file_text(resp) -> str:
+    text = getattr(resp, "text", None)
+    if isinstance(text, str):
+        return text
+    content = getattr(resp, "content", None)
+    if isinstance(content, (bytes, bytearray)):
+        return content.decode("utf-8")
+    if hasattr(resp, "read"):
+        data = resp.read()
+        return data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else str(data)
+    if isinstance(resp, (bytes, bytearray)):
+        return resp.decode("utf-8")
+    return str(resp)
+
+
+def parse_batch_output_line(line: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """解析一行输出，返回 (custom_id, text, error)。"""
+    record = json.loads(line)
+    custom_id = str(record.get("custom_id"))
+    error = record.get("error")
+    response = record.get("response") or {}
+    status_code = response.get("status_code")
+    if error:
+        return (
+            custom_id,
+            None,
+            json.dumps(error, ensure_ascii=False) if not isinstance(error, str) else error,
+        )
+    if status_code is not None and status_code != 200:
+        return (
+            custom_id,
+            None,
+            f"HTTP {status_code}: {json.dumps(response.get('body'), ensure_ascii=False)}",
+        )
+    try:
+        text = response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return custom_id, None, "Batch response missing choices[0].message.content"
+    return custom_id, (text or "").strip(), None
+
+
+def iter_batch_results(client, batch) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """逐行读取输出文件与错误文件，产出 (custom_id, text, error)。"""
+    sdk = _sdk_client(client)
+    for attr in ("output_file_id", "error_file_id"):
+        file_id = getattr(batch, attr, None)
+        if not file_id:
+            continue
+        for line in _read_file_text(sdk.files.content(file_id)).splitlines():
+            if line.strip():
+                yield parse_batch_output_line(line)
@@ -0,0 +1,226 @@
+# codex: 2026-10-18 LLM 响应缓存模块折行到 ≤100，逻辑不变
+"""
+LLM 响应缓存：key = sha256(llm_source, model, sha256(prompt), temperature)。
+
+模式：
+  - off：不读不写
+  - readwrite：命中直接返回，未命中调用模型后写入（默认）
+  - readonly：只读命中，不写入新结果
+  - replay：只读命中，未命中抛 `CacheMissError`（离线回放 / 测试，绝不调用模型）
+
+同一个缓存文件可以被多个线程/进程共享（SQLite WAL 模式）。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+CACHE_MODES = ("off", "readwrite", "readonly", "replay")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    llm_source TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_sha256 TEXT NOT NULL,
+    temperature TEXT,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access);
+CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses(created_at);
+"""
+
+
+class CacheMissError(LookupError):
+    """replay 模式下缓存未命中。"""
+
+
+def make_cache_key(llm_source: str, model: str, prompt: str, temperature=None) -> str:
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    material = json.dumps([llm_source, model, prompt_hash, temperature], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite 响应缓存；线程安全。`max_bytes`/`max_age_s` 为 0 表示不限。"""
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "readwrite",
+        max_bytes: int = 0,
+        max_age_s: float = 0,
+        evict_every: int = 200,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_s = max(0.0, float(max_age_s))
+        self.evict_every = max(1, int(evict_every))
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        if mode != "off":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+            if self.writable:
+                self.evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def writable(self) -> bool:
+        return self.mode == "readwrite"
+
+    def _fetch(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_s and now - row[1] > self.max_age_s):
+                return None
+            if self.writable:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            return row[0]
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            self.counters["hits" if hit else "misses"] += 1
+
+    def get(self, llm_source: str, model: str, prompt: str, temperature=None) -> Optional[str]:
+        """命中返回响应文本；未命中返回 None（replay 模式抛 CacheMissError）。"""
+        if self._conn is None:
+            return None
+        text = self._fetch(make_cache_key(llm_source, model, prompt, temperature))
+        self._count(text is not None)
+        if text is None and self.mode == "replay":
+            raise CacheMissError(f"Cache miss in replay mode: source={llm_source}, model={model}")
+        return text
+
+    def lookup(
+        self, llm_source: str, models: list, prompt: str, temperature=None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """按模型回退顺序查找，返回 (model, text)；都未命中返回 (None, None)（replay 模式抛 CacheMissError）。"""
+        if self._conn is None:
+            return None, None
+        for model in models:
+            text = self._fetch(make_cache_key(llm_source, model, prompt, temperature))
+            if text is not None:
+                self._count(True)
+                return model, text
+        self._count(False)
+        if self.mode == "replay":
+            raise CacheMissError(
+                f"Cache miss in replay mode: source={llm_source}, models={list(models)}"
+            )
+        return None, None
+
+    def put(
+        self, llm_source: str, model: str, prompt: str, response: str, temperature=None
+    ) -> bool:
+        if self._conn is None or not self.writable:
+            return False
+        key = make_cache_key(llm_source, model, prompt, temperature)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    llm_source,
+                    model,
+                    prompt_hash,
+                    None if temperature is None else str(temperature),
+                    response,
+                    len(response.encode("utf-8")),
+                    now,
+                    now,
+                ),
+            )
+            self._conn.commit()
+            self.counters["writes"] += 1
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= self.evict_every
+        if due:
+            self.evict()
+        return True
+
+    def invalidate(self, llm_source: str, model: str, prompt: str, temperature=None) -> bool:
+        """删除一条缓存（例如缓存内容后来被判定为无效）。"""
+        if self._conn is None or not self.writable:
+            return False
+        key = make_cache_key(llm_source, model, prompt, temperature)
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            if cur.rowcount:
+                self.counters["invalidations"] += 1
+            return bool(cur.rowcount)
+
+    def evict(self) -> int:
+        """按时间（created_at）与总大小（最久未访问优先）淘汰；返回删除条数。"""
+        if self._conn is None or not self.writable:
+            return 0
+        removed = 0
+        with self._lock:
+            self._puts_since_evict = 0
+            if self.max_age_s:
+                cur = self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_s,)
+                )
+                removed += cur.rowcount
+            if self.max_bytes:
+                total = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    doomed = []
+                    for key, size in self._conn.execute(
+                        "SELECT key, size FROM responses ORDER BY last_access ASC"
+                    ):
+                        if total <= self.max_bytes:
+                            break
+                        doomed.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                    removed += len(doomed)
+            self._conn.commit()
+            self.counters["evictions"] += removed
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["mode"] = self.mode
+            if self._conn is not None:
+                count, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                out["entries"] = count
+                out["bytes"] = size
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
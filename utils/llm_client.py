@@ -0,0 +1,390 @@
+# codex: 2026-10-18 多 key 池换 key 重发的 429 通过 on_throttle 通知共享限流器
+"""LLM 配置、客户端创建（单 key / 多 key 池）与单模型同步调用；对外入口见 `llm_api`。"""
+
+import configparser
+import os
+from typing import Any, Callable, Optional
+
+# from google.oauth2 import service_account
+# from google.cloud import aiplatform
+# from vertexai.generative_models import GenerativeModel
+# from volcenginesdkarkruntime import Ark
+try:
+    from utils.llm_ratelimit import configure_rate_limits, estimate_tokens, get_rate_limiter
+except ModuleNotFoundError:  # 以 `llm_client` 顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_ratelimit import configure_rate_limits, estimate_tokens, get_rate_limiter
+try:
+    from utils.llm_keypool import (
+        DEFAULT_FAILURE_THRESHOLD,
+        DEFAULT_QUARANTINE_S,
+        KeyPool,
+        mask_key,
+        split_config_list,
+    )
+except ModuleNotFoundError:
+    from llm_keypool import (
+        DEFAULT_FAILURE_THRESHOLD,
+        DEFAULT_QUARANTINE_S,
+        KeyPool,
+        mask_key,
+        split_config_list,
+    )
+try:
+    from utils.llm_gemini import _invoke_gemini_web, _requests
+except ModuleNotFoundError:
+    from llm_gemini import _invoke_gemini_web, _requests
+# from mistralai import Mistral
+
+
+# provider SDK 延迟导入：`--help`、`--dry-run`、全部跳过的续跑等不调用模型的路径不付 openai/requests 的导入成本；
+# 真正用到时由 setup_llm_client（或对应调用路径）按所选 provider 导入一次，之后走 sys.modules 缓存。
+def _openai_sdk():
+    import openai
+
+    return openai
+
+
+def _zhipu_client_classes():
+    """返回 (ZhipuAiClient, ZhipuAI)；未安装的 SDK 为 None。优先新版 zai，旧版 zhipuai 兜底。"""
+    try:
+        from zai import ZhipuAiClient  # New official-style client (OpenAI-like)
+    except Exception:  # pragma: no cover - optional import fallback
+        ZhipuAiClient = None
+    try:
+        from zhipuai import ZhipuAI  # Legacy SDK fallback
+    except Exception:  # pragma: no cover - optional import fallback
+        ZhipuAI = None
+    return ZhipuAiClient, ZhipuAI
+
+
+DEFAULT_LLM_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.ini')
+
+OPENAI_COMPATIBLE_SOURCES = ['deepseek', 'openai', 'openrouter', 'xiaomimimo']
+DEFAULT_MAX_CONCURRENCY = 16
+
+# llmsource -> config.ini 中对应的 Section 名称
+PROVIDER_SECTIONS = {
+    'deepseek': 'DeepSeek',
+    'openai': 'OpenAI',
+    'openrouter': 'OpenRouter',
+    'xiaomimimo': 'XiaomiMimo',
+    'google': 'Google',
+    'mistral': 'Mistral',
+    'zhipuai': 'ZhipuAI',
+    'googlecloud': 'googlecloud',
+    'doubao': 'Doubao',
+    'geminiweb': 'GeminiWeb',
+}
+
+
+def load_llm_config(config_file: Optional[str] = None):
+    """加载 LLM 相关的配置信息"""
+    config = configparser.ConfigParser()
+    target_path = config_file or DEFAULT_LLM_CONFIG_PATH
+    config.read(target_path, encoding='utf-8')  # Specify encoding
+    return config
+
+
+def _key_entries(config, section: str, base_url_required: bool = True) -> list:
+    """读取 `[section]` 的 key 列表：`[(api_key, base_url), ...]`。
+
+    `api_keys` 存在时按逗号/换行拆分；`base_urls` 可以只写一个（所有 key 共用）或与 key 一一对应，
+    不写时退回 `base_url`。没有 `api_keys` 时返回单个 `(api_key, base_url)`。
+    """
+    keys = split_config_list(config.get(section, 'api_keys', fallback=None))
+    if not keys:
+        base_url = (
+            config.get(section, 'base_url')
+            if base_url_required
+            else config.get(section, 'base_url', fallback=None)
+        )
+        return [(config.get(section, 'api_key'), base_url)]
+    base_urls = split_config_list(config.get(section, 'base_urls', fallback=None))
+    if not base_urls:
+        base_url = (
+            config.get(section, 'base_url')
+            if base_url_required
+            else config.get(section, 'base_url', fallback=None)
+        )
+        base_urls = [base_url]
+    if len(base_urls) == 1:
+        base_urls = base_urls * len(keys)
+    if len(base_urls) != len(keys):
+        raise ValueError(
+            f"[{section}] base_urls has {len(base_urls)} entries but api_keys has {len(keys)}."
+        )
+    return list(zip(keys, base_urls))
+
+
+def _key_count(config, section: str) -> int:
+    return max(1, len(split_config_list(config.get(section, 'api_keys', fallback=None))))
+
+
+def _build_keyed_client(
+    config, llm_source: str, entries: list, make_client: Callable[[str, Optional[str]], Any]
+):
+    """单个 key 时直接返回客户端；多个 key 时每个 key 一个客户端，组成 `KeyPool`。"""
+    if len(entries) == 1:
+        return make_client(*entries[0])
+    section = PROVIDER_SECTIONS[llm_source]
+    return KeyPool(
+        llm_source,
+        [
+            (f"{i}:{mask_key(api_key)}", make_client(api_key, base_url))
+            for i, (api_key, base_url) in enumerate(entries)
+        ],
+        strategy=config.get(section, 'key_strategy', fallback='round_robin').strip().lower(),
+        quarantine_s=config.getfloat(section, 'key_quarantine_s', fallback=DEFAULT_QUARANTINE_S),
+        failure_threshold=config.getint(
+            section, 'key_failure_threshold', fallback=DEFAULT_FAILURE_THRESHOLD
+        ),
+    )
+
+
+def _get_max_concurrency(config, llm_source: str) -> int:
+    """读取 `[Section] max_concurrency`（单进程内同时在途的请求上限；按单个 key 填写，多个 key 时按 key 数放大）。"""
+    section = PROVIDER_SECTIONS.get(llm_source, llm_source)
+    value = config.getint(section, 'max_concurrency', fallback=DEFAULT_MAX_CONCURRENCY)
+    return max(1, value) * _key_count(config, section)
+
+
+def setup_llm_client(config, logger=None):
+    """根据配置设置 LLM 客户端"""
+    llm_source_raw = config.get('llmsources', 'llmsource', fallback='zhipuai')
+    llm_source = llm_source_raw.lower()
+
+    valid_sources = [
+        'deepseek',
+        'openai',
+        'openrouter',
+        'xiaomimimo',
+        'google',
+        'mistral',
+        'zhipuai',
+        'googlecloud',
+        'doubao',
+        'geminiweb',
+    ]
+
+    # Read proxy settings
+    use_proxy = config.getboolean('Proxy', 'use_proxy', fallback=False)
+    http_proxy = config.get('Proxy', 'http_proxy', fallback=None)
+    https_proxy = config.get('Proxy', 'https_proxy', fallback=None)
+    proxies = {}
+    if use_proxy and http_proxy:
+        proxies['http'] = http_proxy
+    if use_proxy and https_proxy:
+        proxies['https'] = https_proxy
+
+    models = []  # Initialize model list for fallback handling
+
+    if llm_source in OPENAI_COMPATIBLE_SOURCES:
+        # These are OpenAI-compatible and can support model lists
+        llm_source_name = PROVIDER_SECTIONS[llm_source]
+
+        entries = _key_entries(config, llm_source_name)
+        model_str = config.get(llm_source_name, 'model')
+        models = [m.strip() for m in model_str.split(',')]  # Parse comma-separated string
+        OpenAI = _openai_sdk().OpenAI
+        client = _build_keyed_client(
+            config, llm_source, entries, lambda key, url: OpenAI(api_key=key, base_url=url)
+        )
+        llm_info = f"{llm_source_name} API, models: {models}"
+
+    elif llm_source == 'google':
+        api_key = config.get('Google', 'api_key')
+        model_name = config.get('Google', 'model')
+        models = [model_name]  # Wrap single model in a list
+        region = config.get('Google', 'region')
+        llm_info = f"Google API, model: {model_name}, region: {region}"
+        client = None  # Placeholder
+
+    elif llm_source == 'mistral':
+        api_key = config.get('Mistral', 'api_key')
+        model_name = config.get('Mistral', 'model')
+        models = [model_name]  # Wrap single model in a list
+        client = Mistral(api_key=api_key)
+        llm_info = f"Mistral API, model: {model_name}"
+
+    elif llm_source == 'zhipuai':
+        entries = _key_entries(config, 'ZhipuAI', base_url_required=False)
+        model_name = config.get('ZhipuAI', 'model')
+        models = [model_name]  # Wrap single model in a list
+        temperature = config.getfloat('ZhipuAI', 'temperature', fallback=0.6)
+        system_prompt = config.get('ZhipuAI', 'system_prompt', fallback='你是一个有用的AI助手。')
+
+        ZhipuAiClient, ZhipuAI = _zhipu_client_classes()
+        # Legacy zhipuai SDK fallback keeps compatibility with older environments
+        sdk_class = ZhipuAiClient or ZhipuAI
+        if sdk_class is None:
+            raise RuntimeError(
+                "ZhipuAI SDK not available: neither 'zai' nor 'zhipuai' import succeeded."
+            )
+        client = _build_keyed_client(
+            config,
+            llm_source,
+            entries,
+            lambda key, url: {
+                # base_url 可选：指向代理或本地模拟服务（utils/llm_mockserver.py）时填写
+                "client": sdk_class(api_key=key, base_url=url) if url else sdk_class(api_key=key),
+                "temperature": temperature,
+                "system_prompt": system_prompt,
+            },
+        )
+        llm_info = f"ZhipuAI API, model: {model_name}"
+
+    elif llm_source == 'googlecloud':
+        # ... (googlecloud logic remains the same, model will be a list with one item)
+        model_name = config.get('googlecloud', 'model')
+        models = [model_name]
+        # ... (rest of the googlecloud logic)
+        llm_info = f"Google Cloud API, model: {model_name}, project: {project_id}, region: {region}"
+
+    elif llm_source == 'doubao':
+        api_key = config.get('Doubao', 'api_key')
+        base_url = config.get('Doubao', 'base_url')
+        model_name = config.get('Doubao', 'model')
+        models = [model_name]  # Wrap single model in a list
+        os.environ['ARK_API_KEY'] = api_key
+        client = Ark(base_url=base_url)
+        llm_info = f"Doubao API, model: {model_name}"
+    elif llm_source == 'geminiweb':
+        section = 'GeminiWeb'
+        entries = [(key, url.rstrip('/')) for key, url in _key_entries(config, section)]
+        model_name = config.get(section, 'model')
+        timeout = config.getint(section, 'timeout', fallback=60)
+        auth_mode = config.get(section, 'auth_mode', fallback='auto').lower()
+        auth_header = config.get(section, 'auth_header', fallback='Authorization')
+        auth_scheme = config.get(section, 'auth_scheme', fallback='Bearer')
+        auth_query_param = config.get(section, 'auth_query_param', fallback='key')
+        requests = _requests()
+        # keep-alive 连接池大小与（单个 key 的）并发上限一致，避免多线程/协程并发时反复建连
+        pool_size = _get_max_concurrency(config, llm_source) // len(entries) or 1
+
+        def _gemini_client(api_key, base_url):
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            if proxies:
+                session.proxies.update(proxies)
+            return {
+                'session': session,
+                'base_url': base_url,
+                'api_key': api_key,
+                'timeout': timeout,
+                'auth_mode': auth_mode,
+                'auth_header': auth_header,
+                'auth_scheme': auth_scheme,
+                'auth_query_param': auth_query_param,
+            }
+
+        client = _build_keyed_client(config, llm_source, entries, _gemini_client)
+        models = [model_name]
+        endpoints = ', '.join(sorted({url for _, url in entries}))
+        llm_info = f"Gemini Web API, model: {model_name}, endpoint: {endpoints}"
+    else:
+        error_message = (
+            f"Invalid llmsource: '{llm_source_raw}'. "
+            f"Please choose from the following valid sources: {valid_sources}"
+        )
+        if logger:
+            logger.error(error_message)
+        raise ValueError(error_message)
+
+    if isinstance(client, KeyPool):
+        llm_info += f", {len(client)} API keys ({client.strategy})"
+    if logger:
+        logger.info(f"Using LLM: {llm_info}")
+    # 限流项按单个 key 填写，多个 key 时按 key 数放大
+    limits = configure_rate_limits(
+        config,
+        llm_source,
+        PROVIDER_SECTIONS[llm_source],
+        key_count=len(client) if isinstance(client, KeyPool) else 1,
+    )
+    if logger and limits:
+        logger.info(f"Rate limits for {llm_source}: {limits}")
+    return client, llm_source, models
+
+
+def get_client_temperature(client) -> Optional[float]:
+    """客户端上显式配置的 temperature（目前只有 ZhipuAI 会设置），用于缓存 key。"""
+    if isinstance(client, KeyPool):
+        client = client.primary
+    if isinstance(client, dict):
+        return client.get("temperature")
+    return None
+
+
+def generate_llm_response_single(
+    client, llm_source, prompt: str, model_name: str, logger=None
+) -> str:
+    """调用单个模型生成回复（不做回退）。配置了限流时先经过共享限流器。"""
+    limiter = get_rate_limiter(llm_source, model_name)
+    if limiter is None:
+        return _call_llm_single(client, llm_source, prompt, model_name, logger)
+    lease = limiter.acquire(estimate_tokens(prompt))
+    try:
+        text = _call_llm_single(client, llm_source, prompt, model_name, logger)
+    except Exception as exc:
+        lease.release(ok=False, exc=exc)
+        raise
+    lease.release(ok=True, tokens_used=estimate_tokens(prompt) + estimate_tokens(text))
+    return text
+
+
+def _call_llm_single(client, llm_source, prompt: str, model_name: str, logger=None) -> str:
+    """按 provider 分派的实际调用。"""
+    if isinstance(client, KeyPool):
+        limiter = get_rate_limiter(llm_source, model_name)
+        return client.call(
+            lambda c: _call_llm_single(c, llm_source, prompt, model_name, logger),
+            on_throttle=limiter.on_throttle if limiter is not None else None,
+        )
+
+    if llm_source == 'googlecloud':
+        response = client.generate_content(prompt)
+        return response.text
+
+    if llm_source == 'zhipuai':
+        client_obj = client.get("client") if isinstance(client, dict) else client
+        temperature = client.get("temperature", 0.6) if isinstance(client, dict) else 0.6
+        system_prompt = client.get("system_prompt") if isinstance(client, dict) else None
+
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+
+        response = client_obj.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+        )
+        return response.choices[0].message.content
+
+    if llm_source == 'doubao':
+        response = client.chat.completions.create(
+            model=model_name, messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    if llm_source == 'mistral':
+        response = client.chat.complete(
+            model=model_name, messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    if llm_source in OPENAI_COMPATIBLE_SOURCES:
+        response = client.chat.completions.create(
+            model=model_name, messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content.strip()
+
+    if llm_source == 'geminiweb':
+        return _invoke_gemini_web(client, model_name, prompt, logger)
+
+    raise ValueError(f"Unsupported llm_source: {llm_source}")
@@ -0,0 +1,165 @@
+# codex: 2026-10-18 从 llm_api.py 拆出 Gemini Web（REST / SSE）调用，llm_api 文件回到 500 行以内
+"""Gemini Web (`generativelanguage` REST API / 兼容网关) 的请求、SSE 解析与鉴权方式判断。"""
+
+import json
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+
+def _requests():
+    import requests
+
+    return requests
+
+
+def _invoke_gemini_web(
+    client_config: Dict[str, Any],
+    model_name: str,
+    prompt: str,
+    logger=None,
+    emit: Optional[Callable[[str], None]] = None,
+) -> str:
+    """调用 Gemini Web API 并解析响应；传入 `emit` 时改用 streamGenerateContent（SSE）逐段回调。"""
+    requests = _requests()
+    session = client_config.get('session') or requests.Session()
+    base_url = client_config.get('base_url', '').rstrip('/')
+    timeout = client_config.get('timeout', 60)
+    api_key = client_config.get('api_key')
+    configured_auth_mode = client_config.get('auth_mode', 'auto')
+
+    if not base_url:
+        raise ValueError("Gemini Web API base_url 未配置。")
+
+    endpoint = _build_gemini_endpoint(base_url, model_name, stream=emit is not None)
+    auth_mode = _resolve_auth_mode(base_url, configured_auth_mode)
+    headers = {'Content-Type': 'application/json'}
+    params = None
+    auth_header = client_config.get('auth_header', 'Authorization')
+    auth_scheme = client_config.get('auth_scheme', 'Bearer')
+    auth_query_param = client_config.get('auth_query_param', 'key')
+
+    if auth_mode == 'header':
+        token_value = f"{auth_scheme} {api_key}".strip() if auth_scheme else api_key
+        headers[(auth_header or 'Authorization')] = token_value
+    elif auth_mode == 'query':
+        marker = f"{auth_query_param}=".lower()
+        if marker not in endpoint.lower():
+            params = {auth_query_param: api_key}
+    if emit is not None and 'alt=sse' not in endpoint.lower():
+        params = dict(params or {}, alt='sse')
+
+    payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    try:
+        response = session.post(
+            endpoint,
+            json=payload,
+            headers=headers,
+            params=params,
+            timeout=timeout,
+            stream=emit is not None,
+        )
+        response.raise_for_status()
+    except requests.HTTPError as exc:
+        response_text = ""
+        if exc.response is not None:
+            try:
+                response_text = exc.response.text.strip()
+            except Exception:  # pragma: no cover - 响应文本读取失败忽略
+                response_text = ""
+        raise RuntimeError(f"Gemini Web API 请求失败: {exc} - {response_text}") from exc
+    except requests.RequestException as exc:
+        raise RuntimeError(f"Gemini Web API 请求失败: {exc}") from exc
+
+    if emit is not None:
+        return _read_gemini_sse(response, emit, logger)
+
+    try:
+        data = response.json()
+    except ValueError as exc:
+        raise RuntimeError("Gemini Web API 响应不是有效的 JSON") from exc
+
+    text = _extract_gemini_text(data)
+    if logger:
+        usage = data.get('usageMetadata', {})
+        logger.info(f"Gemini Web API 完成，usage={usage}")
+    return text
+
+
+def _read_gemini_sse(response, emit: Callable[[str], None], logger=None) -> str:
+    """逐行读取 `data: {...}` 事件，提取每段 candidates 文本。"""
+    parts = []
+    usage = {}
+    # SSE 固定为 UTF-8；Content-Type 不带 charset 时 requests 会按 ISO-8859-1 解码导致中文乱码
+    response.encoding = 'utf-8'
+    try:
+        for raw in response.iter_lines(decode_unicode=True):
+            if not raw or not raw.startswith('data:'):
+                continue
+            payload = raw[len('data:') :].strip()
+            if not payload or payload == '[DONE]':
+                continue
+            try:
+                event = json.loads(payload)
+            except ValueError as exc:
+                raise RuntimeError(
+                    f"Gemini Web API 流式事件不是有效的 JSON: {payload[:200]}"
+                ) from exc
+            usage = event.get('usageMetadata') or usage
+            for candidate in (event.get('candidates') or [])[:1]:
+                for part in candidate.get('content', {}).get('parts') or []:
+                    delta = part.get('text')
+                    if delta:
+                        parts.append(delta)
+                        emit(delta)
+    finally:
+        response.close()
+    content = ''.join(parts).strip()
+    if not content:
+        raise RuntimeError("Gemini Web API 响应缺少文本内容")
+    if logger:
+        logger.info(f"Gemini Web API 流式完成，usage={usage}")
+    return content
+
+
+def _build_gemini_endpoint(base_url: str, model_name: str, stream: bool = False) -> str:
+    """根据 base_url 构建 generateContent（或 streamGenerateContent）端点。"""
+    normalized = base_url.rstrip('/')
+    lowered = normalized.lower()
+    if 'models/' in lowered and (
+        ':generatecontent' in lowered or ':streamgeneratecontent' in lowered
+    ):
+        if stream and ':generatecontent' in lowered:
+            idx = lowered.index(':generatecontent')
+            return (
+                normalized[:idx]
+                + ':streamGenerateContent'
+                + normalized[idx + len(':generatecontent') :]
+            )
+        return normalized
+    method = 'streamGenerateContent' if stream else 'generateContent'
+    return f"{normalized}/v1beta/models/{model_name}:{method}"
+
+
+def _extract_gemini_text(response_json: Dict[str, Any]) -> str:
+    """从 Gemini Web 响应中提取文本内容。"""
+    candidates = response_json.get('candidates') or []
+    if not candidates:
+        raise RuntimeError("Gemini Web API 响应缺少 candidates 字段")
+
+    parts = candidates[0].get('content', {}).get('parts') or []
+    texts = [part.get('text', '') for part in parts if part.get('text')]
+    content = ''.join(texts).strip()
+    if not content:
+        raise RuntimeError("Gemini Web API 响应缺少文本内容")
+    return content
+
+
+def _resolve_auth_mode(base_url: str, configured_mode: Optional[str]) -> str:
+    """根据配置或域名决定鉴权模式。"""
+    if configured_mode and configured_mode not in ('', 'auto'):
+        return configured_mode
+    host = urlparse(base_url).netloc.lower()
+    if 'googleapis.com' in host:
+        return 'query'
+    return 'header'
@@ -0,0 +1,232 @@
+# codex: 2026-10-18 多 key 池模块折行到 ≤100，逻辑不变
+"""
+同一 provider Section 配置多个 API key（可选多个 base_url）时的客户端池。
+
+配置写在 `config.ini` 对应的 provider Section 下::
+
+    [DeepSeek]
+    api_keys = sk-aaa, sk-bbb, sk-ccc   ; 逗号或换行分隔；只写 api_key 时保持单客户端
+    base_urls = https://a/v1, https://b/v1   ; 可选：一个（所有 key 共用）或与 api_keys 一一对应
+    key_strategy = round_robin          ; round_robin（默认）/ least_loaded
+    key_quarantine_s = 60               ; 429 且没有 Retry-After 时隔离该 key 的秒数
+    key_failure_threshold = 3           ; 连续失败（非 429）达到该次数也隔离；0 表示只看 429
+
+- 每个 key 各自一个 SDK 客户端 / requests 会话（连接池互不影响）
+- 429：该 key 隔离 Retry-After（没有时 `key_quarantine_s`）秒，请求立即换到下一个可用 key 重发；
+  所有 key 都在隔离中才把 429 抛给调用方（由调用方的限流租约记录）。换 key 重发的 429 通过
+  `on_throttle(exc)` 通知共享限流器，因此每一次 429 都会计数并参与 AIMD 降并发
+- 其他错误只计数，不换 key 重发（重试交给调用方）；连续失败达到阈值时隔离
+- 所有 key 都被隔离时，`acquire` 等到最早解除隔离的那个 key
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+try:
+    from utils.llm_ratelimit import is_rate_limit_error, retry_after_seconds
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_ratelimit import is_rate_limit_error, retry_after_seconds
+
+KEY_STRATEGIES = ("round_robin", "least_loaded")
+DEFAULT_QUARANTINE_S = 60.0
+DEFAULT_FAILURE_THRESHOLD = 3
+
+
+def split_config_list(value: Optional[str]) -> List[str]:
+    """`a, b` / 多行写法 -> ["a", "b"]（忽略空项）。"""
+    if not value:
+        return []
+    return [item.strip() for item in value.replace("\n", ",").split(",") if item.strip()]
+
+
+def mask_key(api_key: str) -> str:
+    """日志与汇总里只显示 key 的末 4 位。"""
+    return f"...{api_key[-4:]}" if api_key and len(api_key) > 4 else "..."
+
+
+class KeySlot:
+    """池中的一个 key：客户端 + 计数。计数由 `KeyPool` 在锁内更新。"""
+
+    def __init__(self, label: str, client: Any):
+        self.label = label
+        self.client = client
+        self.in_flight = 0
+        self.calls = 0
+        self.ok = 0
+        self.failed = 0
+        self.throttled = 0
+        self.quarantines = 0
+        self.consecutive_failures = 0
+        self.quarantined_until = 0.0
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "calls": self.calls,
+            "ok": self.ok,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "quarantines": self.quarantines,
+            "in_flight": self.in_flight,
+            "quarantined_s": round(max(0.0, self.quarantined_until - now), 3),
+        }
+
+
+class KeyPool:
+    """线程与协程共用；`setup_llm_client` 在配置了多个 key 时返回它代替单个客户端。"""
+
+    def __init__(
+        self,
+        llm_source: str,
+        slots: Sequence[Tuple[str, Any]],
+        strategy: str = "round_robin",
+        quarantine_s: float = DEFAULT_QUARANTINE_S,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if not slots:
+            raise ValueError("KeyPool needs at least one key.")
+        if strategy not in KEY_STRATEGIES:
+            raise ValueError(f"Unknown key_strategy: {strategy!r} (choose from {KEY_STRATEGIES})")
+        self.llm_source = llm_source
+        self.slots = [KeySlot(label, client) for label, client in slots]
+        self.strategy = strategy
+        self.quarantine_s = quarantine_s
+        self.failure_threshold = failure_threshold
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def primary(self):
+        """第一个 key 的客户端：Batch API 等需要固定账号的调用使用它。"""
+        return self.slots[0].client
+
+    # --- acquire ---
+    def _pick(self) -> Tuple[Optional[KeySlot], float]:
+        """选一个未隔离的 key 并占用；全部隔离时返回 (None, 需要等待的秒数)。"""
+        with self._lock:
+            now = self._clock()
+            n = len(self.slots)
+            order = [self.slots[(self._next + i) % n] for i in range(n)]
+            ready = [slot for slot in order if slot.quarantined_until <= now]
+            if not ready:
+                return None, min(slot.quarantined_until for slot in self.slots) - now
+            slot = (
+                min(ready, key=lambda s: s.in_flight)
+                if self.strategy == "least_loaded"
+                else ready[0]
+            )
+            self._next = (self.slots.index(slot) + 1) % n
+            slot.in_flight += 1
+            return slot, 0.0
+
+    def acquire(self) -> KeySlot:
+        while True:
+            slot, wait_s = self._pick()
+            if slot is not None:
+                return slot
+            self._sleep(max(0.01, wait_s))
+
+    async def aacquire(self) -> KeySlot:
+        while True:
+            slot, wait_s = self._pick()
+            if slot is not None:
+                return slot
+            await asyncio.sleep(max(0.01, wait_s))
+
+    def available(self) -> int:
+        with self._lock:
+            now = self._clock()
+            return sum(1 for slot in self.slots if slot.quarantined_until <= now)
+
+    # --- release ---
+    def release(self, slot: KeySlot, ok: bool, exc: Optional[BaseException] = None) -> bool:
+        """记录一次调用结果；返回该 key 是否因此被隔离。"""
+        throttled = exc is not None and is_rate_limit_error(exc)
+        with self._lock:
+            slot.in_flight -= 1
+            slot.calls += 1
+            if ok:
+                slot.ok += 1
+                slot.consecutive_failures = 0
+                return False
+            slot.failed += 1
+            slot.consecutive_failures += 1
+            if throttled:
+                slot.throttled += 1
+                pause = retry_after_seconds(exc) or self.quarantine_s
+            elif self.failure_threshold and slot.consecutive_failures >= self.failure_threshold:
+                pause = self.quarantine_s
+                slot.consecutive_failures = 0
+            else:
+                return False
+            slot.quarantined_until = max(slot.quarantined_until, self._clock() + pause)
+            slot.quarantines += 1
+            return True
+
+    # --- call ---
+    def call(
+        self,
+        fn: Callable[[Any], Any],
+        can_retry: Callable[[], bool] = lambda: True,
+        on_throttle: Optional[Callable[[BaseException], None]] = None,
+    ):
+        """
+        用池中的某个 key 调用 `fn(client)`；遇到 429 且还有其他可用 key 时立即换 key 重发，
+        并把这次 429 交给 `on_throttle`（最终抛出的 429 由调用方自己记录）。
+        """
+        for attempt in range(len(self.slots)):
+            slot = self.acquire()
+            try:
+                result = fn(slot.client)
+            except Exception as exc:
+                self.release(slot, ok=False, exc=exc)
+                if (
+                    is_rate_limit_error(exc)
+                    and attempt + 1 < len(self.slots)
+                    and self.available()
+                    and can_retry()
+                ):
+                    if on_throttle is not None:
+                        on_throttle(exc)
+                    continue
+                raise
+            self.release(slot, ok=True)
+            return result
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    async def acall(
+        self,
+        fn: Callable[[Any], Any],
+        on_throttle: Optional[Callable[[BaseException], None]] = None,
+    ):
+        """`call` 的 asyncio 版本：`fn(client)` 返回 awaitable。"""
+        for attempt in range(len(self.slots)):
+            slot = await self.aacquire()
+            try:
+                result = await fn(slot.client)
+            except Exception as exc:
+                self.release(slot, ok=False, exc=exc)
+                if is_rate_limit_error(exc) and attempt + 1 < len(self.slots) and self.available():
+                    if on_throttle is not None:
+                        on_throttle(exc)
+                    continue
+                raise
+            self.release(slot, ok=True)
+            return result
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            return {
+                "strategy": self.strategy,
+                "keys": {slot.label: slot.snapshot(now) for slot in self.slots},
+            }
@@ -0,0 +1,267 @@
+# codex: 2026-10-18 从 llm_mockserver.py 拆出压测与 historycards 端到端命令，以及指向模拟服务的 config
+"""
+对本地模拟 LLM 服务（`llm_mockserver`）的压测与端到端运行；用法见 `llm_mockserver.py` 的模块说明。
+"""
+
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+try:
+    from utils.llm_mockserver import MOCK_MODEL, MockLLMServer, MockScenario
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_mockserver import MOCK_MODEL, MockLLMServer, MockScenario
+
+# loadtest / historycards 子命令支持的 llmsource -> base_url 后缀
+MOCK_SOURCES = {
+    "openai": "/v1",
+    "deepseek": "/v1",
+    "openrouter": "/api/v1",
+    "xiaomimimo": "/v1",
+    "zhipuai": "/api/paas/v4",
+    "geminiweb": "",
+}
+
+
+# -- config ------------------------------------------------------------------
+def mock_config(
+    url: str,
+    source: str = "openai",
+    keys: int = 1,
+    qps: float = 0.0,
+    concurrency: int = 0,
+    model: str = MOCK_MODEL,
+) -> configparser.ConfigParser:
+    """指向模拟服务的 config：`keys` > 1 时配置多 key 池；`qps` > 0 时写入共享限流（requests_per_minute，按单个 key）。"""
+    if source not in MOCK_SOURCES:
+        raise ValueError(
+            f"Unsupported mock source: {source!r} (choose from {sorted(MOCK_SOURCES)})"
+        )
+    try:
+        from utils.llm_api import PROVIDER_SECTIONS
+    except ModuleNotFoundError:
+        from llm_api import PROVIDER_SECTIONS
+    section = PROVIDER_SECTIONS[source]
+    config = configparser.ConfigParser()
+    config["llmsources"] = {"llmsource": source}
+    values = {"base_url": url.rstrip("/") + MOCK_SOURCES[source], "model": model}
+    if keys > 1:
+        values["api_keys"] = ", ".join(f"mock-key-{i:02d}" for i in range(keys))
+    else:
+        values["api_key"] = "mock-key-00"
+    if source == "geminiweb":
+        values["auth_mode"] = "header"
+        values["timeout"] = "30"
+    if qps > 0:
+        values["requests_per_minute"] = f"{qps * 60 / max(1, keys):g}"
+    if concurrency > 0:
+        values["max_concurrency"] = str(max(1, concurrency // max(1, keys)))
+    config[section] = values
+    return config
+
+
+# -- loadtest ----------------------------------------------------------------
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * (len(sorted_values) - 1)))]
+
+
+def run_loadtest(
+    url: str,
+    source: str,
+    qps: float,
+    duration_s: float,
+    concurrency: int = 16,
+    keys: int = 1,
+    stream: bool = False,
+    prompt: str = "请为成语“卧薪尝胆”生成卡片 JSON。",
+) -> dict:
+    """开环压测：按 `qps` 定时发起 `generate_llm_response`（或流式接口），统计吞吐、延迟分位数与错误类型。"""
+    try:
+        from utils import llm_api
+    except ModuleNotFoundError:
+        import llm_api
+
+    client, llm_source, models = llm_api.setup_llm_client(
+        mock_config(url, source, keys=keys, concurrency=concurrency)
+    )
+    total = max(1, int(qps * duration_s))
+    latencies: List[float] = []
+    lags: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    t0 = time.monotonic()
+
+    def _one(i: int) -> None:
+        started = time.monotonic()
+        lag = started - (t0 + i / qps)
+        try:
+            if stream:
+                llm_api.generate_llm_response_stream(client, llm_source, prompt, models[0])
+            else:
+                llm_api.generate_llm_response(client, llm_source, prompt, models)
+        except Exception as e:
+            name = type(e).__name__
+            with lock:
+                errors[name] = errors.get(name, 0) + 1
+            return
+        finally:
+            with lock:
+                lags.append(max(0.0, lag))
+        with lock:
+            latencies.append(time.monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest") as pool:
+        for i in range(total):
+            delay = t0 + i / qps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_one, i)
+    wall_s = time.monotonic() - t0
+    latencies.sort()
+    lags.sort()
+    return {
+        "source": llm_source,
+        "stream": stream,
+        "target_qps": qps,
+        "requests": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall_s, 3),
+        "achieved_qps": round(len(latencies) / wall_s, 2) if wall_s > 0 else 0.0,
+        "latency_s": {
+            "p50": round(_percentile(latencies, 0.5), 4),
+            "p90": round(_percentile(latencies, 0.9), 4),
+            "p99": round(_percentile(latencies, 0.99), 4),
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+        # 开始执行相对计划时刻的滞后：持续增大说明 --concurrency 不够（或限流在排队）
+        "schedule_lag_p99_s": round(_percentile(lags, 0.99), 4),
+        "rate_limits": llm_api.rate_limit_snapshot(),
+        "api_keys": llm_api.key_pool_snapshot(client),
+    }
+
+
+def run_historycards(
+    url: str, source: str, qps: float, passthrough: List[str], keys: int = 1
+) -> int:
+    """写一个指向模拟服务的临时 config.ini，子进程运行 historycards（默认输出到临时 resources 目录）。"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    work = tempfile.mkdtemp(prefix="historycards_mock_")
+    config_file = os.path.join(work, "config.ini")
+    with open(config_file, "w", encoding="utf-8") as f:
+        mock_config(url, source, keys=keys, qps=qps).write(f)
+    args = list(passthrough)
+    if not any(a == "--resources-dir" or a.startswith("--resources-dir=") for a in args):
+        args += ["--resources-dir", os.path.join(work, "resources")]
+    if not any(a == "--progress-file" or a.startswith("--progress-file=") for a in args):
+        args += ["--progress-file", os.path.join(work, "progress.json")]
+    cmd = [
+        sys.executable,
+        os.path.join(root, "history", "historycards.py"),
+        "--config",
+        config_file,
+        "--llmsource",
+        source,
+        *args,
+    ]
+    print(f"Running: {' '.join(cmd)}", file=sys.stderr)
+    return subprocess.run(cmd, cwd=root).returncode
+
+
+def _split_passthrough(argv: List[str]):
+    if "--" in argv:
+        i = argv.index("--")
+        return argv[:i], argv[i + 1 :]
+    return argv, []
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    own, passthrough = _split_passthrough(argv)
+    parser = argparse.ArgumentParser(
+        description="Local mock LLM server (OpenAI chat / Gemini generateContent) and load tests."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "loadtest", "historycards"):
+        p = sub.add_parser(name)
+        p.add_argument(
+            "--scenario",
+            default=None,
+            help="Scenario JSON file (latency / 429 / malformed / truncated ...).",
+        )
+        p.add_argument("--host", default="127.0.0.1")
+        p.add_argument(
+            "--port",
+            type=int,
+            default=0,
+            help="Port for the in-process server (0 = pick a free one).",
+        )
+        if name == "serve":
+            continue
+        p.add_argument(
+            "--url",
+            default=None,
+            help="Use an already running mock server instead of starting one.",
+        )
+        p.add_argument("--source", choices=sorted(MOCK_SOURCES), default="openai")
+        p.add_argument("--qps", type=float, default=10.0, help="Target requests per second.")
+        p.add_argument(
+            "--keys", type=int, default=1, help="Configure N API keys (exercises the key pool)."
+        )
+        if name == "loadtest":
+            p.add_argument("--duration", type=float, default=10.0, help="Seconds to generate load.")
+            p.add_argument("--concurrency", type=int, default=16, help="Max requests in flight.")
+            p.add_argument(
+                "--stream", action="store_true", help="Use generate_llm_response_stream."
+            )
+    args = parser.parse_args(own)
+
+    scenario = MockScenario.from_file(args.scenario) if args.scenario else MockScenario()
+    server = None
+    url = getattr(args, "url", None)
+    if not url:
+        server = MockLLMServer(scenario, port=args.port, host=args.host)
+        url = server.url
+        print(f"Mock LLM server: {url}", file=sys.stderr)
+    try:
+        if args.command == "serve":
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                return 0
+        if args.command == "loadtest":
+            report = run_loadtest(
+                url,
+                args.source,
+                args.qps,
+                args.duration,
+                concurrency=args.concurrency,
+                keys=args.keys,
+                stream=args.stream,
+            )
+            if server is not None:
+                report["server"] = server.stats()
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            return 0
+        rc = run_historycards(url, args.source, args.qps, passthrough, keys=args.keys)
+        if server is not None:
+            print(json.dumps({"server": server.stats()}, ensure_ascii=False), file=sys.stderr)
+        return rc
+    finally:
+        if server is not None:
+            server.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
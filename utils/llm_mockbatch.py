@@ -0,0 +1,168 @@
+# codex: 2026-10-18 新增模拟服务的 Batch API（/files、/batches），端到端覆盖 llm_batch 与 historycards --batch
+"""
+`llm_mockserver.py` 的 OpenAI 兼容 Batch API：
+
+    POST .../files                       上传 JSONL（multipart/form-data，purpose=batch）
+    GET  .../files/<id>/content          下载文件（输入 / 输出 / 错误文件）
+    POST .../batches                     创建批处理任务（input_file_id / endpoint / completion_window）
+    GET  .../batches/<id>                查询任务；第 `batch_polls` 次查询时整批执行并完成
+
+批内每一行按当前场景抽取结果（与交互请求共用编排与计数，格式记为 `batch`）：
+ok / bad_content 写进输出文件；429 / 500 写成输出文件里的非 200 `status_code`；
+malformed / truncated 写进错误文件。
+"""
+
+import itertools
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Callable, Dict, Optional, Tuple
+
+
+def completion_body(model: str, text: str, created: Optional[int] = None) -> dict:
+    """非流式 `chat.completion` 响应体。"""
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()) if created is None else created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 1,
+            "completion_tokens": len(text),
+            "total_tokens": len(text) + 1,
+        },
+    }
+
+
+def parse_upload(content_type: str, raw: bytes) -> Tuple[Dict[str, str], Optional[bytes], str]:
+    """解析 multipart/form-data，返回 (普通字段, 文件内容, 文件名)。"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + raw
+    )
+    fields: Dict[str, str] = {}
+    data, filename = None, ""
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            data, filename = payload, part.get_filename()
+        elif name:
+            fields[name] = payload.decode("utf-8")
+    return fields, data, filename
+
+
+class MockBatchStore:
+    """文件与批处理任务的内存存储；线程安全。
+
+    `run_line(request_body)` 执行批内一行，返回 (结果, 回复文本)，由 `MockLLMServer` 提供。
+    """
+
+    def __init__(self, run_line: Callable[[dict], Tuple[str, str]]):
+        self._run_line = run_line
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.files: Dict[str, dict] = {}
+        self._content: Dict[str, bytes] = {}
+        self.batches: Dict[str, dict] = {}
+        self._polls: Dict[str, int] = {}
+
+    def _new_file(self, data: bytes, filename: str, purpose: str) -> dict:
+        file_id = f"file-mock-{next(self._ids)}"
+        self._content[file_id] = data
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        return self.files[file_id]
+
+    def upload(self, data: bytes, filename: str, purpose: str) -> dict:
+        with self._lock:
+            return dict(self._new_file(data, filename, purpose))
+
+    def content(self, file_id: str) -> Optional[bytes]:
+        with self._lock:
+            return self._content.get(file_id)
+
+    def create(self, body: dict) -> Optional[dict]:
+        """创建任务；输入文件不存在时返回 None。"""
+        with self._lock:
+            input_file_id = body.get("input_file_id")
+            if input_file_id not in self._content:
+                return None
+            total = sum(1 for line in self._content[input_file_id].splitlines() if line.strip())
+            batch_id = f"batch-mock-{next(self._ids)}"
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body.get("endpoint"),
+                "input_file_id": input_file_id,
+                "completion_window": body.get("completion_window", "24h"),
+                "status": "validating",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "metadata": body.get("metadata"),
+                "request_counts": {"total": total, "completed": 0, "failed": 0},
+            }
+            self._polls[batch_id] = 0
+            return dict(self.batches[batch_id])
+
+    def retrieve(self, batch_id: str, polls_to_complete: int) -> Optional[dict]:
+        """查询任务；累计查询达到 `polls_to_complete` 次时执行整批并置为 completed。"""
+        with self._lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch["status"] != "completed":
+                self._polls[batch_id] += 1
+                if self._polls[batch_id] >= max(1, polls_to_complete):
+                    self._complete(batch)
+                else:
+                    batch["status"] = "in_progress"
+            return json.loads(json.dumps(batch))
+
+    def _complete(self, batch: dict) -> None:
+        out_lines, err_lines = [], []
+        for line in self._content[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request.get("custom_id")
+            body = request.get("body") or {}
+            outcome, text = self._run_line(body)
+            if outcome in ("malformed", "truncated"):
+                error = {"code": "server_error", "message": f"Request failed (mock {outcome})"}
+                err_lines.append({"custom_id": custom_id, "response": None, "error": error})
+                continue
+            if outcome in ("429", "500"):
+                status = 429 if outcome == "429" else 503
+                response = {"status_code": status, "body": {"error": {"code": status}}}
+            else:
+                if outcome == "bad_content":
+                    text = text[: len(text) // 2]
+                model = body.get("model") or "mock-model"
+                response = {"status_code": 200, "body": completion_body(model, text)}
+            out_lines.append({"custom_id": custom_id, "response": response, "error": None})
+        counts = batch["request_counts"]
+        counts["completed"] = sum(1 for r in out_lines if r["response"]["status_code"] == 200)
+        counts["failed"] = counts["total"] - counts["completed"]
+        for key, lines in (("output_file_id", out_lines), ("error_file_id", err_lines)):
+            if lines:
+                data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in lines)
+                output = self._new_file(data.encode("utf-8"), f"{key}.jsonl", "batch_output")
+                batch[key] = output["id"]
+        batch["status"] = "completed"
@@ -0,0 +1,495 @@
+# codex: 2026-10-18 接入 Batch API 端点（/files、/batches，实现见 llm_mockbatch.py）与场景字段 batch_polls
+"""
+本地模拟 LLM 服务：不需要任何账号即可对 `llm_api.py` 的各条调用路径与 `historycards.py` 做压测。
+
+支持的线格式（任意路径前缀；除 Batch API 的查询 / 下载外均为 POST）：
+
+    .../chat/completions                         OpenAI 兼容（deepseek / openai / openrouter /
+                                                 xiaomimimo，以及同样走该格式的 ZhipuAI / Doubao /
+                                                 Mistral）；`"stream": true` 时返回 SSE
+    .../models/<model>:generateContent           Gemini Web
+    .../models/<model>:streamGenerateContent     Gemini Web 流式（`alt=sse`）
+    .../files[/<id>/content] .../batches[/<id>]  Batch API 上传 / 下载 / 创建 / 查询（`llm_mockbatch.py`）
+
+另有 `GET /stats`（计数）与 `POST /scenario`（运行中替换场景，JSON 字段同下）。
+
+场景（`--scenario file.json` 或 `MockScenario(...)`）：
+
+    latency_ms / latency_dist / latency_sigma    每个请求的延迟（const / exp / lognormal，均值为 latency_ms）
+    rate_429 / retry_after_s                     按比例返回 429 + Retry-After
+    max_qps / max_concurrency                    超过每秒请求数 / 同时在途数时返回 429（模拟服务端限流）
+    rate_500                                     按比例返回 503
+    rate_malformed                               200，但响应体不是合法 JSON
+    rate_truncated                               响应体（或 SSE 流）发到一半断开连接
+    rate_bad_content                             信封合法，但模型文本（卡片 JSON）被截断
+    script                                       先按顺序使用的结果列表，如 ["429", "ok", "truncated"]；用完后按比例抽样
+    responses                                    回复文本列表（轮流使用）；默认是一张合法的成语卡片 JSON
+    batch_polls                                  批处理任务第几次查询时完成（默认 1）；批内每行同样按场景抽样
+
+命令行（实现见 `llm_loadtest.py`，也可直接运行 `python utils/llm_loadtest.py ...`）：
+
+    # 起服务（Ctrl+C 退出）
+    python utils/llm_mockserver.py serve --port 8765 --scenario scenario.json
+    # 以 50 QPS 压 generate_llm_response 20 秒（不给 --url 时在进程内起服务）
+    python utils/llm_mockserver.py loadtest --source openai --qps 50 --duration 20 \\
+        --concurrency 32 --keys 3
+    # 端到端跑 historycards（模拟服务 + 临时 config.ini，按 --qps 配置共享限流）；`--` 之后原样传给 historycards
+    python utils/llm_mockserver.py historycards --source geminiweb --qps 20 -- \\
+        --range 1-500 --workers 8
+"""
+
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+try:
+    from utils.llm_mockbatch import MockBatchStore, completion_body, parse_upload
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_mockbatch import MockBatchStore, completion_body, parse_upload
+
+_FILE_CONTENT = re.compile(r"/files/([^/]+)/content$")
+_BATCH = re.compile(r"/batches/([^/]+)$")
+OUTCOMES = ("ok", "429", "500", "malformed", "truncated", "bad_content")
+LATENCY_DISTS = ("const", "exp", "lognormal")
+MOCK_MODEL = "mock-model"
+_DEFAULT_CARD = {
+    "period": "汉",
+    "year_estimate": -200,
+    "meaning": "比喻在困境中坚持到底。",
+    "story": "相传汉代有人在困境中不改其志，最终成事。" * 8,
+    "prompt": "Chinese ink painting, a scholar at dawn, misty mountains",
+    "popular": 6,
+}
+
+
+class MockScenario:
+    """请求结果与延迟的编排；线程安全（由 `MockLLMServer` 持锁调用）。"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        latency_dist: str = "const",
+        latency_sigma: float = 0.5,
+        rate_429: float = 0.0,
+        retry_after_s: float = 1.0,
+        max_qps: float = 0.0,
+        max_concurrency: int = 0,
+        rate_500: float = 0.0,
+        rate_malformed: float = 0.0,
+        rate_truncated: float = 0.0,
+        rate_bad_content: float = 0.0,
+        script: Optional[List[str]] = None,
+        responses: Optional[List[str]] = None,
+        batch_polls: int = 1,
+        seed: int = 0,
+    ):
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(
+                f"Unknown latency_dist: {latency_dist!r} (choose from {LATENCY_DISTS})"
+            )
+        unknown = [o for o in (script or []) if o not in OUTCOMES]
+        if unknown:
+            raise ValueError(f"Unknown script outcome(s): {unknown} (choose from {OUTCOMES})")
+        self.latency_s = latency_ms / 1000.0
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.rates = [
+            ("429", rate_429),
+            ("500", rate_500),
+            ("malformed", rate_malformed),
+            ("truncated", rate_truncated),
+            ("bad_content", rate_bad_content),
+        ]
+        self.retry_after_s = retry_after_s
+        self.max_qps = max_qps
+        self.max_concurrency = max_concurrency
+        self.script = list(script or [])
+        self.responses = list(responses or [json.dumps(_DEFAULT_CARD, ensure_ascii=False)])
+        self.batch_polls = max(1, int(batch_polls))
+        self._rng = random.Random(seed)
+        self._next_response = 0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MockScenario":
+        return cls(**data)
+
+    @classmethod
+    def from_file(cls, path: str) -> "MockScenario":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def draw(self):
+        """返回 (结果, 延迟秒数, 回复文本)。"""
+        if self.latency_s <= 0:
+            delay = 0.0
+        elif self.latency_dist == "exp":
+            delay = self._rng.expovariate(1.0 / self.latency_s)
+        elif self.latency_dist == "lognormal":
+            delay = (
+                self._rng.lognormvariate(0.0, self.latency_sigma)
+                * self.latency_s
+                / math.exp(self.latency_sigma**2 / 2)
+            )
+        else:
+            delay = self.latency_s
+        text = self.responses[self._next_response % len(self.responses)]
+        self._next_response += 1
+        if self.script:
+            return self.script.pop(0), delay, text
+        roll = self._rng.random()
+        for outcome, rate in self.rates:
+            if roll < rate:
+                return outcome, delay, text
+            roll -= rate
+        return "ok", delay, text
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive：与 SDK / requests 连接池的真实行为一致
+    server: "_Server"
+
+    def log_message(self, format, *args):  # noqa: A002 - 静默逐请求日志
+        pass
+
+    # -- helpers -------------------------------------------------------------
+    def _send(
+        self,
+        status: int,
+        body: bytes,
+        content_type: str = "application/json",
+        headers: Optional[dict] = None,
+        truncate: bool = False,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if truncate:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body[: len(body) // 2] if truncate else body)
+        if truncate:
+            self.close_connection = True
+
+    def _send_json(
+        self, status: int, obj: Any, headers: Optional[dict] = None, truncate: bool = False
+    ) -> None:
+        self._send(
+            status,
+            json.dumps(obj, ensure_ascii=False).encode("utf-8"),
+            headers=headers,
+            truncate=truncate,
+        )
+
+    def _send_sse(self, events: List[str], truncate: bool = False) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        if truncate:
+            events = events[: max(1, len(events) // 2)]
+        for event in events:
+            self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    # -- routes --------------------------------------------------------------
+    def do_GET(self):  # noqa: N802
+        path = urlparse(self.path).path.rstrip("/")
+        mock = self.server.mock
+        file_match, batch_match = _FILE_CONTENT.search(path), _BATCH.search(path)
+        if path == "/stats":
+            self._send_json(200, mock.stats())
+        elif file_match and mock.batch_store.content(file_match.group(1)) is not None:
+            data = mock.batch_store.content(file_match.group(1))
+            self._send(200, data, content_type="application/octet-stream")
+        elif batch_match and batch_match.group(1) in mock.batch_store.batches:
+            batch_id = batch_match.group(1)
+            self._send_json(200, mock.batch_store.retrieve(batch_id, mock.batch_polls()))
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _create_file(self, raw: bytes) -> None:
+        fields, data, filename = parse_upload(self.headers.get("Content-Type", ""), raw)
+        if data is None:
+            self._send_json(400, {"error": {"message": "multipart field 'file' is required"}})
+            return
+        purpose = fields.get("purpose", "batch")
+        self._send_json(200, self.server.mock.batch_store.upload(data, filename, purpose))
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = urlparse(self.path).path
+        if path.rstrip("/").endswith("/files"):
+            self._create_file(raw)
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "request body is not JSON"}})
+            return
+        if path.rstrip("/") == "/scenario":
+            try:
+                self.server.mock.set_scenario(MockScenario.from_dict(body))
+            except (TypeError, ValueError) as e:
+                self._send_json(400, {"error": {"message": str(e)}})
+                return
+            self._send_json(200, {"ok": True})
+            return
+        if path.rstrip("/").endswith("/batches"):
+            batch = self.server.mock.batch_store.create(body)
+            if batch is None:
+                self._send_json(400, {"error": {"message": "unknown input_file_id"}})
+            else:
+                self._send_json(200, batch)
+            return
+        if path.endswith("/chat/completions"):
+            kind = "openai"
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            kind = "gemini"
+        else:
+            self._send_json(404, {"error": {"message": f"unknown endpoint {path}"}})
+            return
+        mock = self.server.mock
+        outcome, delay, text = mock.begin(kind)
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            if kind == "openai":
+                self._reply_openai(body, outcome, text)
+            else:
+                self._reply_gemini(path, outcome, text)
+        finally:
+            mock.end()
+
+    def _reply_error(self, outcome: str) -> None:
+        if outcome == "429":
+            retry_after = self.server.mock.retry_after()
+            message = {
+                "error": {
+                    "message": "Rate limit exceeded (mock)",
+                    "type": "rate_limit_error",
+                    "code": 429,
+                }
+            }
+            self._send_json(429, message, headers={"Retry-After": f"{retry_after:g}"})
+        else:
+            error = {"message": "Service unavailable (mock)", "type": "server_error", "code": 503}
+            self._send_json(503, {"error": error})
+
+    def _reply_openai(self, body: dict, outcome: str, text: str) -> None:
+        if outcome in ("429", "500"):
+            self._reply_error(outcome)
+            return
+        if outcome == "malformed":
+            self._send(200, b'{"id": "mock", "choices": [{"message": {"content": ')
+            return
+        if outcome == "bad_content":
+            text = text[: len(text) // 2]
+        model = body.get("model") or MOCK_MODEL
+        created = int(time.time())
+        if body.get("stream"):
+            step = max(1, len(text) // 8)
+            events = [
+                json.dumps(
+                    {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": text[i : i + step]},
+                                "finish_reason": None,
+                            }
+                        ],
+                    },
+                    ensure_ascii=False,
+                )
+                for i in range(0, len(text), step)
+            ]
+            events.append(
+                json.dumps(
+                    {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    }
+                )
+            )
+            events.append("[DONE]")
+            self._send_sse(events, truncate=outcome == "truncated")
+            return
+        self._send_json(
+            200, completion_body(model, text, created), truncate=outcome == "truncated"
+        )
+
+    def _reply_gemini(self, path: str, outcome: str, text: str) -> None:
+        if outcome in ("429", "500"):
+            self._reply_error(outcome)
+            return
+        if outcome == "malformed":
+            self._send(200, b'{"candidates": [{"content": {"parts": [{"text": ')
+            return
+        if outcome == "bad_content":
+            text = text[: len(text) // 2]
+        usage = {
+            "promptTokenCount": 1,
+            "candidatesTokenCount": len(text),
+            "totalTokenCount": len(text) + 1,
+        }
+        if ":streamGenerateContent" in path:
+            step = max(1, len(text) // 8)
+            events = [
+                json.dumps(
+                    {
+                        "candidates": [
+                            {"content": {"role": "model", "parts": [{"text": text[i : i + step]}]}}
+                        ]
+                    },
+                    ensure_ascii=False,
+                )
+                for i in range(0, len(text), step)
+            ]
+            events.append(
+                json.dumps(
+                    {
+                        "candidates": [
+                            {"content": {"role": "model", "parts": []}, "finishReason": "STOP"}
+                        ],
+                        "usageMetadata": usage,
+                    }
+                )
+            )
+            self._send_sse(events, truncate=outcome == "truncated")
+            return
+        self._send_json(
+            200,
+            {
+                "candidates": [
+                    {
+                        "content": {"role": "model", "parts": [{"text": text}]},
+                        "finishReason": "STOP",
+                    }
+                ],
+                "usageMetadata": usage,
+            },
+            truncate=outcome == "truncated",
+        )
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    mock: "MockLLMServer"
+
+
+class MockLLMServer:
+    """后台线程中运行的模拟服务；`url` 为根地址，`close()` 停止。"""
+
+    def __init__(
+        self, scenario: Optional[MockScenario] = None, port: int = 0, host: str = "127.0.0.1"
+    ):
+        self._lock = threading.Lock()
+        self._scenario = scenario or MockScenario()
+        self._counts: Dict[str, int] = {}
+        self._by_kind: Dict[str, int] = {}
+        self._window: List[float] = []  # 最近 1 秒内的请求时刻（max_qps）
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_store = MockBatchStore(self._run_batch_line)
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="llm-mockserver", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def set_scenario(self, scenario: MockScenario) -> None:
+        with self._lock:
+            self._scenario = scenario
+
+    def begin(self, kind: str):
+        with self._lock:
+            now = time.monotonic()
+            scenario = self._scenario
+            self.requests += 1
+            self._by_kind[kind] = self._by_kind.get(kind, 0) + 1
+            self._window = [t for t in self._window if now - t < 1.0]
+            self._window.append(now)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            outcome, delay, text = scenario.draw()
+            # 服务端限流优先于编排结果；被限流的请求不等待延迟
+            if (scenario.max_qps and len(self._window) > scenario.max_qps) or (
+                scenario.max_concurrency and self.in_flight > scenario.max_concurrency
+            ):
+                outcome, delay = "429", 0.0
+            if outcome in ("429", "500", "malformed"):
+                delay = min(delay, 0.05)
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+            return outcome, delay, text
+
+    def end(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return self._scenario.retry_after_s
+
+    def batch_polls(self) -> int:
+        with self._lock:
+            return self._scenario.batch_polls
+
+    def _run_batch_line(self, _body: dict):
+        # 批内请求不等待延迟：任务在查询时一次性完成
+        outcome, _delay, text = self.begin("batch")
+        self.end()
+        return outcome, text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "outcomes": dict(self._counts),
+                "by_format": dict(self._by_kind),
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+            }
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join(timeout=5)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行（serve / loadtest / historycards）在 `llm_loadtest` 中实现。"""
+    try:
+        from utils.llm_loadtest import main as loadtest_main
+    except ModuleNotFoundError:
+        from llm_loadtest import main as loadtest_main
+    return loadtest_main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,387 @@
+# codex: 2026-10-18 限流模块折行到 ≤100，逻辑不变
+"""
+按 provider（或 provider+model）共享的限流器。
+
+配置写在 `config.ini` 对应的 provider Section 下（均可选）::
+
+    [ZhipuAI]
+    requests_per_minute = 300      ; 0 表示不限
+    tokens_per_minute = 400000     ; 0 表示不限（按 estimate_tokens 估算）
+    max_concurrency = 32           ; 并发上限（AIMD 的天花板）
+    min_concurrency = 1
+    adaptive_concurrency = true    ; 开启 AIMD：成功加性增长，429/超时延迟乘性减半
+    initial_concurrency = 4
+    latency_target_s = 30          ; 单次调用超过该耗时视为拥塞信号；0 表示只看 429
+    rate_limit_scope = provider    ; provider：所有模型共享；model：每个模型各自一套
+
+同一进程内所有 `generate_llm_response_single` 调用共享同一个限流器实例。
+"""
+
+import asyncio
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+_DEFAULT_MAX_CONCURRENCY = 16
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估算 token 数：CJK 字符约 1 token/字，其余约 4 字符/token。"""
+    if not text:
+        return 0
+    cjk = len(re.findall(r"[㐀-鿿豈-﫿]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 各 SDK 的限流异常类名（openai / anthropic / zhipuai / google-api-core / werkzeug 风格）
+_RATE_LIMIT_TYPES = {"RateLimitError", "APIReachLimitError", "ResourceExhausted", "TooManyRequests"}
+_RATE_LIMIT_TEXT = re.compile(
+    r"too many requests|\brate[ _-]?limit|resource[ _-]?exhausted"
+    r"|(?:status|code|http)\D{0,20}\b429\b|\b429\b\s*(?:client error|too many)",
+    re.IGNORECASE,
+)
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """
+    识别各 SDK 的 429 / 限流异常：优先看状态码与异常类型；只有文本可用时，
+    才按 “HTTP 状态 429” 或限流字样匹配（消息里恰好出现 429 的 token 数、行号等不算）。
+    """
+    for obj in (exc, getattr(exc, "response", None), getattr(exc, "__cause__", None)):
+        if obj is None:
+            continue
+        if getattr(obj, "status_code", None) == 429 or getattr(obj, "status", None) == 429:
+            return True
+        if any(cls.__name__ in _RATE_LIMIT_TYPES for cls in type(obj).__mro__):
+            return True
+    return bool(_RATE_LIMIT_TEXT.search(str(exc)))
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """读取异常携带的 Retry-After 头（秒）。"""
+    for obj in (exc, getattr(exc, "__cause__", None)):
+        response = getattr(obj, "response", None) if obj is not None else None
+        headers = getattr(response, "headers", None)
+        if not headers:
+            continue
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class TokenBucket:
+    """令牌桶：`reserve(n)` 立即记账（允许透支），返回调用方需要等待的秒数。"""
+
+    def __init__(
+        self,
+        per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= amount
+            if self._tokens >= 0 or self.rate <= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正预估（delta>0 表示多用了）。"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= delta
+
+    def drain(self) -> None:
+        """收到 429 时清空余量，避免紧接着再打满。"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self._tokens, 0.0)
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(self._clock())
+            return self._tokens
+
+
+class AIMDController:
+    """AIMD 并发窗口：成功时每个窗口 +increase，拥塞（429/超时延迟）时乘以 decrease。"""
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: Optional[float] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_target_s: float = 0.0,
+        cooldown_s: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        start = initial if initial is not None else self.max_limit
+        self.limit = float(min(self.max_limit, max(self.min_limit, start)))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target_s = latency_target_s
+        self.cooldown_s = cooldown_s
+        self._clock = clock
+        self._last_decrease = float("-inf")
+        self.decreases = 0
+
+    @property
+    def window(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def on_result(self, ok: bool, throttled: bool, latency_s: float) -> None:
+        congested = throttled or (self.latency_target_s > 0 and latency_s > self.latency_target_s)
+        if congested:
+            now = self._clock()
+            # 同一拥塞事件触发的一串 429 只减一次，避免窗口塌缩到底
+            if now - self._last_decrease >= self.cooldown_s:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                self._last_decrease = now
+                self.decreases += 1
+            return
+        if ok:
+            self.limit = min(
+                float(self.max_limit), self.limit + self.increase / max(self.limit, 1.0)
+            )
+
+
+class RateLimitLease:
+    """一次调用占用的额度；调用结束后必须 `release()`。"""
+
+    def __init__(self, limiter: "ProviderRateLimiter", est_tokens: int):
+        self.limiter = limiter
+        self.est_tokens = est_tokens
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(
+        self, ok: bool, exc: Optional[BaseException] = None, tokens_used: Optional[int] = None
+    ) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.limiter._release(self, ok, exc, tokens_used)
+
+
+class ProviderRateLimiter:
+    """一个 provider（或 provider+model）的限流器：令牌桶 + AIMD 并发窗口。线程与协程共用。"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = _DEFAULT_MAX_CONCURRENCY,
+        min_concurrency: int = 1,
+        adaptive: bool = False,
+        initial_concurrency: Optional[int] = None,
+        latency_target_s: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.name = name
+        self.requests = (
+            TokenBucket(requests_per_minute, clock=clock) if requests_per_minute > 0 else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute > 0 else None
+        self.aimd = AIMDController(
+            max_limit=max_concurrency,
+            min_limit=min_concurrency,
+            initial=(initial_concurrency if adaptive else max_concurrency),
+            latency_target_s=latency_target_s if adaptive else 0.0,
+            clock=clock,
+        )
+        self.adaptive = adaptive
+        self._clock = clock
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self.counters = {
+            "calls": 0,
+            "ok": 0,
+            "failed": 0,
+            "throttled": 0,
+            "wait_s": 0.0,
+            "tokens": 0,
+        }
+
+    # --- acquire ---
+    def _rate_wait(self, est_tokens: int) -> float:
+        wait_s = max(0.0, self._paused_until - self._clock())
+        if self.requests is not None:
+            wait_s = max(wait_s, self.requests.reserve(1))
+        if self.tokens is not None and est_tokens:
+            wait_s = max(wait_s, self.tokens.reserve(est_tokens))
+        return wait_s
+
+    def _try_enter(self) -> bool:
+        with self._cond:
+            if self._in_flight < self.aimd.window:
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self, est_tokens: int = 0) -> RateLimitLease:
+        wait_s = self._rate_wait(est_tokens)
+        if wait_s > 0:
+            self._sleep(wait_s)
+        with self._cond:
+            while self._in_flight >= self.aimd.window:
+                self._cond.wait(timeout=0.5)
+            self._in_flight += 1
+            self.counters["wait_s"] += wait_s
+        return RateLimitLease(self, est_tokens)
+
+    async def aacquire(self, est_tokens: int = 0) -> RateLimitLease:
+        wait_s = self._rate_wait(est_tokens)
+        if wait_s > 0:
+            await asyncio.sleep(wait_s)
+        while not self._try_enter():
+            await asyncio.sleep(0.05)
+        with self._cond:
+            self.counters["wait_s"] += wait_s
+        return RateLimitLease(self, est_tokens)
+
+    # --- release ---
+    def _release(
+        self,
+        lease: RateLimitLease,
+        ok: bool,
+        exc: Optional[BaseException],
+        tokens_used: Optional[int],
+    ) -> None:
+        latency = time.monotonic() - lease.started
+        throttled = exc is not None and is_rate_limit_error(exc)
+        with self._cond:
+            self._in_flight -= 1
+            self.counters["calls"] += 1
+            self.counters["ok" if ok else "failed"] += 1
+            if throttled:
+                self.counters["throttled"] += 1
+                pause = retry_after_seconds(exc)
+                if pause:
+                    self._paused_until = max(self._paused_until, self._clock() + pause)
+            if tokens_used is not None:
+                self.counters["tokens"] += tokens_used
+            if self.adaptive:
+                self.aimd.on_result(ok, throttled, latency)
+            self._cond.notify_all()
+        if throttled:
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.drain()
+        if self.tokens is not None and tokens_used is not None:
+            self.tokens.adjust(tokens_used - lease.est_tokens)
+
+    def on_throttle(self, exc: Optional[BaseException] = None) -> None:
+        """
+        调用方自行吸收的 429（如多 key 池换 key 重发成功）：计数并按拥塞降并发。
+        只有这个 key 被限流，不暂停整个限流器、不清空令牌桶。
+        """
+        with self._cond:
+            self.counters["throttled"] += 1
+            if self.adaptive:
+                self.aimd.on_result(False, True, 0.0)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            out = dict(self.counters)
+            out["wait_s"] = round(out["wait_s"], 6)
+            out["in_flight"] = self._in_flight
+            out["concurrency_limit"] = round(self.aimd.limit, 3)
+            out["concurrency_decreases"] = self.aimd.decreases
+        return out
+
+
+# --- 进程级注册表：setup_llm_client 写入配置，generate_llm_response_single 读取 ---
+_LIMITER_SETTINGS: Dict[str, dict] = {}
+_LIMITERS: Dict[Tuple[str, str], ProviderRateLimiter] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def configure_rate_limits(
+    config, llm_source: str, section: str, key_count: int = 1
+) -> Optional[dict]:
+    """从 `[section]` 读取限流配置；未配置任何限流项时返回 None（不限流）。
+
+    配置值按单个 API key 填写；`key_count` > 1（多 key 池）时请求/token 速率与并发上限按 key 数放大。
+    """
+    if not config.has_section(section):
+        return None
+    key_count = max(1, int(key_count))
+    rpm = config.getfloat(section, "requests_per_minute", fallback=0.0) * key_count
+    tpm = config.getfloat(section, "tokens_per_minute", fallback=0.0) * key_count
+    adaptive = config.getboolean(section, "adaptive_concurrency", fallback=False)
+    with _REGISTRY_LOCK:
+        for key in [k for k in _LIMITERS if k[0] == llm_source]:
+            del _LIMITERS[key]
+        if rpm <= 0 and tpm <= 0 and not adaptive:
+            _LIMITER_SETTINGS.pop(llm_source, None)
+            return None
+        max_concurrency = (
+            max(1, config.getint(section, "max_concurrency", fallback=_DEFAULT_MAX_CONCURRENCY))
+            * key_count
+        )
+        settings = {
+            "requests_per_minute": rpm,
+            "tokens_per_minute": tpm,
+            "max_concurrency": max_concurrency,
+            "min_concurrency": config.getint(section, "min_concurrency", fallback=1),
+            "adaptive": adaptive,
+            "initial_concurrency": config.getint(
+                section, "initial_concurrency", fallback=max(1, max_concurrency // key_count // 4)
+            )
+            * key_count,
+            "latency_target_s": config.getfloat(section, "latency_target_s", fallback=0.0),
+            "scope": config.get(section, "rate_limit_scope", fallback="provider").strip().lower(),
+        }
+        _LIMITER_SETTINGS[llm_source] = settings
+        return dict(settings)
+
+
+def get_rate_limiter(
+    llm_source: str, model_name: Optional[str] = None
+) -> Optional[ProviderRateLimiter]:
+    """返回 (llm_source, model) 共享的限流器；未配置限流时返回 None。"""
+    settings = _LIMITER_SETTINGS.get(llm_source)
+    if settings is None:
+        return None
+    scope_key = (model_name or "") if settings["scope"] == "model" else "*"
+    key = (llm_source, scope_key)
+    with _REGISTRY_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            params = {k: v for k, v in settings.items() if k != "scope"}
+            limiter = ProviderRateLimiter(name=f"{llm_source}/{scope_key}", **params)
+            _LIMITERS[key] = limiter
+        return limiter
+
+
+def rate_limit_snapshot() -> dict:
+    """所有限流器的计数快照（写入运行汇总）。"""
+    with _REGISTRY_LOCK:
+        limiters = list(_LIMITERS.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
@@ -0,0 +1,281 @@
+# codex: 2026-10-18 路由统计可改读调用方的统计（model_stats）；对冲改用实例自有的有界线程池，胜出后通知落后请求取消；abort_on 异常不换模型
+"""
+模型回退链的路由策略。
+
+默认（`fixed`）按配置顺序逐个尝试，只有抛异常才换下一个模型。`latency` 策略：
+
+- 按滑动窗口统计每个模型的 p50 / p95 延迟与错误率（包括输出校验失败）
+- 每次调用前按 “p50 × (1 + 4 × 错误率)” 重新排序；样本不足的模型排在已知的可用模型之后、总是失败的模型之前
+- 可选对冲：首选模型超过 p95（样本不足时用 `hedge_after_s`）仍未返回，就并行向下一个模型发同样的请求，
+  谁先给出通过校验的结果就用谁；胜出后设置 `cancel` 事件，能中途停下的请求（如流式）据此放弃，
+  其余落后请求跑完后只用于更新统计
+- 对冲请求在实例自有的线程池里运行（`max_threads`，默认 8）；线程占满时不再发起新的对冲，
+  `close()` 取消尚未开始的请求
+- `model_stats`：由调用方提供每个模型的统计（如 historycards 的 `RunStats.model_stats`）时，
+  路由直接读取它，不再维护自己的滑动窗口
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Type
+
+ROUTING_POLICIES = ("fixed", "latency")
+_EMPTY_STATS = {"samples": 0, "p50_s": 0.0, "p95_s": 0.0, "error_rate": 0.0}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class _ModelWindow:
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+    def snapshot(self) -> dict:
+        values = sorted(self.latencies)
+        errors = sum(1 for ok in self.outcomes if not ok)
+        return {
+            "samples": len(self.outcomes),
+            "p50_s": round(_percentile(values, 0.5), 6),
+            "p95_s": round(_percentile(values, 0.95), 6),
+            "error_rate": round(errors / len(self.outcomes), 6) if self.outcomes else 0.0,
+        }
+
+
+class ModelRouter:
+    """线程安全；同一个实例在所有 worker 间共享。"""
+
+    def __init__(
+        self,
+        policy: str = "latency",
+        hedge: bool = False,
+        hedge_after_s: float = 0.0,
+        hedge_factor: float = 1.0,
+        min_samples: int = 5,
+        window: int = 200,
+        error_penalty: float = 4.0,
+        model_stats: Optional[Callable[[str], dict]] = None,
+        max_threads: int = 8,
+    ):
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(
+                f"Invalid routing policy: {policy!r}, expected one of {ROUTING_POLICIES}"
+            )
+        self.policy = policy
+        self.hedge = hedge
+        self.hedge_after_s = max(0.0, float(hedge_after_s))
+        self.hedge_factor = max(0.0, float(hedge_factor))
+        self.min_samples = max(1, int(min_samples))
+        self.window = max(1, int(window))
+        self.error_penalty = error_penalty
+        self.max_threads = max(2, int(max_threads))
+        self.counters = {
+            "calls": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "hedges_skipped": 0,
+            "reorders": 0,
+        }
+        self._external_stats = model_stats
+        self._models: Dict[str, _ModelWindow] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running = 0  # 线程池里尚未结束的请求（含已输掉、仍在跑的）
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_threads, thread_name_prefix="llm-route"
+                )
+            return self._executor
+
+    def close(self) -> None:
+        """关闭线程池：尚未开始的请求直接取消，正在跑的不等待。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def record(self, model: str, seconds: float, ok: bool) -> None:
+        if self._external_stats is not None:
+            return  # 统计由调用方记录（on_attempt 等），这里只读
+        with self._lock:
+            slot = self._models.setdefault(model, _ModelWindow(self.window))
+            slot.outcomes.append(ok)
+            if ok:
+                # 失败往往很快返回（连接拒绝、4xx），不计入延迟分布，只计入错误率
+                slot.latencies.append(seconds)
+
+    def model_stats(self, model: str) -> dict:
+        if self._external_stats is not None:
+            return self._external_stats(model)
+        with self._lock:
+            slot = self._models.get(model)
+            return slot.snapshot() if slot else dict(_EMPTY_STATS)
+
+    def _score(self, model: str) -> Optional[float]:
+        stats = self.model_stats(model)
+        if stats["samples"] < self.min_samples:
+            return None
+        if stats["error_rate"] >= 1.0 or not stats["p50_s"]:
+            return math.inf if stats["error_rate"] >= 1.0 else 0.0
+        return stats["p50_s"] * (1.0 + self.error_penalty * stats["error_rate"])
+
+    def order(self, models: List[str]) -> List[str]:
+        """按策略排序；样本不足的模型与已知模型中最慢的（非全错）同分，同分按配置顺序。"""
+        models = list(models)
+        if self.policy == "fixed" or len(models) < 2:
+            return models
+        scores = [self._score(m) for m in models]
+        finite = [s for s in scores if s is not None and s != math.inf]
+        if not finite and None in scores:
+            return models
+        default = max(finite) if finite else 0.0
+        ranked = sorted(
+            range(len(models)), key=lambda i: (default if scores[i] is None else scores[i], i)
+        )
+        out = [models[i] for i in ranked]
+        if out != models:
+            with self._lock:
+                self.counters["reorders"] += 1
+        return out
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """对冲的触发时间：模型 p95 × hedge_factor；样本不足时用 hedge_after_s（0 表示不对冲）。"""
+        if not self.hedge:
+            return None
+        stats = self.model_stats(model)
+        if stats["samples"] >= self.min_samples and stats["p95_s"] > 0:
+            return stats["p95_s"] * self.hedge_factor
+        return self.hedge_after_s or None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            per_model = {m: w.snapshot() for m, w in self._models.items()}
+            counters = dict(self.counters)
+        if self._external_stats is not None:
+            per_model = {}  # 调用方的统计里已有逐模型数据
+        return {"policy": self.policy, "hedge": self.hedge, **counters, "per_model": per_model}
+
+    def call(
+        self,
+        models: List[str],
+        call: Callable[[str], str],
+        validate: Optional[Callable[[str], object]] = None,
+        on_attempt: Optional[Callable[[str, float, bool], None]] = None,
+        abort_on: Tuple[Type[BaseException], ...] = (),
+        cancel: Optional[threading.Event] = None,
+    ) -> Tuple[str, str, object]:
+        """
+        按路由顺序调用 `call(model)`，返回 (model, text, validate(text))。
+        `validate` 抛异常视为该模型失败（计入错误率），继续下一个模型；全部失败时抛 Exception。
+        `abort_on` 中的异常直接抛出，不再尝试其他模型（如流式输出已判定不可能成卡）。
+        对冲时，结果确定后设置 `cancel`（未传入则内部新建）；`call` 可据此提前放弃，
+        放弃后抛出的异常不计入统计。
+        """
+        order = self.order(models)
+        cancel = cancel if cancel is not None else threading.Event()
+        with self._lock:
+            self.counters["calls"] += 1
+
+        def _attempt(model: str):
+            t0 = time.monotonic()
+            ok = False
+            try:
+                text = call(model)
+                value = validate(text) if validate is not None else text
+                ok = True
+                return text, value
+            finally:
+                seconds = time.monotonic() - t0
+                if ok or not cancel.is_set():
+                    self.record(model, seconds, ok)
+                    if on_attempt is not None:
+                        on_attempt(model, seconds, ok)
+
+        remaining = list(order)
+        errors: List[str] = []
+        last_exc: Optional[BaseException] = None
+        if not self.hedge:
+            # 不对冲：在调用方线程里顺序尝试，与原来的回退行为一致（只是顺序可能不同）
+            for model in remaining:
+                try:
+                    text, value = _attempt(model)
+                    return model, text, value
+                except abort_on:
+                    raise
+                except Exception as exc:
+                    errors.append(f"{model}: {exc}")
+                    last_exc = exc
+            raise Exception(f"All models failed: {errors}") from last_exc
+
+        in_flight: Dict[object, Tuple[str, float]] = {}
+        hedged = False
+
+        def _tracked(model: str):
+            try:
+                return _attempt(model)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        def _launch() -> None:
+            model = remaining.pop(0)
+            pool = self._pool()
+            with self._lock:
+                self._running += 1
+            in_flight[pool.submit(_tracked, model)] = (model, time.monotonic())
+
+        def _finish() -> None:
+            # 结果已定：通知落后请求放弃，尚未开始的直接取消
+            cancel.set()
+            for fut in in_flight:
+                fut.cancel()
+
+        _launch()
+        primary = order[0]
+        try:
+            while in_flight:
+                timeout = None
+                if not hedged and remaining and len(in_flight) == 1:
+                    ((model, started),) = in_flight.values()
+                    delay = self.hedge_delay(model)
+                    if delay is not None:
+                        timeout = max(0.0, started + delay - time.monotonic())
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    with self._lock:
+                        # 线程池已被（含落后的）请求占满：不再加对冲，继续等首选模型
+                        saturated = self._running >= self.max_threads
+                        self.counters["hedges_skipped" if saturated else "hedges"] += 1
+                    if not saturated:
+                        _launch()
+                    continue
+                for fut in done:
+                    model, _started = in_flight.pop(fut)
+                    try:
+                        text, value = fut.result()
+                    except abort_on:
+                        raise
+                    except Exception as exc:
+                        errors.append(f"{model}: {exc}")
+                        last_exc = exc
+                        continue
+                    if hedged and model != primary:
+                        with self._lock:
+                            self.counters["hedge_wins"] += 1
+                    return model, text, value
+                if not in_flight and remaining:
+                    _launch()
+        finally:
+            _finish()
+        raise Exception(f"All models failed: {errors}") from last_exc
@@ -0,0 +1,116 @@
+# codex: 2026-10-18 多 key 池换 key 重发的 429 通过 on_throttle 通知共享限流器
+"""单模型流式调用：每收到一段文本回调一次，回调抛出 `StreamAborted` 即关闭连接。"""
+
+from typing import Callable, Optional
+
+try:
+    from utils.llm_client import OPENAI_COMPATIBLE_SOURCES, _call_llm_single
+    from utils.llm_gemini import _invoke_gemini_web
+    from utils.llm_keypool import KeyPool
+    from utils.llm_ratelimit import estimate_tokens, get_rate_limiter
+except ModuleNotFoundError:  # 以顶层模块导入时（utils 目录在 sys.path 中）
+    from llm_client import OPENAI_COMPATIBLE_SOURCES, _call_llm_single
+    from llm_gemini import _invoke_gemini_web
+    from llm_keypool import KeyPool
+    from llm_ratelimit import estimate_tokens, get_rate_limiter
+
+
+class StreamAborted(Exception):
+    """`on_delta` 回调抛出此异常即中止流式生成（连接随即关闭）；`partial_text` 为已收到的内容。"""
+
+    def __init__(self, message: str, partial_text: str = ""):
+        super().__init__(message)
+        self.partial_text = partial_text
+
+
+def generate_llm_response_stream(
+    client,
+    llm_source,
+    prompt: str,
+    model_name: str,
+    logger=None,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """流式调用单个模型（不做回退），每收到一段文本调用一次 `on_delta(delta)`，返回完整文本。
+
+    OpenAI 兼容源 / ZhipuAI / Doubao 使用 `stream=True`（SSE），
+    geminiweb 使用 `streamGenerateContent?alt=sse`；
+    其他来源不支持流式，整段回复作为一次 delta 回调。回调抛出 `StreamAborted` 时关闭连接并向上抛出。
+    """
+    limiter = get_rate_limiter(llm_source, model_name)
+    lease = limiter.acquire(estimate_tokens(prompt)) if limiter is not None else None
+    received = []
+
+    def _emit(delta: str) -> None:
+        received.append(delta)
+        if on_delta is not None:
+            on_delta(delta)
+
+    try:
+        text = _stream_llm_single(client, llm_source, prompt, model_name, _emit, logger)
+    except StreamAborted as exc:
+        exc.partial_text = ''.join(received)
+        if lease is not None:
+            lease.release(
+                ok=True, tokens_used=estimate_tokens(prompt) + estimate_tokens(exc.partial_text)
+            )
+        raise
+    except Exception as exc:
+        if lease is not None:
+            lease.release(ok=False, exc=exc)
+        raise
+    if lease is not None:
+        lease.release(ok=True, tokens_used=estimate_tokens(prompt) + estimate_tokens(text))
+    return text
+
+
+def _stream_llm_single(
+    client, llm_source, prompt: str, model_name: str, emit: Callable[[str], None], logger=None
+) -> str:
+    if isinstance(client, KeyPool):
+        emitted = []
+
+        def _emit(delta: str) -> None:
+            emitted.append(True)
+            emit(delta)
+
+        # 已经输出过内容就不能换 key 重发
+        limiter = get_rate_limiter(llm_source, model_name)
+        return client.call(
+            lambda c: _stream_llm_single(c, llm_source, prompt, model_name, _emit, logger),
+            can_retry=lambda: not emitted,
+            on_throttle=limiter.on_throttle if limiter is not None else None,
+        )
+    if llm_source in OPENAI_COMPATIBLE_SOURCES or llm_source in ('zhipuai', 'doubao'):
+        client_obj = client.get("client") if isinstance(client, dict) else client
+        messages = []
+        kwargs = {}
+        if isinstance(client, dict):
+            if client.get("system_prompt"):
+                messages.append({"role": "system", "content": client["system_prompt"]})
+            kwargs["temperature"] = client.get("temperature", 0.6)
+        messages.append({"role": "user", "content": prompt})
+        stream = client_obj.chat.completions.create(
+            model=model_name, messages=messages, stream=True, **kwargs
+        )
+        parts = []
+        try:
+            for chunk in stream:
+                choices = getattr(chunk, "choices", None) or []
+                delta = getattr(choices[0].delta, "content", None) if choices else None
+                if delta:
+                    parts.append(delta)
+                    emit(delta)
+        finally:
+            close = getattr(stream, "close", None)
+            if callable(close):
+                close()
+        text = ''.join(parts)
+        return text.strip() if llm_source in OPENAI_COMPATIBLE_SOURCES else text
+
+    if llm_source == 'geminiweb':
+        return _invoke_gemini_web(client, model_name, prompt, logger, emit=emit)
+
+    text = _call_llm_single(client, llm_source, prompt, model_name, logger)
+    emit(text)
+    return text